@@ -1,5 +1,5 @@
 import abc
-from typing import List
+from typing import List, Dict, Any
 
 from core.command import BotCommandBase
 from core.communication import GroupInfo, GroupMemberInfo
@@ -14,6 +14,14 @@ class ClientProxy(metaclass=abc.ABCMeta):
     async def process_bot_command_list(self, command_list: List[BotCommandBase]):
         pass
 
+    def get_outbound_stats(self) -> Dict[str, Any]:
+        """发送队列的统计信息, 没有发送队列时返回空字典"""
+        return {}
+
+    async def drain(self, timeout: float) -> bool:
+        """等待发送队列中的指令发送完毕, 最多等待timeout秒, 返回是否全部发送完毕, 没有发送队列时直接返回True"""
+        return True
+
     @abc.abstractmethod
     async def get_group_list(self) -> List[GroupInfo]:
         pass
@@ -22,9 +22,10 @@ from core.communication import RequestData, FriendRequestData, JoinGroupRequestD
 from core.command import BotCommandBase, BotSendMsgCommand, BotDelayCommand, BotLeaveGroupCommand, BotSendForwardMsgCommand, BotSendFileCommand
 from utils.logger import dice_log
 
-from module.common.log_command import append_log_record, delete_log_record_by_message_id  # type: ignore
+from module.common.log_command import queue_bot_log_records, delete_log_record_by_message_id  # type: ignore
 
 from adapter.client_proxy import ClientProxy
+from adapter.outbound import OutboundDispatcher
 
 from module.fastapi import dpp_api
 
@@ -62,9 +63,14 @@ def convert_group_member_info(nb_group_member_info: Dict) -> GroupMemberInfo:
 class NoneBotClientProxy(ClientProxy):
     def __init__(self, bot: NoneBot):
         self.bot = bot
+        self.outbound = OutboundDispatcher(self.execute_bot_command)
 
-    # noinspection PyBroadException
     async def process_bot_command(self, command: BotCommandBase):
+        self.outbound.submit([command])
+
+    # noinspection PyBroadException
+    async def execute_bot_command(self, command: BotCommandBase):
+        """实际执行指令, 由发送队列调用, 失败时记录日志后抛出异常"""
         dice_log(f"[OneBot] [BotCommand] {command}")
         try:
             if isinstance(command, BotSendMsgCommand):
@@ -72,10 +78,7 @@ class NoneBotClientProxy(ClientProxy):
                     if target.group_id:
                         await self.bot.send_group_msg(group_id=int(target.group_id), message=CQMessage(command.msg))
                         # 记录到群日志
-                        try:
-                            append_log_record(all_bots[self.bot.self_id], target.group_id, str(self.bot.self_id), all_bots[self.bot.self_id].get_nickname(self.bot.self_id, target.group_id) or "Bot", command.msg)
-                        except Exception:
-                            pass
+                        self.queue_log_records(target.group_id, [command.msg])
                     else:
                         await self.bot.send_private_msg(user_id=int(target.user_id), message=CQMessage(command.msg))
             elif isinstance(command, BotLeaveGroupCommand):
@@ -85,21 +88,14 @@ class NoneBotClientProxy(ClientProxy):
                     for target in command.targets:
                         await self.bot.call_api("send_group_forward_msg", group_id=int(target.group_id), messages=command.msg_json_list)
                         # 合并转发中的每条子消息分别记录（保持原顺序）
-                        try:
-                            for sub_msg in command.msg:
-                                append_log_record(all_bots[self.bot.self_id], target.group_id, str(self.bot.self_id), all_bots[self.bot.self_id].get_nickname(self.bot.self_id, target.group_id) or "Bot", sub_msg)
-                        except Exception:
-                            pass
+                        self.queue_log_records(target.group_id, command.msg)
                 except:
                     if target.group_id:
                         await self.bot.send_group_msg(group_id=int(target.group_id), message="合并转发失败！")
                         for target in command.targets:
                             for msg in command.msg:
                                 await self.bot.send_group_msg(group_id=int(target.group_id), message=CQMessage(msg))
-                                try:
-                                    append_log_record(all_bots[self.bot.self_id], target.group_id, str(self.bot.self_id), all_bots[self.bot.self_id].get_nickname(self.bot.self_id, target.group_id) or "Bot", msg)
-                                except Exception:
-                                    pass
+                                self.queue_log_records(target.group_id, [msg])
                     else:
                         await self.bot.send_group_msg(user_id=int(target.used_id), message="合并转发失败！")
                         for target in command.targets:
@@ -152,10 +148,7 @@ class NoneBotClientProxy(ClientProxy):
                                 except Exception as e2:
                                     dice_log(f"[OneBot][Upload][FallbackFail] group={target.group_id} file={real_name} err={e2}")
                         if primary_done:
-                            try:
-                                append_log_record(all_bots[self.bot.self_id], target.group_id, str(self.bot.self_id), all_bots[self.bot.self_id].get_nickname(self.bot.self_id, target.group_id) or "Bot", f"[文件]{real_name}")
-                            except Exception:
-                                pass
+                            self.queue_log_records(target.group_id, [f"[文件]{real_name}"])
                         else:
                             await self.bot.send_group_msg(group_id=int(target.group_id), message="文件发送失败！")
                     except Exception as ex_outer:
@@ -167,15 +160,38 @@ class NoneBotClientProxy(ClientProxy):
                 raise NotImplementedError("未定义的BotCommand类型")
         except ActionFailed as e:
             dice_log(f"[OneBot] [ActionFailed] {e}")
+            raise  # 交给发送队列计入失败次数
         except Exception as e:
             dice_log(f"[OneBot] [UnknownException] {e}")
+            raise
 
     async def process_bot_command_list(self, command_list: List[BotCommandBase]):
         if len(command_list) > 1:
             log_str = "\n".join([str(command) for command in command_list])
             dice_log(f"[Proxy Bot Command List]\n[{log_str}]")
-        for command in command_list:
-            await self.process_bot_command(command)
+        self.outbound.submit(command_list)
+
+    def get_outbound_stats(self) -> Dict[str, Any]:
+        return self.outbound.get_stats()
+
+    async def drain(self, timeout: float) -> bool:
+        try:
+            # 超时后发送队列仍会继续工作, 只是不再等待
+            await asyncio.wait_for(asyncio.shield(self.outbound.join()), timeout)
+            return True
+        except asyncio.TimeoutError:
+            dice_log(f"[OneBot] [Drain] {timeout}秒内未能发送完毕, 还有{self.outbound.get_depth()}条指令")
+            return False
+
+    def queue_log_records(self, group_id: str, contents: List[str]) -> None:
+        """将骰娘发出的消息交给日志模块, 群没有在记录日志时几乎没有开销"""
+        bot_obj = all_bots.get(self.bot.self_id)
+        if not bot_obj:
+            return
+        try:
+            queue_bot_log_records(bot_obj, str(group_id), contents)
+        except Exception as e:
+            dice_log(f"[OneBot] [LogRecord] {e}")
 
     async def get_group_list(self) -> List[GroupInfo]:
         group_info_list: List[Dict] = await self.bot.get_group_list()
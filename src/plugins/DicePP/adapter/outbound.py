@@ -0,0 +1,216 @@
+"""
+发送队列
+每个群/私聊对象一个先进先出队列, 同一对象的消息按提交顺序发送, 不同对象之间并发发送
+BotDelayCommand只会推迟它所在队列中后续的指令, 不会阻塞其他对象的消息, 之后没有指令的延迟推迟到下一次提交
+发送前需要同时从全局令牌桶和对象的令牌桶中取得令牌, 避免短时间内大量发言触发风控
+"""
+import asyncio
+import copy
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from core.command import BotCommandBase, BotDelayCommand, BotLeaveGroupCommand
+from core.communication import MessagePort
+from utils.logger import dice_log
+
+OUTBOUND_GLOBAL_RATE = 5.0  # 整个账号每秒最多发送的消息数
+OUTBOUND_GLOBAL_BURST = 10  # 整个账号允许连续发送的消息数
+OUTBOUND_TARGET_RATE = 1.0  # 同一个群/私聊每秒最多发送的消息数
+OUTBOUND_TARGET_BURST = 5  # 同一个群/私聊允许连续发送的消息数
+OUTBOUND_IDLE_EXPIRE = 300  # 空闲超过该秒数的对象队列会被清理
+OUTBOUND_LATENCY_SAMPLES = 256  # 统计延迟时保留的样本数
+
+TargetKey = Tuple[str, str]  # ("group"/"private", 群号/账号)
+
+
+class TokenBucket:
+    """
+    令牌桶, 以rate的速度补充令牌, 最多积攒capacity个
+    reserve总是立即扣除一个令牌(可以为负数), 返回需要等待的秒数, 因此先预约的调用者先获得令牌
+    """
+
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens: float = capacity
+        self.updated: float = clock()
+
+    def refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        self.refill()
+        self.tokens -= 1
+        return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def is_full(self) -> bool:
+        self.refill()
+        return self.tokens >= self.capacity
+
+
+class _TargetQueue:
+    def __init__(self, key: TargetKey, bucket: TokenBucket):
+        self.key = key
+        self.bucket = bucket
+        self.jobs: Deque[Tuple[BotCommandBase, float]] = deque()  # (指令, 加入队列的时间)
+        self.worker: Optional[asyncio.Task] = None
+        self.last_active: float = time.monotonic()
+
+
+def get_port_key(port: MessagePort) -> TargetKey:
+    """私聊优先于群聊, 与MessagePort的约定一致"""
+    return ("private", str(port.user_id)) if port.user_id else ("group", str(port.group_id))
+
+
+def get_target_keys(command: BotCommandBase) -> List[TargetKey]:
+    """指令涉及的发送对象"""
+    if isinstance(command, BotLeaveGroupCommand):
+        return [("group", str(command.target_group_id))]
+    keys: List[TargetKey] = []
+    for target in getattr(command, "targets", None) or []:
+        key = get_port_key(target)
+        if key not in keys:
+            keys.append(key)
+    return keys
+
+
+def split_command(command: BotCommandBase, key: TargetKey) -> BotCommandBase:
+    """得到只发送给key对应对象的指令"""
+    targets = getattr(command, "targets", None)
+    if not targets or len(targets) == 1:
+        return command
+    command_copy = copy.copy(command)
+    command_copy.targets = [target for target in targets if get_port_key(target) == key]
+    return command_copy
+
+
+class OutboundDispatcher:
+    """
+    按发送对象分队列的发送器
+    Args:
+        send_func: 实际执行单个指令的协程函数, 指令只会包含一个发送对象
+    """
+
+    def __init__(self, send_func: Callable[[BotCommandBase], Awaitable[Any]],
+                 global_rate: float = OUTBOUND_GLOBAL_RATE, global_burst: float = OUTBOUND_GLOBAL_BURST,
+                 target_rate: float = OUTBOUND_TARGET_RATE, target_burst: float = OUTBOUND_TARGET_BURST):
+        self.send_func = send_func
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.target_rate = target_rate
+        self.target_burst = target_burst
+        self.queues: Dict[TargetKey, _TargetQueue] = {}
+        self.last_prune: float = time.monotonic()
+        self.carry_until: float = 0  # 推迟到下一次提交的延迟的结束时间
+        # 统计信息
+        self.sent = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.wait_samples: Deque[float] = deque(maxlen=OUTBOUND_LATENCY_SAMPLES)  # 从加入队列到开始发送
+        self.send_samples: Deque[float] = deque(maxlen=OUTBOUND_LATENCY_SAMPLES)  # 发送本身的耗时
+
+    def submit(self, command_list: List[BotCommandBase]) -> None:
+        """
+        将指令加入各自对象的队列后立即返回, 需要在事件循环中调用
+        列表中的BotDelayCommand只会加入列表中在它之后还有指令的对象的队列
+        之后没有指令的延迟(包括单独提交的延迟)会推迟到下一次提交, 扣除期间已经过去的时间后加在下一批指令之前
+        """
+        now = time.monotonic()
+        if self.carry_until > now:
+            bot_id = getattr(command_list[0], "bot_id", "") if command_list else ""
+            command_list = [BotDelayCommand(bot_id, self.carry_until - now)] + list(command_list)
+        self.carry_until = 0
+        # 从后向前计算每条指令之后的指令涉及的对象
+        later_keys: List[List[TargetKey]] = []
+        keys_after: List[TargetKey] = []
+        for command in reversed(command_list):
+            later_keys.append(keys_after)
+            if not isinstance(command, BotDelayCommand):
+                keys_after = keys_after + [key for key in get_target_keys(command) if key not in keys_after]
+        later_keys.reverse()
+        for command, keys_after in zip(command_list, later_keys):
+            if isinstance(command, BotDelayCommand):
+                if not keys_after:
+                    self.carry_until = max(self.carry_until, now) + command.seconds
+                for key in keys_after:
+                    self.__enqueue(key, command, now)
+            else:
+                keys = get_target_keys(command)
+                if not keys:
+                    dice_log(f"[Outbound] 指令没有发送对象, 已忽略: {command}")
+                for key in keys:
+                    self.__enqueue(key, split_command(command, key), now)
+        if now - self.last_prune > OUTBOUND_IDLE_EXPIRE:
+            self.prune(now)
+
+    def __enqueue(self, key: TargetKey, command: BotCommandBase, now: float) -> None:
+        queue = self.queues.get(key)
+        if queue is None:
+            queue = self.queues[key] = _TargetQueue(key, TokenBucket(self.target_rate, self.target_burst))
+        queue.jobs.append((command, now))
+        queue.last_active = now
+        self.max_depth = max(self.max_depth, len(queue.jobs))
+        if queue.worker is None or queue.worker.done():
+            queue.worker = asyncio.get_running_loop().create_task(self.__run_queue(queue))
+
+    async def __run_queue(self, queue: _TargetQueue) -> None:
+        delay_end: float = 0  # 主动延迟的时间不计入排队耗时
+        while queue.jobs:
+            command, enqueue_time = queue.jobs[0]
+            if isinstance(command, BotDelayCommand):
+                await asyncio.sleep(command.seconds)
+                queue.jobs.popleft()
+                delay_end = time.monotonic()
+                continue
+            wait = max(self.global_bucket.reserve(), queue.bucket.reserve())
+            if wait > 0:
+                await asyncio.sleep(wait)
+            start_time = time.monotonic()
+            self.wait_samples.append(start_time - max(enqueue_time, delay_end))
+            try:
+                await self.send_func(command)
+                self.sent += 1
+            except Exception as e:
+                self.failed += 1
+                dice_log(f"[Outbound] 发送到{queue.key[0]}:{queue.key[1]}失败: {e}")
+            finally:
+                self.send_samples.append(time.monotonic() - start_time)
+                queue.jobs.popleft()
+                queue.last_active = time.monotonic()
+
+    def prune(self, now: Optional[float] = None) -> None:
+        """清理长时间空闲且令牌已经补满的队列"""
+        now = now if now is not None else time.monotonic()
+        self.last_prune = now
+        for key in [key for key, queue in self.queues.items()
+                    if not queue.jobs and now - queue.last_active > OUTBOUND_IDLE_EXPIRE and queue.bucket.is_full()]:
+            del self.queues[key]
+
+    async def join(self) -> None:
+        """等待所有队列发送完毕"""
+        while True:
+            workers = [queue.worker for queue in self.queues.values() if queue.worker and not queue.worker.done()]
+            if not workers:
+                return
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    def get_depth(self) -> int:
+        return sum(len(queue.jobs) for queue in self.queues.values())
+
+    def get_stats(self) -> Dict[str, Any]:
+        def percentile(samples: Deque[float], ratio: float) -> float:
+            if not samples:
+                return 0.0
+            ordered = sorted(samples)
+            return ordered[min(int(len(ordered) * ratio), len(ordered) - 1)] * 1000
+
+        return {"targets": len(self.queues),
+                "busy_targets": sum(1 for queue in self.queues.values() if queue.jobs),
+                "depth": self.get_depth(), "max_depth": self.max_depth,
+                "sent": self.sent, "failed": self.failed,
+                "wait_p50_ms": percentile(self.wait_samples, 0.5), "wait_p95_ms": percentile(self.wait_samples, 0.95),
+                "send_p50_ms": percentile(self.send_samples, 0.5), "send_p95_ms": percentile(self.send_samples, 0.95),
+                "send_max_ms": max(self.send_samples) * 1000 if self.send_samples else 0.0}
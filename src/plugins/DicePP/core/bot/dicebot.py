@@ -6,12 +6,14 @@ from typing import List, Optional, Dict, Callable, Union, Set
 from random import choice
 
 from utils.logger import dice_log, get_exception_info
+from utils.asset import ASSET_REGISTRY
 from utils.time import str_to_datetime, get_current_date_str, get_current_date_raw, int_to_datetime
 from core.localization import LocalizationManager, LOC_GROUP_ONLY_NOTICE, LOC_PERMISSION_DENIED_NOTICE, LOC_FRIEND_ADD_NOTICE, LOC_GROUP_EXPIRE_WARNING
 from core.config import ConfigManager, CFG_COMMAND_SPLIT, CFG_MASTER, CFG_FRIEND_TOKEN, CFG_GROUP_INVITE
 from core.config import CFG_DATA_EXPIRE, CFG_USER_EXPIRE_DAY, CFG_GROUP_EXPIRE_DAY, CFG_GROUP_EXPIRE_WARNING,\
     CFG_WHITE_LIST_GROUP, CFG_WHITE_LIST_USER, CFG_ADMIN, CFG_MASTER, preprocess_white_list
 from core.config import CFG_MEMORY_MONITOR_ENABLE, CFG_MEMORY_WARN_PERCENT, CFG_MEMORY_RESTART_PERCENT, CFG_MEMORY_RESTART_MB
+from core.config import CFG_COMMAND_DISPATCH_PARITY
 from core.config import BOT_DATA_PATH, CONFIG_PATH
 from core.communication import MessageMetaData, MessagePort, PrivateMessagePort, GroupMessagePort, preprocess_msg
 from core.communication import RequestData, FriendRequestData, JoinGroupRequestData, InviteGroupRequestData
@@ -24,12 +26,18 @@ from core.statistics import MetaStatInfo, GroupStatInfo, UserStatInfo
 
 from core.bot.macro import BotMacro, MACRO_PARSE_LIMIT
 from core.bot.variable import BotVariable
+from core.bot.dispatch import CommandDispatcher
+from core.bot.scheduler import BotScheduler, ScheduledJob
 import shutil
 
 # 日志清理相关常量
 LOGS_SUBDIR = "logs"
 LOG_RETENTION_SECONDS = 24 * 3600  # 24小时
 
+BOT_REGULAR_INTERVAL = 60 * 5  # 保存数据, 检查每日更新与内存的间隔(秒)
+BOT_GROUP_INFO_INTERVAL = 3600 * 4  # 更新群信息的间隔(秒)
+BOT_SHUTDOWN_DRAIN_TIMEOUT = 10  # 关闭或重启前等待发送队列清空的最长时间(秒)
+
 # 内存监控
 try:
     import psutil
@@ -63,9 +71,10 @@ class Bot:
         self.cfg_helper = ConfigManager(CONFIG_PATH, self.account)
 
         self.command_dict: Dict[str, command.UserCommandBase] = {}
+        self.command_dispatcher: CommandDispatcher = CommandDispatcher([])
 
         self.tick_task: Optional[asyncio.Task] = None
-        self.todo_tasks: Dict[Union[Callable, asyncio.Task], Dict] = {}
+        self.scheduler = BotScheduler(self._send_scheduled_result, self._log_scheduled_error)
 
         self.start_up()
 
@@ -91,6 +100,19 @@ class Bot:
         except RuntimeError:  # 在Debug中
             pass
 
+    def schedule_at(self, when: float, func: Callable, timeout: float = 0, timeout_callback: Optional[Callable] = None,
+                    name: str = "") -> ScheduledJob:
+        """
+        在事件循环时间when(loop.time())执行一次异步函数func, 返回的任务可以调用cancel取消
+        func必须没有参数, 必须返回 List[BotCommandBase], 返回的指令会通过proxy发送
+        """
+        return self.scheduler.schedule_at(when, func, timeout, timeout_callback, name)
+
+    def schedule_every(self, period: float, func: Callable, delay: Optional[float] = None, timeout: float = 0,
+                       timeout_callback: Optional[Callable] = None, name: str = "") -> ScheduledJob:
+        """每隔period秒执行一次异步函数func, 第一次在delay秒后执行, 默认为period秒后, 其余同schedule_at"""
+        return self.scheduler.schedule_every(period, func, delay, timeout, timeout_callback, name)
+
     def register_task(self, task: Callable, is_async: bool = True, timeout: float = 10, timeout_callback: Optional[Callable] = None):
         """
         Args:
@@ -100,106 +122,67 @@ class Bot:
             timeout_callback: 超时后调用的回调函数, 必须为同步函数, 同样也应该返回 List[BotCommandBase]
         """
         assert is_async or timeout == 0
-        self.todo_tasks[task] = {"init": False, "is_async": is_async, "timeout": timeout, "callback": timeout_callback}
+        func = task
+        if not is_async:
+            async def func():
+                return await asyncio.get_running_loop().run_in_executor(None, task)
+        return self.scheduler.schedule_at(self.scheduler.now(), func, timeout, timeout_callback,
+                                          name=getattr(task, "__name__", ""))
 
-    async def tick_loop(self):
-        from core.command import BotCommandBase
-        loop = asyncio.get_event_loop()
-        time_counter = [loop.time()] * 2
+    def is_scheduler_running(self) -> bool:
+        """通过register_task等方法加入的后台任务是否会被执行, 调试或测试时没有运行调度器, 需要同步处理"""
+        return self.scheduler.is_running()
 
+    async def tick_loop(self):
+        """注册周期任务后运行调度器, 调度器只在有任务到期时才会被唤醒"""
+        from core.command import UserCommandBase
         meta_stat: MetaStatInfo = self.data_manager.get_data(DC_META, [DCK_META_STAT], default_gen=MetaStatInfo)
         meta_stat.update(is_first_time=True)
 
-        while True:
-            loop_begin_time = loop.time()
-            bot_commands: List[BotCommandBase] = []
-            try:
-                # tick each command
-                for command in self.command_dict.values():
-                    try:
-                        bot_commands += command.tick()
-                    except Exception:
-                        dice_log(str(self.handle_exception(f"Tick: {command.readable_name} CODE110")[0]))
-
-                if loop_begin_time - time_counter[0] > 60 * 5:  # 5分钟执行一次
-                    # 更新在线时间并尝试每日更新
-                    if meta_stat.update():
-                        await self.tick_daily(bot_commands)
-                    # 保存数据到本地
-                    await self.data_manager.save_data_async()
-                    # 内存监控检查
-                    await self._check_memory_and_handle()
-                    # 更新计时器
-                    time_counter[0] = loop_begin_time
-
-                if loop_begin_time - time_counter[1] > 3600 * 4:  # 4小时执行一次
-                    # 更新群信息
-                    async def update_group_info():
-                        await self.update_group_info_all()
-                        return []
-                    self.register_task(update_group_info, timeout=3600)
-                    # 更新计时器
-                    time_counter[1] = loop_begin_time
-
-                if self.todo_tasks:
-                    free_time = max(loop_begin_time + 1 - loop.time(), 0.25)
-                    await self.process_async_task(bot_commands, free_time, loop)
+        self.schedule_every(BOT_REGULAR_INTERVAL, self.tick_regular)
 
-                if self.proxy:
-                    for command in bot_commands:
-                        await self.proxy.process_bot_command(command)
-            except Exception:
-                bot_commands += self.handle_exception(f"Tick Loop: CODE113")
-
-            # 最多每秒执行一次循环
-            free_time = max(loop_begin_time + 1 - loop.time(), 0)
-            await asyncio.sleep(free_time)
-
-    async def process_async_task(self, bot_commands, free_time: float, loop):
-        init_task = [(task, info) for task, info in self.todo_tasks.items() if not info["init"]]
-        for func, info in init_task:
-            func: Callable
-            del self.todo_tasks[func]
-            if not info["is_async"]:
-                dice_log(f"[Async Task] Init Sync: {func.__name__}")
-
-                async def task_wrapper():
-                    future = loop.run_in_executor(None, func)
-                    await future
-                    return future.result()
-
-                task: asyncio.Task = asyncio.create_task(task_wrapper())
-            else:
-                dice_log(f"[Async Task] Init Async: {func.__name__}")
-                task: asyncio.Task = asyncio.create_task(func())
-            info["init"] = True
-            self.todo_tasks[task] = info
-
-        dice_log(f"[Async Task] Try: "
-                 f"{[(task.get_coro().cr_code.co_name, self.todo_tasks[task]['timeout']) for task in self.todo_tasks.keys()]}"
-                 f" for {free_time} s")
-        try:
-            done_tasks, pending_tasks = await asyncio.wait(self.todo_tasks.keys(), timeout=free_time)
-            task: asyncio.Task
-            for task in done_tasks:
-                try:
-                    bot_commands += task.result()
-                except Exception:
-                    dice_log(str(self.handle_exception(f"Async Task: CODE114")[0]))
-                del self.todo_tasks[task]
-                dice_log(f"[Async Task] Finish {task.get_coro().cr_code.co_name}")
-            for task in pending_tasks:
-                if self.todo_tasks[task]["timeout"] > 0:
-                    self.todo_tasks[task]["timeout"] -= free_time
-                    if self.todo_tasks[task]["timeout"] < 0:
-                        dice_log(f"[Async Task] Timeout: {task.get_coro().cr_code.co_name}")
-                        if self.todo_tasks[task]["callback"]:
-                            dice_log(f"[Async Task] Timeout callback: {self.todo_tasks[task]['callback'].__name__}")
-                            bot_commands += self.todo_tasks[task]["callback"]()
-                        task.cancel()
-                        del self.todo_tasks[task]
-        except Exception:
-            dice_log(str(self.handle_exception(f"Async Task: CODE112")[0]))
+        async def update_group_info():
+            await self.update_group_info_all()
+            return []
+        self.schedule_every(BOT_GROUP_INFO_INTERVAL, update_group_info, timeout=3600)
+
+        # 只有声明了tick_period的指令才会被定期调用; 重写了tick却没有声明周期的旧指令仍然每秒调用一次
+        for command in self.command_dict.values():
+            period = command.tick_period
+            if period <= 0 and type(command).tick is not UserCommandBase.tick:
+                period = 1
+            if period > 0:
+                self.schedule_every(period, self.__get_tick_job(command), name=f"Tick: {command.readable_name}")
+
+        await self.scheduler.run()
+
+    @staticmethod
+    def __get_tick_job(command) -> Callable:
+        async def tick_job():
+            return command.tick()
+        return tick_job
+
+    async def tick_regular(self) -> List:
+        """每隔BOT_REGULAR_INTERVAL秒执行一次"""
+        bot_commands = []
+        meta_stat: MetaStatInfo = self.data_manager.get_data(DC_META, [DCK_META_STAT], default_gen=MetaStatInfo)
+        # 更新在线时间并尝试每日更新
+        if meta_stat.update():
+            await self.tick_daily(bot_commands)
+        # 保存数据到本地
+        await self.data_manager.save_data_async()
+        # 内存监控检查
+        await self._check_memory_and_handle()
+        return bot_commands
+
+    async def _send_scheduled_result(self, bot_commands: List) -> None:
+        if self.proxy:
+            # 整个列表一起提交, 列表中的延迟才能作用于之后的指令
+            await self.proxy.process_bot_command_list(bot_commands)
+
+    def _log_scheduled_error(self, info: str) -> None:
+        error_commands = self.handle_exception(info)
+        dice_log(str(error_commands[0]) if error_commands else f"{info}\n{get_exception_info()}")
 
     async def _check_memory_and_handle(self) -> None:
         """内存监控：检查内存使用情况，必要时发送警告或触发重启"""
@@ -328,6 +311,15 @@ class Bot:
         """
         if self.tick_task:
             self.tick_task.cancel()
+        self.scheduler.clear()
+        ASSET_REGISTRY.release(self.account)
+        if self.proxy:  # 先发送完已经排队的消息, 如重启前的回复
+            await self.proxy.drain(BOT_SHUTDOWN_DRAIN_TIMEOUT)
+        for command in self.command_dict.values():
+            try:
+                await command.shutdown_async()
+            except Exception:
+                dice_log(f"[Bot] [Shutdown] {command.readable_name}\n" + "\n".join(get_exception_info()))
         await self.data_manager.save_data_async()
         # 注意如果保存时文件不存在会用当前值写入default, 如果在读取自定义设置后删掉文件再保存, 就会得到一个不是默认的default sheet
         # self.loc_helper.save_localization() # 暂时不会在运行时修改, 不需要保存
@@ -387,6 +379,7 @@ class Bot:
         for command_name in command_names:
             command_cls = command_cls_dict[command_name]
             self.command_dict[command_name] = command_cls(bot=self)  # 默认的Dict是有序的, 所以之后用values拿到的也是有序的
+        self.command_dispatcher = CommandDispatcher(list(self.command_dict.values()))
 
     def delay_init(self):
         """在载入本地化文本和配置等数据后调用"""
@@ -513,10 +506,18 @@ class Bot:
         msg_list = msg.split(command_split)
         msg_list = [m.strip() for m in msg_list]
         is_multi_command = len(msg_list) > 1
+        try:
+            check_parity = bool(int(self.cfg_helper.get_config(CFG_COMMAND_DISPATCH_PARITY)[0]))
+        except (IndexError, ValueError):
+            check_parity = False
 
-        # 遍历所有指令, 尝试处理消息
+        # 遍历可能处理该消息的指令, 尝试处理消息
         for msg_cur in msg_list:
-            for command in self.command_dict.values():
+            if check_parity:
+                missed_commands = self.command_dispatcher.check_parity(msg_cur, meta)
+                if missed_commands:
+                    dice_log(f"[Dispatch] [Parity] {msg_cur} 被前缀表跳过但可以被处理: {missed_commands}")
+            for command in self.command_dispatcher.get_candidates(msg_cur):
                 # 判断是否能处理该条指令
                 try:
                     should_proc, should_pass, hint = command.can_process_msg(msg_cur, meta)
@@ -656,13 +657,13 @@ class Bot:
             group_id = "default"
 
         try:
-            nickname = self.data_manager.get_data(DC_NICKNAME, [user_id, group_id])  # 使用用户在群内的昵称
+            nickname = self.data_manager.get_view(DC_NICKNAME, [user_id, group_id])  # 使用用户在群内的昵称
         except DataManagerError:
             try:
-                nickname = self.data_manager.get_data(DC_NICKNAME, [user_id, "default"])  # 使用用户定义的默认昵称
+                nickname = self.data_manager.get_view(DC_NICKNAME, [user_id, "default"])  # 使用用户定义的默认昵称
             except DataManagerError:
                 try:
-                    nickname = self.data_manager.get_data(DC_NICKNAME, [user_id, "origin"])  # 使用用户本身的用户名
+                    nickname = self.data_manager.get_view(DC_NICKNAME, [user_id, "origin"])  # 使用用户本身的用户名
                 except DataManagerError:
                     nickname = NICKNAME_ERROR
         return nickname
@@ -0,0 +1,73 @@
+"""
+指令分发表, 根据指令声明的触发前缀建立前缀树, 只对可能处理当前消息的指令调用can_process_msg
+"""
+from typing import List, Dict, Tuple
+
+
+class PrefixNode:
+    __slots__ = ("children", "indices")
+
+    def __init__(self):
+        self.children: Dict[str, "PrefixNode"] = {}
+        self.indices: List[int] = []  # 以当前节点为完整前缀的指令在有序列表中的位置
+
+
+class CommandDispatcher:
+    """
+    在Bot.register_command时构建, 保存按优先级排序的全部指令
+    没有声明前缀的指令被视为catch-all, 每条消息都会尝试
+    """
+
+    def __init__(self, commands: List):
+        """
+        Args:
+            commands: 按优先级排好序的UserCommandBase实例
+        """
+        self.commands: List = list(commands)
+        self.root = PrefixNode()
+        self.catch_all: List[int] = []
+        for index, command in enumerate(self.commands):
+            prefixes: Tuple[str, ...] = command.trigger_prefixes
+            if not prefixes:
+                self.catch_all.append(index)
+                continue
+            for prefix in set(prefixes):
+                node = self.root
+                for char in prefix:
+                    node = node.children.setdefault(char, PrefixNode())
+                node.indices.append(index)
+
+    def match_indices(self, msg_str: str) -> List[int]:
+        """返回可能处理msg_str的指令位置, 已按优先级排序"""
+        indices = list(self.catch_all)
+        node = self.root
+        for char in msg_str:
+            node = node.children.get(char)
+            if node is None:
+                break
+            indices += node.indices
+        if len(indices) != len(self.catch_all):
+            indices = sorted(set(indices))
+        return indices
+
+    def get_candidates(self, msg_str: str) -> List:
+        """返回可能处理msg_str的指令, 顺序与command_dict一致"""
+        return [self.commands[index] for index in self.match_indices(msg_str)]
+
+    def check_parity(self, msg_str: str, meta) -> List[str]:
+        """
+        对照模式: 对未被分发表选中的指令也调用can_process_msg, 返回会在全量遍历下处理该消息但被分发表跳过的指令名
+        catch-all和候选指令在两条路径下完全相同, 所以差异只可能来自这些指令
+        """
+        candidates = set(self.match_indices(msg_str))
+        missed: List[str] = []
+        for index, command in enumerate(self.commands):
+            if index in candidates:
+                continue
+            try:
+                should_proc = command.can_process_msg(msg_str, meta)[0]
+            except Exception:
+                continue
+            if should_proc:
+                missed.append(command.__class__.__name__)
+        return missed
@@ -0,0 +1,205 @@
+"""
+Bot内的定时任务调度器
+所有任务按到期时间保存在最小堆中, 调度协程只在最早的任务到期或有更早的任务加入时被唤醒, 没有任务时不会占用CPU
+任务必须是没有参数的异步函数, 返回 List[BotCommandBase], 结果交给on_result发送
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from utils.logger import dice_log
+
+
+class ScheduledJob:
+    """
+    调度器中的一个任务, 由schedule_at/schedule_every返回, 可以调用cancel取消
+    周期任务在上一次执行结束后才会安排下一次, 不会与自身重叠
+    """
+    __slots__ = ("when", "seq", "func", "period", "timeout", "timeout_callback", "name", "cancelled", "task", "runs")
+
+    def __init__(self, when: float, seq: int, func: Callable[[], Awaitable[List]], period: float,
+                 timeout: float, timeout_callback: Optional[Callable[[], List]], name: str):
+        self.when = when
+        self.seq = seq
+        self.func = func
+        self.period = period
+        self.timeout = timeout
+        self.timeout_callback = timeout_callback
+        self.name = name
+        self.cancelled: bool = False
+        self.task: Optional[asyncio.Task] = None
+        self.runs: int = 0
+
+    def __lt__(self, other: "ScheduledJob") -> bool:
+        return (self.when, self.seq) < (other.when, other.seq)
+
+    def cancel(self) -> None:
+        """取消任务, 正在执行的任务会被中断, 周期任务不会再被安排"""
+        self.cancelled = True
+        if self.task and not self.task.done():
+            self.task.cancel()
+
+
+class BotScheduler:
+    """
+    Args:
+        on_result: 处理任务返回的指令列表的协程函数
+        on_error: 任务抛出异常时调用, 参数为异常描述
+    """
+
+    def __init__(self, on_result: Callable[[List], Awaitable[Any]], on_error: Callable[[str], Any]):
+        self.on_result = on_result
+        self.on_error = on_error
+        self.heap: List[ScheduledJob] = []
+        self.running_jobs: Dict[ScheduledJob, asyncio.Task] = {}
+        self.counter = itertools.count()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.wakeup: Optional[asyncio.Event] = None
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.timer_when: Optional[float] = None
+        # 统计信息
+        self.finished = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    def now(self) -> float:
+        # 默认事件循环的时间即为time.monotonic
+        return self.loop.time() if self.loop else time.monotonic()
+
+    def schedule_at(self, when: float, func: Callable[[], Awaitable[List]], timeout: float = 0,
+                    timeout_callback: Optional[Callable[[], List]] = None, name: str = "") -> ScheduledJob:
+        """
+        在事件循环时间when执行一次func
+        Args:
+            when: 以loop.time()为准的时间, 小于当前时间时会尽快执行
+            func: 没有参数的异步函数
+            timeout: 超时时间, 单位秒, 为0代表不会超时
+            timeout_callback: 超时后调用的同步函数, 返回 List[BotCommandBase]
+            name: 日志中显示的名字, 默认为函数名
+        """
+        return self.__push(when, func, 0, timeout, timeout_callback, name)
+
+    def schedule_every(self, period: float, func: Callable[[], Awaitable[List]], delay: Optional[float] = None,
+                       timeout: float = 0, timeout_callback: Optional[Callable[[], List]] = None, name: str = "") -> ScheduledJob:
+        """
+        每隔period秒执行一次func, 第一次在delay秒后执行, 默认为period秒后
+        """
+        assert period > 0
+        delay = period if delay is None else delay
+        return self.__push(self.now() + delay, func, period, timeout, timeout_callback, name)
+
+    def __push(self, when: float, func: Callable, period: float, timeout: float,
+               timeout_callback: Optional[Callable], name: str) -> ScheduledJob:
+        job = ScheduledJob(when, next(self.counter), func, period, timeout, timeout_callback,
+                           name or getattr(func, "__name__", "job"))
+        heapq.heappush(self.heap, job)
+        if self.heap[0] is job:
+            self.__arm_timer()
+        return job
+
+    def __arm_timer(self) -> None:
+        """让调度协程在堆顶任务到期时醒来"""
+        if not self.loop or not self.wakeup:
+            return
+        while self.heap and self.heap[0].cancelled:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return
+        when = self.heap[0].when
+        if self.timer_when is not None and self.timer_when <= when:
+            return
+        if self.timer:
+            self.timer.cancel()
+        self.timer_when = when
+        self.timer = self.loop.call_at(when, self.wakeup.set)
+
+    async def run(self) -> None:
+        """调度循环, 需要作为一个独立的Task运行"""
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        try:
+            while True:
+                self.timer, self.timer_when = None, None
+                now = self.loop.time()
+                while self.heap and (self.heap[0].cancelled or self.heap[0].when <= now):
+                    job = heapq.heappop(self.heap)
+                    if not job.cancelled:
+                        job.task = self.loop.create_task(self.__run_job(job))
+                        self.running_jobs[job] = job.task
+                        job.task.add_done_callback(lambda task, job=job: self.__on_job_done(job, task))
+                self.wakeup.clear()
+                self.__arm_timer()
+                await self.wakeup.wait()
+        finally:
+            if self.timer:
+                self.timer.cancel()
+            self.loop, self.wakeup, self.timer, self.timer_when = None, None, None, None
+
+    async def __run_job(self, job: ScheduledJob) -> None:
+        bot_commands: List = []
+        try:
+            if job.timeout > 0:
+                bot_commands = await asyncio.wait_for(job.func(), job.timeout)
+            else:
+                bot_commands = await job.func()
+            self.finished += 1
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            dice_log(f"[Scheduler] Timeout: {job.name}")
+            if job.timeout_callback:
+                dice_log(f"[Scheduler] Timeout callback: {job.timeout_callback.__name__}")
+                try:
+                    bot_commands = job.timeout_callback()
+                except Exception:
+                    self.on_error(f"Timeout Callback: {job.name} CODE112")
+        except Exception:
+            self.errors += 1
+            self.on_error(f"Scheduled Job: {job.name} CODE114")
+        job.runs += 1
+        if job.period > 0 and not job.cancelled:
+            job.when = max(job.when + job.period, self.now())
+            heapq.heappush(self.heap, job)
+            if self.heap[0] is job:
+                self.__arm_timer()
+        if bot_commands:
+            try:
+                await self.on_result(bot_commands)
+            except Exception:
+                self.on_error(f"Scheduled Job Result: {job.name} CODE113")
+
+    def __on_job_done(self, job: ScheduledJob, task: asyncio.Task) -> None:
+        # 任务可能在开始执行前就被取消, 因此在完成回调中移出执行列表
+        if self.running_jobs.get(job) is task:
+            del self.running_jobs[job]
+        if job.task is task:
+            job.task = None
+
+    def is_running(self) -> bool:
+        """调度循环是否正在运行, 没有运行时加入的任务不会被执行"""
+        return self.loop is not None
+
+    def clear(self) -> None:
+        """取消所有等待中和执行中的任务"""
+        for job in self.heap:
+            job.cancel()
+        for job in list(self.running_jobs.keys()):
+            job.cancel()
+        self.heap.clear()
+        self.running_jobs.clear()
+        if self.timer:
+            self.timer.cancel()
+        self.timer, self.timer_when = None, None
+
+    def get_pending_jobs(self) -> List[ScheduledJob]:
+        return sorted(job for job in self.heap if not job.cancelled)
+
+    def get_stats(self) -> Dict[str, Any]:
+        pending = self.get_pending_jobs()
+        next_job = pending[0] if pending else None
+        return {"pending": len(pending), "running": len(self.running_jobs),
+                "periodic": sum(1 for job in pending if job.period > 0),
+                "finished": self.finished, "timeouts": self.timeouts, "errors": self.errors,
+                "next_job": next_job.name if next_job else "",
+                "next_in": max(next_job.when - self.now(), 0) if next_job and self.loop else 0.0}
@@ -24,7 +24,7 @@ CFG_TEMP = "template_config"
 
 
 # 使用之前取消注释掉下面一行
-# @custom_user_command(readable_name="指令模板", priority=DPP_COMMAND_PRIORITY_DEFAULT)
+# @custom_user_command(readable_name="指令模板", priority=DPP_COMMAND_PRIORITY_DEFAULT, prefixes=(".xxx",))
 class TemplateCommand(UserCommandBase):
     """
     模板命令, 不要使用
@@ -2,6 +2,7 @@ import unittest
 from unittest.async_case import IsolatedAsyncioTestCase
 import os
 import asyncio
+import sqlite3
 from typing import Callable, List
 
 from core.bot import Bot
@@ -199,6 +200,27 @@ class MyTestCase(IsolatedAsyncioTestCase):
         await self.__vg_msg(".help 指令", checker=lambda s: ".r" in s)
         await self.__vg_msg(".help 链接", checker=lambda s: "pear-studio/nonebot-dicepp" in s)
 
+    async def test_2_dispatch(self):
+        dispatcher = self.test_bot.command_dispatcher
+        catch_all = [c for c in self.test_bot.command_dict.values() if not c.trigger_prefixes]
+        self.assertEqual(dispatcher.get_candidates("随便聊聊"), catch_all)
+        candidates = dispatcher.get_candidates(".ri")
+        self.assertIn(self.test_bot.command_dict["InitiativeCommand"], candidates)
+        self.assertIn(self.test_bot.command_dict["RollDiceCommand"], candidates)
+        self.assertNotIn(self.test_bot.command_dict["DeckCommand"], candidates)
+        # 候选列表与全量遍历顺序一致
+        order = list(self.test_bot.command_dict.values())
+        self.assertEqual(candidates, sorted(candidates, key=order.index))
+        # 对照模式: 被跳过的指令都不应该能处理消息
+        meta = MessageMetaData("", "", MessageSender("user", "测试用户"), "group", False)
+        for msg in [".r", ".rd20", ".ri", ".init", ".先攻检定", ".draw 塔罗牌", ".deck", ".log on", ".stat log",
+                    ".m point", ".master", ".point", ".set a=1", ".hp", ".力量检定", ".长休", ".help r", ".nn 张三",
+                    ".coc", ".dnd", ".jrrp", ".统计", ".随机", ".w 10a10", ".c a b", ".br", ".turn", ".dset d20",
+                    ".hub", "dicehub%%$card%%info", ".业力骰子", ".welcome 欢迎", ".define a b", ".config", ".bot",
+                    "1", "+", "随便聊聊", ""]:
+            meta.plain_msg = meta.raw_msg = msg
+            self.assertEqual(dispatcher.check_parity(msg, meta), [], msg)
+
     async def test_2_multi_command(self):
         await self.__vg_msg(".help\\\\.r", checker=lambda s: "提出意见~\n测试用户's" in s)
         await self.__vg_msg(".r\\\\.r\\\\", checker=lambda s: s.count("测试用户's roll result") == 2)
@@ -336,6 +358,84 @@ class MyTestCase(IsolatedAsyncioTestCase):
         await self.__vg_msg("-", checker=lambda s: "This is the first page!" in s)
         await self.__vg_msg(".s TENT_1/KEY_REP", checker=lambda s: "0." not in s and "TEST_KEY_REPEAT" in s)
 
+    async def test_3_query_record(self):
+        import tempfile
+        from core.communication import GroupMessagePort
+        from module.query import query_database
+
+        command = self.test_bot.command_dict["QueryCommand"]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, "record_test.db")
+            query_database.create_empty_sqlite_database(db_path)
+            conn = sqlite3.connect(db_path)
+            with conn:
+                conn.executemany("INSERT INTO data (名称, 英文, 来源, 分类, 标签, 内容) VALUES (?,?,?,?,?,?)",
+                                 [(f"记录测试{i}", "", "SRC", "CAT", "", f"内容{i}") for i in range(3)])
+            conn.close()
+            self.assertEqual(query_database.connect_query_database(db_path), "")
+            port = GroupMessagePort("query_record_group")
+            try:
+                # 查询可能在查询线程中进行, 结果中的记录由调用方在事件循环中写入record_dict
+                feedback, record = command.query_info("record_test", "", "记录测试", search_mode=0)
+                self.assertIn("记录测试", feedback)
+                self.assertEqual(record.length, 3)
+                self.assertNotIn(port, command.record_dict)
+
+                runner = asyncio.create_task(self.test_bot.scheduler.run())
+                await asyncio.sleep(0)
+                try:
+                    command.start_query_task("query_record_group", port, "record_test", "", "记录测试", port, 0, 0)
+                    for _ in range(100):
+                        if port in command.record_dict:
+                            break
+                        await asyncio.sleep(0.05)
+                finally:
+                    runner.cancel()
+                    await asyncio.sleep(0)
+                    self.test_bot.scheduler.clear()
+                self.assertEqual(command.record_dict[port].length, 3)
+            finally:
+                command.record_dict.pop(port, None)
+                query_database.disconnect_query_database("record_test")
+
+    async def test_3_query_fts(self):
+        import tempfile
+        from module.query import query_database
+
+        command = self.test_bot.command_dict["QueryCommand"]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, "fts_test.db")
+            query_database.create_empty_sqlite_database(db_path)
+            conn = sqlite3.connect(db_path)
+            with conn:
+                conn.executemany("INSERT INTO data (名称, 英文, 来源, 分类, 标签, 内容) VALUES (?,?,?,?,?,?)",
+                                 [("火焰箭ABC", "DEF", "PHB", "法术", "塑能", "造成火焰伤害"),
+                                  ("冰霜射线", "Ray", "PHB", "法术", "塑能", "造成寒冷伤害")])
+            conn.close()
+            self.assertEqual(query_database.connect_query_database(db_path), "")
+            try:
+                if not query_database.FTS5_TRIGRAM_AVAILABLE:
+                    return
+                self.assertIn("fts_test", query_database.FTS_QUERY_DATABASES)
+
+                def names(keywords: str, search_mode: int = 0):
+                    return sorted(item.data_name for item in command.query_item("fts_test", "", keywords, search_mode))
+
+                # 与正则匹配一样, 关键字可以跨越名称与英文, 或者名称与来源等列的边界
+                self.assertEqual(names("ABCDEF"), ["火焰箭ABC"])
+                self.assertEqual(names("RayPHB", search_mode=1), ["冰霜射线"])
+                self.assertEqual(names("伤害", search_mode=1), ["冰霜射线", "火焰箭ABC"])
+                # 通过触发器同步修改与删除
+                main_conn = query_database.CONNECTED_QUERY_DATABASES["fts_test"]
+                with main_conn:
+                    main_conn.execute("UPDATE data SET 英文='XYZ' WHERE 名称='火焰箭ABC'")
+                    main_conn.execute("DELETE FROM data WHERE 名称='冰霜射线'")
+                self.assertEqual(names("ABCDEF"), [])
+                self.assertEqual(names("ABCXYZ"), ["火焰箭ABC"])
+                self.assertEqual(names("寒冷伤害", search_mode=1), [])
+            finally:
+                query_database.disconnect_query_database("fts_test")
+
     async def test_4_deck(self):
         await self.__vg_msg(".draw", checker=lambda s: "Possible decks:" in s)
         await self.__vg_msg(".draw Deck_A", checker=lambda s: "Draw 1 times from Deck_A:" in s)
@@ -354,6 +454,233 @@ class MyTestCase(IsolatedAsyncioTestCase):
         await self.__vg_msg(".draw #Deck_G", checker=lambda s: "The draw time 零 is invalid!" in s and "times from Deck_G:" not in s)
         await self.__vg_msg(".draw deck_z", checker=lambda s: "Draw 1 times from Deck_Z:\nC1" in s)
 
+    async def test_4_deck_sampler(self):
+        import random
+        from module.deck.deck_command import Deck, DeckItem, DeckSampler, build_weight_tree
+
+        def legacy_draw(deck: Deck, times: int) -> List[int]:
+            # 原先按顺序累减权重的抽取方式
+            weight_sum_cur, index_mask, result = deck.weight_sum, set(), []
+            for _ in range(times):
+                if weight_sum_cur <= 0:
+                    break
+                weight_random = random.randint(1, weight_sum_cur)
+                for i, item in enumerate(deck.items):
+                    if i in index_mask:
+                        continue
+                    weight_random -= item.weight
+                    if weight_random <= 0:
+                        break
+                if not item.redraw:
+                    index_mask.add(i)
+                    weight_sum_cur -= item.weight
+                result.append(i)
+            return result
+
+        def sampler_draw(deck: Deck, times: int) -> List[int]:
+            sampler, result = DeckSampler(deck), []
+            for _ in range(times):
+                if sampler.weight_sum <= 0:
+                    break
+                index, item = sampler.draw()
+                if not item.redraw:
+                    sampler.remove(index)
+                result.append(index)
+            return result
+
+        rng = random.Random(42)
+        deck = Deck("Sampler", "")
+        for i in range(37):
+            deck.add_item(DeckItem(f"C{i}", rng.randint(1, 9), redraw=rng.random() < 0.5))
+        # 相同的随机数序列应当得到相同的结果
+        for seed in range(200):
+            random.seed(seed)
+            expected = legacy_draw(deck, 40)
+            random.seed(seed)
+            self.assertEqual(sampler_draw(deck, 40), expected)
+        # 缓存的树状数组不应被不放回抽取修改
+        self.assertEqual(deck.get_weight_tree(), build_weight_tree([item.weight for item in deck.items]))
+        self.assertEqual(DeckSampler(deck).weight_sum, deck.weight_sum)
+
+        # 频率检验: 卡方统计量在自由度为3时超过16.27的概率小于0.1%
+        deck = Deck("Chi", "")
+        weights = [1, 2, 3, 4]
+        for i, weight in enumerate(weights):
+            deck.add_item(DeckItem(f"C{i}", weight, redraw=(i != 3)))
+        random.seed(2024)
+        trials = 20000
+        first, second = [0] * 4, [0] * 4
+        for _ in range(trials):
+            result = sampler_draw(deck, 2)
+            first[result[0]] += 1
+            second[result[1]] += 1
+        chi_first = sum((first[i] - trials * w / 10) ** 2 / (trials * w / 10) for i, w in enumerate(weights))
+        # 第一次抽出C3(不放回)后第二次只能在剩余权重6中抽取
+        p_second = [w / 10 * (0.6 + 0.4 * (10 / 6 if i != 3 else 0)) for i, w in enumerate(weights)]
+        chi_second = sum((second[i] - trials * p) ** 2 / (trials * p) for i, p in enumerate(p_second) if p > 0)
+        self.assertLess(chi_first, 16.27)
+        self.assertLess(chi_second, 16.27)
+        random.seed()
+
+    async def test_4_deck_template(self):
+        import random
+        from module.deck.deck_command import Deck, DeckItem
+
+        loc_helper = self.test_bot.loc_helper
+        decks: List[Deck] = []
+        for name, contents in [("姓", ["赵", "钱", "孙", "李"]),
+                               ("名", ["一", "二", "DRAW(姓,1)"]),
+                               ("人", ["DRAW(姓,1)DRAW(名, 2)", "ROLL(1d1)岁的DRAW(名,1)", "DRAW(人, 1D1)"]),
+                               ("T", ["ROLL(1D1+2)", "DRAW(none,1)", "DRAW(姓,0)", "DRAW(姓,xyz)", "DRAW(姓,ROLL(1d1))",
+                                      "IMG(not_exist.png)x", "DRAW(人,3) and IMG(not_exist.jpg)", "DRAW(姓,1"])]:
+            deck = Deck(name, "")
+            for content in contents:
+                deck.add_item(DeckItem(content, 1, True, 1 if name == "人" else 0))
+            decks.append(deck)
+        deck_index = {deck.name: deck for deck in decks}
+        errors = sum([deck.compile(deck_index) for deck in decks], [])
+        self.assertEqual(len(errors), 2)
+        self.assertTrue("none in DRAW(none,1) is an invalid deck!" in errors[0])
+        self.assertTrue("T的第3个条目中存在错误" in errors[1])
+        self.assertIsNone(deck_index["T"].items[4].template)  # 抽取次数依赖ROLL的结果, 保留逐次替换
+        self.assertRaises(ValueError, deck_index["T"].items[1].get_result, deck_index["T"], decks, loc_helper, False)
+        # 编译后的结果应当与逐次替换的结果相同
+        for deck in decks:
+            for item in deck.items:
+                for seed in range(10):
+                    random.seed(seed)
+                    expected = item.substitute(deck, decks, loc_helper) if not item.is_plain else \
+                        loc_helper.format_loc_text("draw_result_design", result=item.content)
+                    random.seed(seed)
+                    self.assertEqual(item.get_result(deck, decks, loc_helper), expected)
+        random.seed()
+
+    async def test_4_deck_image(self):
+        import tempfile
+        from base64 import b64encode
+        from pathlib import Path
+        from module.deck.deck_command import Deck, DeckItem
+        from utils.cq_code import IMAGE_CACHE
+
+        loc_helper = self.test_bot.loc_helper
+        with tempfile.TemporaryDirectory() as img_dir:
+            img_path = os.path.join(img_dir, "card.png")
+            with open(img_path, "wb") as f:
+                f.write(b"card-v1")
+            deck = Deck("Image", img_dir)
+            deck.add_item(DeckItem("IMG(card.png)"))
+            deck.compile({deck.name: deck})
+            IMAGE_CACHE.clear()
+            payload = f"[CQ:image,file=base64://{b64encode(b'card-v1').decode()}]"
+            self.assertEqual(deck.items[0].get_result(deck, [deck], loc_helper), payload)
+            self.assertEqual(deck.items[0].get_result(deck, [deck], loc_helper), payload)
+            self.assertEqual(IMAGE_CACHE.get_stats()["hits"], 1)
+            # 文件变化后重新读取
+            with open(img_path, "wb") as f:
+                f.write(b"card-v2!")
+            self.assertIn(b64encode(b"card-v2!").decode(), deck.items[0].get_result(deck, [deck], loc_helper))
+            # 发送file:///路径
+            deck.compile({deck.name: deck}, image_file_uri=True)
+            self.assertEqual(deck.items[0].get_result(deck, [deck], loc_helper),
+                             f"[CQ:image,file={Path(img_path).resolve().as_uri()}]")
+            # 加载后删除图片则返回原文
+            os.remove(img_path)
+            self.assertEqual(deck.items[0].get_result(deck, [deck], loc_helper), "card.png")
+        IMAGE_CACHE.clear()
+
+    async def test_4_shared_assets(self):
+        import tempfile
+        from utils.asset import AssetRegistry, ASSET_REGISTRY, get_path_signature
+        from module.deck.deck_command import DECK_ASSET_SLOT
+        from module.deck.random_generator_command import RAND_GEN_ASSET_SLOT
+
+        registry, loaded = AssetRegistry(), []
+        with tempfile.TemporaryDirectory() as data_dir:
+            data_path = os.path.join(data_dir, "deck.xlsx")
+            with open(data_path, "w") as f:
+                f.write("v1")
+
+            def loader():
+                loaded.append(1)
+                return {"version": len(loaded)}
+
+            def key_func():
+                return get_path_signature(data_dir, (".xlsx",))
+
+            # 相同的文件只加载一次, 多个账号共享同一个对象
+            asset_a = registry.acquire("bot_a", "deck", key_func, loader)
+            asset_b = registry.acquire("bot_b", "deck", key_func, loader)
+            self.assertIs(asset_a, asset_b)
+            self.assertEqual((len(loaded), registry.get_ref_count("deck", key_func())), (1, 2))
+            old_key = key_func()
+            # 文件变化后重新加载, 旧的资源在没有账号引用后被丢弃
+            with open(data_path, "w") as f:
+                f.write("v2-changed")
+            asset_a = registry.acquire("bot_a", "deck", key_func, loader)
+            self.assertEqual(asset_a["version"], 2)
+            self.assertEqual(registry.get_ref_count("deck", old_key), 1)
+            registry.release("bot_b")
+            self.assertEqual(registry.get_ref_count("deck", old_key), 0)
+            self.assertEqual(registry.get_stats()["slots"], {"deck": {"entries": 1, "refs": 1}})
+            registry.release("bot_a")
+            self.assertEqual(registry.get_stats()["entries"], 0)
+
+        # 牌库和随机生成器登记在共享资源表中, 重新初始化时直接复用
+        account = self.test_bot.account
+        self.assertIsNotNone(ASSET_REGISTRY.get_held_key(account, DECK_ASSET_SLOT))
+        self.assertIsNotNone(ASSET_REGISTRY.get_held_key(account, RAND_GEN_ASSET_SLOT))
+        deck_command = self.test_bot.command_dict["DeckCommand"]
+        deck_dict, hits = deck_command.deck_dict, ASSET_REGISTRY.hits
+        deck_command.delay_init()
+        self.assertIs(deck_command.deck_dict, deck_dict)
+        self.assertEqual(ASSET_REGISTRY.hits, hits + 1)
+
+    async def test_4_xlsx_cache(self):
+        import tempfile
+        import time
+        import openpyxl
+        from openpyxl.comments import Comment
+        from utils.localdata import XlsxCache, col_based_workbook_to_dict, is_sheet_rows_equal
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            xlsx_path, cache_dir = os.path.join(temp_dir, "deck.xlsx"), os.path.join(temp_dir, "cache")
+            wb = openpyxl.Workbook()
+            ws = wb.active
+            ws.title = "Sheet"
+            ws.append(["Content", "Weight"])
+            ws.append(["A", 2])
+            ws.append(["B", None])
+            ws["A1"].comment = Comment("词条内容", "DicePP")
+            wb.save(xlsx_path)
+
+            cache = XlsxCache(cache_dir)
+            snapshot = cache.read(xlsx_path)
+            self.assertEqual((cache.hits, cache.misses), (0, 1))
+            # 新的进程直接读取pickle缓存
+            cache = XlsxCache(cache_dir)
+            snapshot = cache.read(xlsx_path)
+            self.assertEqual((cache.hits, cache.misses), (1, 0))
+            self.assertEqual(snapshot.sheetnames, ["Sheet"])
+            self.assertEqual(snapshot["Sheet"].comments, {(1, 1): "词条内容"})
+            self.assertEqual(col_based_workbook_to_dict(snapshot, ["Content", "Weight"], []),
+                             {"Sheet": {"Content": ["A", "B"], "Weight": ["2", ""]}})
+            self.assertTrue(is_sheet_rows_equal(snapshot["Sheet"], [["Content", "Weight"], ["A", 2]], {1: "词条内容"}))
+            self.assertFalse(is_sheet_rows_equal(snapshot["Sheet"], [["Content", "Weight"], ["A", 3]]))
+            # 文件变化后重新解析
+            ws.append(["C", 1])
+            wb.save(xlsx_path)
+            self.assertEqual(len(cache.read(xlsx_path)["Sheet"].rows), 4)
+            self.assertEqual(cache.misses, 1)
+
+        # 配置没有变化时不会回写表格
+        cfg_helper = self.test_bot.cfg_helper
+        cfg_helper.save_config()
+        mtime = os.stat(cfg_helper.data_path).st_mtime_ns
+        time.sleep(0.01)
+        cfg_helper.save_config()
+        self.assertTrue(cfg_helper.is_config_saved())
+        self.assertEqual(os.stat(cfg_helper.data_path).st_mtime_ns, mtime)
+
     async def test_4_rand_gen(self):
         await self.__vg_msg(".随机", checker=lambda s: "These are available generator: " in s and "姓名" in s)
         await self.__vg_msg(".随机男性姓名")
@@ -508,6 +835,532 @@ class MyTestCase(IsolatedAsyncioTestCase):
         await self.__vg_msg(".统计所有用户", user_id="test_master", checker=lambda s: "权限不足" not in s and "今日收到信息:" in s and "今日指令记录:" in s)
         await self.__vg_msg(".统计所有群聊", user_id="test_master", checker=lambda s: "权限不足" not in s and "条群组信息" in s)
 
+    async def test_9_log_upload(self):
+        import json
+        import threading
+        import time
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        from module.common.log_db import get_log_writer
+        from module.common.log_upload import LogUploadQueue, UPLOAD_DONE, UPLOAD_RETRY, UPLOAD_FAILED
+
+        requests_seen = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_PUT(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                requests_seen.append((self.headers.get("Authorization"), body))
+                if len(requests_seen) == 1:
+                    status, resp = 503, {"message": "busy"}
+                else:
+                    status, resp = 200, {"url": "https://log.example/abc"}
+                data = json.dumps(resp).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        queue = LogUploadQueue("upload_test_account", 105)
+        try:
+            upload = queue.enqueue(log_id="upload_test_log", group_id="group", name="测试日志",
+                                   endpoint=f"http://127.0.0.1:{server.server_port}/dice/api/log",
+                                   token="secret", uploader_id="test_master", file=b"compressed")
+            # 第一次失败后留在队列中, 下次重试的时间在未来
+            result = await queue.attempt(upload)
+            self.assertEqual(result["status"], UPLOAD_RETRY)
+            self.assertIn("HTTP 503 busy", result["message"])
+            pending = get_log_writer().get_pending_upload("upload_test_log")
+            self.assertEqual(pending["attempts"], 1)
+            self.assertFalse(queue.has_due())
+            self.assertTrue(queue.has_due(time.time() + 3600))
+            # 正在发送的任务不算到期
+            queue.in_flight.add(upload["id"])
+            self.assertFalse(queue.has_due(time.time() + 3600))
+            queue.in_flight.discard(upload["id"])
+            self.assertEqual(await queue.process_due(), [])
+            # 到期后由队列重新发送
+            get_log_writer().reschedule_upload(pending["id"], 1, 0, pending["last_error"])
+            results = await queue.process_due()
+            self.assertEqual(len(results), 1)
+            self.assertEqual(results[0][1]["status"], UPLOAD_DONE)
+            self.assertEqual(results[0][1]["url"], "https://log.example/abc")
+            self.assertIsNone(get_log_writer().get_pending_upload("upload_test_log"))
+            self.assertEqual(len(requests_seen), 2)
+            self.assertEqual(requests_seen[1][0], "Bearer secret")
+            self.assertIn(b"QQ:test_master", requests_seen[1][1])
+            self.assertIn(b"compressed", requests_seen[1][1])
+            # 地址无效等无法通过重试解决的错误直接移出队列
+            upload = queue.enqueue(log_id="upload_bad_log", group_id="group", name="测试日志", endpoint="not a url",
+                                   token="", uploader_id="test_master", file=b"compressed")
+            result = await queue.attempt(upload)
+            self.assertEqual(result["status"], UPLOAD_FAILED)
+            self.assertIsNone(get_log_writer().get_pending_upload("upload_bad_log"))
+            # 关闭时释放HTTP客户端与只读连接
+            self.assertIsNotNone(queue.client.client)
+            await queue.close()
+            self.assertIsNone(queue.client.client)
+            self.assertIsNone(queue.reader)
+        finally:
+            await queue.close()
+            server.shutdown()
+            server.server_close()
+
+    async def test_9_log_bot_records(self):
+        from module.common import log_command
+        from module.common.log_db import get_log_writer
+
+        await self.__vg_msg(".log new 发送记录", group_id="log_bot_group")
+        log_id = log_command._peek_group_payload(self.test_bot, "log_bot_group")[log_command.LOG_GROUP_CURRENT]
+        self.assertTrue(log_command.is_log_recording(self.test_bot, "log_bot_group"))
+        self.assertFalse(log_command.is_log_recording(self.test_bot, "log_idle_group"))
+        log_command.queue_bot_log_records(self.test_bot, "log_idle_group", ["不会被记录"])
+        log_command.queue_bot_log_records(self.test_bot, "log_bot_group", ["第一条回复", "第二条回复"])
+        # 记录在事件循环的下一轮才写入
+        self.assertEqual(len(log_command._PENDING_BOT_RECORDS), 2)
+        await asyncio.sleep(0)
+        self.assertEqual(len(log_command._PENDING_BOT_RECORDS), 0)
+        records = [rec for rec in get_log_writer().fetch_records(log_id) if rec["source"] == "bot"]
+        self.assertEqual([rec["content"] for rec in records][-2:], ["第一条回复", "第二条回复"])
+        await self.__vg_msg(".log halt", group_id="log_bot_group")
+
+    async def test_9_log_session(self):
+        from module.common import log_command
+        from module.common.log_db import get_log_writer
+
+        group_id = "log_session_group"
+        sessions = log_command._LOG_SESSIONS.setdefault(self.test_bot.data_manager, {})
+        # 没有在记录的群也会缓存结果, 之后只需要一次字典查询
+        self.assertFalse(log_command.is_log_recording(self.test_bot, group_id))
+        self.assertIsNone(sessions[group_id])
+        await self.__vg_msg(".log new 会话", group_id=group_id)
+        self.assertNotIn(group_id, sessions)
+        await self.__vg_msg("第一句", group_id=group_id)
+        session = sessions[group_id]
+        log_id = session.log_id
+        await self.__vg_msg("第二句", group_id=group_id)
+        self.assertIs(sessions[group_id], session)
+        # 暂停记录后会话被丢弃, 之后的消息不会被记录
+        await self.__vg_msg(".log off", group_id=group_id)
+        self.assertNotIn(group_id, sessions)
+        await self.__vg_msg("暂停时说的话", group_id=group_id)
+        self.assertIsNone(sessions[group_id])
+        await self.__vg_msg(".log on", group_id=group_id)
+        await self.__vg_msg("第三句", group_id=group_id)
+        self.assertIsNot(sessions[group_id], session)
+        self.assertEqual(sessions[group_id].log_id, log_id)
+        # 结束记录后同样不再记录
+        await self.__vg_msg(".log end", group_id=group_id)
+        self.assertNotIn(group_id, sessions)
+        await self.__vg_msg("结束后说的话", group_id=group_id)
+        self.assertIsNone(sessions[group_id])
+        get_log_writer().flush()
+        contents = [rec["content"] for rec in get_log_writer().fetch_records(log_id) if rec["source"] == "user"]
+        self.assertEqual([content for content in contents if not content.startswith(".")], ["第一句", "第二句", "第三句"])
+
+    async def test_9_log_stat(self):
+        from module.common import log_command
+        from module.common.log_db import get_log_writer
+
+        group_id = "log_stat_group"
+        await self.__vg_msg(".log new 统计", group_id=group_id)
+        log_id = log_command._peek_group_payload(self.test_bot, group_id)[log_command.LOG_GROUP_CURRENT]
+        log_command.record_incoming_message(self.test_bot, group_id, "30001", "甲", "我来检定", "m1", is_bot=False)
+        log_command.record_incoming_message(self.test_bot, group_id, "30001", "甲", "再来一次", "m2", is_bot=False)
+        log_command.record_incoming_message(self.test_bot, group_id, "30002", "乙", "我也来", "m3", is_bot=False)
+        log_command.record_incoming_message(self.test_bot, group_id, self.test_bot.account, "骰娘",
+                                            "甲的侦查检定: D100=20/50 成功 HP: 10 -> 7", None, is_bot=True)
+        log_command.record_incoming_message(self.test_bot, group_id, self.test_bot.account, "骰娘",
+                                            "乙的攻击检定: 大失败", None, is_bot=True)
+        # 统计随记录一起批量写入统计表, 查询前会先写入缓冲
+        stats = get_log_writer().fetch_stats(log_id)
+        self.assertEqual(stats["messages"], 5)
+        self.assertEqual(stats["participants"]["30001"], [2, "甲"])
+        self.assertEqual(stats["participants"]["30002"], [1, "乙"])
+        self.assertEqual(stats["rolls"]["success"], 1)
+        self.assertEqual(stats["rolls"]["critical_failure"], 1)
+        self.assertEqual(stats["attributes"], {"HP": -3})
+        await self.__vg_msg(".log stat", group_id=group_id,
+                            checker=lambda s: "日志《统计》统计" in s and "甲(2)" in s and "乙(1)" in s
+                            and "成功 1，失败 0，大成功 0，大失败 1" in s and "HP-3" in s)
+        # 撤回只删除记录, 统计与之前的版本一样是累计值, 不会减少
+        messages = get_log_writer().fetch_stats(log_id)["messages"]
+        log_command.delete_log_record_by_message_id(self.test_bot, group_id, "m2")
+        self.assertNotIn("再来一次", [rec["content"] for rec in get_log_writer().fetch_records(log_id)])
+        stats = get_log_writer().fetch_stats(log_id)
+        self.assertEqual(stats["messages"], messages)
+        self.assertEqual(stats["participants"]["30001"], [2, "甲"])
+        await self.__vg_msg(".log stat", group_id=group_id, checker=lambda s: "甲(2)" in s and "大失败 1" in s)
+        await self.__vg_msg(".log halt", group_id=group_id)
+
+    async def test_9_log_maintenance(self):
+        import datetime
+        import gzip
+        import json
+        from unittest import mock
+        from module.common import log_command
+        from module.common.log_db import get_log_writer, LOG_ARCHIVE_DIR
+        from utils.time import datetime_to_str, get_current_date_raw
+
+        group_id = "log_archive_group"
+        await self.__vg_msg(".log new 过期", group_id=group_id)
+        log_id = log_command._peek_group_payload(self.test_bot, group_id)[log_command.LOG_GROUP_CURRENT]
+        for index in range(5):
+            log_command.record_incoming_message(self.test_bot, group_id, "40001", "丙", "过期记录" + "长" * 2000 + str(index),
+                                                f"a{index}", is_bot=False)
+        await self.__vg_msg(".log halt", group_id=group_id)
+        await self.__vg_msg(".log new 保留", group_id=group_id)
+        keep_id = log_command._peek_group_payload(self.test_bot, group_id)[log_command.LOG_GROUP_CURRENT]
+        log_command.record_incoming_message(self.test_bot, group_id, "40001", "丙", "保留记录", "k0", is_bot=False)
+        await self.__vg_msg(".log halt", group_id=group_id)
+        await self.__vg_msg(".log set keep 7", group_id=group_id, checker=lambda s: "7 天" in s)
+        payload = log_command._load_group_payload(self.test_bot, group_id)
+        old_time = datetime_to_str(get_current_date_raw() - datetime.timedelta(days=30))
+        payload[log_command.LOG_GROUP_LOGS][log_id][log_command.LOG_KEY_UPDATED_AT] = old_time
+        log_command._save_group_payload(self.test_bot, group_id, payload)
+
+        command = next(cmd for cmd in self.test_bot.command_dict.values() if isinstance(cmd, log_command.LogCommand))
+        writer = get_log_writer()
+        with mock.patch.object(log_command, "LOG_MAINTENANCE_BATCH", 2):  # 分多批删除
+            report = await command._run_maintenance()
+        self.assertIn("归档并删除 1 个日志，共 6 条记录", "\n".join(str(cmd) for cmd in report))
+        # 过期日志归档为gzip压缩的JSONL, 第一行为元数据
+        archive_path = os.path.join(LOG_ARCHIVE_DIR, group_id, f"过期_{log_id}.jsonl.gz")
+        with gzip.open(archive_path, "rt", encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(lines[0]["log_id"], log_id)
+        self.assertEqual(lines[0]["stats"]["messages"], len(lines) - 1)
+        contents = [line["content"] for line in lines[1:] if line["content"].startswith("过期记录")]
+        self.assertEqual([content[-1] for content in contents], ["0", "1", "2", "3", "4"])
+        # 数据库中的记录与群数据中的日志都被删除, 未过期的日志不受影响
+        self.assertEqual(writer.fetch_records(log_id), [])
+        self.assertEqual(writer.fetch_stats(log_id)["messages"], 0)
+        logs = log_command._load_group_payload(self.test_bot, group_id)[log_command.LOG_GROUP_LOGS]
+        self.assertNotIn(log_id, logs)
+        self.assertIn(keep_id, logs)
+        self.assertIn("保留记录", [rec["content"] for rec in writer.fetch_records(keep_id)])
+        # 数据库切换为增量回收, 空闲页已被回收
+        conn = writer.connection()
+        self.assertEqual(conn.execute("PRAGMA auto_vacuum").fetchone()[0], 2)
+        self.assertEqual(conn.execute("PRAGMA freelist_count").fetchone()[0], 0)
+
+    async def test_9_log_recall(self):
+        from unittest import mock
+        from module.common import log_command
+        from module.common.log_db import get_log_writer
+
+        group_id = "log_recall_group"
+        writer = get_log_writer()
+        await self.__vg_msg(".log new 撤回", group_id=group_id)
+        log_id = log_command._peek_group_payload(self.test_bot, group_id)[log_command.LOG_GROUP_CURRENT]
+
+        def record(message_id: str) -> None:
+            log_command.record_incoming_message(self.test_bot, group_id, "50001", "丁", "消息" + message_id, message_id,
+                                                is_bot=False)
+
+        def contents() -> list:
+            return [rec["content"] for rec in writer.fetch_records(log_id) if rec["content"].startswith("消息")]
+
+        for index in range(4):
+            record(f"r{index}")
+        writer.flush()
+        with mock.patch.object(writer, "delete_records_by_message_id", wraps=writer.delete_records_by_message_id) as spy:
+            # 撤回环中没有的消息一定没有被记录, 不访问数据库
+            log_command.delete_log_record_by_message_id(self.test_bot, group_id, "unlogged")
+            spy.assert_not_called()
+            # 撤回环命中时交给写入器, 多条撤回在同一次批量写入中删除
+            with writer.write_lock:  # 阻止后台线程提前写入, 以便检查缓冲
+                log_command.delete_log_record_by_message_id(self.test_bot, group_id, "r1")
+                log_command.delete_log_record_by_message_id(self.test_bot, group_id, "r2")
+                self.assertEqual(writer.pending_deletes, [(log_id, "r1"), (log_id, "r2")])
+                self.assertEqual(contents(), ["消息r0", "消息r3"])
+                self.assertEqual(writer.pending_deletes, [])
+            self.assertEqual(spy.call_count, 2)
+            # 尚未写入的记录直接从缓冲中移除
+            with writer.write_lock:
+                record("r4")
+                log_command.delete_log_record_by_message_id(self.test_bot, group_id, "r4")
+                self.assertEqual(writer.pending_records, [])
+            self.assertEqual(contents(), ["消息r0", "消息r3"])
+
+            # 记录数超过撤回环的容量后, 不在环中的消息需要回退到数据库删除
+            spy.reset_mock()
+            with mock.patch.object(log_command, "LOG_RECALL_RING_SIZE", 1):
+                log_command._RECALL_RINGS[self.test_bot.data_manager].pop(group_id)
+                log_command.delete_log_record_by_message_id(self.test_bot, group_id, "r0")
+                spy.assert_called_once_with(log_id, "r0")
+                self.assertEqual(contents(), ["消息r3"])
+                log_command.delete_log_record_by_message_id(self.test_bot, group_id, "unlogged")
+                self.assertEqual(spy.call_count, 2)
+        await self.__vg_msg(".log halt", group_id=group_id)
+
+    async def test_9_log_export_mentions(self):
+        from module.common import log_command
+
+        await self.__vg_msg(".nn 被提及者", group_id="log_mention_group", user_id="20001")
+        await self.__vg_msg(".log new 提及", group_id="log_mention_group")
+        await self.__vg_msg("看这里[CQ:at,qq=20001]", group_id="log_mention_group")
+        command = next(cmd for cmd in self.test_bot.command_dict.values() if isinstance(cmd, log_command.LogCommand))
+        payload = log_command._load_group_payload(self.test_bot, "log_mention_group")
+        log_id = payload[log_command.LOG_GROUP_CURRENT]
+        entry = payload[log_command.LOG_GROUP_LOGS][log_id]
+        # 被@的用户没有在日志中发言, 准备导出时不扫描记录, 由工作线程找出被@的用户后再回到事件循环查询昵称
+        job = command._prepare_export("log_mention_group", entry, log_command._ensure_filters(payload), log_id=log_id)
+        self.assertEqual(job.mention_names, {})
+        main_path, _, extra_files = await command._export_files_async(job)
+        self.assertEqual(job.mention_names, {"20001": "被提及者"})
+        txt_path = next(path for path in [main_path] + [path for path, _ in extra_files] if path.endswith(".txt"))
+        with open(txt_path, encoding="utf-8") as f:
+            self.assertIn("看这里@被提及者", f.read())
+        # docx带有样式表, 标题使用Heading 1样式
+        import zipfile
+        self.assertTrue(main_path.endswith(".docx"))
+        with zipfile.ZipFile(main_path) as docx_file:
+            self.assertIn('w:styleId="Heading1"', docx_file.read("word/styles.xml").decode("utf-8"))
+            self.assertIn('<w:pStyle w:val="Heading1"/>', docx_file.read("word/document.xml").decode("utf-8"))
+        await self.__vg_msg(".log halt", group_id="log_mention_group")
+
+    async def test_9_log_writer_flush(self):
+        import sqlite3
+        import tempfile
+        import threading
+        import time
+        from module.common.log_db import LogWriter
+
+        log_payload = {"id": "flush_log", "group_id": "group", "name": "测试日志", "created_at": "2024", "updated_at": "2024",
+                       "record_begin_at": "2024", "last_warn": "2024"}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            writer = LogWriter(os.path.join(tmp_dir, "log.db"))
+            try:
+                writer.upsert_log(log_payload)
+                # 日志不存在的记录违反外键约束, 只丢弃这一条, 其他记录照常写入
+                for log_id, content in [("flush_log", "第一条"), ("missing_log", "坏数据"), ("flush_log", "第二条")]:
+                    writer.append_record(log_id, time="2024", user_id="u", nickname="n", content=content,
+                                         source="user", message_id=None, stats={"messages": 1})
+                self.assertEqual(writer.flush(), 2)
+                self.assertEqual([rec["content"] for rec in writer.fetch_records("flush_log")], ["第一条", "第二条"])
+                self.assertEqual(writer.fetch_stats("flush_log")["messages"], 2)
+                self.assertEqual(writer.pending_records, [])
+                writer.append_record("flush_log", time="2024", user_id="u", nickname="n", content="第三条",
+                                     source="user", message_id=None)
+                self.assertEqual(writer.flush(), 1)
+
+                # 数据库被锁定时整批保留, 之后重新写入
+                blocker = sqlite3.connect(writer.db_path, timeout=0)
+                blocker.execute("BEGIN EXCLUSIVE")
+                writer.connection().execute("PRAGMA busy_timeout=0")
+                writer.append_record("flush_log", time="2024", user_id="u", nickname="n", content="第四条",
+                                     source="user", message_id=None)
+                self.assertEqual(writer.flush(), 0)
+                self.assertEqual(len(writer.pending_records), 1)
+                blocker.rollback()
+                blocker.close()
+                self.assertEqual(writer.flush(), 1)
+                self.assertEqual(writer.fetch_records("flush_log")[-1]["content"], "第四条")
+
+                # 数据库读写进行中时, 追加记录与撤回只需要缓冲的锁
+                writing, release = threading.Event(), threading.Event()
+
+                def hold_write_lock():
+                    with writer.write_lock:
+                        writing.set()
+                        release.wait(5)
+
+                holder = threading.Thread(target=hold_write_lock)
+                holder.start()
+                writing.wait(5)
+                begin = time.monotonic()
+                writer.append_record("flush_log", time="2024", user_id="u", nickname="n", content="第五条",
+                                     source="user", message_id="m5")
+                writer.delete_records_by_message_id("flush_log", "m5")
+                writer.upsert_log(dict(log_payload, updated_at="2025"))
+                self.assertLess(time.monotonic() - begin, 1)
+                release.set()
+                holder.join()
+                self.assertEqual(writer.flush(), 0)
+                self.assertEqual(writer.fetch_records("flush_log")[-1]["content"], "第四条")
+            finally:
+                writer.close()
+
+    async def test_9_outbound(self):
+        import time
+        from core.command import BotSendMsgCommand, BotDelayCommand
+        from core.communication import GroupMessagePort, PrivateMessagePort
+        from adapter.outbound import OutboundDispatcher
+
+        sent = []
+
+        async def send(command):
+            await asyncio.sleep(0.01)
+            sent.append((command.targets[0].group_id or command.targets[0].user_id, command.msg, time.monotonic()))
+
+        dispatcher = OutboundDispatcher(send, global_rate=1000, global_burst=1000, target_rate=1000, target_burst=1000)
+        port_a, port_b = GroupMessagePort("A"), GroupMessagePort("B")
+        start = time.monotonic()
+        dispatcher.submit([BotSendMsgCommand("bot", "A1", [port_a]), BotDelayCommand("bot", 0.2),
+                           BotSendMsgCommand("bot", "A2", [port_a])])
+        dispatcher.submit([BotSendMsgCommand("bot", "B1", [port_b, PrivateMessagePort("C")])])
+        self.assertEqual(dispatcher.get_depth(), 5)
+        await dispatcher.join()
+        # 同一对象按顺序发送, 延迟只推迟自己的队列
+        self.assertEqual([msg for target, msg, _ in sent if target == "A"], ["A1", "A2"])
+        self.assertEqual([msg for _, msg, _ in sent][-1], "A2")
+        self.assertLess(max(t for target, _, t in sent if target != "A") - start, 0.15)
+        self.assertGreaterEqual(sent[-1][2] - start, 0.2)
+        stats = dispatcher.get_stats()
+        self.assertEqual((stats["sent"], stats["depth"], stats["targets"]), (4, 0, 3))
+
+        # 令牌桶: 突发2条之后每秒20条
+        sent.clear()
+        dispatcher = OutboundDispatcher(send, global_rate=1000, global_burst=1000, target_rate=20, target_burst=2)
+        start = time.monotonic()
+        dispatcher.submit([BotSendMsgCommand("bot", f"A{i}", [port_a]) for i in range(5)])
+        await dispatcher.join()
+        self.assertEqual([msg for _, msg, _ in sent], [f"A{i}" for i in range(5)])
+        self.assertGreaterEqual(sent[-1][2] - start, 0.14)
+
+        # 关闭前等待发送队列清空, 超时后队列继续发送
+        from adapter.nonebot_adapter import NoneBotClientProxy
+        sent.clear()
+        proxy = NoneBotClientProxy(None)
+        proxy.outbound = dispatcher
+        dispatcher.submit([BotSendMsgCommand("bot", f"B{i}", [port_b]) for i in range(5)])
+        self.assertFalse(await proxy.drain(0.01))
+        self.assertTrue(await proxy.drain(5))
+        self.assertEqual([msg for _, msg, _ in sent], [f"B{i}" for i in range(5)])
+        # 没有发送对象的指令不会进入任何队列
+        dispatcher.submit([BotSendMsgCommand("bot", "lost", [])])
+        self.assertEqual(dispatcher.get_depth(), 0)
+
+        # 延迟只加入之后还有指令的对象的队列, 其他对象的下一条消息不受影响
+        sent.clear()
+        dispatcher = OutboundDispatcher(send, global_rate=1000, global_burst=1000, target_rate=1000, target_burst=1000)
+        start = time.monotonic()
+        dispatcher.submit([BotSendMsgCommand("bot", "A1", [port_a]), BotDelayCommand("bot", 0.2),
+                           BotSendMsgCommand("bot", "B1", [port_b])])
+        self.assertEqual((len(dispatcher.queues[("group", "A")].jobs), len(dispatcher.queues[("group", "B")].jobs)), (1, 2))
+        dispatcher.submit([BotSendMsgCommand("bot", "A2", [port_a])])
+        await dispatcher.join()
+        times = {msg: t - start for _, msg, t in sent}
+        self.assertLess(times["A2"], 0.15)
+        self.assertGreaterEqual(times["B1"], 0.2)
+        # 单独提交的延迟推迟到下一次提交的指令之前
+        sent.clear()
+        start = time.monotonic()
+        dispatcher.submit([BotSendMsgCommand("bot", "A3", [port_a])])
+        dispatcher.submit([BotDelayCommand("bot", 0.2)])
+        self.assertEqual(dispatcher.get_depth(), 1)
+        dispatcher.submit([BotSendMsgCommand("bot", "B2", [port_b])])
+        await dispatcher.join()
+        times = {msg: t - start for _, msg, t in sent}
+        self.assertLess(times["A3"], 0.15)
+        self.assertGreaterEqual(times["B2"], 0.2)
+        # 下一次提交前已经过去的时间会被扣除
+        dispatcher.submit([BotDelayCommand("bot", 0.1)])
+        await asyncio.sleep(0.15)
+        sent.clear()
+        start = time.monotonic()
+        dispatcher.submit([BotSendMsgCommand("bot", "A4", [port_a])])
+        await dispatcher.join()
+        self.assertLess(sent[0][2] - start, 0.1)
+
+        # 适配器发送失败时抛出异常, 由发送队列计入失败次数
+        class FailingBot:
+            async def send_group_msg(self, **kwargs):
+                raise RuntimeError("network down")
+
+        proxy = NoneBotClientProxy(FailingBot())
+        proxy.outbound.submit([BotSendMsgCommand("bot", "A5", [port_a])])
+        await proxy.outbound.join()
+        stats = proxy.get_outbound_stats()
+        self.assertEqual((stats["sent"], stats["failed"]), (0, 1))
+
+    async def test_9_scheduler(self):
+        from core.bot.scheduler import BotScheduler
+
+        results, errors = [], []
+
+        async def on_result(bot_commands):
+            results.extend(bot_commands)
+
+        scheduler = BotScheduler(on_result, errors.append)
+        self.assertFalse(scheduler.is_running())
+        runner = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0)
+        self.assertTrue(scheduler.is_running())
+        # 测试用的Bot没有运行调度器, 导出等耗时操作会同步进行
+        self.assertFalse(self.test_bot.is_scheduler_running())
+        loop = asyncio.get_running_loop()
+        start, fired, ticks = loop.time(), {}, []
+
+        def make_job(name):
+            async def job():
+                fired[name] = loop.time()
+                return [name]
+            return job
+
+        async def tick():
+            ticks.append(loop.time())
+            return []
+
+        async def slow():
+            await asyncio.sleep(1)
+            return ["slow"]
+
+        async def broken():
+            raise ValueError("broken")
+
+        scheduler.schedule_at(start + 0.2, make_job("late"))
+        scheduler.schedule_at(start + 0.1, make_job("early"))  # 更早的任务加入后会提前唤醒调度器
+        scheduler.schedule_at(start + 0.05, make_job("cancelled")).cancel()
+        periodic = scheduler.schedule_every(0.05, tick)
+        scheduler.schedule_at(start, slow, timeout=0.03, timeout_callback=lambda: ["timeout"])
+        scheduler.schedule_at(start, broken)
+        await asyncio.sleep(0.3)
+        periodic.cancel()
+        tick_count = len(ticks)
+        await asyncio.sleep(0.1)
+
+        self.assertEqual(results, ["timeout", "early", "late"])
+        self.assertNotIn("cancelled", fired)
+        self.assertGreaterEqual(fired["early"] - start, 0.1)
+        self.assertLess(fired["early"] - start, 0.18)
+        self.assertGreaterEqual(tick_count, 4)
+        self.assertEqual(len(ticks), tick_count)
+        self.assertEqual(len(errors), 1)
+        self.assertIn("broken", errors[0])
+        stats = scheduler.get_stats()
+        self.assertEqual((stats["pending"], stats["running"], stats["timeouts"], stats["errors"]), (0, 0, 1, 1))
+        runner.cancel()
+        await asyncio.sleep(0)
+        self.assertFalse(scheduler.is_running())
+
+        # 只有声明了周期的指令会被定期调用, register_task交给调度器立即执行
+        periods = {command.__class__.__name__: command.tick_period for command in self.test_bot.command_dict.values()}
+        self.assertGreater(periods["HubCommand"], 0)
+        self.assertGreater(periods["LogCommand"], 0)
+        self.assertEqual(periods["RollDiceCommand"], 0)
+
+        async def noop():
+            return []
+        job = self.test_bot.register_task(noop)
+        self.assertIn(job, self.test_bot.scheduler.get_pending_jobs())
+        job.cancel()
+        self.assertNotIn(job, self.test_bot.scheduler.get_pending_jobs())
+
+        # 任务返回的指令整体提交, 其中的延迟才能作用于之后的指令
+        from unittest import mock
+        from core.command import BotSendMsgCommand, BotDelayCommand
+        from core.communication import GroupMessagePort
+        result = [BotDelayCommand("test_bot", 1), BotSendMsgCommand("test_bot", "msg", [GroupMessagePort("group")])]
+        with mock.patch.object(self.test_proxy, "process_bot_command_list", wraps=self.test_proxy.process_bot_command_list) as spy:
+            await self.test_bot._send_scheduled_result(result)
+        spy.assert_called_once_with(result)
+
     async def test_end_reload(self):
         await self.test_bot.data_manager.save_data_async()
         self.test_bot.data_manager.load_data()
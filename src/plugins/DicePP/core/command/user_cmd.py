@@ -1,5 +1,5 @@
 import abc
-from typing import List, Tuple, Dict, Type, Any
+from typing import List, Tuple, Dict, Type, Any, Iterable
 
 from core.bot import Bot
 from core.communication import MessageMetaData
@@ -19,6 +19,8 @@ class UserCommandBase(metaclass=abc.ABCMeta):
     
     group_only: bool = False
     permission_require: int = 0
+    trigger_prefixes: Tuple[str, ...] = ()  # 为空代表任意消息都可能触发, 每条消息都会调用can_process_msg
+    tick_period: float = 0  # 大于0时每隔tick_period秒调用一次tick, 为0代表不需要定期调用
 
     def __init__(self, bot: Bot):
         """
@@ -33,13 +35,17 @@ class UserCommandBase(metaclass=abc.ABCMeta):
         return []
 
     def tick(self) -> List[BotCommandBase]:
-        """每秒调用一次的方法"""
+        """每隔tick_period秒调用一次的方法"""
         return []
 
     def tick_daily(self) -> List[BotCommandBase]:
         """每天调用一次"""
         return []
 
+    async def shutdown_async(self) -> None:
+        """骰娘关闭或重启时调用, 用于释放网络连接等资源"""
+        pass
+
     @abc.abstractmethod
     def can_process_msg(self, msg_str: str, meta: MessageMetaData) -> Tuple[bool, bool, Any]:
         """
@@ -96,7 +102,9 @@ def custom_user_command(readable_name: str,
                         group_only: bool = False,
                         flag: int = DPP_COMMAND_FLAG_DEFAULT,
                         cluster: int = DPP_COMMAND_CLUSTER_DEFAULT,
-                        permission_require: int = 0):
+                        permission_require: int = 0,
+                        prefixes: Iterable[str] = (),
+                        tick_period: float = 0):
     """
     装饰Command类, 给自定义的Command附加一些参数
     Args:
@@ -106,6 +114,9 @@ def custom_user_command(readable_name: str,
         flag: 标志位, 标志着指令的类型是DND指令, 娱乐指令等等, 主要用于profiler
         cluster: 所属的命令群组, 被用来开关某一组功能
         permission_require: 所需权限，默认为谁都能用
+        prefixes: 触发前缀, 预处理后的消息以其中之一开头时才会调用can_process_msg. 为空代表任意消息都可能触发(如聊天/日志记录)
+                  声明的前缀必须覆盖can_process_msg所有可能返回should_proc为True的情况
+        tick_period: 调用tick的间隔(秒), 为0代表不需要定期调用tick
     """
 
     def custom_inner(cls):
@@ -120,6 +131,8 @@ def custom_user_command(readable_name: str,
         cls.flag = flag
         cls.cluster = cluster
         cls.permission_require = permission_require
+        cls.trigger_prefixes = tuple(prefixes)
+        cls.tick_period = tick_period
         USER_COMMAND_CLS_DICT[cls.__name__] = cls
         return cls
 
@@ -1,4 +1,4 @@
-from core.config.basic import PROJECT_PATH, DATA_PATH, BOT_DATA_PATH, CONFIG_PATH, LOCAL_IMG_PATH
+from core.config.basic import PROJECT_PATH, DATA_PATH, BOT_DATA_PATH, CONFIG_PATH, LOCAL_IMG_PATH, CACHE_PATH
 from core.config.common import *
 from core.config.declare import BOT_VERSION, BOT_DESCRIBE, BOT_GIT_LINK
 
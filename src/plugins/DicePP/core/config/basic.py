@@ -1,6 +1,7 @@
 import os
 
 from utils.logger import dice_log
+from utils.localdata import XLSX_CACHE
 
 PROJECT_PATH = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
 
@@ -64,6 +65,7 @@ DATA_PATH = _select_data_path(PROJECT_PATH)
 BOT_DATA_PATH = os.path.join(DATA_PATH, 'Bot')
 CONFIG_PATH = os.path.join(DATA_PATH, 'Config')
 LOCAL_IMG_PATH = os.path.join(CONFIG_PATH, 'LocalImage')
+CACHE_PATH = os.path.join(DATA_PATH, 'Cache')  # 可以随时删除的缓存, 如已解析的xlsx
 
 
 ALL_LOCAL_DIR_PATH = [DATA_PATH, BOT_DATA_PATH, CONFIG_PATH, LOCAL_IMG_PATH]
@@ -72,3 +74,5 @@ for dirPath in ALL_LOCAL_DIR_PATH:
     if not os.path.exists(dirPath):
         os.makedirs(dirPath)
         dice_log("[Config] [Init] 创建文件夹: " + dirPath)
+
+XLSX_CACHE.set_cache_dir(os.path.join(CACHE_PATH, 'xlsx'))
@@ -80,3 +80,8 @@ DEFAULT_CONFIG_COMMENT[CFG_MEMORY_RESTART_PERCENT] = "内存使用率重启阈
 CFG_MEMORY_RESTART_MB = "memory_restart_mb"
 DEFAULT_CONFIG[CFG_MEMORY_RESTART_MB] = "2048"
 DEFAULT_CONFIG_COMMENT[CFG_MEMORY_RESTART_MB] = "内存绝对上限 (MB), 达到后自动重启机器人 (即使百分比未达阈值)"
+
+# 指令分发
+CFG_COMMAND_DISPATCH_PARITY = "command_dispatch_parity"
+DEFAULT_CONFIG[CFG_COMMAND_DISPATCH_PARITY] = "0"
+DEFAULT_CONFIG_COMMENT[CFG_COMMAND_DISPATCH_PARITY] = "指令分发对照模式, 1为开启. 开启后会额外对被前缀表跳过的指令调用判断, 若与全量遍历结果不一致则记录到日志, 仅用于调试"
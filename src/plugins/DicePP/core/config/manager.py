@@ -5,7 +5,7 @@ import openpyxl
 from openpyxl.comments import Comment
 
 from utils.logger import dice_log
-from utils.localdata import read_xlsx
+from utils.localdata import read_xlsx, read_xlsx_cached, is_sheet_rows_equal
 
 from core.config.config_item import ConfigItem
 from core.config.basic import DATA_PATH
@@ -29,7 +29,7 @@ class ConfigManager:
         if not os.path.exists(self.data_path):
             dice_log(f"[BotConfig] [Load] 无法读取配置文件 {self.data_path.replace(DATA_PATH, '~')}")
             return
-        workbook = read_xlsx(self.data_path)
+        workbook = read_xlsx_cached(self.data_path, keep_in_memory=True)
         if self.identifier in workbook.sheetnames:
             sheet = workbook[self.identifier]
         elif "Default" in workbook.sheetnames:
@@ -45,11 +45,16 @@ class ConfigManager:
             self.all_configs[key] = ConfigItem(key, comment=comment)
             for text in [str(cell.value) for cell in row[1:] if (cell.value is not None)]:
                 self.all_configs[key].add(text)
-        workbook.close()
         dice_log(f"[BotConfig] [Load] 成功读取配置文件 {self.data_path.replace(DATA_PATH, '~')}")
 
     def save_config(self):
-        """按现在的设置多个机器人会读写同一个配置文件, 如果并行可能存在写冲突, 现在应该是单线程异步, 应该没问题"""
+        """
+        按现在的设置多个机器人会读写同一个配置文件, 如果并行可能存在写冲突, 现在应该是单线程异步, 应该没问题
+        文件中当前账号的配置与内存中一致时不会重新写入
+        """
+        if self.is_config_saved():
+            return
+
         def save_loc_text_to_row(sheet, item: ConfigItem, row: int):
             header = sheet.cell(row=row, column=1, value=item.key)
             if item.comment:
@@ -82,6 +87,19 @@ class ConfigManager:
 
         dice_log(f"[BotConfig] [Save] 成功更新配置文件 {self.data_path.replace(DATA_PATH, '~')}")
 
+    def is_config_saved(self) -> bool:
+        """配置文件中当前账号的工作表是否已经与内存中的配置一致"""
+        if not os.path.exists(self.data_path):
+            return False
+        try:
+            workbook = read_xlsx_cached(self.data_path, keep_in_memory=True)
+        except Exception:
+            return False
+        sheet = workbook[self.identifier] if self.identifier in workbook.sheetnames else None
+        rows = [[item.key] + item.contents for item in self.all_configs.values()]
+        comments = {ri + 1: item.comment for ri, item in enumerate(self.all_configs.values()) if item.comment}
+        return is_sheet_rows_equal(sheet, rows, comments)
+
     def register_config(self, key: str, origin_str: str, comment: str = ""):
         """
         将一个配置注册至Helper中
@@ -2,4 +2,6 @@ from core.data.basic import *
 
 from core.data.json_object import JsonObject, custom_json_object
 from core.data.data_chunk import DataChunkBase, custom_data_chunk
+from core.data.storage import STORAGE_JSON, STORAGE_SQLITE
 from core.data.manager import DataManager, DataManagerError
+from core.data.view import ReadOnlyDict, ReadOnlyList, freeze, thaw
@@ -1,4 +1,5 @@
 from core.data.data_chunk import custom_data_chunk, DataChunkBase
+from core.data.storage import STORAGE_SQLITE
 
 DC_META = "meta"
 DCK_META_STAT = "stat"
@@ -39,7 +40,7 @@ class _(DataChunkBase):
         super().__init__()
 
 
-@custom_data_chunk(identifier=DC_USER_DATA, include_json_object=True)
+@custom_data_chunk(identifier=DC_USER_DATA, include_json_object=True, storage=STORAGE_SQLITE)
 class _(DataChunkBase):
     def __init__(self):
         super().__init__()
@@ -51,7 +52,7 @@ class _(DataChunkBase):
         self.version = 1
 
 
-@custom_data_chunk(identifier=DC_GROUP_DATA, include_json_object=True)
+@custom_data_chunk(identifier=DC_GROUP_DATA, include_json_object=True, storage=STORAGE_SQLITE)
 class _(DataChunkBase):
     def __init__(self):
         super().__init__()
@@ -63,7 +64,7 @@ class _(DataChunkBase):
         self.version = 1
 
 
-@custom_data_chunk(identifier=DC_NICKNAME)
+@custom_data_chunk(identifier=DC_NICKNAME, storage=STORAGE_SQLITE)
 class _(DataChunkBase):
     def __init__(self):
         super().__init__()
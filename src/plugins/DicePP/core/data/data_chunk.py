@@ -12,6 +12,7 @@ from utils.time import get_current_date_str
 from utils.logger import dice_log
 
 from core.data.json_object import JsonObject, JSON_OBJECT_PREFIX
+from core.data.storage import STORAGE_JSON, STORAGE_TYPES
 
 
 def _update_hasher(hasher: "hashlib._Hash", value: Any) -> None:
@@ -58,18 +59,137 @@ def _update_hasher(hasher: "hashlib._Hash", value: Any) -> None:
     hasher.update(b"S")
     hasher.update(str(value).encode("utf-8", "surrogatepass"))
 
+
+# noinspection PyBroadException
+def deserialize_json_object_in_node(node: Any) -> None:
+    """
+    递归地将节点中的 JsonObject 字符串或可推断的 dict 转换为 JsonObject 实例。
+    - 处理字符串形式的 JsonObject（以 JSON_OBJECT_PREFIX 开头）
+    - 处理字符串形式的裸 JSON（如 '{...}'），尝试 json.loads 后再推断
+    - 处理已经是 dict 的旧格式，使用 construct_from_dict 做启发式匹配
+    """
+    if isinstance(node, dict):
+        invalid_key = []
+        for key, value in list(node.items()):
+            # Recurse into nested containers first
+            if isinstance(value, (dict, list)):
+                deserialize_json_object_in_node(value)
+                continue
+
+            # Case A: explicit JsonObject encoded with prefix
+            if isinstance(value, str) and value.find(JSON_OBJECT_PREFIX) == 0:
+                try:
+                    node[key] = JsonObject.construct_from_json(value)
+                    continue
+                except Exception as e:
+                    dice_log(f"[DataManager] [Load] 从字典中加载{key}: {value}时出现错误 {e}")
+                    invalid_key.append(key)
+                    continue
+
+            # Case B: string that looks like JSON (old formats)
+            if isinstance(value, str) and value and value[0] in ('{', '['):
+                try:
+                    parsed = json.loads(value)
+                except Exception:
+                    parsed = None
+                if isinstance(parsed, dict):
+                    # try to construct JsonObject from dict
+                    try:
+                        obj = JsonObject.construct_from_dict(parsed)
+                        if obj is not None:
+                            node[key] = obj
+                            continue
+                        else:
+                            # if not a JsonObject, keep parsed dict
+                            node[key] = parsed
+                            continue
+                    except Exception as e:
+                        dice_log(f"[DataManager] [Load] 解析字符串JSON为对象时出错 {e}")
+
+            # Case C: dict in place of JsonObject (older dumps)
+            if isinstance(value, dict):
+                try:
+                    obj = JsonObject.construct_from_dict(value)
+                    if obj is not None:
+                        node[key] = obj
+                        continue
+                except Exception as e:
+                    dice_log(f"[DataManager] [Load] 从字典构造 JsonObject 时出错 {e}")
+
+        for key in invalid_key:
+            del node[key]
+
+    elif isinstance(node, list):
+        invalid_index = []
+        for index, value in enumerate(list(node)):
+            if isinstance(value, (dict, list)):
+                deserialize_json_object_in_node(value)
+                continue
+
+            if isinstance(value, str) and value.find(JSON_OBJECT_PREFIX) == 0:
+                try:
+                    node[index] = JsonObject.construct_from_json(value)
+                    continue
+                except Exception as e:
+                    dice_log(f"[DataManager] [Load] 从列表中加载{index}: {value}时出现错误 {e}")
+                    invalid_index.append(index)
+                    continue
+
+            if isinstance(value, str) and value and value[0] in ('{', '['):
+                try:
+                    parsed = json.loads(value)
+                except Exception:
+                    parsed = None
+                if isinstance(parsed, dict):
+                    try:
+                        obj = JsonObject.construct_from_dict(parsed)
+                        if obj is not None:
+                            node[index] = obj
+                            continue
+                        else:
+                            node[index] = parsed
+                            continue
+                    except Exception as e:
+                        dice_log(f"[DataManager] [Load] 解析列表中字符串JSON为对象时出错 {e}")
+
+            if isinstance(value, dict):
+                try:
+                    obj = JsonObject.construct_from_dict(value)
+                    if obj is not None:
+                        node[index] = obj
+                        continue
+                except Exception as e:
+                    dice_log(f"[DataManager] [Load] 从列表中构造 JsonObject 时出错 {e}")
+
+        for index in reversed(invalid_index):
+            del node[index]
+
+
 DC_VERSION_LATEST = "1.0"  # 格式版本
 
 
+def get_chunk_hash(version_base: str, update_time: str, root: Dict) -> int:
+    """DataChunk的哈希校验码, 也可以对保存时拷贝出的快照计算, 结果与原数据相同"""
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(str(version_base).encode("utf-8", "surrogatepass"))
+    hasher.update(b"|")
+    hasher.update(str(update_time).encode("utf-8", "surrogatepass"))
+    hasher.update(b"|")
+    _update_hasher(hasher, root)
+    return int.from_bytes(hasher.digest(), "big", signed=False)
+
+
 class DataChunkBase(metaclass=abc.ABCMeta):
     """
     DataChunk是一次读取/更新文件的最小单位, 每个DataChunk子类都对应一个同名的持久化json文件
     为了方便阅读和管理, 一个DataChunk应当包括某一类功能所需要的全部数据, 也不应包含太多或太少内容
     不能拥有非基础类型, 自定义类型必须继承自DataManager.JsonObject! 否则无法序列化
     例子: 保存20000条某类数据, 每条数据200字节, 大概就是4MB
+    以用户/群为顶层key的大型DataChunk可以使用sqlite后端, 此时对应同名的.db文件, 只会读写被访问/修改过的顶层key
     """
     identifier = "basic_data"
     include_json_object = False
+    storage = STORAGE_JSON
 
     def __init__(self):
         self.version_base: str = DC_VERSION_LATEST  # 如果修改了相关的代码, 可以通过版本号来将旧版本的数据转换到新版本
@@ -96,110 +216,6 @@ class DataChunkBase(metaclass=abc.ABCMeta):
             obj: 生成的实例
         """
 
-        # noinspection PyBroadException
-        def deserialize_json_object_in_node(node: Any) -> None:
-            """
-            递归地将节点中的 JsonObject 字符串或可推断的 dict 转换为 JsonObject 实例。
-            - 处理字符串形式的 JsonObject（以 JSON_OBJECT_PREFIX 开头）
-            - 处理字符串形式的裸 JSON（如 '{...}'），尝试 json.loads 后再推断
-            - 处理已经是 dict 的旧格式，使用 construct_from_dict 做启发式匹配
-            """
-            if isinstance(node, dict):
-                invalid_key = []
-                for key, value in list(node.items()):
-                    # Recurse into nested containers first
-                    if isinstance(value, (dict, list)):
-                        deserialize_json_object_in_node(value)
-                        continue
-
-                    # Case A: explicit JsonObject encoded with prefix
-                    if isinstance(value, str) and value.find(JSON_OBJECT_PREFIX) == 0:
-                        try:
-                            node[key] = JsonObject.construct_from_json(value)
-                            continue
-                        except Exception as e:
-                            dice_log(f"[DataManager] [Load] 从字典中加载{key}: {value}时出现错误 {e}")
-                            invalid_key.append(key)
-                            continue
-
-                    # Case B: string that looks like JSON (old formats)
-                    if isinstance(value, str) and value and value[0] in ('{', '['):
-                        try:
-                            parsed = json.loads(value)
-                        except Exception:
-                            parsed = None
-                        if isinstance(parsed, dict):
-                            # try to construct JsonObject from dict
-                            try:
-                                obj = JsonObject.construct_from_dict(parsed)
-                                if obj is not None:
-                                    node[key] = obj
-                                    continue
-                                else:
-                                    # if not a JsonObject, keep parsed dict
-                                    node[key] = parsed
-                                    continue
-                            except Exception as e:
-                                dice_log(f"[DataManager] [Load] 解析字符串JSON为对象时出错 {e}")
-
-                    # Case C: dict in place of JsonObject (older dumps)
-                    if isinstance(value, dict):
-                        try:
-                            obj = JsonObject.construct_from_dict(value)
-                            if obj is not None:
-                                node[key] = obj
-                                continue
-                        except Exception as e:
-                            dice_log(f"[DataManager] [Load] 从字典构造 JsonObject 时出错 {e}")
-
-                for key in invalid_key:
-                    del node[key]
-
-            elif isinstance(node, list):
-                invalid_index = []
-                for index, value in enumerate(list(node)):
-                    if isinstance(value, (dict, list)):
-                        deserialize_json_object_in_node(value)
-                        continue
-
-                    if isinstance(value, str) and value.find(JSON_OBJECT_PREFIX) == 0:
-                        try:
-                            node[index] = JsonObject.construct_from_json(value)
-                            continue
-                        except Exception as e:
-                            dice_log(f"[DataManager] [Load] 从列表中加载{index}: {value}时出现错误 {e}")
-                            invalid_index.append(index)
-                            continue
-
-                    if isinstance(value, str) and value and value[0] in ('{', '['):
-                        try:
-                            parsed = json.loads(value)
-                        except Exception:
-                            parsed = None
-                        if isinstance(parsed, dict):
-                            try:
-                                obj = JsonObject.construct_from_dict(parsed)
-                                if obj is not None:
-                                    node[index] = obj
-                                    continue
-                                else:
-                                    node[index] = parsed
-                                    continue
-                            except Exception as e:
-                                dice_log(f"[DataManager] [Load] 解析列表中字符串JSON为对象时出错 {e}")
-
-                    if isinstance(value, dict):
-                        try:
-                            obj = JsonObject.construct_from_dict(value)
-                            if obj is not None:
-                                node[index] = obj
-                                continue
-                        except Exception as e:
-                            dice_log(f"[DataManager] [Load] 从列表中构造 JsonObject 时出错 {e}")
-
-                for index in reversed(invalid_index):
-                    del node[index]
-
         obj = cls()
         for k, v in json_dict.items():
             obj.__setattr__(k, v)
@@ -240,13 +256,7 @@ class DataChunkBase(metaclass=abc.ABCMeta):
             return self.__dict__
 
     def __hash__(self):
-        hasher = hashlib.blake2b(digest_size=16)
-        hasher.update(str(self.version_base).encode("utf-8", "surrogatepass"))
-        hasher.update(b"|")
-        hasher.update(str(self.update_time).encode("utf-8", "surrogatepass"))
-        hasher.update(b"|")
-        _update_hasher(hasher, self.root)
-        return int.from_bytes(hasher.digest(), "big", signed=False)
+        return get_chunk_hash(self.version_base, self.update_time, self.root)
 
     def introspect(self) -> None:
         pass
@@ -256,12 +266,14 @@ DATA_CHUNK_TYPES: List[Type[DataChunkBase]] = []  # 记录所有DataChunk的子
 
 
 def custom_data_chunk(identifier: str,
-                      include_json_object=False):
+                      include_json_object=False,
+                      storage: str = STORAGE_JSON):
     """
     类修饰器, 将自定义DataChunk注册到列表中
     Args:
         identifier: 一个字符串, 作为储存该DataChunk实例的名字, 应当是一个有区分度的名字, 不能含有空格, 也不能含有文件名中的非法字符
         include_json_object: 是否会含有Json Object类型, 如果为否, 在序列化时不会进行检查
+        storage: 存储后端, STORAGE_JSON为整个文件读写, STORAGE_SQLITE为按顶层key分片读写, 已有的json文件会在首次载入时自动迁移
     """
 
     def custom_inner(cls):
@@ -274,10 +286,12 @@ def custom_data_chunk(identifier: str,
         """
         assert issubclass(cls, DataChunkBase)
         assert " " not in identifier
+        assert storage in STORAGE_TYPES
         for dc in DATA_CHUNK_TYPES:
             assert dc.identifier != identifier
         cls.identifier = identifier
         cls.include_json_object = include_json_object
+        cls.storage = storage
         cls.__name__ = "DataChunkClass" + identifier
         DATA_CHUNK_TYPES.append(cls)
         return cls
@@ -5,16 +5,55 @@
 
 import os
 import copy
+import json
+import time
 import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from json import JSONDecodeError
-from typing import Tuple, List, Dict, Any, Optional, Callable
+from typing import Tuple, List, Dict, Any, Optional, Callable, Set
 
 from utils.logger import dice_log
-from utils.localdata import update_json_async, read_json
+from utils.localdata import write_json_atomic, read_json
 
 from core.config import DATA_PATH as ROOT_DATA_PATH
 
-from core.data.data_chunk import DATA_CHUNK_TYPES, DataChunkBase
+from core.data.data_chunk import DATA_CHUNK_TYPES, DataChunkBase, deserialize_json_object_in_node, get_chunk_hash
+from core.data.storage import STORAGE_SQLITE, SqliteChunkStore, ShardState, dumps_node, migrate_json_to_store, \
+    get_store_path, json_object_default
+from core.data.view import freeze
+
+# 所有DataManager共用的写入线程, 只有一个线程以保证同一文件的写入顺序
+SAVE_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="DataManagerSave")
+
+
+def _write_json_snapshot(root: Dict[str, Any], attrs: Dict[str, Any], json_path: str) -> Tuple[int, int]:
+    """在写入线程中计算快照的校验码并写入json文件, 返回(校验码, 写入的字节数)"""
+    hash_code = get_chunk_hash(attrs.get("version_base"), attrs.get("update_time"), root)
+    json_dict = dict(attrs, root=root, hash_code=hash_code)
+    return hash_code, write_json_atomic(json_dict, json_path, default=json_object_default)
+
+
+class SaveMetrics:
+    """记录每个DataChunk的保存耗时与写入字节数"""
+
+    def __init__(self):
+        self.chunks: Dict[str, Dict[str, float]] = {}
+        self.last_total_ms: float = 0  # 最近一次save_data_async的总耗时
+
+    def record(self, dc_name: str, latency_ms: float, size: int) -> None:
+        info = self.chunks.setdefault(dc_name, {"count": 0, "fail": 0, "last_ms": 0, "max_ms": 0,
+                                                "last_bytes": 0, "total_bytes": 0})
+        info["count"] += 1
+        info["last_ms"] = latency_ms
+        info["max_ms"] = max(info["max_ms"], latency_ms)
+        info["last_bytes"] = size
+        info["total_bytes"] += size
+
+    def record_failure(self, dc_name: str) -> None:
+        self.record(dc_name, 0, 0)
+        self.chunks[dc_name]["count"] -= 1
+        self.chunks[dc_name]["fail"] += 1
 
 
 class DataManager:
@@ -35,6 +74,12 @@ class DataManager:
             dice_log(f"[DataManager] [Init] 创建文件夹: {data_path.replace(ROOT_DATA_PATH, '~')}")
 
         self.__dataChunks: Dict[str, DataChunkBase] = {}
+        self.__shards: Dict[str, ShardState] = {}  # 使用sqlite后端的DataChunk的分片状态
+        self.__generations: Dict[str, int] = {}  # 每个DataChunk被修改或被引用的次数, 用于判断保存期间数据是否变化
+        # json后端的快照: 顶层key -> 上次保存时的深拷贝, 只有被修改或引用过的key需要重新拷贝, 没有快照时拷贝全部数据
+        self.__json_snapshots: Dict[str, Dict[str, Any]] = {}
+        self.__json_dirty_keys: Dict[str, Set[str]] = {}
+        self.save_metrics = SaveMetrics()
         self.load_data()
 
     def get_data(self, target: str, path: List[str],
@@ -53,10 +98,21 @@ class DataManager:
         Returns:
             data(Any): 取得的数据
         """
+        cur_node = self.__get_node(target, path, default_val, default_gen)
+        if get_ref:
+            # 持有引用的调用者可能直接修改数据, 分片存储需要在下次保存时写回这个key
+            self.__mark_ref(target, path)
+            return cur_node
+        else:  # 默认返回拷贝
+            return copy.deepcopy(cur_node)
+
+    def __get_node(self, target: str, path: List[str],
+                   default_val: Optional[Any], default_gen: Optional[Callable[[], Any]]) -> Any:
         if len(path) > 1 and not path[-1]:
             raise DataManagerError(f"[GetData] 叶子结点的名称不能为空 完整路径: {path}")
 
         data_chunk = self.__get_data_chunk(target)
+        self.__page_in(target, data_chunk, path)
         strict_check = data_chunk.strict_check
         parent_node = data_chunk.root
         cur_node = parent_node
@@ -81,7 +137,7 @@ class DataManager:
                 if default_val_cur is None:
                     raise DataManagerError(f"[GetData] 尝试在不给出默认值的情况下访问不存在的路径! 路径: {path}")
                 parent_node[cur_path] = default_val_cur
-                data_chunk.dirty = True
+                self.__mark_dirty(target, data_chunk, path)
             cur_node = parent_node[cur_path]
             if strict_check:  # 检查是否与默认值拥有相同类型
                 if default_val_cur is not None and type(cur_node) != type(default_val_cur):
@@ -89,11 +145,23 @@ class DataManager:
                                            f" {type(cur_node)} != {type(default_val_cur)}\n"
                                            f"路径: {path} 当前节点: {path[i]} 已有值:{cur_node}")
             parent_node = cur_node
+        return cur_node
 
-        if get_ref:
-            return cur_node
-        else:  # 默认返回拷贝
-            return copy.deepcopy(cur_node)
+    def get_view(self, target: str, path: List[str],
+                 default_val: Optional[Any] = None, default_gen: Optional[Callable[[], Any]] = None) -> Any:
+        """
+        与get_data相同, 但不会产生拷贝, 而是返回数据的只读视图, 适合只需要读取数据的高频路径
+        字典和列表会被包装为ReadOnlyDict/ReadOnlyList, 尝试修改会抛出TypeError, 其他类型原样返回
+        视图会随DataManager中的数据同步变化, 需要修改或长期持有时请用thaw得到拷贝
+        Args:
+            target(str): 目标DataChunk的名字, 通过identifier定义
+            path(Tuple[str]): 路径节点
+            default_val(Optional[Any]): 数据默认值, 含义与get_data相同
+            default_gen(Optional[Callable[]]): 数据默认值生成器, 含义与get_data相同
+        Returns:
+            view(Any): 取得的数据的只读视图
+        """
+        return freeze(self.__get_node(target, path, default_val, default_gen))
 
     def set_data(self, target: str, path: List[str], new_val: Any) -> None:
         """
@@ -107,6 +175,7 @@ class DataManager:
             raise DataManagerError(f"[SetData] 叶子结点的名称不能为空 完整路径: {path}")
 
         data_chunk = self.__get_data_chunk(target)
+        self.__page_in(target, data_chunk, path)
         strict_check = data_chunk.strict_check
         parent_node = data_chunk.root
         for i in range(len(path)):
@@ -131,7 +200,7 @@ class DataManager:
 
             # 节点不存在或已经是目标节点值和新值不符合
             if (cur_path not in parent_node) or (is_last and parent_node[cur_path] != new_val_cur):
-                data_chunk.dirty = True
+                self.__mark_dirty(target, data_chunk, path)
                 parent_node[cur_path] = new_val_cur
 
             parent_node = parent_node[cur_path]  # 继续访问下一节点
@@ -150,12 +219,14 @@ class DataManager:
             data(Any): 被删除的数据
         """
         data_chunk = self.__get_data_chunk(target)
+        self.__page_in(target, data_chunk, path)
         parent_node = data_chunk.root
         cur_node = parent_node
 
         if not path:
             if force_delete:
                 data_chunk.root = {}
+                self.__truncate(target, data_chunk)
                 return cur_node
             else:
                 raise DataManagerError(f"[DeleteData] 尝试非安全地删除所有数据!")
@@ -177,6 +248,7 @@ class DataManager:
 
             if is_last:
                 del parent_node[cur_path]
+                self.__mark_dirty(target, data_chunk, path)
             parent_node = cur_node
 
         return cur_node
@@ -196,6 +268,7 @@ class DataManager:
                 for _name, _chunk in self.__dataChunks.items():
                     if issubclass(type(_chunk), DataChunkBase):
                         _chunk.root = {}
+                        self.__truncate(_name, _chunk)
                 return None
             else:
                 raise DataManagerError(f"[DeleteData] 尝试非安全地删除所有数据!")
@@ -214,6 +287,9 @@ class DataManager:
             raise DataManagerError(f"[GetData] 叶子结点的名称不能为空 完整路径: {path}")
 
         data_chunk = self.__get_data_chunk(target)
+        if not path and target in self.__shards:  # 分片存储不需要为了列出顶层key载入全部数据
+            return self.__shards[target].all_keys(data_chunk.root)
+        self.__page_in(target, data_chunk, path)
         parent_node = data_chunk.root
         cur_node = parent_node
         for i in range(len(path)):
@@ -238,17 +314,155 @@ class DataManager:
             raise DataManagerError(f"[GetDataChunk] 找到的变量({type(data_chunk)})不是继承于{DataChunkBase}!")
         return data_chunk
 
+    def __page_in(self, target: str, data_chunk: DataChunkBase, path: List[str]) -> None:
+        """分片存储按需载入path对应的顶层key, path为空时载入全部数据"""
+        shard = self.__shards.get(target)
+        if shard is None or not shard.unloaded:
+            return
+        if not path:
+            keys = list(shard.unloaded)
+        elif path[0] in shard.unloaded:
+            keys = [path[0]]
+        else:
+            return
+        rows = shard.store.items() if not path else shard.store.items(keys)
+        for key, value in rows:
+            if key not in shard.unloaded:
+                continue
+            node = json.loads(value)
+            if data_chunk.include_json_object:
+                wrapper = {key: node}
+                deserialize_json_object_in_node(wrapper)
+                node = wrapper.get(key)
+            if node is not None:
+                data_chunk.root[key] = node
+        shard.unloaded.difference_update(keys)
+
+    def __mark_dirty(self, target: str, data_chunk: DataChunkBase, path: List[str]) -> None:
+        data_chunk.dirty = True
+        self.__generations[target] = self.__generations.get(target, 0) + 1
+        shard = self.__shards.get(target)
+        if shard is None:
+            self.__touch_json(target, path)
+        elif path:
+            shard.touch(path[0])
+
+    def __mark_ref(self, target: str, path: List[str]) -> None:
+        self.__generations[target] = self.__generations.get(target, 0) + 1
+        shard = self.__shards.get(target)
+        if shard is None:
+            self.__touch_json(target, path)
+            return
+        if path:
+            shard.touch(path[0])
+        else:
+            shard.all_dirty = True
+
+    def __touch_json(self, target: str, path: List[str]) -> None:
+        """json后端在下次保存时重新拷贝path对应的顶层key, path为空时重新拷贝全部数据"""
+        if path:
+            self.__json_dirty_keys.setdefault(target, set()).add(path[0])
+        else:
+            self.__json_snapshots.pop(target, None)
+
+    def __truncate(self, target: str, data_chunk: DataChunkBase) -> None:
+        data_chunk.dirty = True
+        self.__generations[target] = self.__generations.get(target, 0) + 1
+        shard = self.__shards.get(target)
+        if shard is None:
+            self.__touch_json(target, [])
+        else:
+            shard.truncate = True
+            shard.unloaded.clear()
+            shard.dirty_keys.clear()
+
+    def __load_shard(self, dc_type, json_path: str, json_path_tmp: str) -> DataChunkBase:
+        """
+        打开sqlite后端的DataChunk, 只读取key列表, 数据在首次访问时载入
+        数据库中还没有数据时, 会从旧的json文件(优先临时文件)迁移, 迁移后的json文件会被重命名为*.migrated
+        """
+        dc_name = dc_type.get_identifier()
+        db_path = get_store_path(self.dataPath, dc_name)
+        db_path_readable = db_path.replace(ROOT_DATA_PATH, "~")
+        store = SqliteChunkStore(db_path)
+        attrs = store.get_attrs()
+        if attrs is None:
+            for path in (json_path_tmp, json_path):
+                if not os.path.exists(path):
+                    continue
+                path_readable = path.replace(ROOT_DATA_PATH, "~")
+                try:
+                    count = migrate_json_to_store(read_json(path), store)
+                except JSONDecodeError as e:
+                    dice_log(f"[DataManager] [Init] 无法从{path_readable}迁移{dc_name}: {e.args}")
+                    continue
+                dice_log(f"[DataManager] [Init] 已将{path_readable}中的{count}条数据迁移至{db_path_readable}")
+                for old_path in (json_path_tmp, json_path):
+                    if os.path.exists(old_path):
+                        os.replace(old_path, old_path + ".migrated")
+                attrs = store.get_attrs()
+                break
+
+        shard = ShardState(store)
+        self.__shards[dc_name] = shard
+        if attrs is None:
+            return dc_type()
+        root = {}
+        data_chunk = dc_type.from_json(dict(attrs, root=root))
+        if data_chunk.root is not root:  # introspect认为数据已经失效
+            data_chunk.root = {}
+            self.__truncate(dc_name, data_chunk)
+        else:
+            dice_log(f"[DataManager] [Init] 从{db_path_readable}中载入{dc_name}, 共{len(shard.unloaded)}条")
+        return data_chunk
+
+    async def __save_shard(self, data_chunk: DataChunkBase, shard: ShardState) -> int:
+        """
+        只写回被修改或被引用过的顶层key, 返回写入的字节数, 失败抛出sqlite3.Error
+        序列化在事件循环中进行(只涉及被修改的key), 写入数据库在写入线程中进行
+        """
+        root = data_chunk.root
+        keys = list(root.keys()) if shard.all_dirty else list(shard.dirty_keys)
+        rows: Dict[str, str] = {}
+        deleted: List[str] = []
+        for key in keys:
+            if key in root:
+                rows[key] = dumps_node(root[key])
+            else:
+                deleted.append(key)
+        attrs = {k: v for k, v in data_chunk.__dict__.items() if k != "root"}
+        truncate = shard.truncate
+        shard.dirty_keys.clear()
+        shard.all_dirty = False
+        shard.truncate = False
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(SAVE_EXECUTOR, shard.store.write, rows, deleted, attrs, truncate)
+        except sqlite3.Error:
+            shard.dirty_keys.update(keys)
+            shard.truncate = shard.truncate or truncate
+            raise
+        return sum(len(value.encode("utf-8")) for value in rows.values())
+
     def load_data(self):
         """
         从本地文件中读取数据, 会完全用本地文件覆盖内存中的信息
         """
         self.__dataChunks: Dict[str, DataChunkBase] = dict()
+        for shard in self.__shards.values():
+            shard.store.close()
+        self.__shards = {}
+        self.__json_snapshots.clear()
+        self.__json_dirty_keys.clear()
         for dcType in DATA_CHUNK_TYPES:
             dc_name = dcType.get_identifier()
             json_path = os.path.join(self.dataPath, f"{dc_name}.json")
             json_path_readable = json_path.replace(ROOT_DATA_PATH, "~")
             json_path_tmp = json_path + ".tmp"
             json_path_tmp_readable = json_path_tmp.replace(ROOT_DATA_PATH, "~")
+            if dcType.storage == STORAGE_SQLITE:
+                self.__dataChunks[dc_name] = self.__load_shard(dcType, json_path, json_path_tmp)
+                continue
             if os.path.exists(json_path_tmp):  # 先看看能不能从临时文件恢复, 临时文件应该比正式文件更新
                 try:
                     json_dict = read_json(json_path_tmp)
@@ -256,53 +470,88 @@ class DataManager:
                     dice_log(f"[DataManager] [Init] 从备份{json_path_tmp_readable}中载入{dc_name}")
                     continue
                 except JSONDecodeError as e:
+                    # 临时文件可能在写入途中中断, 正式文件总是完整的
                     dice_log(f"[DataManager] [Init] 无法从备份{json_path_tmp_readable}中载入{dc_name}: {e.args}")
-            elif os.path.exists(json_path):  # 如果存在该文件, 则读取json文件并用它初始化数据
+            if os.path.exists(json_path):  # 如果存在该文件, 则读取json文件并用它初始化数据
                 try:
                     json_dict = read_json(json_path)
                     self.__dataChunks[dc_name] = dcType.from_json(json_dict)
                     dice_log(f"[DataManager] [Init] 从{json_path_readable}中载入{dc_name}")
                     continue
                 except JSONDecodeError as e:
-                    if not os.path.exists(json_path_tmp):
-                        dice_log(f"[DataManager] [Init] 无法从{json_path_readable}中载入{dc_name}: {e.args}")
+                    dice_log(f"[DataManager] [Init] 无法从{json_path_readable}中载入{dc_name}: {e.args}")
             # 文件不存在则用默认构造函数生成一个数据对象
             self.__dataChunks[dc_name] = dcType()
             # logger.dice_log(f"[DataManager] [Init] 找不到{json_path_readable}, 使用空白数据")
 
     async def save_data_async(self):
-        for dataChunk in self.__dataChunks.values():
+        """
+        将被修改过的Data Chunks写入硬盘, 文件写入在写入线程中进行, 不会长时间阻塞事件循环
+        json后端: 在事件循环中只深拷贝被修改或引用过的顶层key, 与之前的拷贝组成快照, 写入线程计算校验码并流式写入临时文件后原子替换正式文件
+        写入线程不会读取任何可能被同时修改的数据
+        如果写入期间数据又被修改, 会保持dirty以便下次保存时重新写入
+        """
+        loop = asyncio.get_running_loop()
+        save_begin = time.perf_counter()
+        for dataChunk in list(self.__dataChunks.values()):
+            dc_name = dataChunk.get_identifier()
+            shard = self.__shards.get(dc_name)
+            if shard is not None:
+                if not (dataChunk.dirty or shard.dirty_keys or shard.all_dirty or shard.truncate):
+                    continue
+                dataChunk.dirty = False
+                begin = time.perf_counter()
+                try:
+                    size = await self.__save_shard(dataChunk, shard)
+                except (sqlite3.Error, TypeError, ValueError) as e:
+                    dice_log(f"[SaveData] 写入{dc_name}时出现错误: {e}")
+                    dataChunk.dirty = True
+                    self.save_metrics.record_failure(dc_name)
+                    continue
+                self.save_metrics.record(dc_name, (time.perf_counter() - begin) * 1000, size)
+                continue
             if not dataChunk.dirty:  # 没有被修改过则不需要更新
                 continue
             dataChunk.dirty = False
-            dc_name = dataChunk.get_identifier()
-            dataChunk.hash_code = hash(dataChunk)
+            generation = self.__generations.get(dc_name, 0)
             json_path = os.path.join(self.dataPath, f"{dc_name}.json")
-            # 为了安全起见, 先将文件保存在临时文件中
             json_path_readable = json_path.replace(ROOT_DATA_PATH, "~")
-            json_path_tmp = json_path + ".tmp"
-            json_path_tmp_readable = json_path_tmp.replace(ROOT_DATA_PATH, "~")
-            try:
-                await update_json_async(dataChunk.to_json(), json_path_tmp)
-            except JSONDecodeError as e:
-                dice_log(f"[SaveData] 序列化过程中出现错误: {e.msg}")
-                dataChunk.dirty = True
-                continue
-            # 删除正式文件
+            begin = time.perf_counter()
+            root, attrs = self.__snapshot_json(dataChunk)
             try:
-                if os.path.exists(json_path):
-                    os.remove(json_path)
-            except OSError as e:
-                dice_log(f"[SaveData] 无法删除文件{json_path_readable}: {e.args}")
+                hash_code, size = await loop.run_in_executor(SAVE_EXECUTOR, _write_json_snapshot, root, attrs, json_path)
+            except (TypeError, ValueError, OSError) as e:
+                dice_log(f"[SaveData] 写入{json_path_readable}时出现错误: {e}")
                 dataChunk.dirty = True
+                self.save_metrics.record_failure(dc_name)
                 continue
-            # 重命名临时文件
-            try:
-                os.rename(json_path_tmp, json_path)
-            except OSError as e:
-                dice_log(f"[SaveData] 无法重命名文件{json_path_tmp_readable} -> {json_path_readable} 原因: {e.args}")
+            dataChunk.hash_code = hash_code
+            if self.__generations.get(dc_name, 0) != generation:  # 写入期间数据发生了变化
                 dataChunk.dirty = True
-                continue
+            self.save_metrics.record(dc_name, (time.perf_counter() - begin) * 1000, size)
+        self.save_metrics.last_total_ms = (time.perf_counter() - save_begin) * 1000
+
+    def __snapshot_json(self, data_chunk: DataChunkBase) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        拷贝json后端的数据, 返回(root的快照, 其他属性的快照), 快照之后不会再被修改, 可以交给写入线程
+        没有被修改或引用过的顶层key直接沿用上次保存时的拷贝
+        """
+        dc_name = data_chunk.get_identifier()
+        root = data_chunk.root
+        dirty_keys = self.__json_dirty_keys.pop(dc_name, set())
+        prev = self.__json_snapshots.get(dc_name)
+        if prev is None:
+            snapshot = copy.deepcopy(root)
+        else:
+            snapshot = {key: prev[key] if key in prev and key not in dirty_keys else copy.deepcopy(value)
+                        for key, value in root.items()}
+        self.__json_snapshots[dc_name] = snapshot
+        attrs = copy.deepcopy({k: v for k, v in data_chunk.__dict__.items() if k not in ("root", "hash_code")})
+        return snapshot, attrs
+
+    def get_save_metrics(self) -> SaveMetrics:
+        """返回保存耗时与写入字节数的统计"""
+        return self.save_metrics
 
     def save_data(self):
         """
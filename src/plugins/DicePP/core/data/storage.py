@@ -0,0 +1,115 @@
+"""
+DataChunk的分片存储后端
+默认的json后端每次保存都会重写整个文件, 对于以用户/群为顶层key的大型DataChunk开销很大
+sqlite后端为每个顶层key保存一行, 只写入被修改过的key, 读取时按需载入
+"""
+import os
+import json
+import sqlite3
+from typing import Dict, Any, List, Optional, Iterable, Set, Tuple
+
+from core.data.json_object import JsonObject
+
+STORAGE_JSON = "json"  # 整个DataChunk保存为一个json文件
+STORAGE_SQLITE = "sqlite"  # 每个顶层key保存为sqlite中的一行
+
+STORAGE_TYPES = (STORAGE_JSON, STORAGE_SQLITE)
+
+ATTRS_KEY = "attrs"  # meta表中保存DataChunk除root以外属性的键
+
+
+def dumps_node(node: Any) -> str:
+    """序列化一个节点, JsonObject会被转换为带前缀的字符串, 与DataChunkBase.to_json的结果一致"""
+    return json.dumps(node, ensure_ascii=False, default=json_object_default)
+
+
+def json_object_default(obj: Any) -> str:
+    """json.dump的default参数, 将JsonObject转换为带前缀的字符串"""
+    if isinstance(obj, JsonObject):
+        return obj.to_json()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class SqliteChunkStore:
+    """
+    单个DataChunk对应的键值存储, 文件名为{identifier}.db
+    kv表保存顶层key与序列化后的值, meta表保存版本号等DataChunk属性
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.execute("PRAGMA synchronous=NORMAL;")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL);")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL);")
+        self.conn.commit()
+
+    def get_attrs(self) -> Optional[Dict[str, Any]]:
+        """返回保存的DataChunk属性, 从未写入过则返回None"""
+        row = self.conn.execute("SELECT value FROM meta WHERE name=?", (ATTRS_KEY,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def keys(self) -> List[str]:
+        return [row[0] for row in self.conn.execute("SELECT key FROM kv")]
+
+    def get(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM kv WHERE key=?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def items(self, keys: Optional[Iterable[str]] = None) -> List[Tuple[str, str]]:
+        if keys is None:
+            return list(self.conn.execute("SELECT key, value FROM kv"))
+        return [(key, value) for key in keys for value in [self.get(key)] if value is not None]
+
+    def write(self, rows: Dict[str, str], deleted: Iterable[str], attrs: Optional[Dict[str, Any]] = None,
+              truncate: bool = False) -> None:
+        """在一个事务中写入修改过的行并删除被移除的行"""
+        with self.conn:
+            if truncate:
+                self.conn.execute("DELETE FROM kv")
+            self.conn.executemany("DELETE FROM kv WHERE key=?", [(key,) for key in deleted])
+            self.conn.executemany("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", list(rows.items()))
+            if attrs is not None:
+                self.conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+                                  (ATTRS_KEY, json.dumps(attrs, ensure_ascii=False)))
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class ShardState:
+    """
+    DataManager为sqlite后端的DataChunk维护的状态
+    root中只包含已经载入的key, unloaded为数据库中存在但尚未载入的key
+    dirty_keys记录需要写回的顶层key, 保存时仍在root中的key会被写入, 已不在root中的key会被删除
+    """
+
+    def __init__(self, store: SqliteChunkStore):
+        self.store = store
+        self.unloaded: Set[str] = set(store.keys())
+        self.dirty_keys: Set[str] = set()
+        self.all_dirty: bool = False  # root被整体引用或修改, 保存时写回全部已载入的key
+        self.truncate: bool = False  # root被整体清空, 保存时先清空数据库
+
+    def all_keys(self, root: dict) -> List[str]:
+        return list(root.keys()) + [key for key in self.unloaded if key not in root]
+
+    def touch(self, key: str) -> None:
+        self.dirty_keys.add(key)
+
+
+def migrate_json_to_store(json_dict: Dict[str, Any], store: SqliteChunkStore) -> int:
+    """
+    将json后端保存的DataChunk字典写入sqlite存储, 返回写入的行数
+    json中的JsonObject已经是序列化后的字符串, 直接按原样保存
+    """
+    root = json_dict.get("root", {})
+    attrs = {k: v for k, v in json_dict.items() if k != "root"}
+    rows = {str(key): json.dumps(value, ensure_ascii=False) for key, value in root.items()}
+    store.write(rows, [], attrs=attrs, truncate=True)
+    return len(rows)
+
+
+def get_store_path(data_path: str, identifier: str) -> str:
+    return os.path.join(data_path, f"{identifier}.db")
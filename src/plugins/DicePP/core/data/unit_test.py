@@ -4,6 +4,9 @@ import os
 from core.data.manager import DataManager, DataManagerError
 from core.data.data_chunk import DataChunkBase, custom_data_chunk
 from core.data.json_object import JsonObject, custom_json_object
+from core.data.view import ReadOnlyDict, ReadOnlyList, thaw
+from core.data.storage import STORAGE_SQLITE, SqliteChunkStore
+from utils.localdata import update_json
 
 test_path = os.path.join(os.path.dirname(__file__), 'test_data')
 
@@ -139,6 +142,122 @@ class MyTestCase(unittest.TestCase):
         self.assertEqual(dumb_obj_1.strField, "CBA")
         self.assertEqual(dumb_obj_2.strField, "")
 
+    def test3_view(self):
+        self.data_manager = DataManager(test_path)
+        self.data_manager.set_data("Test_A", ["View"], {"list": [1, {"k": "v"}], "num": 3})
+        view = self.data_manager.get_view("Test_A", ["View"])
+        self.assertTrue(isinstance(view, ReadOnlyDict))
+        self.assertTrue(isinstance(view["list"], ReadOnlyList))
+        self.assertEqual(view, {"list": [1, {"k": "v"}], "num": 3})
+        self.assertEqual(view["list"][1]["k"], "v")
+        self.assertEqual(view.get("missing", 0), 0)
+        self.assertEqual(sorted(view.keys()), ["list", "num"])
+        self.assertEqual(self.data_manager.get_view("Test_A", ["View", "num"]), 3)
+        print("只读视图可以正常读取")
+        with self.assertRaises(TypeError):
+            view["num"] = 4
+        with self.assertRaises(TypeError):
+            view["list"][0] = 4
+        self.assertRaises(AttributeError, getattr, view["list"][1], "setdefault")
+        print("无法通过只读视图修改数据")
+        copied_data = thaw(view)
+        copied_data["list"][1]["k"] = "w"
+        self.assertEqual(view["list"][1]["k"], "v")
+        self.data_manager.set_data("Test_A", ["View", "num"], 4)
+        self.assertEqual(view["num"], 4)
+        print("视图与数据同步, 拷贝与数据独立")
+        self.assertEqual(self.data_manager.get_view("Test_A", ["View-New"], default_val=[0]), [0])
+        self.assertRaises(DataManagerError, self.data_manager.get_view, "Test_A", ["Invalid-path"])
+
+    def test4_shard(self):
+        print("开始测试分片存储")
+
+        @custom_data_chunk(identifier="Test_Shard", include_json_object=True, storage=STORAGE_SQLITE)
+        class _(DataChunkBase):
+            def __init__(self):
+                super().__init__()
+        self.data_manager = DataManager(test_path)
+        self.data_manager.set_data("Test_Shard", ["User-1", "Attr"], [1, 2])
+        self.data_manager.set_data("Test_Shard", ["User-2"], {"Name": "B"})
+        self.data_manager.save_data()
+        self.assertTrue(os.path.exists(os.path.join(test_path, "Test_Shard.db")))
+        self.assertFalse(os.path.exists(os.path.join(test_path, "Test_Shard.json")))
+
+        data_manager_new = DataManager(test_path)
+        self.assertEqual(sorted(data_manager_new.get_keys("Test_Shard", [])), ["User-1", "User-2"])
+        self.assertEqual(data_manager_new.get_data("Test_Shard", ["User-1", "Attr"]), [1, 2])
+        ref = data_manager_new.get_data("Test_Shard", ["User-2"], get_ref=True)
+        ref["Name"] = "C"
+        data_manager_new.delete_data("Test_Shard", ["User-1"])
+        data_manager_new.save_data()
+        print("按需载入与引用修改正确")
+
+        store = SqliteChunkStore(os.path.join(test_path, "Test_Shard.db"))
+        self.assertEqual(store.keys(), ["User-2"])
+        self.assertEqual(store.get("User-2"), '{"Name": "C"}')
+        store.close()
+        data_manager_new = DataManager(test_path)
+        self.assertEqual(data_manager_new.get_data("Test_Shard", []), {"User-2": {"Name": "C"}})
+        print("只写回被修改的key")
+
+    def test5_shard_migrate(self):
+        @custom_data_chunk(identifier="Test_Shard_Migrate", storage=STORAGE_SQLITE)
+        class _(DataChunkBase):
+            def __init__(self):
+                super().__init__()
+        json_path = os.path.join(test_path, "Test_Shard_Migrate.json")
+        update_json({"version_base": "1.0", "root": {"A": {"B": 1}, "C": [2]}}, json_path)
+        self.data_manager = DataManager(test_path)
+        self.assertFalse(os.path.exists(json_path))
+        self.assertTrue(os.path.exists(json_path + ".migrated"))
+        self.assertEqual(self.data_manager.get_data("Test_Shard_Migrate", ["A", "B"]), 1)
+        self.assertEqual(self.data_manager.get_data("Test_Shard_Migrate", ["C"]), [2])
+        print("json数据迁移正确")
+
+    def test6_save_atomic(self):
+        self.data_manager = DataManager(test_path)
+        self.data_manager.set_data("Test_A", ["Atomic"], {"A": [1, 2]})
+        self.data_manager.save_data()
+        json_path = os.path.join(test_path, "Test_A.json")
+        self.assertFalse(os.path.exists(json_path + ".tmp"))
+        metrics = self.data_manager.get_save_metrics().chunks["Test_A"]
+        self.assertEqual(metrics["last_bytes"], os.path.getsize(json_path))
+        print("保存后不残留临时文件, 写入字节数正确")
+        with open(json_path + ".tmp", "w", encoding="utf-8") as f:
+            f.write('{"root": {"Atom')  # 模拟写入临时文件途中中断
+        data_manager_new = DataManager(test_path)
+        self.assertEqual(data_manager_new.get_data("Test_A", ["Atomic"]), {"A": [1, 2]})
+        os.remove(json_path + ".tmp")
+        print("临时文件损坏时从正式文件恢复")
+
+    def test7_save_snapshot(self):
+        import json
+        from core.data.data_chunk import get_chunk_hash
+        self.data_manager = DataManager(test_path)
+        self.data_manager.set_data("Test_A", ["Snap-1"], {"v": 1})
+        self.data_manager.set_data("Test_A", ["Snap-2"], {"v": 2})
+        self.data_manager.save_data()
+        # 通过引用修改的key与set_data修改的key都会在下次保存时重新拷贝, 其他key沿用上次的拷贝
+        self.data_manager.get_data("Test_A", ["Snap-2"], get_ref=True)["v"] = 20
+        self.data_manager.set_data("Test_A", ["Snap-3"], {"v": 3})
+        self.data_manager.delete_data("Test_A", ["Snap-1"])
+        self.data_manager.save_data()
+        with open(os.path.join(test_path, "Test_A.json"), encoding="utf-8") as f:
+            json_dict = json.load(f)
+        self.assertNotIn("Snap-1", json_dict["root"])
+        self.assertEqual(json_dict["root"]["Snap-2"], {"v": 20})
+        self.assertEqual(json_dict["root"]["Snap-3"], {"v": 3})
+        self.assertEqual(json_dict["hash_code"],
+                         get_chunk_hash(json_dict["version_base"], json_dict["update_time"], json_dict["root"]))
+        # 快照与数据互不影响
+        self.data_manager.get_data("Test_A", ["Snap-3"], get_ref=True)["v"] = 30
+        self.data_manager.set_data("Test_A", ["Snap-2"], {"v": 200})
+        self.data_manager.save_data()
+        data_manager_new = DataManager(test_path)
+        self.assertEqual(data_manager_new.get_data("Test_A", ["Snap-2"]), {"v": 200})
+        self.assertEqual(data_manager_new.get_data("Test_A", ["Snap-3"]), {"v": 30})
+        print("json后端的增量快照正确")
+
     def test9_exception(self):
         print("开始测试异常")
         self.data_manager = DataManager(test_path)
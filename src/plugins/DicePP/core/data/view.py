@@ -0,0 +1,101 @@
+"""
+DataManager的只读视图, 用于在热路径上代替深拷贝读取数据
+视图直接引用DataChunk中的节点, 不会产生拷贝, 也不允许通过视图修改数据
+需要修改时调用thaw得到一份可以随意修改的深拷贝, 修改完毕后再通过set_data写回
+"""
+import copy
+from typing import Any, Iterator, Mapping, Sequence
+
+
+class ReadOnlyDict(Mapping):
+    """字典节点的只读视图, 子节点在访问时才会被包装"""
+    __slots__ = ("_node",)
+
+    def __init__(self, node: dict):
+        self._node = node
+
+    def __getitem__(self, key: Any) -> Any:
+        return freeze(self._node[key])
+
+    def __iter__(self) -> Iterator:
+        return iter(self._node)
+
+    def __len__(self) -> int:
+        return len(self._node)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._node
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, ReadOnlyDict):
+            other = other._node
+        return self._node == other
+
+    def __ne__(self, other: Any) -> bool:
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"ReadOnlyDict({self._node!r})"
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        if key in self._node:
+            return freeze(self._node[key])
+        return default
+
+
+class ReadOnlyList(Sequence):
+    """列表节点的只读视图, 子节点在访问时才会被包装"""
+    __slots__ = ("_node",)
+
+    def __init__(self, node: list):
+        self._node = node
+
+    def __getitem__(self, index: Any) -> Any:
+        if isinstance(index, slice):
+            return ReadOnlyList(self._node[index])
+        return freeze(self._node[index])
+
+    def __iter__(self) -> Iterator:
+        for item in self._node:
+            yield freeze(item)
+
+    def __len__(self) -> int:
+        return len(self._node)
+
+    def __contains__(self, item: Any) -> bool:
+        return item in self._node
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, ReadOnlyList):
+            other = other._node
+        return self._node == other
+
+    def __ne__(self, other: Any) -> bool:
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"ReadOnlyList({self._node!r})"
+
+
+def freeze(node: Any) -> Any:
+    """
+    将数据节点包装为只读视图, 字典和列表会被包装, 其他类型原样返回
+    注意JsonObject等自定义对象不会被包装, 调用者不应修改其内容
+    """
+    node_type = type(node)
+    if node_type is dict:
+        return ReadOnlyDict(node)
+    if node_type is list:
+        return ReadOnlyList(node)
+    return node
+
+
+def thaw(view: Any) -> Any:
+    """返回只读视图对应数据的深拷贝, 可以随意修改, 不会影响DataManager中的数据"""
+    if isinstance(view, (ReadOnlyDict, ReadOnlyList)):
+        return copy.deepcopy(view._node)
+    return copy.deepcopy(view)
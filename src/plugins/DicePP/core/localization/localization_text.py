@@ -4,7 +4,7 @@ import random
 
 from core.config import LOCAL_IMG_PATH
 from utils.logger import dice_log
-from utils.cq_code import get_cq_image
+from utils.cq_code import get_cq_image_cached
 
 
 class LocalizationText:
@@ -26,9 +26,9 @@ class LocalizationText:
         def replace_image_code(match):
             key = match.group(1)
             file_path = Path(LOCAL_IMG_PATH) / key
-            if file_path.exists():
-                return get_cq_image(file_path.read_bytes())
-            else:
+            try:
+                return get_cq_image_cached(file_path)
+            except OSError:
                 dice_log(f"[LocalImage] 找不到图片 {file_path}")
                 return match.group(0)
 
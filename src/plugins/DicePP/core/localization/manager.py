@@ -8,7 +8,7 @@ from openpyxl.comments import Comment
 from openpyxl.worksheet import worksheet
 
 from utils.logger import dice_log
-from utils.localdata import read_xlsx
+from utils.localdata import read_xlsx, read_xlsx_cached, is_sheet_rows_equal, CachedWorkbook, CachedWorksheet
 from core.config import DATA_PATH as ROOT_DATA_PATH
 from core.communication import preprocess_msg
 
@@ -49,13 +49,17 @@ class LocalizationManager:
                 continue
             comment: str = self.all_local_texts[key].comment  # 沿用原来的注释, 不用文件里的
             self.all_local_texts[key] = LocalizationText(key, comment=comment)
-            for text in [str(cell.value) for cell in row[1:] if cell.value and cell.value.strip()]:
+            for text in [str(cell.value) for cell in row[1:] if cell.value and str(cell.value).strip()]:
                 self.all_local_texts[key].add(text)
         dice_log(f"[Local] [Load] 成功读取本地化文件 {self.data_path.replace(ROOT_DATA_PATH, '~')}")
-        workbook.close()
 
     def save_localization(self):
-        """注意按多个机器人会读写同一个配置文件, 如果并行可能存在写冲突, 现在单线程异步没问题"""
+        """
+        注意按多个机器人会读写同一个配置文件, 如果并行可能存在写冲突, 现在单线程异步没问题
+        文件中当前账号的工作表与内存中一致时不会重新写入
+        """
+        if is_loc_text_saved(self.data_path, self.identifier, self.all_local_texts):
+            return
         workbook, local_sheet = get_sheet_from_path(self.data_path, self.identifier)
         for ri, loc_text in enumerate(self.all_local_texts.values()):
             save_loc_text_to_row(local_sheet, loc_text, ri + 1)
@@ -93,10 +97,14 @@ class LocalizationManager:
         if not has_chat:
             add_default_chat()
         dice_log(f"[Local] [ChatLoad] 成功读取自定义对话文件 {self.chat_data_path.replace(ROOT_DATA_PATH, '~')}")
-        workbook.close()
 
     def save_chat(self):
-        """注意多个机器人会读写同一个配置文件, 如果并行可能存在写冲突, 现在单线程异步没问题"""
+        """
+        注意多个机器人会读写同一个配置文件, 如果并行可能存在写冲突, 现在单线程异步没问题
+        文件中当前账号的工作表与内存中一致时不会重新写入
+        """
+        if is_loc_text_saved(self.chat_data_path, self.identifier, self.all_chat_texts):
+            return
         workbook, local_sheet = get_sheet_from_path(self.chat_data_path, self.identifier)
         for ri, loc_text in enumerate(self.all_chat_texts.values()):
             save_loc_text_to_row(local_sheet, loc_text, ri + 1)
@@ -176,23 +184,37 @@ def save_loc_text_to_row(sheet: worksheet, l_text: LocalizationText, row: int):
         sheet.cell(row=row, column=ci + 2, value=text)
 
 
-def load_sheet_from_path(data_path: str, identifier: str, default_id: str = DEFAULT_ID) -> (openpyxl.Workbook, worksheet):
-    """若指定data_path无效或id无效, 返回None. 若id无效会尝试使用default_id, 一般用来得到读取的sheet"""
+def load_sheet_from_path(data_path: str, identifier: str, default_id: str = DEFAULT_ID) -> (CachedWorkbook, CachedWorksheet):
+    """
+    若指定data_path无效或id无效, 返回None. 若id无效会尝试使用default_id, 一般用来得到读取的sheet
+    返回的是只读快照, 文件没有变化时不会重新解析
+    """
     if not os.path.exists(data_path):
         return None, None
-    workbook = read_xlsx(data_path)
+    workbook = read_xlsx_cached(data_path, keep_in_memory=True)
     if identifier in workbook.sheetnames:
         sheet = workbook[identifier]
-        sheet.title = identifier
     elif default_id in workbook.sheetnames:
         sheet = workbook[default_id]
-        sheet.title = default_id
     else:
-        workbook.close()
         return None, None
     return workbook, sheet
 
 
+def is_loc_text_saved(data_path: str, identifier: str, loc_texts: Dict[str, LocalizationText]) -> bool:
+    """文件中identifier对应的工作表是否已经与loc_texts一致"""
+    if not os.path.exists(data_path):
+        return False
+    try:
+        workbook = read_xlsx_cached(data_path, keep_in_memory=True)
+    except Exception:
+        return False
+    sheet = workbook[identifier] if identifier in workbook.sheetnames else None
+    rows = [[loc_text.key] + loc_text.loc_texts for loc_text in loc_texts.values()]
+    comments = {ri + 1: loc_text.comment for ri, loc_text in enumerate(loc_texts.values()) if loc_text.comment}
+    return is_sheet_rows_equal(sheet, rows, comments)
+
+
 def get_sheet_from_path(data_path: str, identifier: str) -> (openpyxl.Workbook, worksheet):
     """若指定的data_path无效或id无效, 就创建新的workbook或worksheet. 一般用来得到写入的sheet"""
     feedback: str
@@ -38,7 +38,8 @@ class _(DataChunkBase):
 
 
 @custom_user_command(readable_name="DND5E角色卡", priority=DPP_COMMAND_PRIORITY_DEFAULT+10,
-                     flag=DPP_COMMAND_FLAG_CHAR | DPP_COMMAND_FLAG_DND, group_only=True)
+                     flag=DPP_COMMAND_FLAG_CHAR | DPP_COMMAND_FLAG_DND, group_only=True,
+                     prefixes=(".",))
 class CharacterCommand(UserCommandBase):
     """
     角色卡指令
@@ -37,7 +37,8 @@ class _(DataChunkBase):
 
 
 @custom_user_command(readable_name="生命值指令", priority=DPP_COMMAND_PRIORITY_DEFAULT,
-                     flag=DPP_COMMAND_FLAG_CHAR | DPP_COMMAND_FLAG_DND | DPP_COMMAND_FLAG_BATTLE, group_only=True)
+                     flag=DPP_COMMAND_FLAG_CHAR | DPP_COMMAND_FLAG_DND | DPP_COMMAND_FLAG_BATTLE, group_only=True,
+                     prefixes=(".hp",))
 class HPCommand(UserCommandBase):
     """
     调整和记录生命值的指令, 以.hp开头
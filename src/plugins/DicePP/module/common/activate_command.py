@@ -58,13 +58,13 @@ class ActivateCommand(UserCommandBase):
     def can_process_msg(self, msg_str: str, meta: MessageMetaData) -> Tuple[bool, bool, Any]:
         if meta.group_id:
             try:
-                activate_data = self.bot.data_manager.get_data(DC_ACTIVATE, [meta.group_id])
+                activate_data = self.bot.data_manager.get_view(DC_ACTIVATE, [meta.group_id])
             except DataManagerError:
                 try:
                     default_enable: bool = bool(int(self.bot.cfg_helper.get_config(CFG_BOT_DEF_ENABLE)[0]))
                 except (IndexError, ValueError):
                     default_enable = True
-                activate_data = self.bot.data_manager.get_data(DC_ACTIVATE, [meta.group_id], default_gen=lambda: get_default_activate_data(default_enable))
+                activate_data = self.bot.data_manager.get_view(DC_ACTIVATE, [meta.group_id], default_gen=lambda: get_default_activate_data(default_enable))
         else:
             activate_data = None
         should_pass: bool = False
@@ -46,14 +46,14 @@ class ChatCommand(UserCommandBase):
     def can_process_msg(self, msg_str: str, meta: MessageMetaData) -> Tuple[bool, bool, Any]:
         should_proc: bool = False
         # 如果没开chat，那就别处理了
-        if not self.bot.data_manager.get_data(DC_GROUPCONFIG,[meta.group_id,"chat"],default_val=True):
+        if not self.bot.data_manager.get_view(DC_GROUPCONFIG,[meta.group_id,"chat"],default_val=True):
             return False, False, ""
         target: str = meta.group_id if meta.group_id else meta.user_id
         try:
-            time_str = self.bot.data_manager.get_data(DC_CHAT_RECORD, [target, DCK_CHAT_TIME])
+            time_str = self.bot.data_manager.get_view(DC_CHAT_RECORD, [target, DCK_CHAT_TIME])
         except DataManagerError:
             default_time = get_default_chat_time(self.get_interval())
-            time_str = self.bot.data_manager.get_data(DC_CHAT_RECORD, [target, DCK_CHAT_TIME], default_val=default_time)
+            time_str = self.bot.data_manager.get_view(DC_CHAT_RECORD, [target, DCK_CHAT_TIME], default_val=default_time)
         feedback = ""
         # 兼容旧格式：可能存成 YYYY_MM_DD_HH_MM_SS（下划线）
         parse_ok = False
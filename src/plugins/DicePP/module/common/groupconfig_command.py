@@ -48,7 +48,8 @@ class _(DataChunkBase):
 
 @custom_user_command(readable_name="群配置指令", priority=-1,  # 要比掷骰命令前, 否则.c会覆盖.config
                      flag=DPP_COMMAND_FLAG_MANAGE, group_only=True,
-                     permission_require=1 # 限定群管理/骰管理使用
+                     permission_require=1, # 限定群管理/骰管理使用
+                     prefixes=(".设置", ".config", ".聊天", ".chat", ".骰面", ".dice")
                      )
 class GroupconfigCommand(UserCommandBase):
     """
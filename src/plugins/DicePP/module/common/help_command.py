@@ -26,7 +26,8 @@ HELP_INFO_DEFAULT = "@骰娘 .bot on/off 开启或关闭骰娘\n" \
 @custom_user_command(readable_name="帮助指令",
                      priority=0,
                      flag=DPP_COMMAND_FLAG_HELP,
-                     cluster=DPP_COMMAND_CLUSTER_DEFAULT)
+                     cluster=DPP_COMMAND_CLUSTER_DEFAULT,
+                     prefixes=(".help",))
 class HelpCommand(UserCommandBase):
     """
     查询帮助的指令, 以.help开头
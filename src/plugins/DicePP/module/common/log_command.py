@@ -1,48 +1,33 @@
+import asyncio
+import datetime
 import json
 import os
 import re
 import time
 import uuid
+import weakref
 import zlib
-from typing import Any, Dict, List, Optional, Tuple
-
-try:
-    import requests  # type: ignore
-except Exception:  # pragma: no cover
-    requests = None
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from core.bot import Bot
-from core.data import DataManagerError, DataChunkBase, custom_data_chunk
+from core.data import DataManagerError, DataChunkBase, custom_data_chunk, ReadOnlyDict, STORAGE_SQLITE
 from core.config import CFG_MASTER
 from core.command.const import *
 from core.command import BotCommandBase, BotSendFileCommand, BotSendMsgCommand
 from core.command import UserCommandBase, custom_user_command
-from core.communication import GroupMessagePort, MessageMetaData
-from utils.time import get_current_date_str, str_to_datetime
+from core.communication import GroupMessagePort, PrivateMessagePort, MessageMetaData
+from utils.time import get_current_date_str, get_current_date_raw, str_to_datetime
 from utils.logger import dice_log
 
 # 日志数据库后端（将记录存入 SQLite，导出从 DB 读取）
 try:
-    from .log_db import (
-        get_connection,
-        upsert_log,
-        insert_record,
-        fetch_records,
-        delete_log,
-        delete_records_by_message_id,
-        set_recording,
-        update_log_upload,
-    )
+    from .log_db import get_log_writer, merge_log_stats, enable_incremental_vacuum, LOG_ARCHIVE_DIR
 except Exception:
     # 兼容导入失败场景，保持旧逻辑可运行（但不会用到 DB）
-    get_connection = None  # type: ignore
-    upsert_log = None  # type: ignore
-    insert_record = None  # type: ignore
-    fetch_records = None  # type: ignore
-    delete_log = None  # type: ignore
-    delete_records_by_message_id = None  # type: ignore
-    set_recording = None  # type: ignore
-    update_log_upload = None  # type: ignore
+    get_log_writer = None  # type: ignore
+from .log_export import LogExportJob, LogRecordSource, export_log_files, archive_log
+from .log_upload import LogUploadQueue, UPLOAD_DONE, UPLOAD_FAILED, LOG_UPLOAD_TIMEOUT, LOG_UPLOAD_BATCH
 
 # 旧版本使用的常量，保留以兼容外部引用或进行数据迁移
 DC_LOG_SESSION = "log_session"
@@ -77,6 +62,7 @@ LOG_GROUP_CURRENT = "current"
 LOG_GROUP_LOGS = "logs"
 LOG_GROUP_FILTERS = "filters"
 LOG_GROUP_NAME_INDEX = "name_index"
+LOG_GROUP_RETENTION = "retention"  # 本群日志的保留天数, 不存在时使用全局配置
 
 FILTER_OUTSIDE = "outside"
 FILTER_COMMAND = "command"
@@ -99,6 +85,8 @@ LOG_KEY_UPLOAD_TIME = "time"
 LOG_KEY_UPLOAD_FILE = "file"
 LOG_KEY_UPLOAD_NOTE = "note"
 LOG_KEY_SOURCE = "source"
+# LOG_KEY_STATS的值为该标记时, 统计保存在日志数据库的统计表中
+LOG_STATS_IN_DB = "db"
 
 DEFAULT_FILTERS = {
     FILTER_OUTSIDE: False,
@@ -147,15 +135,20 @@ CFG_LOG_UPLOAD_ENDPOINT = "log_upload_endpoint"
 CFG_LOG_UPLOAD_TOKEN = "log_upload_token"
 # 限制单个日志在内存中保留的最大记录条数（可通过配置覆盖）。
 CFG_LOG_MAX_RECORDS = "log_max_records"
+CFG_LOG_RETENTION_DAYS = "log_retention_days"
+LOG_RETENTION_DAYS_DEFAULT = 0
 LOG_MAX_RECORDS_DEFAULT = 5000
 # 在启用数据库存储后，内存侧仅保留少量最新记录作为保险，避免深拷贝过大数据。
 LOG_IN_MEMORY_SAFE_LIMIT = 50
-# 内存中 stats.participants 字典最大条目数，超出将保留最活跃的用户
-LOG_PARTICIPANTS_LIMIT = 500
-# 内存中 color_map 字典最大条目数
-LOG_COLOR_MAP_LIMIT = 500
-# 每个骰面类型在 dice_faces.users 中保留的最大用户数
-LOG_DICE_USERS_LIMIT = 100
+# .log end 后台导出与上传的超时时间（秒）
+LOG_EXPORT_TIMEOUT = 600
+# 检查上传队列中到期任务的间隔(秒)
+LOG_UPLOAD_POLL_INTERVAL = 10
+# 每个群在内存中保留的最近写入日志的消息ID数量, 撤回不在其中的消息时不需要访问数据库
+LOG_RECALL_RING_SIZE = 2000
+# 每日维护时每批删除的记录条数, 每批之间让出事件循环
+LOG_MAINTENANCE_BATCH = 2000
+LOG_MAINTENANCE_TIMEOUT = 3600
 
 
 def _pick_color(color_map: Dict[str, str], user_id: str) -> str:
@@ -164,7 +157,7 @@ def _pick_color(color_map: Dict[str, str], user_id: str) -> str:
     return color_map[user_id]
 
 
-@custom_data_chunk(identifier=DC_LOG_SESSION)
+@custom_data_chunk(identifier=DC_LOG_SESSION, storage=STORAGE_SQLITE)
 class _(DataChunkBase):  # noqa: E742
     def __init__(self):
         super().__init__()
@@ -236,38 +229,22 @@ def _detect_attr_changes(content: str) -> Dict[str, int]:
     return changes
 
 
-def _accumulate_roll_detail(stats: Dict[str, Any], record: Dict[str, Any]) -> None:
+def _detect_dice_rolls(record: Dict[str, Any]) -> Dict[Tuple[int, str], List[float]]:
+    """解析掷骰结果, 返回{(骰面, 掷骰者名称): [归一化点数之和, 次数]}, 掷骰者在查询统计时再与参与者对应"""
     content = record.get("content", "")
     if not content:
-        return
+        return {}
     matches = list(RE_DICE_RESULT.finditer(content))
     if not matches:
-        return
-
-    participants = stats.setdefault("participants", {})
-    dice_faces_stats = stats.setdefault("dice_faces", {})
+        return {}
 
     # 估算掷骰者昵称
-    candidate_name = record.get("nickname") or ""
-    stripped_content = content.strip()
-    prefix_match = RE_ROLLER_PREFIX.match(stripped_content)
+    roller = record.get("nickname") or ""
+    prefix_match = RE_ROLLER_PREFIX.match(content.strip())
     if prefix_match:
-        candidate_name = prefix_match.group(1)
-
-    user_key = None
-    display_name = candidate_name
-    if candidate_name:
-        for uid, info in participants.items():
-            nickname = info.get("nickname") or uid
-            if candidate_name == nickname or candidate_name == uid:
-                user_key = uid
-                display_name = nickname
-                break
-    if not user_key:
-        user_key = f"name:{candidate_name}" if candidate_name else "unknown"
-        if user_key not in participants and candidate_name:
-            participants.setdefault(user_key, {"count": 0, "nickname": candidate_name})
+        roller = prefix_match.group(1)
 
+    dice: Dict[Tuple[int, str], List[float]] = {}
     for match in matches:
         count = max(int(match.group(1)), 1)
         faces = int(match.group(2))
@@ -276,52 +253,129 @@ def _accumulate_roll_detail(stats: Dict[str, Any], record: Dict[str, Any]) -> No
             continue
         max_val = count * faces
         norm = min(max(result, 0), max_val) / max_val
-
-        face_entry = dice_faces_stats.setdefault(faces, {"sum": 0.0, "count": 0, "users": {}})
-        face_entry["sum"] += norm
-        face_entry["count"] += 1
-
-        user_entry = face_entry["users"].setdefault(user_key, {"sum": 0.0, "count": 0, "nickname": display_name or user_key})
-        user_entry["sum"] += norm
-        user_entry["count"] += 1
+        info = dice.setdefault((faces, roller), [0.0, 0])
+        info[0] += norm
+        info[1] += 1
+    return dice
 
 
-def _update_stats_with_record(stats: Dict[str, Any], record: Dict[str, Any], *, source_is_bot: bool) -> None:
+def _analyze_record(record: Dict[str, Any], *, source_is_bot: bool) -> Dict[str, Any]:
+    """解析一条记录对统计的贡献, 每条记录只解析一次, 由LogWriter与记录在同一个事务中累加到统计表"""
     user_id = record.get("user_id", "?")
     nickname = record.get("nickname")
-    stats["messages"] = stats.get("messages", 0) + 1
-
-    participants = stats.setdefault("participants", {})
-    info = participants.setdefault(user_id, {"count": 0, "nickname": None})
-    info["count"] = info.get("count", 0) + 1
-    if nickname and nickname not in ("UNDEF_NAME", "----"):
-        info["nickname"] = nickname
-
+    if not nickname or nickname in ("UNDEF_NAME", "----"):
+        nickname = None
+    delta: Dict[str, Any] = {"messages": 1, "participants": {user_id: [1, nickname]}}
     if source_is_bot:
-        result = _detect_roll_result(record.get("content", ""))
+        content = record.get("content", "")
+        result = _detect_roll_result(content)
         if result:
-            stats.setdefault("rolls", {}).setdefault(result, 0)
-            stats["rolls"][result] += 1
-        attr_changes = _detect_attr_changes(record.get("content", ""))
+            delta["rolls"] = {result: 1}
+        attr_changes = _detect_attr_changes(content)
         if attr_changes:
-            attr_stats = stats.setdefault("attributes", {})
-            for attr, delta in attr_changes.items():
-                attr_stats[attr] = attr_stats.get(attr, 0) + delta
-        _accumulate_roll_detail(stats, record)
+            delta["attributes"] = attr_changes
+        dice = _detect_dice_rolls(record)
+        if dice:
+            delta["dice"] = dice
+    return delta
+
+
+def _legacy_stats_to_delta(stats: Dict[str, Any]) -> Dict[str, Any]:
+    """将旧版本保存在payload中的统计转换为统计表使用的结构"""
+    delta: Dict[str, Any] = {
+        "messages": stats.get("messages", 0),
+        "rolls": dict(stats.get("rolls", {})),
+        "attributes": dict(stats.get("attributes", {})),
+        "participants": {},
+        "dice": {},
+    }
+    for user_id, info in stats.get("participants", {}).items():
+        if not str(user_id).startswith("name:"):  # 旧版本会为无法对应的掷骰者添加0条消息的参与者
+            delta["participants"][user_id] = [info.get("count", 0), info.get("nickname")]
+    for face, face_info in stats.get("dice_faces", {}).items():
+        for user_key, info in face_info.get("users", {}).items():
+            if user_key == "unknown":
+                roller = ""
+            elif user_key.startswith("name:"):
+                roller = user_key[len("name:"):]
+            else:
+                roller = user_key
+            dice_info = delta["dice"].setdefault((int(face), roller), [0.0, 0])
+            dice_info[0] += info.get("sum", 0.0)
+            dice_info[1] += info.get("count", 0)
+    return delta
 
 
-def _compute_log_stats(bot: Bot, records: List[Dict[str, Any]]) -> Dict[str, Any]:
+def _migrate_entry_stats(bot: Bot, log_id: str, entry: Dict[str, Any]) -> bool:
+    """旧版本的统计保存在payload中, 第一次读取时转存到统计表, 之后只保留LOG_STATS_IN_DB标记, 返回entry是否被修改"""
+    stats = entry.get(LOG_KEY_STATS)
+    if stats == LOG_STATS_IN_DB or not get_log_writer:
+        return False
+    if isinstance(stats, dict):
+        delta = _legacy_stats_to_delta(stats)
+    else:
+        delta = {}
+        for rec in entry.get(LOG_KEY_RECORDS, []):
+            source = rec.get(LOG_KEY_SOURCE)
+            source_is_bot = rec.get("user_id") == bot.account if source is None else source == "bot"
+            merge_log_stats(delta, _analyze_record(rec, source_is_bot=source_is_bot))
+    try:
+        get_log_writer().replace_stats(log_id, delta)
+    except Exception as e:
+        dice_log(f"[LogDB] migrate stats error: {e}")
+        return False
+    entry[LOG_KEY_STATS] = LOG_STATS_IN_DB
+    return True
+
+
+def _fetch_log_stats(log_id: str) -> Dict[str, Any]:
+    """从统计表读取日志的统计, 并将掷骰者对应到参与者, 返回的结构与_empty_stats相同"""
     stats = _empty_stats()
-    for rec in records:
-        source = rec.get(LOG_KEY_SOURCE)
-        if source is None:
-            source_is_bot = rec.get("user_id") == bot.account
+    if not get_log_writer:
+        return stats
+    try:
+        raw = get_log_writer().fetch_stats(log_id)
+    except Exception as e:
+        dice_log(f"[LogDB] fetch stats error: {e}")
+        return stats
+    stats["messages"] = raw["messages"]
+    stats["rolls"].update(raw["rolls"])
+    stats["attributes"] = raw["attributes"]
+    participants = stats["participants"]
+    for user_id, (count, nickname) in raw["participants"].items():
+        participants[user_id] = {"count": count, "nickname": nickname}
+
+    name_to_user: Dict[str, Tuple[str, str]] = {}  # 名称 -> (user_id, 显示名称), 先出现的参与者优先
+    for user_id, info in participants.items():
+        nickname = info["nickname"] or user_id
+        name_to_user.setdefault(nickname, (user_id, nickname))
+        name_to_user.setdefault(user_id, (user_id, nickname))
+    dice_faces = stats["dice_faces"]
+    for (face, roller), (total, count) in raw["dice"].items():
+        if roller in name_to_user:
+            user_key, display_name = name_to_user[roller]
         else:
-            source_is_bot = source == "bot"
-        _update_stats_with_record(stats, rec, source_is_bot=source_is_bot)
+            user_key = f"name:{roller}" if roller else "unknown"
+            display_name = roller or user_key
+        face_entry = dice_faces.setdefault(face, {"sum": 0.0, "count": 0, "users": {}})
+        face_entry["sum"] += total
+        face_entry["count"] += count
+        user_entry = face_entry["users"].setdefault(user_key, {"sum": 0.0, "count": 0, "nickname": display_name})
+        user_entry["sum"] += total
+        user_entry["count"] += count
     return stats
 
 
+def _fetch_message_counts(log_ids: List[str]) -> Dict[str, int]:
+    if not get_log_writer or not log_ids:
+        return {}
+    try:
+        return get_log_writer().fetch_message_counts(log_ids)
+    except Exception as e:
+        dice_log(f"[LogDB] fetch message counts error: {e}")
+        return {}
+
+
 def _ensure_filters(payload: Dict[str, Any]) -> Dict[str, bool]:
     filters = payload.setdefault(LOG_GROUP_FILTERS, {})
     for key, default in DEFAULT_FILTERS.items():
@@ -363,18 +417,19 @@ def _init_group_payload(bot: Bot, group_id: str, legacy: Optional[Dict[str, Any]
                 LOG_KEY_RECORDING: legacy.get(DCK_ACTIVE, False),
                 LOG_KEY_RECORDS: legacy_records,
                 LOG_KEY_COLOR_MAP: legacy.get(DCK_COLOR_MAP, {}),
-                LOG_KEY_STATS: _compute_log_stats(bot, legacy_records),
                 LOG_KEY_SESSION_COUNT: legacy.get(DCK_MSG_COUNT, 0),
                 LOG_KEY_RECORD_BEGIN_AT: legacy.get(DCK_START_TIME, start_time),
                 LOG_KEY_LAST_WARN: legacy.get(DCK_LAST_HOUR_WARN, start_time),
                 LOG_KEY_UPLOAD: {},
             }
+            _migrate_entry_stats(bot, log_id, log_entry)
             payload[LOG_GROUP_LOGS][log_id] = log_entry
             payload[LOG_GROUP_NAME_INDEX][log_name.lower()] = log_id
             if legacy.get(DCK_ACTIVE, False):
                 payload[LOG_GROUP_CURRENT] = log_id
 
     bot.data_manager.set_data(DC_LOG_SESSION, [group_id], payload)
+    _drop_log_session(bot, group_id)
     return payload
 
 
@@ -407,15 +462,8 @@ def _load_group_payload(bot: Bot, group_id: str) -> Dict[str, Any]:
             records = entry.setdefault(LOG_KEY_RECORDS, [])
             for rec in records:
                 rec.setdefault(LOG_KEY_SOURCE, "bot" if rec.get("user_id") == bot.account else "user")
-            if LOG_KEY_STATS not in entry:
-                entry[LOG_KEY_STATS] = _compute_log_stats(bot, records)
+            if _migrate_entry_stats(bot, log_id, entry):
                 mutated = True
-            else:
-                stats = entry[LOG_KEY_STATS]
-                if "dice_faces" not in stats:
-                    stats["dice_faces"] = {}
-                    entry[LOG_KEY_STATS] = stats
-                    mutated = True
             if LOG_KEY_COLOR_MAP not in entry:
                 entry[LOG_KEY_COLOR_MAP] = {}
                 mutated = True
@@ -433,11 +481,152 @@ def _load_group_payload(bot: Bot, group_id: str) -> Dict[str, Any]:
         _rebuild_name_index(payload)
         if mutated:
             bot.data_manager.set_data(DC_LOG_SESSION, [group_id], payload)
+            _drop_log_session(bot, group_id)
+    return payload
+
+
+def _peek_group_payload(bot: Bot, group_id: str) -> Optional[ReadOnlyDict]:
+    """只读地获取群日志数据, 不产生拷贝, 供每条消息都会调用的检查使用
+    尚未迁移到新格式的数据会返回None, 调用者应退回_load_group_payload
+    """
+    try:
+        payload = bot.data_manager.get_view(DC_LOG_SESSION, [group_id])
+    except DataManagerError:
+        return ReadOnlyDict({})
+    if not isinstance(payload, ReadOnlyDict) or LOG_GROUP_LOGS not in payload:
+        return None
     return payload
 
 
+def _get_recording_log_id(bot: Bot, group_id: str) -> str:
+    """返回群内正在记录的日志ID, 没有则返回空字符串"""
+    session = _get_log_session(bot, group_id)
+    return session.log_id if session else ""
+
+
 def _save_group_payload(bot: Bot, group_id: str, payload: Dict[str, Any]) -> None:
     bot.data_manager.set_data(DC_LOG_SESSION, [group_id], payload)
+    _drop_log_session(bot, group_id)
+
+
+class _LogSession:
+    """
+    正在记录日志的群在内存中的会话对象, 跨消息复用
+    payload是DataManager中该群数据的引用, 每条消息只原地修改当前日志的条目, 不再拷贝/重建整个群的数据
+    指令处理器通过_save_group_payload整体写回群数据时会丢弃会话, 下一条消息时重新建立
+    """
+    __slots__ = ("group_id", "payload", "log_id", "entry", "filters")
+
+    def __init__(self, group_id: str, payload: Dict[str, Any], log_id: str):
+        self.group_id = group_id
+        self.payload = payload
+        self.log_id = log_id
+        self.entry: Dict[str, Any] = payload[LOG_GROUP_LOGS][log_id]
+        self.filters: Dict[str, bool] = _ensure_filters(payload)
+
+    def persist(self, bot: Bot) -> bool:
+        """
+        通知DataManager在下次保存时写回该群的数据, 只应在条目确实被修改后调用
+        若该群数据已被其他途径替换或删除则返回False, 调用者应丢弃会话
+        """
+        try:
+            node = bot.data_manager.get_data(DC_LOG_SESSION, [self.group_id], get_ref=True)
+        except DataManagerError:
+            return False
+        return node is self.payload
+
+
+# DataManager -> {群号: 会话}, 值为None表示该群当前没有在记录的日志
+_LOG_SESSIONS: "weakref.WeakKeyDictionary[Any, Dict[str, Optional[_LogSession]]]" = weakref.WeakKeyDictionary()
+_NO_SESSION = object()
+
+
+def _get_log_session(bot: Bot, group_id: str) -> Optional[_LogSession]:
+    """返回群的日志会话, 没有在记录的日志时返回None, 结果会被缓存, 绝大多数消息只需要一次字典查询"""
+    sessions = _LOG_SESSIONS.get(bot.data_manager)
+    if sessions is None:
+        sessions = _LOG_SESSIONS.setdefault(bot.data_manager, {})
+    session = sessions.get(group_id, _NO_SESSION)
+    if session is _NO_SESSION:
+        session = _open_log_session(bot, group_id)
+        sessions[group_id] = session
+    return session
+
+
+def _open_log_session(bot: Bot, group_id: str) -> Optional[_LogSession]:
+    payload = _peek_group_payload(bot, group_id)
+    if payload is None:
+        payload = _load_group_payload(bot, group_id)
+    current_id = payload.get(LOG_GROUP_CURRENT, "")
+    if not current_id:
+        return None
+    entry = payload.get(LOG_GROUP_LOGS, {}).get(current_id)
+    if not entry or not entry.get(LOG_KEY_RECORDING):
+        return None
+    # 只在建立会话时补全一次缺省字段, 之后直接持有DataManager中的数据
+    _save_group_payload(bot, group_id, _load_group_payload(bot, group_id))
+    payload = bot.data_manager.get_data(DC_LOG_SESSION, [group_id], get_ref=True)
+    return _LogSession(group_id, payload, current_id)
+
+
+def _drop_log_session(bot: Bot, group_id: str) -> None:
+    sessions = _LOG_SESSIONS.get(bot.data_manager)
+    if sessions is not None:
+        sessions.pop(group_id, None)
+
+
+class _RecallRing:
+    """
+    群内当前日志最近写入的消息ID, 撤回大量未被记录的消息(如清理刷屏)时不需要访问数据库
+    complete为True时日志中所有带消息ID的记录都在环中, 不在环中的消息一定没有被记录
+    """
+    __slots__ = ("log_id", "order", "ids", "complete")
+
+    def __init__(self, log_id: str, recent_ids: List[str], complete: bool):
+        self.log_id = log_id
+        self.order: deque = deque()
+        self.ids: set = set()
+        self.complete = True
+        for message_id in recent_ids:
+            self.add(message_id)
+        self.complete = self.complete and complete
+
+    def add(self, message_id: str) -> None:
+        if message_id in self.ids:
+            return
+        if len(self.order) >= LOG_RECALL_RING_SIZE:
+            self.ids.discard(self.order.popleft())
+            self.complete = False
+        self.order.append(message_id)
+        self.ids.add(message_id)
+
+    def may_contain(self, message_id: str) -> bool:
+        return not self.complete or message_id in self.ids
+
+    def discard(self, message_id: str) -> None:
+        if message_id in self.ids:  # 很少发生, 从deque中删除的线性开销可以接受
+            self.ids.discard(message_id)
+            self.order.remove(message_id)
+
+
+# DataManager -> {群号: 撤回环}
+_RECALL_RINGS: "weakref.WeakKeyDictionary[Any, Dict[str, _RecallRing]]" = weakref.WeakKeyDictionary()
+
+
+def _get_recall_ring(bot: Bot, group_id: str, log_id: str, entry: Dict[str, Any]) -> _RecallRing:
+    """返回群内日志的撤回环, 日志变化后第一次调用时从数据库与旧版记录中载入最近的消息ID"""
+    rings = _RECALL_RINGS.get(bot.data_manager)
+    if rings is None:
+        rings = _RECALL_RINGS.setdefault(bot.data_manager, {})
+    ring = rings.get(group_id)
+    if ring is None or ring.log_id != log_id:
+        recent_ids = [str(rec["message_id"]) for rec in entry.get(LOG_KEY_RECORDS, []) if rec.get("message_id")]
+        if get_log_writer:
+            db_ids = get_log_writer().fetch_recent_message_ids(log_id, LOG_RECALL_RING_SIZE + 1)
+            recent_ids += [str(message_id) for message_id in reversed(db_ids)]
+        ring = _RecallRing(log_id, recent_ids[-LOG_RECALL_RING_SIZE:], len(recent_ids) <= LOG_RECALL_RING_SIZE)
+        rings[group_id] = ring
+    return ring
 
 
 def _find_log_id_by_name(payload: Dict[str, Any], name: str) -> Optional[str]:
@@ -453,84 +642,46 @@ def _find_log_id_by_name(payload: Dict[str, Any], name: str) -> Optional[str]:
     return None
 
 
-def _append_record_to_entry(log_entry: Dict[str, Any], record: Dict[str, Any], *, source_is_bot: bool) -> None:
-    records = log_entry.setdefault(LOG_KEY_RECORDS, [])
-    records.append(record)
-    color_map = log_entry.setdefault(LOG_KEY_COLOR_MAP, {})
-    _pick_color(color_map, record.get("user_id", ""))
-    stats = log_entry.setdefault(LOG_KEY_STATS, _empty_stats())
-    stats.setdefault("dice_faces", {})
-    _update_stats_with_record(stats, record, source_is_bot=source_is_bot)
-    log_entry[LOG_KEY_UPDATED_AT] = record.get("time", _now_str())
-
-
 def _append_record_to_db(group_id: str, log_id: str, log_entry: Dict[str, Any], record: Dict[str, Any], *, source_is_bot: bool) -> None:
-    """将记录写入数据库，同时在内存里仅维护必要的统计与配色，避免内存暴涨。"""
-    # 1) 确保日志元数据存在（旧日志可能在 DB 中尚未建档）
-    if get_connection and upsert_log:
+    """将记录与其统计增量写入数据库，payload 中不再保存记录与统计，避免内存暴涨。"""
+    # 1) 确保日志元数据存在（旧日志可能在 DB 中尚未建档）, 内容未变化时不会重复写入
+    # 2) 写入记录, 写入器会缓冲后批量提交
+    if get_log_writer:
         try:
-            conn = get_connection()
-            try:
-                # 取 filters 快照，便于后续导出/查看
-                filters = log_entry.get(LOG_KEY_UPLOAD)  # dummy to satisfy type checker
-            except Exception:
-                filters = None
-            finally:
-                # 重置，真实 filters 从调用方 payload 中难以直接传入，这里尽量填充已有字段
-                pass
-            try:
-                upsert_log(conn, {
-                    "id": log_id,
-                    "group_id": group_id,
-                    "name": log_entry.get(LOG_KEY_NAME, log_id),
-                    "created_at": log_entry.get(LOG_KEY_CREATED_AT, record.get("time", _now_str())),
-                    "updated_at": record.get("time", _now_str()),
-                    "recording": True if log_entry.get(LOG_KEY_RECORDING) else False,
-                    "record_begin_at": log_entry.get(LOG_KEY_RECORD_BEGIN_AT, record.get("time", _now_str())),
-                    "last_warn": log_entry.get(LOG_KEY_LAST_WARN, log_entry.get(LOG_KEY_RECORD_BEGIN_AT, record.get("time", _now_str()))),
-                    "filter_outside": 0,
-                    "filter_command": 0,
-                    "filter_bot": 0,
-                    "filter_media": 0,
-                    "filter_forum_code": 0,
-                    "upload_time": log_entry.get(LOG_KEY_UPLOAD, {}).get(LOG_KEY_UPLOAD_TIME),
-                    "upload_file": log_entry.get(LOG_KEY_UPLOAD, {}).get(LOG_KEY_UPLOAD_FILE),
-                    "upload_note": log_entry.get(LOG_KEY_UPLOAD, {}).get(LOG_KEY_UPLOAD_NOTE),
-                    "url": log_entry.get(LOG_KEY_UPLOAD, {}).get("url"),
-                })
-                conn.commit()
-            finally:
-                conn.close()
+            writer = get_log_writer()
+            writer.upsert_log({
+                "id": log_id,
+                "group_id": group_id,
+                "name": log_entry.get(LOG_KEY_NAME, log_id),
+                "created_at": log_entry.get(LOG_KEY_CREATED_AT, record.get("time", _now_str())),
+                "updated_at": record.get("time", _now_str()),
+                "recording": True if log_entry.get(LOG_KEY_RECORDING) else False,
+                "record_begin_at": log_entry.get(LOG_KEY_RECORD_BEGIN_AT, record.get("time", _now_str())),
+                "last_warn": log_entry.get(LOG_KEY_LAST_WARN, log_entry.get(LOG_KEY_RECORD_BEGIN_AT, record.get("time", _now_str()))),
+                "filter_outside": 0,
+                "filter_command": 0,
+                "filter_bot": 0,
+                "filter_media": 0,
+                "filter_forum_code": 0,
+                "upload_time": log_entry.get(LOG_KEY_UPLOAD, {}).get(LOG_KEY_UPLOAD_TIME),
+                "upload_file": log_entry.get(LOG_KEY_UPLOAD, {}).get(LOG_KEY_UPLOAD_FILE),
+                "upload_note": log_entry.get(LOG_KEY_UPLOAD, {}).get(LOG_KEY_UPLOAD_NOTE),
+                "url": log_entry.get(LOG_KEY_UPLOAD, {}).get("url"),
+            })
+            writer.append_record(
+                log_id,
+                time=record.get("time", _now_str()),
+                user_id=str(record.get("user_id") or ""),
+                nickname=record.get("nickname") or str(record.get("user_id") or ""),
+                content=record.get("content", ""),
+                source=record.get(LOG_KEY_SOURCE, "user"),
+                message_id=record.get("message_id"),
+                stats=_analyze_record(record, source_is_bot=source_is_bot),
+            )
         except Exception as e:
-            dice_log(f"[LogDB] upsert before insert error: {e}")
+            dice_log(f"[LogDB] append record error: {e}")
 
-    # 2) 写入记录
-    if get_connection and insert_record:
-        try:
-            conn = get_connection()
-            try:
-                insert_record(
-                    conn,
-                    log_id,
-                    time=record.get("time", _now_str()),
-                    user_id=str(record.get("user_id") or ""),
-                    nickname=record.get("nickname") or str(record.get("user_id") or ""),
-                    content=record.get("content", ""),
-                    source=record.get(LOG_KEY_SOURCE, "user"),
-                    message_id=record.get("message_id"),
-                )
-                conn.commit()
-            finally:
-                conn.close()
-        except Exception as e:
-            dice_log(f"[LogDB] insert_record error: {e}")
-
-    # 3) 内存：只维护统计与颜色映射
-    color_map = log_entry.setdefault(LOG_KEY_COLOR_MAP, {})
-    _pick_color(color_map, record.get("user_id", ""))
-    stats = log_entry.setdefault(LOG_KEY_STATS, _empty_stats())
-    stats.setdefault("dice_faces", {})
-    _update_stats_with_record(stats, record, source_is_bot=source_is_bot)
+    # 3) 内存：统计由写入器累加到统计表, 颜色在导出时按出现顺序分配, 这里只更新时间
     log_entry[LOG_KEY_UPDATED_AT] = record.get("time", _now_str())
 
 
@@ -561,62 +712,6 @@ def _trim_records_if_needed(bot: Bot, entry: Dict[str, Any]) -> None:
             entry[LOG_KEY_RECORDS] = records
 
 
-def _trim_stats_if_needed(entry: Dict[str, Any]) -> None:
-    """裁剪 stats 中的 participants 和 dice_faces.users，避免无限增长。"""
-    stats = entry.get(LOG_KEY_STATS)
-    if not isinstance(stats, dict):
-        return
-
-    # 1) 裁剪 participants：保留消息数最多的用户
-    participants = stats.get("participants")
-    if isinstance(participants, dict) and len(participants) > LOG_PARTICIPANTS_LIMIT:
-        sorted_items = sorted(
-            participants.items(),
-            key=lambda x: x[1].get("count", 0) if isinstance(x[1], dict) else 0,
-            reverse=True
-        )[:LOG_PARTICIPANTS_LIMIT]
-        stats["participants"] = dict(sorted_items)
-
-    # 2) 裁剪 dice_faces.users：每个骰面保留掷骰次数最多的用户
-    dice_faces = stats.get("dice_faces")
-    if isinstance(dice_faces, dict):
-        for face, face_info in dice_faces.items():
-            if not isinstance(face_info, dict):
-                continue
-            users = face_info.get("users")
-            if isinstance(users, dict) and len(users) > LOG_DICE_USERS_LIMIT:
-                sorted_users = sorted(
-                    users.items(),
-                    key=lambda x: x[1].get("count", 0) if isinstance(x[1], dict) else 0,
-                    reverse=True
-                )[:LOG_DICE_USERS_LIMIT]
-                face_info["users"] = dict(sorted_users)
-
-
-def _trim_color_map_if_needed(entry: Dict[str, Any]) -> None:
-    """裁剪 color_map，避免无限增长。保留活跃用户的颜色映射。"""
-    color_map = entry.get(LOG_KEY_COLOR_MAP)
-    if not isinstance(color_map, dict) or len(color_map) <= LOG_COLOR_MAP_LIMIT:
-        return
-
-    # 优先保留 participants 中存在的用户
-    stats = entry.get(LOG_KEY_STATS, {})
-    participants = stats.get("participants", {}) if isinstance(stats, dict) else {}
-    active_users = set(participants.keys())
-
-    new_map: Dict[str, str] = {}
-    # 先添加活跃用户
-    for uid in active_users:
-        if uid in color_map and len(new_map) < LOG_COLOR_MAP_LIMIT:
-            new_map[uid] = color_map[uid]
-    # 再填充其他（按原顺序）
-    for uid, color in color_map.items():
-        if uid not in new_map and len(new_map) < LOG_COLOR_MAP_LIMIT:
-            new_map[uid] = color
-
-    entry[LOG_KEY_COLOR_MAP] = new_map
-
-
 def _should_filter(filters: Dict[str, bool], content: str, *, is_bot: bool) -> bool:
     text = (content or "").strip()
     if filters.get(FILTER_OUTSIDE) and (
@@ -638,8 +733,11 @@ def _should_filter(filters: Dict[str, bool], content: str, *, is_bot: bool) -> b
 
 
 def should_filter_record(bot: Bot, group_id: str, user_id: str, content: str, is_bot: bool = False) -> bool:
-    payload = _load_group_payload(bot, group_id)
-    filters = _ensure_filters(payload)
+    payload = _peek_group_payload(bot, group_id)
+    if payload is None:
+        payload = _load_group_payload(bot, group_id)
+    filters = dict(DEFAULT_FILTERS)
+    filters.update(payload.get(LOG_GROUP_FILTERS, {}))
     return _should_filter(filters, content, is_bot=is_bot)
 
 
@@ -653,6 +751,52 @@ def _generate_forum_code_log(records: List[Dict[str, Any]]) -> str:
     return "\n".join(forum_code)
 
 
+def is_log_recording(bot: Bot, group_id: str) -> bool:
+    """群当前是否在记录日志, 只查询会话缓存"""
+    return bool(group_id) and _get_log_session(bot, group_id) is not None
+
+
+# 等待写入日志的骰娘消息, (bot, 群号, 内容)
+_PENDING_BOT_RECORDS: deque = deque()
+_bot_records_scheduled = False
+
+
+def queue_bot_log_records(bot: Bot, group_id: str, contents: List[str]) -> None:
+    """
+    登记骰娘发出的消息, 群没有在记录日志时直接返回
+    记录在事件循环的下一轮统一写入, 发送消息的流程不需要等待昵称查询与日志处理
+    """
+    global _bot_records_scheduled
+    if not contents or not is_log_recording(bot, group_id):
+        return
+    for content in contents:
+        _PENDING_BOT_RECORDS.append((bot, group_id, content))
+    if _bot_records_scheduled:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:  # 不在事件循环中, 直接写入
+        _drain_bot_log_records()
+        return
+    _bot_records_scheduled = True
+    loop.call_soon(_drain_bot_log_records)
+
+
+def _drain_bot_log_records() -> None:
+    global _bot_records_scheduled
+    _bot_records_scheduled = False
+    nicknames: Dict[Tuple[int, str], str] = {}
+    while _PENDING_BOT_RECORDS:
+        bot, group_id, content = _PENDING_BOT_RECORDS.popleft()
+        key = (id(bot), group_id)
+        if key not in nicknames:
+            try:
+                nicknames[key] = bot.get_nickname(bot.account, group_id) or "Bot"
+            except Exception:
+                nicknames[key] = "Bot"
+        append_log_record(bot, group_id, str(bot.account), nicknames[key], content)
+
+
 def append_log_record(bot: Bot, group_id: str, user_id: str, nickname: str, content: str,
                       message_id: Optional[str] = None):
     try:
@@ -671,9 +815,8 @@ def append_log_record(bot: Bot, group_id: str, user_id: str, nickname: str, cont
 
 class _StatsFormatter:
     @staticmethod
-    def format(log_entry: Dict[str, Any]) -> str:
+    def format(log_entry: Dict[str, Any], stats: Dict[str, Any]) -> str:
         name = log_entry.get(LOG_KEY_NAME, "?")
-        stats = log_entry.get(LOG_KEY_STATS, _empty_stats())
         messages = stats.get("messages", 0)
         participants = stats.get("participants", {})
         rolls = stats.get("rolls", {})
@@ -772,6 +915,17 @@ class _LogMessages:
         self.pause_before_delete = "日志《{name}》正在记录，请先 .log off 或 .log halt。"
         self.not_recording = "日志《{name}》当前处于暂停状态。"
         self.switch_success = "已切换至日志《{name}》。"
+        self.exporting = "日志《{name}》已停止记录，共 {count} 条消息，正在后台导出，完成后会上传至群文件。"
+        self.export_timeout = "日志《{name}》导出超时，请稍后使用 .log get 查看。"
+        self.upload_queued = "已加入云端上传队列"
+        self.retention_set = "本群日志将在 {days} 天未更新后自动归档并从数据库中删除。"
+        self.retention_off = "本群日志不会被自动归档。"
+        self.retention_default = "本群日志的保留天数已恢复为全局设置（{days} 天，0 为不清理）。"
+        self.maintenance_report = "日志维护完成：归档并删除 {logs} 个日志，共 {records} 条记录，数据库 {before:.1f}MB -> {after:.1f}MB。"
+        self.maintenance_failed = "以下日志归档失败，已保留在数据库中：\n{errors}"
+        self.upload_pending = "云端上传排队中，已失败 {attempts} 次，最近一次错误：{error}"
+        self.upload_done = "日志《{name}》云端上传成功：{url}"
+        self.upload_failed = "日志《{name}》{message}"
 
 
 class _LogHelper:
@@ -802,10 +956,8 @@ class _LogHelper:
 
 class _LogFormatter:
     @staticmethod
-    def status_line(log_id: str, entry: Dict[str, Any], current_id: str) -> str:
+    def status_line(log_id: str, entry: Dict[str, Any], current_id: str, count: int) -> str:
         name = entry.get(LOG_KEY_NAME, log_id)
-        stats = entry.get(LOG_KEY_STATS, {})
-        count = stats.get("messages", len(entry.get(LOG_KEY_RECORDS, [])))
         created = entry.get(LOG_KEY_CREATED_AT, "-")
         upload = entry.get(LOG_KEY_UPLOAD, {}).get(LOG_KEY_UPLOAD_TIME)
         if log_id == current_id:
@@ -854,19 +1006,14 @@ def record_incoming_message(bot: Bot,
                             is_bot: bool) -> List[BotCommandBase]:
     if not group_id:
         return []
-
-    payload = _load_group_payload(bot, group_id)
-    current_id = payload.get(LOG_GROUP_CURRENT, "")
-    if not current_id:
+    # 绝大多数消息所在的群并没有在记录日志, 只需要查询一次会话缓存
+    session = _get_log_session(bot, group_id)
+    if session is None:
         return []
+    current_id = session.log_id
+    entry = session.entry
 
-    logs = payload.get(LOG_GROUP_LOGS, {})
-    entry = logs.get(current_id)
-    if not entry or not entry.get(LOG_KEY_RECORDING):
-        return []
-
-    filters = _ensure_filters(payload)
-    if _should_filter(filters, content, is_bot=is_bot):
+    if _should_filter(session.filters, content, is_bot=is_bot):
         return []
 
     record = {
@@ -905,13 +1052,17 @@ def record_incoming_message(bot: Bot,
             entry[LOG_KEY_LAST_WARN] = now_time
 
     _append_record_to_db(group_id, current_id, entry, record, source_is_bot=is_bot)
-    # 不再堆积内存 records，仅保留统计；裁剪留作安全网（不会影响）
-    _trim_records_if_needed(bot, entry)
-    # 裁剪 stats 和 color_map，防止无限增长
-    _trim_stats_if_needed(entry)
-    _trim_color_map_if_needed(entry)
-    payload[LOG_GROUP_LOGS][current_id] = entry
-    _save_group_payload(bot, group_id, payload)
+    if message_id:
+        try:
+            _get_recall_ring(bot, group_id, current_id, entry).add(str(message_id))
+        except Exception as e:
+            dice_log(f"[LogDB] recall ring error: {e}")
+    # 不再堆积内存 records，仅保留统计；裁剪留作安全网（只有旧版日志才会有 records）
+    if entry.get(LOG_KEY_RECORDS):
+        _trim_records_if_needed(bot, entry)
+    # 会话中的条目就是DataManager中的数据, 原地修改后只需标记待写回
+    if not session.persist(bot):
+        _drop_log_session(bot, group_id)
     return commands
 
 
@@ -919,7 +1070,9 @@ def record_incoming_message(bot: Bot,
                      priority=DPP_COMMAND_PRIORITY_DEFAULT,
                      flag=DPP_COMMAND_FLAG_DEFAULT,
                      cluster=DPP_COMMAND_CLUSTER_DEFAULT,
-                     group_only=True)
+                     group_only=True,
+                     prefixes=(".log",),
+                     tick_period=LOG_UPLOAD_POLL_INTERVAL)
 class LogCommand(UserCommandBase):
     """运行日志核心指令"""
 
@@ -927,6 +1080,8 @@ class LogCommand(UserCommandBase):
         super().__init__(bot)
         self.helper = _LogHelper(bot)
         self.messages = _LogMessages()
+        self.upload_queue = LogUploadQueue(str(bot.account), UPLOAD_VERSION)
+        self.upload_poll_at: float = 0
         self.log_usage = (
             "日志指令：\n"
             ".log new <名称>  创建并立即开始新的日志\n"
@@ -938,7 +1093,8 @@ class LogCommand(UserCommandBase):
             ".log stat [名称] 查看日志统计\n"
             ".log get <名称>  查看最近一次导出信息\n"
             ".log del <名称>  删除指定日志\n"
-            ".log set [选项]  切换过滤设置"
+            ".log set [选项]  切换过滤设置\n"
+            ".log set keep <天数>  设置本群日志自动归档的天数"
         )
         self.log_help = self.log_usage
         self.log_on_already = "日志已在进行中。"
@@ -955,6 +1111,7 @@ class LogCommand(UserCommandBase):
         self.bot.cfg_helper.register_config(CFG_LOG_UPLOAD_TOKEN, "", "日志云端上传授权 Token，可留空")
         # 允许配置内存中保留的最大日志记录条数，超出自动丢弃最早的记录以避免 OOM
         self.bot.cfg_helper.register_config(CFG_LOG_MAX_RECORDS, str(LOG_MAX_RECORDS_DEFAULT), "单个日志在内存中保留的最大消息条数，超过将自动丢弃最早的记录；-1 为不限制（不建议长期开启）")
+        self.bot.cfg_helper.register_config(CFG_LOG_RETENTION_DAYS, str(LOG_RETENTION_DAYS_DEFAULT), "每日维护时将超过该天数未更新的已结束日志归档为压缩文件并从数据库中删除；0 为不清理，群内可用 .log set keep <天数> 单独设置")
 
     def can_process_msg(self, msg_str: str, meta: MessageMetaData) -> Tuple[bool, bool, Any]:
         if not msg_str.startswith(".log"):
@@ -1035,7 +1192,7 @@ class LogCommand(UserCommandBase):
             LOG_KEY_RECORDING: True,
             LOG_KEY_RECORDS: [],
             LOG_KEY_COLOR_MAP: {},
-            LOG_KEY_STATS: _empty_stats(),
+            LOG_KEY_STATS: LOG_STATS_IN_DB,
             LOG_KEY_SESSION_COUNT: 0,
             LOG_KEY_RECORD_BEGIN_AT: now,
             LOG_KEY_LAST_WARN: now,
@@ -1044,33 +1201,28 @@ class LogCommand(UserCommandBase):
         payload[LOG_GROUP_NAME_INDEX][name.lower()] = log_id
         payload[LOG_GROUP_CURRENT] = log_id
         # 同步到 DB（元数据）
-        if get_connection and upsert_log:
+        if get_log_writer:
             try:
-                conn = get_connection()
-                try:
-                    filters = payload.get(LOG_GROUP_FILTERS, DEFAULT_FILTERS)
-                    upsert_log(conn, {
-                        "id": log_id,
-                        "group_id": group_id,
-                        "name": name,
-                        "created_at": now,
-                        "updated_at": now,
-                        "recording": True,
-                        "record_begin_at": now,
-                        "last_warn": now,
-                        "filter_outside": int(bool(filters.get(FILTER_OUTSIDE))),
-                        "filter_command": int(bool(filters.get(FILTER_COMMAND))),
-                        "filter_bot": int(bool(filters.get(FILTER_BOT))),
-                        "filter_media": int(bool(filters.get(FILTER_MEDIA))),
-                        "filter_forum_code": int(bool(filters.get(FILTER_FORUM_CODE))),
-                        "upload_time": None,
-                        "upload_file": None,
-                        "upload_note": None,
-                        "url": None,
-                    })
-                    conn.commit()
-                finally:
-                    conn.close()
+                filters = payload.get(LOG_GROUP_FILTERS, DEFAULT_FILTERS)
+                get_log_writer().upsert_log({
+                    "id": log_id,
+                    "group_id": group_id,
+                    "name": name,
+                    "created_at": now,
+                    "updated_at": now,
+                    "recording": True,
+                    "record_begin_at": now,
+                    "last_warn": now,
+                    "filter_outside": int(bool(filters.get(FILTER_OUTSIDE))),
+                    "filter_command": int(bool(filters.get(FILTER_COMMAND))),
+                    "filter_bot": int(bool(filters.get(FILTER_BOT))),
+                    "filter_media": int(bool(filters.get(FILTER_MEDIA))),
+                    "filter_forum_code": int(bool(filters.get(FILTER_FORUM_CODE))),
+                    "upload_time": None,
+                    "upload_file": None,
+                    "upload_note": None,
+                    "url": None,
+                })
             except Exception as e:
                 dice_log(f"[LogDB] upsert new log error: {e}")
         return self.messages.new_started.format(name=name)
@@ -1108,33 +1260,28 @@ class LogCommand(UserCommandBase):
         logs[target_id] = entry
         payload[LOG_GROUP_LOGS] = logs
         # DB 同步
-        if get_connection and upsert_log:
+        if get_log_writer:
             try:
-                conn = get_connection()
-                try:
-                    filters = payload.get(LOG_GROUP_FILTERS, DEFAULT_FILTERS)
-                    upsert_log(conn, {
-                        "id": target_id,
-                        "group_id": group_id,
-                        "name": entry.get(LOG_KEY_NAME, target_id),
-                        "created_at": entry.get(LOG_KEY_CREATED_AT, now),
-                        "updated_at": now,
-                        "recording": True,
-                        "record_begin_at": entry.get(LOG_KEY_RECORD_BEGIN_AT, now),
-                        "last_warn": entry.get(LOG_KEY_LAST_WARN, now),
-                        "filter_outside": int(bool(filters.get(FILTER_OUTSIDE))),
-                        "filter_command": int(bool(filters.get(FILTER_COMMAND))),
-                        "filter_bot": int(bool(filters.get(FILTER_BOT))),
-                        "filter_media": int(bool(filters.get(FILTER_MEDIA))),
-                        "filter_forum_code": int(bool(filters.get(FILTER_FORUM_CODE))),
-                        "upload_time": entry.get(LOG_KEY_UPLOAD, {}).get(LOG_KEY_UPLOAD_TIME),
-                        "upload_file": entry.get(LOG_KEY_UPLOAD, {}).get(LOG_KEY_UPLOAD_FILE),
-                        "upload_note": entry.get(LOG_KEY_UPLOAD, {}).get(LOG_KEY_UPLOAD_NOTE),
-                        "url": entry.get(LOG_KEY_UPLOAD, {}).get("url"),
-                    })
-                    conn.commit()
-                finally:
-                    conn.close()
+                filters = payload.get(LOG_GROUP_FILTERS, DEFAULT_FILTERS)
+                get_log_writer().upsert_log({
+                    "id": target_id,
+                    "group_id": group_id,
+                    "name": entry.get(LOG_KEY_NAME, target_id),
+                    "created_at": entry.get(LOG_KEY_CREATED_AT, now),
+                    "updated_at": now,
+                    "recording": True,
+                    "record_begin_at": entry.get(LOG_KEY_RECORD_BEGIN_AT, now),
+                    "last_warn": entry.get(LOG_KEY_LAST_WARN, now),
+                    "filter_outside": int(bool(filters.get(FILTER_OUTSIDE))),
+                    "filter_command": int(bool(filters.get(FILTER_COMMAND))),
+                    "filter_bot": int(bool(filters.get(FILTER_BOT))),
+                    "filter_media": int(bool(filters.get(FILTER_MEDIA))),
+                    "filter_forum_code": int(bool(filters.get(FILTER_FORUM_CODE))),
+                    "upload_time": entry.get(LOG_KEY_UPLOAD, {}).get(LOG_KEY_UPLOAD_TIME),
+                    "upload_file": entry.get(LOG_KEY_UPLOAD, {}).get(LOG_KEY_UPLOAD_FILE),
+                    "upload_note": entry.get(LOG_KEY_UPLOAD, {}).get(LOG_KEY_UPLOAD_NOTE),
+                    "url": entry.get(LOG_KEY_UPLOAD, {}).get("url"),
+                })
             except Exception as e:
                 dice_log(f"[LogDB] upsert on error: {e}")
         return self.messages.resume.format(name=entry.get(LOG_KEY_NAME, target_id))
@@ -1153,33 +1300,28 @@ class LogCommand(UserCommandBase):
         entry[LOG_KEY_UPDATED_AT] = _now_str()
         payload[LOG_GROUP_LOGS][current_id] = entry
         # DB 同步
-        if get_connection and upsert_log:
+        if get_log_writer:
             try:
-                conn = get_connection()
-                try:
-                    filters = payload.get(LOG_GROUP_FILTERS, DEFAULT_FILTERS)
-                    upsert_log(conn, {
-                        "id": current_id,
-                        "group_id": group_id,
-                        "name": entry.get(LOG_KEY_NAME, current_id),
-                        "created_at": entry.get(LOG_KEY_CREATED_AT, _now_str()),
-                        "updated_at": entry.get(LOG_KEY_UPDATED_AT),
-                        "recording": False,
-                        "record_begin_at": entry.get(LOG_KEY_RECORD_BEGIN_AT),
-                        "last_warn": entry.get(LOG_KEY_LAST_WARN),
-                        "filter_outside": int(bool(filters.get(FILTER_OUTSIDE))),
-                        "filter_command": int(bool(filters.get(FILTER_COMMAND))),
-                        "filter_bot": int(bool(filters.get(FILTER_BOT))),
-                        "filter_media": int(bool(filters.get(FILTER_MEDIA))),
-                        "filter_forum_code": int(bool(filters.get(FILTER_FORUM_CODE))),
-                        "upload_time": entry.get(LOG_KEY_UPLOAD, {}).get(LOG_KEY_UPLOAD_TIME),
-                        "upload_file": entry.get(LOG_KEY_UPLOAD, {}).get(LOG_KEY_UPLOAD_FILE),
-                        "upload_note": entry.get(LOG_KEY_UPLOAD, {}).get(LOG_KEY_UPLOAD_NOTE),
-                        "url": entry.get(LOG_KEY_UPLOAD, {}).get("url"),
-                    })
-                    conn.commit()
-                finally:
-                    conn.close()
+                filters = payload.get(LOG_GROUP_FILTERS, DEFAULT_FILTERS)
+                get_log_writer().upsert_log({
+                    "id": current_id,
+                    "group_id": group_id,
+                    "name": entry.get(LOG_KEY_NAME, current_id),
+                    "created_at": entry.get(LOG_KEY_CREATED_AT, _now_str()),
+                    "updated_at": entry.get(LOG_KEY_UPDATED_AT),
+                    "recording": False,
+                    "record_begin_at": entry.get(LOG_KEY_RECORD_BEGIN_AT),
+                    "last_warn": entry.get(LOG_KEY_LAST_WARN),
+                    "filter_outside": int(bool(filters.get(FILTER_OUTSIDE))),
+                    "filter_command": int(bool(filters.get(FILTER_COMMAND))),
+                    "filter_bot": int(bool(filters.get(FILTER_BOT))),
+                    "filter_media": int(bool(filters.get(FILTER_MEDIA))),
+                    "filter_forum_code": int(bool(filters.get(FILTER_FORUM_CODE))),
+                    "upload_time": entry.get(LOG_KEY_UPLOAD, {}).get(LOG_KEY_UPLOAD_TIME),
+                    "upload_file": entry.get(LOG_KEY_UPLOAD, {}).get(LOG_KEY_UPLOAD_FILE),
+                    "upload_note": entry.get(LOG_KEY_UPLOAD, {}).get(LOG_KEY_UPLOAD_NOTE),
+                    "url": entry.get(LOG_KEY_UPLOAD, {}).get("url"),
+                })
             except Exception as e:
                 dice_log(f"[LogDB] upsert off error: {e}")
         return self.messages.paused.format(name=entry.get(LOG_KEY_NAME, current_id))
@@ -1197,33 +1339,28 @@ class LogCommand(UserCommandBase):
         payload[LOG_GROUP_LOGS][current_id] = entry
         payload[LOG_GROUP_CURRENT] = ""
         # DB 同步
-        if get_connection and upsert_log:
+        if get_log_writer:
             try:
-                conn = get_connection()
-                try:
-                    filters = payload.get(LOG_GROUP_FILTERS, DEFAULT_FILTERS)
-                    upsert_log(conn, {
-                        "id": current_id,
-                        "group_id": group_id,
-                        "name": entry.get(LOG_KEY_NAME, current_id),
-                        "created_at": entry.get(LOG_KEY_CREATED_AT, _now_str()),
-                        "updated_at": entry.get(LOG_KEY_UPDATED_AT),
-                        "recording": False,
-                        "record_begin_at": entry.get(LOG_KEY_RECORD_BEGIN_AT),
-                        "last_warn": entry.get(LOG_KEY_LAST_WARN),
-                        "filter_outside": int(bool(filters.get(FILTER_OUTSIDE))),
-                        "filter_command": int(bool(filters.get(FILTER_COMMAND))),
-                        "filter_bot": int(bool(filters.get(FILTER_BOT))),
-                        "filter_media": int(bool(filters.get(FILTER_MEDIA))),
-                        "filter_forum_code": int(bool(filters.get(FILTER_FORUM_CODE))),
-                        "upload_time": entry.get(LOG_KEY_UPLOAD, {}).get(LOG_KEY_UPLOAD_TIME),
-                        "upload_file": entry.get(LOG_KEY_UPLOAD, {}).get(LOG_KEY_UPLOAD_FILE),
-                        "upload_note": entry.get(LOG_KEY_UPLOAD, {}).get(LOG_KEY_UPLOAD_NOTE),
-                        "url": entry.get(LOG_KEY_UPLOAD, {}).get("url"),
-                    })
-                    conn.commit()
-                finally:
-                    conn.close()
+                filters = payload.get(LOG_GROUP_FILTERS, DEFAULT_FILTERS)
+                get_log_writer().upsert_log({
+                    "id": current_id,
+                    "group_id": group_id,
+                    "name": entry.get(LOG_KEY_NAME, current_id),
+                    "created_at": entry.get(LOG_KEY_CREATED_AT, _now_str()),
+                    "updated_at": entry.get(LOG_KEY_UPDATED_AT),
+                    "recording": False,
+                    "record_begin_at": entry.get(LOG_KEY_RECORD_BEGIN_AT),
+                    "last_warn": entry.get(LOG_KEY_LAST_WARN),
+                    "filter_outside": int(bool(filters.get(FILTER_OUTSIDE))),
+                    "filter_command": int(bool(filters.get(FILTER_COMMAND))),
+                    "filter_bot": int(bool(filters.get(FILTER_BOT))),
+                    "filter_media": int(bool(filters.get(FILTER_MEDIA))),
+                    "filter_forum_code": int(bool(filters.get(FILTER_FORUM_CODE))),
+                    "upload_time": entry.get(LOG_KEY_UPLOAD, {}).get(LOG_KEY_UPLOAD_TIME),
+                    "upload_file": entry.get(LOG_KEY_UPLOAD, {}).get(LOG_KEY_UPLOAD_FILE),
+                    "upload_note": entry.get(LOG_KEY_UPLOAD, {}).get(LOG_KEY_UPLOAD_NOTE),
+                    "url": entry.get(LOG_KEY_UPLOAD, {}).get("url"),
+                })
             except Exception as e:
                 dice_log(f"[LogDB] upsert halt error: {e}")
         return self.messages.halted.format(name=entry.get(LOG_KEY_NAME, current_id))
@@ -1244,40 +1381,79 @@ class LogCommand(UserCommandBase):
         payload[LOG_GROUP_LOGS][current_id] = entry
 
         filters = _ensure_filters(payload)
-        file_main_path, display_name, extra_files = self._generate_file(group_id, entry, filters, log_id=current_id)
-        count = entry.get(LOG_KEY_STATS, {}).get("messages", len(entry.get(LOG_KEY_RECORDS, [])))
-        upload_feedback = self._try_upload_log(group_id, entry, log_id=current_id)
+        count = _fetch_message_counts([current_id]).get(current_id, len(entry.get(LOG_KEY_RECORDS, [])))
+        job = self._prepare_export(group_id, entry, filters, log_id=current_id)
+        if not self.bot.is_scheduler_running():  # 没有运行调度器(调试/测试)时直接在当前线程导出
+            exported = self._generate_file_from_job(job)
+            upload, upload_feedback = self._enqueue_upload(group_id, entry, log_id=current_id)
+            if upload:  # 没有事件循环时不发送请求, 留在队列中等待之后处理
+                upload_feedback = {"success": False, "message": self.messages.upload_queued}
+            return self._finish_end(payload, group_id, current_id, count, exported, upload_feedback)
+
+        log_name = entry.get(LOG_KEY_NAME, current_id)
+        entry_snapshot = dict(entry)
+        entry_snapshot[LOG_KEY_RECORDS] = list(entry.get(LOG_KEY_RECORDS, []))
+
+        def report_progress(done: int, total: int) -> None:
+            dice_log(f"[LogExport] 《{log_name}》已导出 {done}/{total} 条")
+
+        async def export_task() -> List[BotCommandBase]:
+            # 读取记录与写文件/压缩在工作线程中进行, 上传由异步客户端发送, 失败时留在队列中等待重试
+            loop = asyncio.get_running_loop()
+            exported = await self._export_files_async(job, report_progress)
+            upload, upload_feedback = await loop.run_in_executor(
+                None, lambda: self._enqueue_upload(group_id, entry_snapshot, log_id=current_id))
+            if upload:
+                upload_feedback = await self.upload_queue.attempt(upload)
+            latest_payload = _load_group_payload(self.bot, group_id)
+            commands = self._finish_end(latest_payload, group_id, current_id, count, exported, upload_feedback,
+                                        fallback_entry=entry_snapshot)
+            _save_group_payload(self.bot, group_id, latest_payload)
+            return commands
+
+        def on_timeout() -> List[BotCommandBase]:
+            return [BotSendMsgCommand(self.bot.account, self.messages.export_timeout.format(name=log_name),
+                                      [GroupMessagePort(group_id)])]
+
+        self.bot.register_task(export_task, timeout=LOG_EXPORT_TIMEOUT, timeout_callback=on_timeout)
+        feedback = self.messages.exporting.format(name=log_name, count=count)
+        return [BotSendMsgCommand(self.bot.account, feedback, [GroupMessagePort(group_id)])]
+
+    def _finish_end(self, payload: Dict[str, Any], group_id: str, log_id: str, count: int,
+                    exported: Tuple[str, str, List[Tuple[str, str]]], upload_feedback: Optional[Dict[str, Any]],
+                    *, fallback_entry: Optional[Dict[str, Any]] = None) -> List[BotCommandBase]:
+        """导出完成后记录上传信息并生成发送文件的指令, 导出期间日志被删除时只发送文件"""
+        file_main_path, display_name, extra_files = exported
+        entry = payload.get(LOG_GROUP_LOGS, {}).get(log_id)
         upload_note = "上传至群文件"
         upload_url = None
         if upload_feedback:
             upload_note = upload_feedback.get("message", upload_note)
             upload_url = upload_feedback.get("url")
-        entry[LOG_KEY_UPLOAD] = {
-            LOG_KEY_UPLOAD_TIME: _now_str(),
-            LOG_KEY_UPLOAD_FILE: display_name,
-            LOG_KEY_UPLOAD_NOTE: upload_note,
-        }
-        if upload_url:
-            entry[LOG_KEY_UPLOAD]["url"] = upload_url
-        payload[LOG_GROUP_LOGS][current_id] = entry
-        # DB 更新上传信息
-        if get_connection and update_log_upload:
-            try:
-                conn = get_connection()
+        if entry is not None:
+            entry[LOG_KEY_UPLOAD] = {
+                LOG_KEY_UPLOAD_TIME: _now_str(),
+                LOG_KEY_UPLOAD_FILE: display_name,
+                LOG_KEY_UPLOAD_NOTE: upload_note,
+            }
+            if upload_url:
+                entry[LOG_KEY_UPLOAD]["url"] = upload_url
+            payload[LOG_GROUP_LOGS][log_id] = entry
+            # DB 更新上传信息
+            if get_log_writer:
                 try:
-                    update_log_upload(conn, current_id, {
+                    get_log_writer().update_log_upload(log_id, {
                         "time": entry[LOG_KEY_UPLOAD].get(LOG_KEY_UPLOAD_TIME),
                         "file": entry[LOG_KEY_UPLOAD].get(LOG_KEY_UPLOAD_FILE),
                         "note": entry[LOG_KEY_UPLOAD].get(LOG_KEY_UPLOAD_NOTE),
                         "url": entry[LOG_KEY_UPLOAD].get("url"),
                     })
-                    conn.commit()
-                finally:
-                    conn.close()
-            except Exception as e:
-                dice_log(f"[LogDB] update upload error: {e}")
+                except Exception as e:
+                    dice_log(f"[LogDB] update upload error: {e}")
+        else:
+            entry = fallback_entry or {}
 
-        feedback_lines = [self.messages.end_summary.format(name=entry.get(LOG_KEY_NAME, current_id), count=count)]
+        feedback_lines = [self.messages.end_summary.format(name=entry.get(LOG_KEY_NAME, log_id), count=count)]
         if upload_feedback:
             if upload_feedback.get("success") and upload_url:
                 feedback_lines.append(f"线上日志链接：{upload_url}")
@@ -1299,7 +1475,9 @@ class LogCommand(UserCommandBase):
         if not logs:
             return "当前没有保存任何日志。"
         current_id = payload.get(LOG_GROUP_CURRENT, "")
-        lines = [_LogFormatter.status_line(log_id, entry, current_id) for log_id, entry in logs.items()]
+        counts = _fetch_message_counts(list(logs.keys()))
+        lines = [_LogFormatter.status_line(log_id, entry, current_id, counts.get(log_id, len(entry.get(LOG_KEY_RECORDS, []))))
+                 for log_id, entry in logs.items()]
         return "\n".join([self.messages.list_header] + lines)
 
     def _handle_delete(self, payload: Dict[str, Any], group_id: str, name: str) -> str:
@@ -1319,14 +1497,9 @@ class LogCommand(UserCommandBase):
             k: v for k, v in payload.get(LOG_GROUP_NAME_INDEX, {}).items() if v != log_id
         }
         # DB 删除（级联删除记录）
-        if get_connection and delete_log:
+        if get_log_writer:
             try:
-                conn = get_connection()
-                try:
-                    delete_log(conn, log_id)
-                    conn.commit()
-                finally:
-                    conn.close()
+                get_log_writer().delete_log(log_id)
             except Exception as e:
                 dice_log(f"[LogDB] delete log error: {e}")
         return self.messages.deleted.format(name=entry.get(LOG_KEY_NAME, name) if entry else name)
@@ -1344,8 +1517,15 @@ class LogCommand(UserCommandBase):
         should_retry = not upload or not upload.get("url")
         retry_feedback: Optional[Dict[str, Any]] = None
         if should_retry:
-            retry_feedback = self._try_upload_log(group_id, entry, log_id=log_id)
-            if retry_feedback:
+            pending = get_log_writer().get_pending_upload(log_id) if get_log_writer else None
+            if pending:
+                retry_feedback = {"success": False, "message": self.messages.upload_pending.format(
+                    attempts=pending.get("attempts", 0), error=pending.get("last_error") or "无")}
+            else:
+                upload_task, retry_feedback = self._enqueue_upload(group_id, entry, log_id=log_id)
+                if upload_task:
+                    retry_feedback = {"success": False, "message": self.messages.upload_queued}
+            if retry_feedback and not pending:
                 upload_file_name = upload.get(LOG_KEY_UPLOAD_FILE) or f"{entry.get(LOG_KEY_NAME, name)}"
                 note = retry_feedback.get("message", "")
                 entry[LOG_KEY_UPLOAD] = {
@@ -1374,18 +1554,11 @@ class LogCommand(UserCommandBase):
 
     def _handle_stat(self, payload: Dict[str, Any], group_id: str, name: str) -> str:
         logs = payload.get(LOG_GROUP_LOGS, {})
-        target_entry: Optional[Dict[str, Any]] = None
-        if name:
-            log_id = _find_log_id_by_name(payload, name)
-            if log_id:
-                target_entry = logs.get(log_id)
-        else:
-            current_id = payload.get(LOG_GROUP_CURRENT)
-            if current_id:
-                target_entry = logs.get(current_id)
+        log_id = _find_log_id_by_name(payload, name) if name else payload.get(LOG_GROUP_CURRENT)
+        target_entry = logs.get(log_id) if log_id else None
         if not target_entry:
             return "未找到对应日志，或当前没有正在使用的日志。"
-        return _StatsFormatter.format(target_entry)
+        return _StatsFormatter.format(target_entry, _fetch_log_stats(log_id))
 
     def _handle_set(self, payload: Dict[str, Any], filters: Dict[str, bool], param: str) -> str:
         if not param:
@@ -1396,7 +1569,12 @@ class LogCommand(UserCommandBase):
                 f"图片表情过滤：{'ON' if filters.get(FILTER_MEDIA) else 'OFF'}",
                 f"论坛代码生成：{'ON' if filters.get(FILTER_FORUM_CODE) else 'OFF'}",
             ]
+            retention = self._get_retention_days(payload)
+            status_lines.append(f"自动归档：{f'{retention} 天未更新后' if retention > 0 else 'OFF'}（.log set keep <天数/off/default>）")
             return "日志过滤设置：\n" + "\n".join(status_lines)
+        args = param.split()
+        if args[0].lower() in ("keep", "保留"):
+            return self._handle_set_retention(payload, args[1] if len(args) > 1 else "")
         alias_map = {
             "outside": FILTER_OUTSIDE,
             "场外": FILTER_OUTSIDE,
@@ -1422,145 +1600,226 @@ class LogCommand(UserCommandBase):
         state = "ON" if filters[key] else "OFF"
         return self.bot.loc_helper.format_loc_text(LOC_LOG_SET_TOGGLED, item=param, state=state)
 
-    def _generate_file(self, group_id: str, log_entry: Dict[str, Any], filters: Dict[str, bool], *, log_id: Optional[str] = None) -> Tuple[str, str, List[Tuple[str, str]]]:
-        # 优先从 DB 读取记录，避免占用内存
-        records: List[Dict[str, Any]]
-        # Prefer DB records but merge with any legacy in-memory records so that
-        # old-format logs (stored in payload) and new DB-backed records are
-        # concatenated for export.
-        records_payload = list(log_entry.get(LOG_KEY_RECORDS, []))
-        records_db = []
-        if get_connection and fetch_records:
-            try:
-                conn = get_connection()
+    def _handle_set_retention(self, payload: Dict[str, Any], value: str) -> str:
+        value = value.strip().lower()
+        if value in ("default", "默认"):
+            payload.pop(LOG_GROUP_RETENTION, None)
+            return self.messages.retention_default.format(days=self._get_retention_days())
+        if value in ("off", "0", "关闭"):
+            payload[LOG_GROUP_RETENTION] = 0
+            return self.messages.retention_off
+        try:
+            days = int(value)
+        except ValueError:
+            days = 0
+        if days <= 0:
+            return "用法：.log set keep <天数/off/default>"
+        payload[LOG_GROUP_RETENTION] = days
+        return self.messages.retention_set.format(days=days)
+
+    def _get_retention_days(self, payload: Optional[Dict[str, Any]] = None) -> int:
+        if payload is not None and LOG_GROUP_RETENTION in payload:
+            return int(payload[LOG_GROUP_RETENTION])
+        try:
+            return int(str(self.bot.cfg_helper.get_config(CFG_LOG_RETENTION_DAYS)[0]).strip())
+        except Exception:
+            return LOG_RETENTION_DAYS_DEFAULT
+
+    def tick_daily(self) -> List[BotCommandBase]:
+        if get_log_writer:
+            self.bot.register_task(self._run_maintenance, timeout=LOG_MAINTENANCE_TIMEOUT)
+        return []
+
+    async def _run_maintenance(self) -> List[BotCommandBase]:
+        """
+        日志数据库的每日维护: 将超过保留期限的已结束日志归档为gzip压缩的JSONL文件, 再分批删除其记录,
+        最后增量回收空闲页并执行PRAGMA optimize, 结果通知Master
+        归档与删除都在工作线程中进行, 每批之间让出事件循环
+        """
+        loop = asyncio.get_running_loop()
+        writer = get_log_writer()
+        size_before = await loop.run_in_executor(None, writer.db_size)
+        now = get_current_date_raw()
+        archived_logs, removed_records = 0, 0
+        errors: List[str] = []
+        for group_id in self.bot.data_manager.get_keys(DC_LOG_SESSION, []):
+            payload = _load_group_payload(self.bot, group_id)
+            days = self._get_retention_days(payload)
+            if days <= 0:
+                continue
+            cutoff = now - datetime.timedelta(days=days)
+            expired = []
+            for log_id, entry in payload.get(LOG_GROUP_LOGS, {}).items():
+                if log_id == payload.get(LOG_GROUP_CURRENT) or entry.get(LOG_KEY_RECORDING):
+                    continue
                 try:
-                    use_log_id = log_id or self._get_log_id_by_entry(group_id, log_entry)
-                    records_db = fetch_records(conn, use_log_id)
-                finally:
-                    conn.close()
-            except Exception as e:
-                dice_log(f"[LogDB] fetch_records error: {e}")
-                records_db = []
-        # Merge DB-backed and payload records, sort by timestamp to preserve order
-        if records_db and records_payload:
-            try:
-                combined = records_db + records_payload
-                combined.sort(key=lambda r: str_to_datetime(r.get('time', _now_str())) or _now_str())
-                records = combined
-            except Exception:
-                records = records_db + records_payload
-        elif records_db:
-            records = records_db
-        else:
-            records = records_payload
-        color_map = dict(log_entry.get(LOG_KEY_COLOR_MAP, {}))
+                    updated_at = str_to_datetime(entry.get(LOG_KEY_UPDATED_AT, ""))
+                except Exception:
+                    continue
+                if updated_at is not None and updated_at < cutoff:
+                    expired.append((log_id, entry))
+            for log_id, entry in expired:
+                name = entry.get(LOG_KEY_NAME, log_id)
+                meta = {
+                    "log_id": log_id,
+                    "group_id": group_id,
+                    "name": name,
+                    "created_at": entry.get(LOG_KEY_CREATED_AT),
+                    "updated_at": entry.get(LOG_KEY_UPDATED_AT),
+                    "upload": entry.get(LOG_KEY_UPLOAD, {}),
+                    "stats": _fetch_log_stats(log_id),
+                }
+                path = os.path.join(LOG_ARCHIVE_DIR, group_id, f"{_sanitize_filename(name)}_{log_id}.jsonl.gz")
+                legacy_records = list(entry.get(LOG_KEY_RECORDS, []))
+
+                def archive_task() -> int:
+                    with LogRecordSource(log_id, legacy_records) as source:
+                        return archive_log(path, meta, source)
+                try:
+                    await loop.run_in_executor(None, archive_task)
+                except Exception as e:
+                    dice_log(f"[LogMaintenance] archive {log_id} error: {e}")
+                    errors.append(f"群{group_id}《{name}》: {e}")
+                    continue
+                # 归档期间日志可能被重新开启或删除, 此时保留数据库中的数据
+                payload = _load_group_payload(self.bot, group_id)
+                if log_id not in payload.get(LOG_GROUP_LOGS, {}) or log_id == payload.get(LOG_GROUP_CURRENT):
+                    continue
+                payload[LOG_GROUP_LOGS].pop(log_id)
+                payload[LOG_GROUP_NAME_INDEX] = {
+                    k: v for k, v in payload.get(LOG_GROUP_NAME_INDEX, {}).items() if v != log_id
+                }
+                _save_group_payload(self.bot, group_id, payload)
+                while True:
+                    removed = await loop.run_in_executor(None, writer.delete_records_batch, log_id, LOG_MAINTENANCE_BATCH)
+                    removed_records += removed
+                    if removed < LOG_MAINTENANCE_BATCH:
+                        break
+                writer.delete_log(log_id)
+                removed_records += len(legacy_records)
+                archived_logs += 1
+        try:
+            if archived_logs:
+                await loop.run_in_executor(None, enable_incremental_vacuum)
+            free_pages = None
+            while True:  # 每次只回收一部分空闲页, 没有开启增量回收时空闲页数不会减少
+                remain = await loop.run_in_executor(None, writer.incremental_vacuum)
+                if not remain or remain == free_pages:
+                    break
+                free_pages = remain
+            await loop.run_in_executor(None, writer.optimize)
+        except Exception as e:
+            dice_log(f"[LogMaintenance] compact error: {e}")
+        size_after = await loop.run_in_executor(None, writer.db_size)
+        dice_log(f"[LogMaintenance] archived {archived_logs} logs, {removed_records} records, "
+                 f"db size {size_before} -> {size_after}")
+
+        if not archived_logs and not errors:
+            return []
+        feedback = self.messages.maintenance_report.format(logs=archived_logs, records=removed_records,
+                                                          before=size_before / 1024 / 1024,
+                                                          after=size_after / 1024 / 1024)
+        if errors:
+            feedback += "\n" + self.messages.maintenance_failed.format(errors="\n".join(errors))
+        master_list = self.bot.get_master_ids()
+        if not master_list:
+            return []
+        return [BotSendMsgCommand(self.bot.account, feedback, [PrivateMessagePort(master_list[0])])]
+
+    def _generate_file(self, group_id: str, log_entry: Dict[str, Any], filters: Dict[str, bool], *, log_id: Optional[str] = None,
+                       on_progress: Optional[Callable[[int, int], None]] = None) -> Tuple[str, str, List[Tuple[str, str]]]:
+        return self._generate_file_from_job(self._prepare_export(group_id, log_entry, filters, log_id=log_id), on_progress)
+
+    def _generate_file_from_job(self, job: LogExportJob, on_progress: Optional[Callable[[int, int], None]] = None) \
+            -> Tuple[str, str, List[Tuple[str, str]]]:
+        """在当前线程中完成导出, 用于没有运行调度器的情况"""
+        self._resolve_mentions(job, self._find_mentions(job))
+        return self._export_files(job, on_progress)
+
+    def _prepare_export(self, group_id: str, log_entry: Dict[str, Any], filters: Dict[str, bool], *, log_id: Optional[str] = None) -> LogExportJob:
+        """在事件循环中准备导出需要的信息, 记录本身不会被读入内存"""
+        use_log_id = log_id or self._get_log_id_by_entry(group_id, log_entry)
+        # 旧格式的日志记录保存在 payload 中，导出时与 DB 中的记录按时间合并
+        records_payload = list(log_entry.get(LOG_KEY_RECORDS, []))
         log_name = log_entry.get(LOG_KEY_NAME, "log")
         start_time = log_entry.get(LOG_KEY_CREATED_AT, _now_str())
         safe_name = _sanitize_filename(log_name)
         safe_start = start_time.replace('/', '-').replace(':', '-').replace(' ', '_')
-        display_name_base = f"{safe_name}_{safe_start}"
         logs_dir = os.path.join(self.bot.data_path, "logs")
         os.makedirs(logs_dir, exist_ok=True)
 
+        # 参与者的数量有限, 在这里一次性查好昵称, 导出线程不需要再访问 DataManager
+        participants: List[Dict[str, Any]] = []
+        if get_log_writer:
+            try:
+                participants = get_log_writer().fetch_participants(use_log_id)
+            except Exception as e:
+                dice_log(f"[LogDB] fetch participants error: {e}")
+        participants += [{"user_id": rec.get("user_id"), "nickname": rec.get("nickname")} for rec in records_payload]
         nickname_cache: Dict[str, str] = {}
-        for record in records:
-            uid = record.get('user_id')
-            if uid and uid not in nickname_cache:
-                try:
-                    nick = self.bot.get_nickname(uid, group_id)
-                except Exception:
-                    nick = None
-                if nick and nick not in ("UNDEF_NAME", "----"):
-                    nickname_cache[uid] = nick
-
-        msg_map: Dict[str, Dict[str, str]] = {}
-        for record in records:
-            mid = record.get('message_id')
-            if not mid:
+        user_display: Dict[str, str] = {}
+        for info in participants:
+            uid = info.get("user_id")
+            if not uid or uid in user_display:
                 continue
-            raw_content = record.get('content', '')
-            cleaned = re.sub(r"\[CQ:reply,(?:id|reply|source_id)=\d+[^\]]*\]", "", raw_content)
-            sender_display = nickname_cache.get(record.get('user_id')) or record.get('nickname', '?')
-            msg_map[str(mid)] = {"content": cleaned, "nickname": sender_display}
+            try:
+                nick = self.bot.get_nickname(uid, group_id)
+            except Exception:
+                nick = None
+            if nick and nick not in ("UNDEF_NAME", "----"):
+                nickname_cache[uid] = nick
+            user_display[uid] = nickname_cache.get(uid) or info.get("nickname") or uid
+
+        return LogExportJob(
+            group_id=group_id,
+            log_id=use_log_id,
+            title=f"群 {group_id} 跑团日志 (开始于 {start_time})",
+            file_base=os.path.join(logs_dir, f"{safe_name}_{safe_start}"),
+            legacy_records=records_payload,
+            color_map=dict(log_entry.get(LOG_KEY_COLOR_MAP, {})),
+            nickname_cache=nickname_cache,
+            user_display=user_display,
+            bot_account=self.bot.account,
+            pick_color=_pick_color,
+            mention_names={},
+            forum_code=bool(filters.get(FILTER_FORUM_CODE)),
+        )
 
-        user_display: Dict[str, str] = {}
-        for record in records:
-            uid = record.get('user_id')
-            if uid and uid not in user_display:
-                user_display[uid] = nickname_cache.get(uid) or record.get('nickname') or uid
-
-        def humanize_cq(raw: str) -> str:
-            text = raw
-
-            def repl_reply(match: re.Match) -> str:
-                rid = match.group(1)
-                origin = msg_map.get(rid)
-                if not origin:
-                    return "| 引用消息不在 log 范围内\n"
-                origin_content = origin['content'].strip() or "(空白)"
-                lines = [ln.strip() for ln in origin_content.splitlines() if ln.strip()][:3] or [origin_content]
-                lines = [ln[:60] + ('…' if len(ln) > 60 else '') for ln in lines]
-                quote_lines = [f"| {origin['nickname']}"] + [f"| {ln}" for ln in lines]
-                return "\n".join(quote_lines) + "\n"
-
-            text = re.sub(r"\[CQ:reply,(?:id|reply|source_id)=(\d+)[^\]]*\]", repl_reply, text)
-
-            def repl_at(match: re.Match) -> str:
-                uid = match.group(1)
-                nick = user_display.get(uid)
-                if not nick or nick in ("UNDEF_NAME", "----"):
-                    try:
-                        nick = self.bot.get_nickname(uid, group_id) or uid
-                    except Exception:
-                        nick = uid
-                return f"@{nick}"
-
-            text = re.sub(r"\[CQ:at,qq=(\d+)(?:,[^\]]*)?\]", repl_at, text)
-            return text
-
-        txt_path = os.path.join(logs_dir, display_name_base + ".txt")
-        with open(txt_path, "w", encoding="utf-8") as txt_file:
-            txt_file.write(f"群 {group_id} 跑团日志 (开始于 {start_time})\n\n")
-            for record in records:
-                uid = record.get('user_id', '?')
-                display_name = nickname_cache.get(uid) or record.get('nickname') or ("骰娘" if uid == self.bot.account else uid)
-                color_map.setdefault(uid, _pick_color(color_map, uid))
-                content_out = humanize_cq(record.get('content', ''))
-                txt_file.write(f"{display_name} ({uid})  {record.get('time', '?')}\n")
-                txt_file.write(content_out + "\n\n")
-
-        docx_path = None
+    @staticmethod
+    def _find_mentions(job: LogExportJob) -> List[str]:
+        """在工作线程中找出被@但没有在日志中发言的用户, 需要扫描日志中所有包含@的记录"""
         try:
-            from docx import Document  # type: ignore
-            from docx.shared import RGBColor  # type: ignore
-
-            document = Document()
-            document.add_heading(f"群 {group_id} 跑团日志 (开始于 {start_time})", level=1)
-            for record in records:
-                uid = record.get('user_id', '?')
-                color_hex = color_map.get(uid, "000000")
-                r = int(color_hex[0:2], 16)
-                g = int(color_hex[2:4], 16)
-                b = int(color_hex[4:6], 16)
-                display_name = nickname_cache.get(uid) or record.get('nickname') or ("骰娘" if uid == self.bot.account else uid)
-                body = document.add_paragraph()
-                run_body = body.add_run(f"<{display_name}>{humanize_cq(record.get('content', ''))}")
-                run_body.font.color.rgb = RGBColor(r, g, b)
-            docx_path = os.path.join(logs_dir, display_name_base + ".docx")
-            document.save(docx_path)
-        except Exception as exc:
-            dice_log(f"[LogExport] docx generation failed: {type(exc).__name__}: {exc}")
-            docx_path = None
+            with LogRecordSource(job.log_id, job.legacy_records) as source:
+                return [uid for uid in source.find_mentioned_ids() if uid not in job.user_display]
+        except Exception as e:
+            dice_log(f"[LogDB] fetch mentions error: {e}")
+            return []
 
-        extra_files: List[Tuple[str, str]] = []
-        if filters.get(FILTER_FORUM_CODE):
-            forum_txt_path = os.path.join(logs_dir, display_name_base + "_forum.txt")
+    def _resolve_mentions(self, job: LogExportJob, mentioned_ids: List[str]) -> None:
+        """在事件循环中查询被@用户的昵称, 只涉及_find_mentions找到的少量用户"""
+        for uid in mentioned_ids:
             try:
-                with open(forum_txt_path, "w", encoding="utf-8") as forum_file:
-                    forum_file.write(_generate_forum_code_log(records))
-                extra_files.append((forum_txt_path, os.path.basename(forum_txt_path)))
-            except Exception as exc:
-                dice_log(f"[LogExport] forum code generation failed: {type(exc).__name__}: {exc}")
+                nick = self.bot.get_nickname(uid, job.group_id)
+            except Exception:
+                nick = None
+            if nick and nick not in ("UNDEF_NAME", "----"):
+                job.mention_names[uid] = nick
+
+    async def _export_files_async(self, job: LogExportJob, on_progress: Optional[Callable[[int, int], None]] = None) \
+            -> Tuple[str, str, List[Tuple[str, str]]]:
+        """读取记录与写文件在工作线程中进行, 只有查询被@用户的昵称回到事件循环"""
+        loop = asyncio.get_running_loop()
+        mentioned_ids = await loop.run_in_executor(None, self._find_mentions, job)
+        self._resolve_mentions(job, mentioned_ids)
+        return await loop.run_in_executor(None, self._export_files, job, on_progress)
+
+    @staticmethod
+    def _export_files(job: LogExportJob, on_progress: Optional[Callable[[int, int], None]] = None) -> Tuple[str, str, List[Tuple[str, str]]]:
+        """流式写入导出文件, 可以在工作线程中调用, 返回(主文件路径, 主文件名, 附加文件列表)"""
+        txt_path, docx_path, forum_path = export_log_files(job, on_progress)
+        extra_files: List[Tuple[str, str]] = []
+        if forum_path:
+            extra_files.append((forum_path, os.path.basename(forum_path)))
         if docx_path:
             extra_files.append((txt_path, os.path.basename(txt_path)))
             return docx_path, os.path.basename(docx_path), extra_files
@@ -1586,94 +1845,77 @@ class LogCommand(UserCommandBase):
             "token": token.strip(),
         }
 
-    def _build_upload_payload(self, log_entry: Dict[str, Any], log_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
-        # 尝试从 DB 获取记录
-        # Merge DB and payload records for upload payload as well
-        records_payload = list(log_entry.get(LOG_KEY_RECORDS, []))
-        records_db = []
-        if get_connection and fetch_records:
-            try:
-                conn = get_connection()
-                try:
-                    use_log_id = log_id or self._get_log_id_by_entry(group_id, log_entry)
-                    records_db = fetch_records(conn, use_log_id)
-                finally:
-                    conn.close()
-            except Exception as e:
-                dice_log(f"[LogDB] fetch_records for upload error: {e}")
-                records_db = []
-        if records_db and records_payload:
-            try:
-                combined = records_db + records_payload
-                combined.sort(key=lambda r: str_to_datetime(r.get('time', _now_str())) or _now_str())
-                records = combined
-            except Exception:
-                records = records_db + records_payload
-        elif records_db:
-            records = records_db
-        else:
-            records = records_payload
-        if not records:
+    def _build_upload_payload(self, log_entry: Dict[str, Any], log_id: Optional[str] = None, group_id: str = "") -> Optional[Dict[str, Any]]:
+        """逐条读取记录并流式压缩, 结果与对完整 payload 做 json.dumps + zlib.compress 相同"""
+        use_log_id = log_id or self._get_log_id_by_entry(group_id, log_entry)
+        compressor = zlib.compressobj()
+        chunks = [compressor.compress(('{"version": ' + json.dumps(UPLOAD_VERSION) + ', "items": [').encode("utf-8"))]
+        count = 0
+        with LogRecordSource(use_log_id, list(log_entry.get(LOG_KEY_RECORDS, []))) as source:
+            for record in source:
+                item = json.dumps(self._make_upload_item(record), ensure_ascii=False)
+                chunks.append(compressor.compress(((", " if count else "") + item).encode("utf-8")))
+                count += 1
+        if not count:
             return None
-        items: List[Dict[str, Any]] = []
-        for record in records:
-            raw_uid = record.get("user_id") or record.get("imUserId") or ""
-            if isinstance(raw_uid, int):
-                raw_uid = str(raw_uid)
-            if not raw_uid and record.get("uniformId"):
-                raw_uid = str(record.get("uniformId")).split(":")[-1]
-            user_id = str(raw_uid or "")
-            nickname = record.get("nickname", user_id or "?")
-            try:
-                timestamp = int(str_to_datetime(record.get("time", _now_str())).timestamp())
-            except Exception:
-                timestamp = int(time.time())
-            content = record.get("content", "")
-            is_bot_msg = record.get(LOG_KEY_SOURCE) == "bot"
-            roll_result = _detect_roll_result(content) if is_bot_msg else None
-            is_dice = bool(roll_result)
-            command_info: Optional[Dict[str, Any]] = None
-            if roll_result:
-                command_info = {
-                    "cmd": "roll",
-                    "result": roll_result,
-                }
-            items.append({
-                "nickname": nickname,
-                "imUserId": user_id,
-                "uniformId": f"QQ:{user_id}" if user_id else "",
-                "time": timestamp,
-                "message": content,
-                "isDice": is_dice,
-                "commandId": record.get("message_id") or "",
-                "commandInfo": command_info,
-                "rawMsgId": record.get("message_id") or "",
-            })
-        payload = {
-            "version": UPLOAD_VERSION,
-            "items": items,
-        }
-        json_str = json.dumps(payload, ensure_ascii=False)
-        compressed = zlib.compress(json_str.encode("utf-8"))
+        chunks.append(compressor.compress(b"]}"))
+        chunks.append(compressor.flush())
         return {
-            "file": compressed,
+            "file": b"".join(chunks),
             "name": log_entry.get(LOG_KEY_NAME, "日志"),
         }
 
-    def _try_upload_log(self, group_id: str, log_entry: Dict[str, Any], *, log_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    @staticmethod
+    def _make_upload_item(record: Dict[str, Any]) -> Dict[str, Any]:
+        raw_uid = record.get("user_id") or record.get("imUserId") or ""
+        if isinstance(raw_uid, int):
+            raw_uid = str(raw_uid)
+        if not raw_uid and record.get("uniformId"):
+            raw_uid = str(record.get("uniformId")).split(":")[-1]
+        user_id = str(raw_uid or "")
+        nickname = record.get("nickname", user_id or "?")
+        try:
+            timestamp = int(str_to_datetime(record.get("time", _now_str())).timestamp())
+        except Exception:
+            timestamp = int(time.time())
+        content = record.get("content", "")
+        is_bot_msg = record.get(LOG_KEY_SOURCE) == "bot"
+        roll_result = _detect_roll_result(content) if is_bot_msg else None
+        is_dice = bool(roll_result)
+        command_info: Optional[Dict[str, Any]] = None
+        if roll_result:
+            command_info = {
+                "cmd": "roll",
+                "result": roll_result,
+            }
+        return {
+            "nickname": nickname,
+            "imUserId": user_id,
+            "uniformId": f"QQ:{user_id}" if user_id else "",
+            "time": timestamp,
+            "message": content,
+            "isDice": is_dice,
+            "commandId": record.get("message_id") or "",
+            "commandInfo": command_info,
+            "rawMsgId": record.get("message_id") or "",
+        }
+
+    def _enqueue_upload(self, group_id: str, log_entry: Dict[str, Any], *,
+                        log_id: Optional[str] = None) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """
+        压缩日志并加入上传队列, 返回(上传任务, 无法上传时的提示), 未开启上传时均为None
+        需要读取全部记录, 有事件循环时应在工作线程中调用
+        """
         settings = self._get_upload_settings()
         if not settings.get("enabled"):
-            return None
-        if requests is None:
-            return {"success": False, "message": "requests 模块不可用，已跳过云端上传"}
+            return None, None
+        if not get_log_writer:
+            return None, {"success": False, "message": "日志数据库不可用，已跳过云端上传"}
         # 获取当前日志 ID 以便从 DB 读取
         use_log_id = log_id or self._get_log_id_by_entry(group_id, log_entry)
-        payload_data = self._build_upload_payload(log_entry, log_id=use_log_id)
+        payload_data = self._build_upload_payload(log_entry, log_id=use_log_id, group_id=group_id)
         if not payload_data:
-            return {"success": False, "message": "日志内容为空，已跳过云端上传"}
-        files = {
-            'file': ('log-zlib-compressed', payload_data['file'], 'application/octet-stream')
-        }
+            return None, {"success": False, "message": "日志内容为空，已跳过云端上传"}
         try:
             masters = self.bot.cfg_helper.get_config(CFG_MASTER)
         except Exception:
@@ -1685,34 +1927,70 @@ class LogCommand(UserCommandBase):
                 break
         if not uploader_id:
             uploader_id = str(self.bot.account)
-        form = {
-            'name': payload_data['name'],
-            'uniform_id': f"QQ:{uploader_id}",
-            'client': 'DicePP',
-            'version': str(UPLOAD_VERSION),
-        }
-        headers = {}
-        if settings.get("token"):
-            headers['Authorization'] = f"Bearer {settings['token']}"
         try:
-            response = requests.put(settings['endpoint'], data=form, files=files, headers=headers, timeout=15)
+            upload = self.upload_queue.enqueue(log_id=use_log_id, group_id=group_id, name=payload_data['name'],
+                                               endpoint=settings['endpoint'], token=settings.get("token"),
+                                               uploader_id=uploader_id, file=payload_data['file'])
         except Exception as exc:
-            return {"success": False, "message": f"云端上传失败：{exc}"}
+            dice_log(f"[LogDB] enqueue upload error: {exc}")
+            return None, {"success": False, "message": f"云端上传失败：{exc}"}
+        return upload, None
+
+    async def shutdown_async(self) -> None:
+        # 重启时关闭上传队列的HTTP客户端, 未完成的上传会在下次启动后继续
+        await self.upload_queue.close()
+
+    def tick(self) -> List[BotCommandBase]:
+        # 定期检查上传队列, 有到期的任务时交给事件循环处理
+        now = time.time()
+        if now < self.upload_poll_at or not self.bot.is_scheduler_running() or not get_log_writer:
+            return []
+        self.upload_poll_at = now + LOG_UPLOAD_POLL_INTERVAL
+        if self.upload_queue.draining:
+            return []
         try:
-            resp_json = response.json()
-        except Exception:
-            resp_json = {}
-        if response.ok and isinstance(resp_json, dict) and resp_json.get('url'):
-            return {
-                "success": True,
-                "message": "云端上传成功",
-                "url": resp_json['url'],
-            }
-        msg = resp_json.get('message') if isinstance(resp_json, dict) else response.text
-        return {
-            "success": False,
-            "message": f"云端上传失败：HTTP {response.status_code} {msg or response.reason}",
-        }
+            has_due = self.upload_queue.has_due(now)
+        except Exception as e:
+            dice_log(f"[LogDB] fetch uploads error: {e}")
+            return []
+        if has_due:
+            self.bot.register_task(self._drain_upload_queue, timeout=LOG_UPLOAD_TIMEOUT * (LOG_UPLOAD_BATCH + 1))
+        return []
+
+    async def _drain_upload_queue(self) -> List[BotCommandBase]:
+        """发送到期的上传任务, 成功或放弃时写回上传信息并通知对应的群"""
+        commands: List[BotCommandBase] = []
+        for upload, result in await self.upload_queue.process_due():
+            if result["status"] not in (UPLOAD_DONE, UPLOAD_FAILED):
+                continue
+            group_id, log_id = upload["group_id"], upload["log_id"]
+            payload = _load_group_payload(self.bot, group_id)
+            entry = payload.get(LOG_GROUP_LOGS, {}).get(log_id)
+            if entry is None:  # 日志已被删除
+                continue
+            upload_info = dict(entry.get(LOG_KEY_UPLOAD) or {})
+            upload_info[LOG_KEY_UPLOAD_NOTE] = result["message"]
+            if result.get("url"):
+                upload_info["url"] = result["url"]
+            entry[LOG_KEY_UPLOAD] = upload_info
+            payload[LOG_GROUP_LOGS][log_id] = entry
+            _save_group_payload(self.bot, group_id, payload)
+            try:
+                get_log_writer().update_log_upload(log_id, {
+                    "time": upload_info.get(LOG_KEY_UPLOAD_TIME),
+                    "file": upload_info.get(LOG_KEY_UPLOAD_FILE),
+                    "note": upload_info.get(LOG_KEY_UPLOAD_NOTE),
+                    "url": upload_info.get("url"),
+                })
+            except Exception as e:
+                dice_log(f"[LogDB] update upload error: {e}")
+            name = entry.get(LOG_KEY_NAME, upload["name"])
+            if result["status"] == UPLOAD_DONE:
+                feedback = self.messages.upload_done.format(name=name, url=result["url"])
+            else:
+                feedback = self.messages.upload_failed.format(name=name, message=result["message"])
+            commands.append(BotSendMsgCommand(self.bot.account, feedback, [GroupMessagePort(group_id)]))
+        return commands
 
     def get_help(self, keyword: str, meta: MessageMetaData) -> str:
         if keyword in ("log", "日志"):
@@ -1739,17 +2017,21 @@ class LogCommand(UserCommandBase):
 # 提供给适配器：按消息撤回删除对应 DB 记录
 def delete_log_record_by_message_id(bot: Bot, group_id: str, message_id: str) -> None:
     try:
-        payload = _load_group_payload(bot, group_id)
+        payload = _peek_group_payload(bot, group_id)
+        if payload is None:
+            payload = _load_group_payload(bot, group_id)
         current_id = payload.get(LOG_GROUP_CURRENT, "")
-        if not current_id:
+        entry = payload.get(LOG_GROUP_LOGS, {}).get(current_id)
+        if not current_id or entry is None:
             return
-        if get_connection and delete_records_by_message_id:
-            conn = get_connection()
-            try:
-                delete_records_by_message_id(conn, current_id, str(message_id))
-                conn.commit()
-            finally:
-                conn.close()
+        message_id = str(message_id)
+        ring = _get_recall_ring(bot, group_id, current_id, entry)
+        if not ring.may_contain(message_id):  # 没有被记录的消息, 不需要访问数据库
+            return
+        ring.discard(message_id)
+        if get_log_writer:
+            # 写入器会移除尚在缓冲中的记录, 已写入的记录与下一批记录一起删除
+            get_log_writer().delete_records_by_message_id(current_id, message_id)
     except Exception as e:
         try:
             dice_log(f"[LogDB] delete by message_id error: {e}")
@@ -1767,13 +2049,9 @@ class LogRecorderCommand(UserCommandBase):
     def can_process_msg(self, msg_str: str, meta: MessageMetaData) -> Tuple[bool, bool, Any]:
         if not meta.group_id:
             return False, False, None
-        payload = _load_group_payload(self.bot, meta.group_id)
-        current_id = payload.get(LOG_GROUP_CURRENT, "")
+        current_id = _get_recording_log_id(self.bot, meta.group_id)
         if not current_id:
             return False, False, None
-        entry = payload.get(LOG_GROUP_LOGS, {}).get(current_id)
-        if not entry or not entry.get(LOG_KEY_RECORDING):
-            return False, False, None
         return True, True, current_id
 
     def process_msg(self, msg_str: str, meta: MessageMetaData, hint: Any) -> List[BotCommandBase]:
@@ -1799,7 +2077,8 @@ class LogRecorderCommand(UserCommandBase):
 
 
 @custom_user_command(readable_name="日志统计指令", priority=DPP_COMMAND_PRIORITY_DEFAULT,
-                     flag=DPP_COMMAND_FLAG_INFO, cluster=DPP_COMMAND_CLUSTER_DEFAULT, group_only=True)
+                     flag=DPP_COMMAND_FLAG_INFO, cluster=DPP_COMMAND_CLUSTER_DEFAULT, group_only=True,
+                     prefixes=(".stat",))
 class LogStatCommand(UserCommandBase):
     def __init__(self, bot: Bot):
         super().__init__(bot)
@@ -1820,19 +2099,12 @@ class LogStatCommand(UserCommandBase):
         payload = _load_group_payload(self.bot, meta.group_id)
         logs = payload.get(LOG_GROUP_LOGS, {})
         name = hint if isinstance(hint, str) else ""
-        entry: Optional[Dict[str, Any]] = None
-        if name:
-            log_id = _find_log_id_by_name(payload, name)
-            if log_id:
-                entry = logs.get(log_id)
-        else:
-            current_id = payload.get(LOG_GROUP_CURRENT, "")
-            if current_id:
-                entry = logs.get(current_id)
+        log_id = _find_log_id_by_name(payload, name) if name else payload.get(LOG_GROUP_CURRENT, "")
+        entry = logs.get(log_id) if log_id else None
         if not entry:
             feedback = "未找到对应日志，或当前没有正在使用的日志。"
         else:
-            feedback = _StatsFormatter.format(entry)
+            feedback = _StatsFormatter.format(entry, _fetch_log_stats(log_id))
         return [BotSendMsgCommand(self.bot.account, feedback, [GroupMessagePort(meta.group_id)])]
 
     def get_help(self, keyword: str, meta: MessageMetaData) -> str:
@@ -1,12 +1,25 @@
+import atexit
 import os
 import sqlite3
-from typing import Any, Dict, Iterable, List, Optional
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 from core.config import DATA_PATH
 from utils.logger import dice_log
 
 LOG_DIR = os.path.join(DATA_PATH, "log")
 LOG_DB_PATH = os.path.join(LOG_DIR, "log.db")
+LOG_ARCHIVE_DIR = os.path.join(LOG_DIR, "archive")
+
+LOG_FLUSH_SIZE = 200  # 缓冲的记录达到该数量时立即写入
+LOG_FLUSH_INTERVAL = 2.0  # 缓冲中最早的记录最多等待的秒数
+LOG_VACUUM_PAGES = 1000  # 每次增量回收的最大页数
+
+LOG_COLUMNS = (
+    "id", "group_id", "name", "created_at", "updated_at", "recording", "record_begin_at", "last_warn",
+    "filter_outside", "filter_command", "filter_bot", "filter_media", "filter_forum_code",
+    "upload_time", "upload_file", "upload_note", "url",
+)
 
 
 def _ensure_dir() -> None:
@@ -18,21 +31,19 @@ def _ensure_dir() -> None:
 def get_connection() -> sqlite3.Connection:
     """Get a sqlite3 connection and ensure schema exists.
     Callers are responsible to close the connection.
+    Record writes should go through get_log_writer() which keeps one connection open.
     """
     _ensure_dir()
-    init_needed = not os.path.exists(LOG_DB_PATH)
     conn = sqlite3.connect(LOG_DB_PATH)
     conn.row_factory = sqlite3.Row
     try:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")  # 只对新建的数据库生效
         conn.execute("PRAGMA journal_mode=WAL;")
         conn.execute("PRAGMA synchronous=NORMAL;")
         conn.execute("PRAGMA foreign_keys=ON;")
     except Exception:
         pass
-    if init_needed:
-        _init_schema(conn)
-    else:
-        _init_schema(conn)  # idempotent
+    _init_schema(conn)  # idempotent
     return conn
 
 
@@ -81,16 +92,84 @@ def _init_schema(conn: sqlite3.Connection) -> None:
         """
     )
     cur.execute("CREATE INDEX IF NOT EXISTS idx_records_log ON records(log_id);")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_records_msg ON records(message_id);")
+    # 撤回时按(log_id, message_id)删除, 旧的单列索引不再需要
+    cur.execute("DROP INDEX IF EXISTS idx_records_msg;")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_records_log_msg ON records(log_id, message_id);")
+
+    # 云端上传队列：进程重启后仍会继续重试
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS uploads (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            log_id TEXT NOT NULL,
+            group_id TEXT NOT NULL,
+            account TEXT NOT NULL, -- 负责上传并通知结果的骰娘账号
+            name TEXT NOT NULL,
+            endpoint TEXT NOT NULL,
+            token TEXT,
+            uploader_id TEXT NOT NULL,
+            file BLOB NOT NULL, -- zlib 压缩后的上传内容
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            created_at TEXT NOT NULL,
+            last_error TEXT
+        );
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_uploads_due ON uploads(account, next_attempt_at);")
+
+    # 统计表：与记录在同一个事务中累加, 查询统计时不需要再扫描记录
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS log_stats (
+            log_id TEXT PRIMARY KEY,
+            messages INTEGER NOT NULL DEFAULT 0,
+            success INTEGER NOT NULL DEFAULT 0,
+            failure INTEGER NOT NULL DEFAULT 0,
+            critical_success INTEGER NOT NULL DEFAULT 0,
+            critical_failure INTEGER NOT NULL DEFAULT 0
+        );
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS log_participants (
+            log_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            nickname TEXT, -- 最近一次有效的昵称
+            PRIMARY KEY(log_id, user_id)
+        );
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS log_attributes (
+            log_id TEXT NOT NULL,
+            attr TEXT NOT NULL,
+            delta INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY(log_id, attr)
+        );
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS log_dice (
+            log_id TEXT NOT NULL,
+            face INTEGER NOT NULL,
+            roller TEXT NOT NULL, -- 掷骰结果中的掷骰者名称, 查询时再与参与者对应
+            sum REAL NOT NULL DEFAULT 0, -- 归一化到[0, 1]后的点数之和
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY(log_id, face, roller)
+        );
+        """
+    )
     conn.commit()
 
 
 def insert_record(conn: sqlite3.Connection, log_id: str, *, time: str, user_id: str,
                   nickname: str, content: str, source: str, message_id: Optional[str]) -> None:
-    conn.execute(
-        "INSERT INTO records(log_id, time, user_id, nickname, content, source, message_id) VALUES (?,?,?,?,?,?,?)",
-        (log_id, time, user_id, nickname, content, source, message_id),
-    )
+    conn.execute(INSERT_RECORD_SQL, (log_id, time, user_id, nickname, content, source, message_id))
 
 
 def fetch_records(conn: sqlite3.Connection, log_id: str) -> List[Dict[str, Any]]:
@@ -101,58 +180,287 @@ def fetch_records(conn: sqlite3.Connection, log_id: str) -> List[Dict[str, Any]]
     return [dict(row) for row in cur.fetchall()]
 
 
-def delete_records_by_message_id(conn: sqlite3.Connection, log_id: str, message_id: str) -> int:
+def iter_records(conn: sqlite3.Connection, log_id: str, chunk_size: int = 500) -> Iterable[Dict[str, Any]]:
+    """按写入顺序逐批读取记录, 内存中最多同时保留chunk_size行"""
     cur = conn.execute(
-        "DELETE FROM records WHERE log_id=? AND message_id=?",
+        "SELECT time, user_id, nickname, content, source, message_id FROM records WHERE log_id=? ORDER BY id ASC",
+        (log_id,),
+    )
+    try:
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(row)
+    finally:
+        cur.close()
+
+
+def count_records(conn: sqlite3.Connection, log_id: str) -> int:
+    return conn.execute("SELECT COUNT(*) FROM records WHERE log_id=?", (log_id,)).fetchone()[0]
+
+
+def fetch_participants(conn: sqlite3.Connection, log_id: str) -> List[Dict[str, Any]]:
+    """返回日志中出现过的用户及其第一条记录使用的昵称, 按第一次出现的顺序排列"""
+    cur = conn.execute(
+        "SELECT user_id, nickname, MIN(id) AS first_id FROM records WHERE log_id=? GROUP BY user_id ORDER BY first_id",
+        (log_id,),
+    )
+    return [{"user_id": row["user_id"], "nickname": row["nickname"]} for row in cur.fetchall()]
+
+
+def iter_contents_containing(conn: sqlite3.Connection, log_id: str, needle: str) -> Iterable[str]:
+    """按写入顺序返回日志中包含needle的记录内容"""
+    cur = conn.execute("SELECT content FROM records WHERE log_id=? AND instr(content, ?) > 0 ORDER BY id ASC", (log_id, needle))
+    for row in cur:
+        yield row[0]
+
+
+def fetch_record_by_message_id(conn: sqlite3.Connection, log_id: str, message_id: str) -> Optional[Dict[str, Any]]:
+    cur = conn.execute(
+        "SELECT time, user_id, nickname, content, source, message_id FROM records "
+        "WHERE log_id=? AND message_id=? ORDER BY id DESC LIMIT 1",
         (log_id, message_id),
     )
+    row = cur.fetchone()
+    return dict(row) if row else None
+
+
+def enqueue_upload(conn: sqlite3.Connection, upload: Dict[str, Any]) -> int:
+    cur = conn.execute(
+        "INSERT INTO uploads(log_id, group_id, account, name, endpoint, token, uploader_id, file, next_attempt_at, created_at)"
+        " VALUES (?,?,?,?,?,?,?,?,?,?)",
+        (upload["log_id"], upload["group_id"], upload["account"], upload["name"], upload["endpoint"], upload.get("token"),
+         upload["uploader_id"], upload["file"], upload["next_attempt_at"], upload["created_at"]),
+    )
+    return cur.lastrowid
+
+
+def fetch_due_uploads(conn: sqlite3.Connection, account: str, now: float, limit: int = 10) -> List[Dict[str, Any]]:
+    cur = conn.execute(
+        "SELECT * FROM uploads WHERE account=? AND next_attempt_at<=? ORDER BY next_attempt_at ASC LIMIT ?",
+        (account, now, limit),
+    )
+    return [dict(row) for row in cur.fetchall()]
+
+
+def fetch_due_upload_ids(conn: sqlite3.Connection, account: str, now: float, limit: int) -> List[int]:
+    """只查询到期任务的ID, 不会读取日志文件, 用于定期检查队列"""
+    cur = conn.execute(
+        "SELECT id FROM uploads WHERE account=? AND next_attempt_at<=? ORDER BY next_attempt_at ASC LIMIT ?",
+        (account, now, limit),
+    )
+    return [row[0] for row in cur.fetchall()]
+
+
+def get_pending_upload(conn: sqlite3.Connection, log_id: str) -> Optional[Dict[str, Any]]:
+    cur = conn.execute("SELECT id, attempts, next_attempt_at, last_error FROM uploads WHERE log_id=? LIMIT 1", (log_id,))
+    row = cur.fetchone()
+    return dict(row) if row else None
+
+
+def reschedule_upload(conn: sqlite3.Connection, upload_id: int, attempts: int, next_attempt_at: float, error: str) -> None:
+    conn.execute("UPDATE uploads SET attempts=?, next_attempt_at=?, last_error=? WHERE id=?",
+                 (attempts, next_attempt_at, error, upload_id))
+
+
+def delete_upload(conn: sqlite3.Connection, upload_id: int) -> None:
+    conn.execute("DELETE FROM uploads WHERE id=?", (upload_id,))
+
+
+def open_reader(db_path: str = LOG_DB_PATH) -> sqlite3.Connection:
+    """打开一个只读连接, 供导出等耗时的读取在其他线程中使用, 不会阻塞LogWriter的写入"""
+    conn = sqlite3.connect("file:" + os.path.abspath(db_path) + "?mode=ro", uri=True, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+DELETE_RECORD_BY_MSG_SQL = "DELETE FROM records WHERE log_id=? AND message_id=?"
+
+
+def delete_records_by_message_id(conn: sqlite3.Connection, log_id: str, message_id: str) -> int:
+    cur = conn.execute(DELETE_RECORD_BY_MSG_SQL, (log_id, message_id))
     return cur.rowcount or 0
 
 
+def fetch_recent_message_ids(conn: sqlite3.Connection, log_id: str, limit: int) -> List[str]:
+    """按从新到旧的顺序返回日志中最近limit条带有消息ID的记录的消息ID"""
+    cur = conn.execute(
+        "SELECT message_id FROM records WHERE log_id=? AND message_id IS NOT NULL ORDER BY id DESC LIMIT ?",
+        (log_id, limit),
+    )
+    return [row[0] for row in cur.fetchall()]
+
+
 def delete_records_for_log(conn: sqlite3.Connection, log_id: str) -> None:
     conn.execute("DELETE FROM records WHERE log_id=?", (log_id,))
 
 
+def delete_records_batch(conn: sqlite3.Connection, log_id: str, limit: int) -> int:
+    cur = conn.execute("DELETE FROM records WHERE id IN (SELECT id FROM records WHERE log_id=? LIMIT ?)", (log_id, limit))
+    return cur.rowcount or 0
+
+
+def get_db_size(conn: sqlite3.Connection) -> int:
+    """数据库文件占用的字节数, 包括空闲页"""
+    return conn.execute("PRAGMA page_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0]
+
+
+def incremental_vacuum(conn: sqlite3.Connection, max_pages: int) -> int:
+    """回收最多max_pages个空闲页, 返回剩余的空闲页数, 数据库未开启增量回收时什么也不做"""
+    # execute只会执行一步(回收一页), executescript才会执行到结束
+    conn.executescript(f"PRAGMA incremental_vacuum({int(max_pages)});")
+    return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def enable_incremental_vacuum(db_path: str = LOG_DB_PATH) -> bool:
+    """
+    旧版本创建的数据库没有开启增量回收, 需要完整VACUUM一次才能切换, 返回是否进行了切换
+    使用单独的连接, VACUUM期间LogWriter的批量写入会失败并留待下次写入, 不会阻塞调用LogWriter的线程
+    """
+    conn = sqlite3.connect(db_path, timeout=60)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        return True
+    finally:
+        conn.close()
+
+
 def delete_log(conn: sqlite3.Connection, log_id: str) -> None:
     conn.execute("DELETE FROM logs WHERE id=?", (log_id,))
+    conn.execute("DELETE FROM uploads WHERE log_id=?", (log_id,))
+    delete_log_stats(conn, log_id)
+
+
+ROLL_RESULT_KEYS = ("success", "failure", "critical_success", "critical_failure")
+
+UPSERT_STATS_SQL = f"""
+    INSERT INTO log_stats(log_id, messages, {", ".join(ROLL_RESULT_KEYS)}) VALUES (?,?,?,?,?,?)
+    ON CONFLICT(log_id) DO UPDATE SET messages=messages+excluded.messages,
+    {", ".join(f"{key}={key}+excluded.{key}" for key in ROLL_RESULT_KEYS)};
+"""
+UPSERT_PARTICIPANT_SQL = """
+    INSERT INTO log_participants(log_id, user_id, count, nickname) VALUES (?,?,?,?)
+    ON CONFLICT(log_id, user_id) DO UPDATE SET count=count+excluded.count, nickname=COALESCE(excluded.nickname, nickname);
+"""
+UPSERT_ATTRIBUTE_SQL = """
+    INSERT INTO log_attributes(log_id, attr, delta) VALUES (?,?,?)
+    ON CONFLICT(log_id, attr) DO UPDATE SET delta=delta+excluded.delta;
+"""
+UPSERT_DICE_SQL = """
+    INSERT INTO log_dice(log_id, face, roller, sum, count) VALUES (?,?,?,?,?)
+    ON CONFLICT(log_id, face, roller) DO UPDATE SET sum=sum+excluded.sum, count=count+excluded.count;
+"""
+
+
+def merge_log_stats(target: Dict[str, Any], delta: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    将统计增量合并到target中并返回target, 单条记录的增量与累计的统计使用相同的结构:
+    {"messages": int, "rolls": {结果: 次数}, "participants": {user_id: [消息数, 昵称或None]},
+     "attributes": {属性: 变化量}, "dice": {(骰面, 掷骰者): [归一化点数之和, 次数]}}
+    """
+    target["messages"] = target.get("messages", 0) + delta.get("messages", 0)
+    for key in ("rolls", "attributes"):
+        if delta.get(key):
+            merged = target.setdefault(key, {})
+            for item, value in delta[key].items():
+                merged[item] = merged.get(item, 0) + value
+    if delta.get("participants"):
+        participants = target.setdefault("participants", {})
+        for user_id, (count, nickname) in delta["participants"].items():
+            info = participants.get(user_id)
+            if info is None:
+                participants[user_id] = [count, nickname]
+            else:
+                info[0] += count
+                info[1] = nickname or info[1]
+    if delta.get("dice"):
+        dice = target.setdefault("dice", {})
+        for key, (total, count) in delta["dice"].items():
+            info = dice.get(key)
+            if info is None:
+                dice[key] = [total, count]
+            else:
+                info[0] += total
+                info[1] += count
+    return target
+
+
+def write_log_stats(conn: sqlite3.Connection, stats: Dict[str, Dict[str, Any]]) -> None:
+    """将每个日志累计的统计增量加到统计表中, 需要在调用方的事务中执行"""
+    conn.executemany(UPSERT_STATS_SQL, [
+        (log_id, agg.get("messages", 0), *(agg.get("rolls", {}).get(key, 0) for key in ROLL_RESULT_KEYS))
+        for log_id, agg in stats.items()
+    ])
+    conn.executemany(UPSERT_PARTICIPANT_SQL, [
+        (log_id, user_id, count, nickname)
+        for log_id, agg in stats.items() for user_id, (count, nickname) in agg.get("participants", {}).items()
+    ])
+    conn.executemany(UPSERT_ATTRIBUTE_SQL, [
+        (log_id, attr, delta) for log_id, agg in stats.items() for attr, delta in agg.get("attributes", {}).items()
+    ])
+    conn.executemany(UPSERT_DICE_SQL, [
+        (log_id, face, roller, total, count)
+        for log_id, agg in stats.items() for (face, roller), (total, count) in agg.get("dice", {}).items()
+    ])
+
+
+def fetch_log_stats(conn: sqlite3.Connection, log_id: str) -> Dict[str, Any]:
+    """读取日志的统计, 结构与merge_log_stats相同, 参与者与属性按第一次出现的顺序排列"""
+    stats: Dict[str, Any] = {"messages": 0, "rolls": {}, "participants": {}, "attributes": {}, "dice": {}}
+    row = conn.execute(f"SELECT messages, {', '.join(ROLL_RESULT_KEYS)} FROM log_stats WHERE log_id=?", (log_id,)).fetchone()
+    if row:
+        stats["messages"] = row["messages"]
+        stats["rolls"] = {key: row[key] for key in ROLL_RESULT_KEYS}
+    for row in conn.execute("SELECT user_id, count, nickname FROM log_participants WHERE log_id=? ORDER BY rowid", (log_id,)):
+        stats["participants"][row["user_id"]] = [row["count"], row["nickname"]]
+    for row in conn.execute("SELECT attr, delta FROM log_attributes WHERE log_id=? ORDER BY rowid", (log_id,)):
+        stats["attributes"][row["attr"]] = row["delta"]
+    for row in conn.execute("SELECT face, roller, sum, count FROM log_dice WHERE log_id=? ORDER BY rowid", (log_id,)):
+        stats["dice"][(row["face"], row["roller"])] = [row["sum"], row["count"]]
+    return stats
+
+
+def fetch_message_counts(conn: sqlite3.Connection, log_ids: List[str]) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for start in range(0, len(log_ids), 500):
+        chunk = log_ids[start:start + 500]
+        cur = conn.execute(f"SELECT log_id, messages FROM log_stats WHERE log_id IN ({','.join('?' * len(chunk))})", chunk)
+        counts.update((row["log_id"], row["messages"]) for row in cur.fetchall())
+    return counts
+
+
+def delete_log_stats(conn: sqlite3.Connection, log_id: str) -> None:
+    for table in ("log_stats", "log_participants", "log_attributes", "log_dice"):
+        conn.execute(f"DELETE FROM {table} WHERE log_id=?", (log_id,))
+
+
+UPSERT_LOG_SQL = f"""
+    INSERT INTO logs ({", ".join(LOG_COLUMNS)}) VALUES ({",".join("?" * len(LOG_COLUMNS))})
+    ON CONFLICT(id) DO UPDATE SET {", ".join(f"{col}=excluded.{col}" for col in LOG_COLUMNS[1:])};
+"""
+
+INSERT_RECORD_SQL = \
+    "INSERT INTO records(log_id, time, user_id, nickname, content, source, message_id) VALUES (?,?,?,?,?,?,?)"
+
+
+def _log_row(payload: Dict[str, Any]) -> Tuple:
+    return (
+        payload.get("id"), payload.get("group_id"), payload.get("name"), payload.get("created_at"),
+        payload.get("updated_at"), int(bool(payload.get("recording", 0))), payload.get("record_begin_at"),
+        payload.get("last_warn"), int(bool(payload.get("filter_outside", 0))), int(bool(payload.get("filter_command", 0))),
+        int(bool(payload.get("filter_bot", 0))), int(bool(payload.get("filter_media", 0))), int(bool(payload.get("filter_forum_code", 0))),
+        payload.get("upload_time"), payload.get("upload_file"), payload.get("upload_note"), payload.get("url"),
+    )
 
 
 def upsert_log(conn: sqlite3.Connection, payload: Dict[str, Any]) -> None:
     # Upsert by primary key id
-    conn.execute(
-        """
-        INSERT INTO logs (
-            id, group_id, name, created_at, updated_at, recording, record_begin_at, last_warn,
-            filter_outside, filter_command, filter_bot, filter_media, filter_forum_code,
-            upload_time, upload_file, upload_note, url
-        ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-        ON CONFLICT(id) DO UPDATE SET
-            group_id=excluded.group_id,
-            name=excluded.name,
-            created_at=excluded.created_at,
-            updated_at=excluded.updated_at,
-            recording=excluded.recording,
-            record_begin_at=excluded.record_begin_at,
-            last_warn=excluded.last_warn,
-            filter_outside=excluded.filter_outside,
-            filter_command=excluded.filter_command,
-            filter_bot=excluded.filter_bot,
-            filter_media=excluded.filter_media,
-            filter_forum_code=excluded.filter_forum_code,
-            upload_time=excluded.upload_time,
-            upload_file=excluded.upload_file,
-            upload_note=excluded.upload_note,
-            url=excluded.url
-        ;
-        """,
-        (
-            payload.get("id"), payload.get("group_id"), payload.get("name"), payload.get("created_at"),
-            payload.get("updated_at"), int(bool(payload.get("recording", 0))), payload.get("record_begin_at"),
-            payload.get("last_warn"), int(bool(payload.get("filter_outside", 0))), int(bool(payload.get("filter_command", 0))),
-            int(bool(payload.get("filter_bot", 0))), int(bool(payload.get("filter_media", 0))), int(bool(payload.get("filter_forum_code", 0))),
-            payload.get("upload_time"), payload.get("upload_file"), payload.get("upload_note"), payload.get("url"),
-        ),
-    )
+    conn.execute(UPSERT_LOG_SQL, _log_row(payload))
 
 
 def get_logs_by_group(conn: sqlite3.Connection, group_id: str) -> List[Dict[str, Any]]:
@@ -182,3 +490,300 @@ def update_log_upload(conn: sqlite3.Connection, log_id: str, upload: Dict[str, A
         (upload.get("time"), upload.get("file"), upload.get("note"), upload.get("url"), log_id),
     )
 
+
+
+class LogWriter:
+    """
+    进程内共用的日志写入器
+    持有一个长期打开的连接(只在打开时初始化一次表结构), 新记录先放入内存缓冲,
+    缓冲达到LOG_FLUSH_SIZE条或最早的记录等待超过LOG_FLUSH_INTERVAL秒时, 由后台线程在一个事务中用executemany批量写入
+    日志元数据只在内容变化时写入, 同一批次内的多次修改合并为一次upsert
+    每条记录的统计增量在内存中按日志合并, 与记录在同一个事务中累加到统计表
+    撤回消息时先移除缓冲中的记录, 已写入的记录排队后与下一批记录一起删除
+    所有读取与删除操作都会先考虑缓冲中的数据, 调用方看到的结果与逐条写入时一致
+    lock只保护内存缓冲, 数据库读写在write_lock下进行, 两把锁同时持有时总是先获取write_lock
+    批量写入时只在交换缓冲的瞬间持有lock, 事件循环中追加记录不会被数据库读写阻塞
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.lock = threading.RLock()  # 保护内存缓冲
+        self.write_lock = threading.RLock()  # 保护数据库连接
+        self.conn: Optional[sqlite3.Connection] = None
+        self.pending_records: List[Tuple] = []  # (log_id, time, user_id, nickname, content, source, message_id)
+        self.pending_logs: Dict[str, Tuple] = {}  # log_id -> 待写入的元数据行
+        self.written_logs: Dict[str, Tuple] = {}  # log_id -> 数据库中的元数据行
+        self.pending_stats: Dict[str, Dict[str, Any]] = {}  # log_id -> 待累加的统计增量
+        self.pending_deletes: List[Tuple[str, str]] = []  # 待删除记录的(log_id, message_id)
+        self.timer: Optional[threading.Timer] = None
+
+    def connection(self) -> sqlite3.Connection:
+        """返回长期连接, 第一次调用或关闭后调用时打开并初始化表结构"""
+        with self.write_lock:
+            if self.conn is None:
+                _ensure_dir()
+                conn = sqlite3.connect(self.db_path, check_same_thread=False)
+                conn.row_factory = sqlite3.Row
+                try:
+                    conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")  # 只对新建的数据库生效
+                    conn.execute("PRAGMA journal_mode=WAL;")
+                    conn.execute("PRAGMA synchronous=NORMAL;")
+                    conn.execute("PRAGMA foreign_keys=ON;")
+                except Exception:
+                    pass
+                _init_schema(conn)
+                self.conn = conn
+            return self.conn
+
+    def upsert_log(self, payload: Dict[str, Any]) -> bool:
+        """登记日志元数据, 与已写入或待写入的内容相同时什么也不做, 返回是否有变化"""
+        row = _log_row(payload)
+        log_id = row[0]
+        with self.lock:
+            if self.pending_logs.get(log_id, self.written_logs.get(log_id)) == row:
+                return False
+            self.pending_logs[log_id] = row
+            self._schedule()
+        return True
+
+    def update_log_upload(self, log_id: str, upload: Dict[str, Any]) -> None:
+        with self.write_lock:
+            self.flush()
+            conn = self.connection()
+            with conn:
+                update_log_upload(conn, log_id, upload)
+            with self.lock:
+                self.written_logs.pop(log_id, None)
+
+    def append_record(self, log_id: str, *, time: str, user_id: str, nickname: str, content: str,
+                      source: str, message_id: Optional[str], stats: Optional[Dict[str, Any]] = None) -> None:
+        """stats为这条记录的统计增量, 结构见merge_log_stats"""
+        with self.lock:
+            self.pending_records.append((log_id, time, user_id, nickname, content, source, message_id))
+            if stats:
+                merge_log_stats(self.pending_stats.setdefault(log_id, {}), stats)
+            self._schedule(immediate=len(self.pending_records) >= LOG_FLUSH_SIZE)
+
+    def fetch_records(self, log_id: str) -> List[Dict[str, Any]]:
+        with self.write_lock:
+            self.flush()
+            return fetch_records(self.connection(), log_id)
+
+    def fetch_participants(self, log_id: str) -> List[Dict[str, Any]]:
+        with self.write_lock:
+            self.flush()
+            return fetch_participants(self.connection(), log_id)
+
+    def fetch_stats(self, log_id: str) -> Dict[str, Any]:
+        with self.write_lock:
+            self.flush()
+            return fetch_log_stats(self.connection(), log_id)
+
+    def fetch_message_counts(self, log_ids: List[str]) -> Dict[str, int]:
+        with self.write_lock:
+            self.flush()
+            return fetch_message_counts(self.connection(), log_ids)
+
+    def replace_stats(self, log_id: str, stats: Dict[str, Any]) -> None:
+        """用完整的统计覆盖日志现有的统计, 用于迁移旧版本保存在payload中的统计"""
+        with self.write_lock:
+            self.flush()
+            conn = self.connection()
+            with conn:
+                delete_log_stats(conn, log_id)
+                write_log_stats(conn, {log_id: stats})
+
+    def enqueue_upload(self, upload: Dict[str, Any]) -> int:
+        with self.write_lock:
+            conn = self.connection()
+            with conn:
+                return enqueue_upload(conn, upload)
+
+    def fetch_due_uploads(self, account: str, now: float, limit: int = 10) -> List[Dict[str, Any]]:
+        with self.write_lock:
+            return fetch_due_uploads(self.connection(), account, now, limit)
+
+    def get_pending_upload(self, log_id: str) -> Optional[Dict[str, Any]]:
+        with self.write_lock:
+            return get_pending_upload(self.connection(), log_id)
+
+    def reschedule_upload(self, upload_id: int, attempts: int, next_attempt_at: float, error: str) -> None:
+        with self.write_lock:
+            conn = self.connection()
+            with conn:
+                reschedule_upload(conn, upload_id, attempts, next_attempt_at, error)
+
+    def delete_upload(self, upload_id: int) -> None:
+        with self.write_lock:
+            conn = self.connection()
+            with conn:
+                delete_upload(conn, upload_id)
+
+    def fetch_recent_message_ids(self, log_id: str, limit: int) -> List[str]:
+        with self.write_lock:
+            self.flush()
+            return fetch_recent_message_ids(self.connection(), log_id, limit)
+
+    def delete_records_by_message_id(self, log_id: str, message_id: str) -> None:
+        """删除某条消息对应的记录, 尚在缓冲中的记录直接移除, 已写入的记录在下次批量写入时删除"""
+        with self.lock:
+            self.pending_records = [rec for rec in self.pending_records if rec[0] != log_id or rec[6] != message_id]
+            self.pending_deletes.append((log_id, message_id))
+            self._schedule(immediate=len(self.pending_deletes) >= LOG_FLUSH_SIZE)
+
+    def delete_records_batch(self, log_id: str, limit: int) -> int:
+        """删除日志中最多limit条记录, 返回删除的条数, 用于分批删除大日志, 每批只短暂持有锁"""
+        with self.write_lock:
+            self.flush()
+            conn = self.connection()
+            with conn:
+                return delete_records_batch(conn, log_id, limit)
+
+    def db_size(self) -> int:
+        with self.write_lock:
+            return get_db_size(self.connection())
+
+    def incremental_vacuum(self, max_pages: int = LOG_VACUUM_PAGES) -> int:
+        with self.write_lock:
+            return incremental_vacuum(self.connection(), max_pages)
+
+    def optimize(self) -> None:
+        """让SQLite根据最近的查询更新索引统计信息"""
+        with self.write_lock:
+            self.connection().execute("PRAGMA optimize")
+
+    def delete_log(self, log_id: str) -> None:
+        """删除日志及其全部记录(包括缓冲中的)"""
+        with self.write_lock:
+            with self.lock:
+                self.pending_records = [rec for rec in self.pending_records if rec[0] != log_id]
+                self.pending_logs.pop(log_id, None)
+                self.pending_stats.pop(log_id, None)
+                self.pending_deletes = [item for item in self.pending_deletes if item[0] != log_id]
+                self.written_logs.pop(log_id, None)
+            conn = self.connection()
+            with conn:
+                delete_log(conn, log_id)
+
+    def flush(self) -> int:
+        """
+        在一个事务中写入所有缓冲的元数据与记录, 返回写入的记录条数
+        数据库被锁定等暂时性错误会让整批数据留待下次写入
+        某些行违反约束时改为逐行写入, 丢弃并记录无法写入的行, 避免一行坏数据让之后的每次写入都失败
+        """
+        with self.write_lock:
+            # 先取出缓冲再写入, 写入期间新的记录进入新的缓冲
+            with self.lock:
+                if self.timer:
+                    self.timer.cancel()
+                    self.timer = None
+                if not self.pending_records and not self.pending_logs and not self.pending_stats and not self.pending_deletes:
+                    return 0
+                records, logs, stats, deletes = self.pending_records, self.pending_logs, self.pending_stats, self.pending_deletes
+                self.pending_records, self.pending_logs, self.pending_stats, self.pending_deletes = [], {}, {}, []
+            try:
+                conn = self.connection()
+                try:
+                    with conn:
+                        # 先写元数据, 保证记录的外键有效
+                        conn.executemany(UPSERT_LOG_SQL, list(logs.values()))
+                        conn.executemany(INSERT_RECORD_SQL, records)
+                        write_log_stats(conn, stats)
+                        conn.executemany(DELETE_RECORD_BY_MSG_SQL, deletes)
+                    written_logs, record_num = logs, len(records)
+                except sqlite3.OperationalError:
+                    raise
+                except sqlite3.Error as e:
+                    dice_log(f"[LogDB] 批量写入失败, 改为逐条写入: {e}")
+                    written_logs, record_num = self._write_rows_individually(conn, records, logs, stats, deletes)
+            except sqlite3.OperationalError as e:
+                dice_log(f"[LogDB] 批量写入失败, {len(records)}条记录留待下次写入: {e}")
+                with self.lock:
+                    # 写入期间新增的撤回排在放回的记录之后, 下次写入时仍会删除对应的记录
+                    self.pending_records = records + self.pending_records
+                    self.pending_deletes = deletes + self.pending_deletes
+                    for log_id, row in logs.items():
+                        self.pending_logs.setdefault(log_id, row)
+                    for log_id, agg in stats.items():
+                        merge_log_stats(self.pending_stats.setdefault(log_id, {}), agg)
+                    self._schedule()
+                return 0
+            with self.lock:
+                self.written_logs.update(written_logs)
+            return record_num
+
+    @staticmethod
+    def _write_rows_individually(conn: sqlite3.Connection, records: List[Tuple], logs: Dict[str, Tuple],
+                                 stats: Dict[str, Dict[str, Any]], deletes: List[Tuple[str, str]]) -> Tuple[Dict[str, Tuple], int]:
+        """逐行写入一批数据, 丢弃违反约束的行, 返回成功写入的元数据与记录条数, 暂时性错误仍会抛出OperationalError"""
+        written_logs: Dict[str, Tuple] = {}
+        record_num = 0
+        with conn:
+            for log_id, row in logs.items():
+                try:
+                    conn.execute(UPSERT_LOG_SQL, row)
+                    written_logs[log_id] = row
+                except sqlite3.OperationalError:
+                    raise
+                except sqlite3.Error as e:
+                    dice_log(f"[LogDB] 丢弃无法写入的日志元数据 {log_id}: {e}")
+            for rec in records:
+                try:
+                    conn.execute(INSERT_RECORD_SQL, rec)
+                    record_num += 1
+                except sqlite3.OperationalError:
+                    raise
+                except sqlite3.Error as e:
+                    dice_log(f"[LogDB] 丢弃无法写入的记录 {rec[0]} {rec[1]} {rec[2]}: {e}")
+            for log_id, agg in stats.items():
+                # 一个日志的统计分布在多张表中, 用保存点保证要么全部累加要么全部丢弃
+                conn.execute("SAVEPOINT log_stats")
+                try:
+                    write_log_stats(conn, {log_id: agg})
+                    conn.execute("RELEASE SAVEPOINT log_stats")
+                except sqlite3.OperationalError:
+                    raise
+                except sqlite3.Error as e:
+                    conn.execute("ROLLBACK TO SAVEPOINT log_stats")
+                    conn.execute("RELEASE SAVEPOINT log_stats")
+                    dice_log(f"[LogDB] 丢弃无法写入的统计 {log_id}: {e}")
+            conn.executemany(DELETE_RECORD_BY_MSG_SQL, deletes)
+        return written_logs, record_num
+
+    def close(self) -> None:
+        with self.write_lock:
+            try:
+                self.flush()
+            finally:
+                if self.conn is not None:
+                    self.conn.close()
+                    self.conn = None
+                with self.lock:
+                    self.written_logs.clear()
+
+    def _schedule(self, immediate: bool = False) -> None:
+        """安排后台线程写入缓冲, immediate为True时不再等待LOG_FLUSH_INTERVAL, 调用者不会被数据库读写阻塞"""
+        if self.timer is not None:
+            if not immediate or self.timer.interval == 0:
+                return
+            self.timer.cancel()
+        self.timer = threading.Timer(0 if immediate else LOG_FLUSH_INTERVAL, self._flush_by_timer)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def _flush_by_timer(self) -> None:
+        self.flush()
+
+
+_LOG_WRITER: Optional[LogWriter] = None
+_LOG_WRITER_LOCK = threading.Lock()
+
+
+def get_log_writer() -> LogWriter:
+    """返回进程内唯一的LogWriter, 进程退出时会写入缓冲中剩余的数据"""
+    global _LOG_WRITER
+    with _LOG_WRITER_LOCK:
+        if _LOG_WRITER is None:
+            _LOG_WRITER = LogWriter(LOG_DB_PATH)
+            atexit.register(_LOG_WRITER.close)
+        return _LOG_WRITER
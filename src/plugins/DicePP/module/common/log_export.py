@@ -0,0 +1,370 @@
+"""
+日志导出与归档
+从数据库游标中逐批读取记录, 边读边写入txt/论坛代码/docx/归档文件, 内存占用与日志长度无关
+导出可能运行在工作线程中, 这里的函数不访问DataManager, 需要的昵称等信息由调用方预先准备
+"""
+import datetime
+import gzip
+import heapq
+import json
+import os
+import re
+import zipfile
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+from utils.time import str_to_datetime
+from utils.logger import dice_log
+
+from .log_db import LOG_DB_PATH, get_log_writer, open_reader, iter_records, count_records, fetch_record_by_message_id, \
+    iter_contents_containing
+
+LOG_EXPORT_CHUNK_SIZE = 500  # 每次从游标中取出的行数
+LOG_EXPORT_PROGRESS_STEP = 5000  # 每导出多少条记录报告一次进度
+LOG_EXPORT_REPLY_CACHE = 2000  # 缓存最近多少条消息供引用查找, 更早的消息回退到数据库查询
+
+RE_CQ_REPLY = re.compile(r"\[CQ:reply,(?:id|reply|source_id)=(\d+)[^\]]*\]")
+RE_CQ_AT = re.compile(r"\[CQ:at,qq=(\d+)(?:,[^\]]*)?\]")
+RE_XML_INVALID = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]")
+
+_MIN_TIME = datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+
+
+def _record_time_key(record: Dict[str, Any]) -> datetime.datetime:
+    try:
+        return str_to_datetime(record.get("time", "")) or _MIN_TIME
+    except Exception:
+        return _MIN_TIME
+
+
+class LogRecordSource:
+    """
+    一个日志的全部记录, 数据库中的记录按写入顺序流式读取, 旧版保存在内存中的记录按时间合并进来
+    读取使用独立的只读连接, 不会阻塞LogWriter, 打开前会先写入LogWriter缓冲中的记录
+    """
+
+    def __init__(self, log_id: str, legacy_records: Optional[List[Dict[str, Any]]] = None,
+                 db_path: str = LOG_DB_PATH, chunk_size: int = LOG_EXPORT_CHUNK_SIZE):
+        self.log_id = log_id
+        self.legacy_records = sorted(legacy_records or [], key=_record_time_key)
+        self.db_path = db_path
+        self.chunk_size = chunk_size
+        self.conn = None
+        if log_id:
+            try:
+                get_log_writer().flush()
+                self.conn = open_reader(db_path)
+            except Exception as e:
+                dice_log(f"[LogExport] 无法打开日志数据库: {e}")
+                self.conn = None
+
+    def count(self) -> int:
+        total = len(self.legacy_records)
+        if self.conn is not None:
+            total += count_records(self.conn, self.log_id)
+        return total
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        db_iter: Iterable[Dict[str, Any]] = iter_records(self.conn, self.log_id, self.chunk_size) \
+            if self.conn is not None else []
+        if not self.legacy_records:
+            return iter(db_iter)
+        return heapq.merge(db_iter, self.legacy_records, key=_record_time_key)
+
+    def find_mentioned_ids(self) -> List[str]:
+        """按第一次出现的顺序返回被@的所有用户, 只读取包含@的记录"""
+        contents: List[Iterable[str]] = [[record.get("content", "") for record in self.legacy_records]]
+        if self.conn is not None:
+            contents.append(iter_contents_containing(self.conn, self.log_id, "[CQ:at,"))
+        mentioned: Dict[str, None] = {}
+        for content_iter in contents:
+            for content in content_iter:
+                for match in RE_CQ_AT.finditer(content):
+                    mentioned.setdefault(match.group(1), None)
+        return list(mentioned)
+
+    def find_by_message_id(self, message_id: str) -> Optional[Dict[str, Any]]:
+        for record in self.legacy_records:
+            if str(record.get("message_id")) == message_id:
+                return record
+        if self.conn is None:
+            return None
+        return fetch_record_by_message_id(self.conn, self.log_id, message_id)
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def __enter__(self) -> "LogRecordSource":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class DocxStreamWriter:
+    """
+    以流的方式写入docx, 正文逐段写入压缩包, 不在内存中构建文档树
+    文档以内置的模板为基础, 模板包含正文与一级标题的样式, 标题可以在导航窗格和目录中使用
+    只支持日志导出需要的标题与带颜色的段落
+    """
+    CONTENT_TYPES = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/word/document.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+        '<Override PartName="/word/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>'
+        '</Types>'
+    )
+    RELS = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="word/document.xml"/>'
+        '</Relationships>'
+    )
+    DOCUMENT_RELS = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+        'Target="styles.xml"/>'
+        '</Relationships>'
+    )
+    # 与python-docx默认模板中的Normal和Heading 1样式相近, 不依赖主题字体
+    STYLES = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<w:styles xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        '<w:docDefaults>'
+        '<w:rPrDefault><w:rPr><w:rFonts w:ascii="Calibri" w:eastAsia="SimSun" '
+        'w:hAnsi="Calibri" w:cs="Times New Roman"/><w:sz w:val="22"/><w:szCs w:val="22"/>'
+        '<w:lang w:val="en-US" w:eastAsia="zh-CN" w:bidi="ar-SA"/></w:rPr></w:rPrDefault>'
+        '<w:pPrDefault><w:pPr><w:spacing w:after="200" w:line="276" w:lineRule="auto"/></w:pPr></w:pPrDefault>'
+        '</w:docDefaults>'
+        '<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/><w:qFormat/></w:style>'
+        '<w:style w:type="paragraph" w:styleId="Heading1"><w:name w:val="heading 1"/><w:basedOn w:val="Normal"/>'
+        '<w:next w:val="Normal"/><w:uiPriority w:val="9"/><w:qFormat/>'
+        '<w:pPr><w:keepNext/><w:keepLines/><w:spacing w:before="480" w:after="0"/><w:outlineLvl w:val="0"/></w:pPr>'
+        '<w:rPr><w:rFonts w:ascii="Calibri" w:eastAsia="SimHei" w:hAnsi="Calibri" '
+        'w:cs="Times New Roman"/><w:b/><w:bCs/><w:color w:val="365F91"/><w:sz w:val="28"/><w:szCs w:val="28"/></w:rPr>'
+        '</w:style>'
+        '<w:style w:type="character" w:default="1" w:styleId="DefaultParagraphFont">'
+        '<w:name w:val="Default Paragraph Font"/><w:uiPriority w:val="1"/><w:semiHidden/><w:unhideWhenUsed/></w:style>'
+        '</w:styles>'
+    )
+    DOCUMENT_HEAD = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+    )
+    DOCUMENT_TAIL = '<w:sectPr/></w:body></w:document>'
+
+    def __init__(self, path: str):
+        self.zip_file = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+        self.zip_file.writestr("[Content_Types].xml", self.CONTENT_TYPES)
+        self.zip_file.writestr("_rels/.rels", self.RELS)
+        self.zip_file.writestr("word/_rels/document.xml.rels", self.DOCUMENT_RELS)
+        self.zip_file.writestr("word/styles.xml", self.STYLES)
+        self.body = self.zip_file.open("word/document.xml", "w")
+        self.body.write(self.DOCUMENT_HEAD.encode("utf-8"))
+
+    @staticmethod
+    def _runs(text: str, run_props: str) -> str:
+        """换行转换为<w:br/>, 制表符转换为<w:tab/>, 与python-docx的add_run一致"""
+        text = RE_XML_INVALID.sub("", text)
+        parts = []
+        for line_index, line in enumerate(text.split("\n")):
+            if line_index:
+                parts.append("<w:br/>")
+            for tab_index, piece in enumerate(line.split("\t")):
+                if tab_index:
+                    parts.append("<w:tab/>")
+                if piece:
+                    parts.append(f'<w:t xml:space="preserve">{escape(piece)}</w:t>')
+        return f"<w:r>{run_props}{''.join(parts)}</w:r>"
+
+    def add_heading(self, text: str) -> None:
+        """一级标题, 与python-docx的add_heading(level=1)一致"""
+        self.body.write(f'<w:p><w:pPr><w:pStyle w:val="Heading1"/></w:pPr>{self._runs(text, "")}</w:p>'
+                        .encode("utf-8"))
+
+    def add_paragraph(self, text: str, color_hex: str = "000000") -> None:
+        run_props = f'<w:rPr><w:color w:val="{color_hex}"/></w:rPr>'
+        self.body.write(f"<w:p>{self._runs(text, run_props)}</w:p>".encode("utf-8"))
+
+    def close(self) -> None:
+        try:
+            self.body.write(self.DOCUMENT_TAIL.encode("utf-8"))
+            self.body.close()
+        finally:
+            self.zip_file.close()
+
+
+class LogExportJob:
+    """
+    一次导出需要的全部信息, 在事件循环中准备好后交给工作线程
+    Args:
+        group_id: 群号
+        log_id: 日志ID
+        title: 文件抬头
+        file_base: 不含扩展名的文件路径
+        legacy_records: 旧版保存在内存中的记录
+        color_map: user_id -> 颜色, 导出过程中会为新用户分配颜色
+        nickname_cache: user_id -> 骰娘记录的昵称, 优先于记录中的昵称
+        user_display: user_id -> 展示用昵称, 已包含日志中出现过的所有用户, 用于@
+        bot_account: 骰娘账号
+        pick_color: 为新用户分配颜色的函数
+        mention_names: user_id -> 日志外用户(例如被@的用户)的昵称, 由事件循环在导出前根据工作线程找到的用户填写
+        forum_code: 是否额外导出论坛代码
+    """
+
+    def __init__(self, group_id: str, log_id: str, title: str, file_base: str,
+                 legacy_records: List[Dict[str, Any]], color_map: Dict[str, str],
+                 nickname_cache: Dict[str, str], user_display: Dict[str, str],
+                 bot_account: str, pick_color: Callable[[Dict[str, str], str], str],
+                 mention_names: Dict[str, str], forum_code: bool):
+        self.group_id = group_id
+        self.log_id = log_id
+        self.title = title
+        self.file_base = file_base
+        self.legacy_records = legacy_records
+        self.color_map = color_map
+        self.nickname_cache = nickname_cache
+        self.user_display = user_display
+        self.bot_account = bot_account
+        self.pick_color = pick_color
+        self.mention_names = mention_names
+        self.forum_code = forum_code
+
+
+def export_log_files(job: LogExportJob, on_progress: Optional[Callable[[int, int], None]] = None) \
+        -> Tuple[str, Optional[str], Optional[str]]:
+    """
+    单遍读取记录并同时写入txt, docx与论坛代码文件, 返回(txt路径, docx路径, 论坛代码路径), 生成失败的文件为None
+    on_progress(已导出条数, 总条数)每导出LOG_EXPORT_PROGRESS_STEP条以及结束时调用一次
+    """
+    txt_path = job.file_base + ".txt"
+    docx_path: Optional[str] = job.file_base + ".docx"
+    forum_path: Optional[str] = job.file_base + "_forum.txt" if job.forum_code else None
+    os.makedirs(os.path.dirname(txt_path), exist_ok=True)
+
+    with LogRecordSource(job.log_id, job.legacy_records) as source:
+        total = source.count()
+        reply_cache: "OrderedDict[str, Dict[str, str]]" = OrderedDict()
+
+        def display_of(record: Dict[str, Any]) -> str:
+            return job.nickname_cache.get(record.get("user_id")) or record.get("nickname", "?")
+
+        def find_reply(mid: str) -> Optional[Dict[str, str]]:
+            origin = reply_cache.get(mid)
+            if origin is None:
+                record = source.find_by_message_id(mid)
+                if record is not None:
+                    origin = {"content": RE_CQ_REPLY.sub("", record.get("content", "")),
+                              "nickname": display_of(record)}
+            return origin
+
+        def repl_reply(match: re.Match) -> str:
+            origin = find_reply(match.group(1))
+            if not origin:
+                return "| 引用消息不在 log 范围内\n"
+            origin_content = origin['content'].strip() or "(空白)"
+            lines = [ln.strip() for ln in origin_content.splitlines() if ln.strip()][:3] or [origin_content]
+            lines = [ln[:60] + ('…' if len(ln) > 60 else '') for ln in lines]
+            quote_lines = [f"| {origin['nickname']}"] + [f"| {ln}" for ln in lines]
+            return "\n".join(quote_lines) + "\n"
+
+        def repl_at(match: re.Match) -> str:
+            uid = match.group(1)
+            nick = job.user_display.get(uid)
+            if not nick or nick in ("UNDEF_NAME", "----"):
+                nick = job.mention_names.get(uid) or uid
+            return f"@{nick}"
+
+        docx_writer: Optional[DocxStreamWriter] = None
+        try:
+            docx_writer = DocxStreamWriter(docx_path)
+            docx_writer.add_heading(job.title)
+        except Exception as exc:
+            dice_log(f"[LogExport] docx generation failed: {type(exc).__name__}: {exc}")
+            docx_writer, docx_path = None, None
+        forum_file = None
+        if forum_path:
+            try:
+                forum_file = open(forum_path, "w", encoding="utf-8")
+            except Exception as exc:
+                dice_log(f"[LogExport] forum code generation failed: {type(exc).__name__}: {exc}")
+                forum_path = None
+
+        done = 0
+        try:
+            with open(txt_path, "w", encoding="utf-8") as txt_file:
+                txt_file.write(f"{job.title}\n\n")
+                for record in source:
+                    uid = record.get('user_id', '?')
+                    raw_content = record.get('content', '')
+                    display_name = job.nickname_cache.get(uid) or record.get('nickname') or \
+                        ("骰娘" if uid == job.bot_account else uid)
+                    color_hex = job.pick_color(job.color_map, uid)
+                    content_out = RE_CQ_AT.sub(repl_at, RE_CQ_REPLY.sub(repl_reply, raw_content))
+                    txt_file.write(f"{display_name} ({uid})  {record.get('time', '?')}\n")
+                    txt_file.write(content_out + "\n\n")
+                    if docx_writer is not None:
+                        try:
+                            docx_writer.add_paragraph(f"<{display_name}>{content_out}", color_hex)
+                        except Exception as exc:
+                            dice_log(f"[LogExport] docx generation failed: {type(exc).__name__}: {exc}")
+                            docx_writer.close()
+                            docx_writer, docx_path = None, None
+                    if forum_file is not None:
+                        forum_file.write(("\n" if done else "") +
+                                         f"[color=#9ca3af]{record.get('time', '未知时间')}[/color]"
+                                         f"[color=#f99252] <{record.get('nickname', '未知用户')}>{raw_content} [/color]")
+                    mid = record.get('message_id')
+                    if mid:
+                        reply_cache[str(mid)] = {"content": RE_CQ_REPLY.sub("", raw_content),
+                                                 "nickname": display_of(record)}
+                        if len(reply_cache) > LOG_EXPORT_REPLY_CACHE:
+                            reply_cache.popitem(last=False)
+                    done += 1
+                    if on_progress and done % LOG_EXPORT_PROGRESS_STEP == 0:
+                        on_progress(done, total)
+        finally:
+            if docx_writer is not None:
+                try:
+                    docx_writer.close()
+                except Exception as exc:
+                    dice_log(f"[LogExport] docx generation failed: {type(exc).__name__}: {exc}")
+                    docx_path = None
+            if forum_file is not None:
+                forum_file.close()
+    if on_progress:
+        on_progress(done, total)
+    return txt_path, docx_path, forum_path
+
+
+def archive_log(path: str, meta: Dict[str, Any], source: LogRecordSource) -> int:
+    """
+    将日志归档为gzip压缩的JSONL文件, 第一行为元数据, 之后每行一条记录, 返回记录条数
+    先写入临时文件再替换, 中途失败不会留下不完整的归档
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    count = 0
+    try:
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            f.write(json.dumps(meta, ensure_ascii=False) + "\n")
+            for record in source:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                count += 1
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return count
+
@@ -0,0 +1,219 @@
+"""
+日志云端上传
+上传任务先写入日志数据库的uploads表, 再由事件循环中的异步HTTP客户端发送, 不会阻塞事件循环
+可重试的失败(网络错误, 5xx, 429)按指数退避重新排队, 进程重启后会继续尝试
+"""
+import asyncio
+import random
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+try:
+    import httpx  # type: ignore
+except Exception:  # pragma: no cover
+    httpx = None
+try:
+    import requests  # type: ignore
+except Exception:  # pragma: no cover
+    requests = None
+
+from utils.time import get_current_date_str
+from utils.logger import dice_log
+
+from .log_db import get_log_writer, open_reader, fetch_due_upload_ids
+
+LOG_UPLOAD_TIMEOUT = 15  # 单次上传的超时时间(秒)
+LOG_UPLOAD_RETRY_BASE = 30  # 第一次重试前等待的秒数, 之后每次翻倍
+LOG_UPLOAD_RETRY_MAX = 3600  # 两次重试之间最多等待的秒数
+LOG_UPLOAD_MAX_ATTEMPTS = 8  # 超过该次数后放弃上传
+LOG_UPLOAD_BATCH = 5  # 每次处理队列时最多发送的任务数
+
+UPLOAD_DONE = "done"
+UPLOAD_RETRY = "retry"
+UPLOAD_FAILED = "failed"
+
+
+class UploadError(Exception):
+    def __init__(self, info: str, retryable: bool):
+        super().__init__(info)
+        self.info = info
+        self.retryable = retryable
+
+    def __str__(self):
+        return self.info
+
+
+def get_retry_delay(attempts: int) -> float:
+    """第attempts次失败后等待的秒数, 带有±20%的随机抖动, 避免多个任务同时重试"""
+    delay = min(LOG_UPLOAD_RETRY_BASE * 2 ** max(attempts - 1, 0), LOG_UPLOAD_RETRY_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+
+class LogUploadClient:
+    """
+    异步上传客户端, 同一个事件循环中的多次上传复用同一个httpx.AsyncClient的连接
+    没有安装httpx时退回到在线程池中调用requests
+    """
+
+    def __init__(self, timeout: float = LOG_UPLOAD_TIMEOUT):
+        self.timeout = timeout
+        self.client = None
+        self.client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def get_client(self):
+        loop = asyncio.get_running_loop()
+        if self.client is None or self.client_loop is not loop:
+            self.client = httpx.AsyncClient(timeout=self.timeout)
+            self.client_loop = loop
+        return self.client
+
+    async def put(self, endpoint: str, form: Dict[str, str], file: bytes, token: Optional[str] = None) -> str:
+        """上传一个日志, 成功时返回线上链接, 失败时抛出UploadError"""
+        files = {
+            'file': ('log-zlib-compressed', file, 'application/octet-stream')
+        }
+        headers = {}
+        if token:
+            headers['Authorization'] = f"Bearer {token}"
+        if httpx is not None:
+            try:
+                response = await self.get_client().put(endpoint, data=form, files=files, headers=headers)
+            except httpx.UnsupportedProtocol as exc:
+                raise UploadError(str(exc) or type(exc).__name__, retryable=False)
+            except httpx.HTTPError as exc:
+                raise UploadError(str(exc) or type(exc).__name__, retryable=True)
+            except Exception as exc:  # 例如地址格式错误, 重试也不会成功
+                raise UploadError(f"{type(exc).__name__}: {exc}", retryable=False)
+            ok, reason = response.is_success, response.reason_phrase
+        elif requests is not None:
+            loop = asyncio.get_running_loop()
+            try:
+                response = await loop.run_in_executor(None, lambda: requests.put(
+                    endpoint, data=form, files=files, headers=headers, timeout=self.timeout))
+            except (requests.exceptions.InvalidURL, requests.exceptions.MissingSchema, requests.exceptions.InvalidSchema) as exc:
+                raise UploadError(str(exc) or type(exc).__name__, retryable=False)
+            except requests.RequestException as exc:
+                raise UploadError(str(exc) or type(exc).__name__, retryable=True)
+            except Exception as exc:
+                raise UploadError(f"{type(exc).__name__}: {exc}", retryable=False)
+            ok, reason = response.ok, response.reason
+        else:
+            raise UploadError("httpx 与 requests 模块均不可用", retryable=False)
+        try:
+            resp_json = response.json()
+        except Exception:
+            resp_json = {}
+        if ok and isinstance(resp_json, dict) and resp_json.get('url'):
+            return resp_json['url']
+        msg = resp_json.get('message') if isinstance(resp_json, dict) else response.text
+        status = response.status_code
+        raise UploadError(f"HTTP {status} {msg or reason}", retryable=status >= 500 or status == 429)
+
+    async def close(self) -> None:
+        if self.client is not None:
+            client, client_loop = self.client, self.client_loop
+            self.client, self.client_loop = None, None
+            if client_loop is asyncio.get_running_loop():  # 其他事件循环中创建的客户端已经无法关闭
+                await client.aclose()
+
+
+class LogUploadQueue:
+    """
+    单个骰娘账号的上传队列, 任务保存在日志数据库中, 同一时间只有一个协程在处理队列
+    Args:
+        account: 骰娘账号, 只处理该账号加入的任务
+        version: 上传格式版本号
+    """
+
+    def __init__(self, account: str, version: int, client: Optional[LogUploadClient] = None):
+        self.account = account
+        self.version = version
+        self.client = client or LogUploadClient()
+        self.in_flight: Set[int] = set()
+        self.draining: bool = False
+        self.reader: Optional[sqlite3.Connection] = None  # 定期检查队列使用的只读连接, 不需要等待写入器
+
+    def enqueue(self, *, log_id: str, group_id: str, name: str, endpoint: str, token: Optional[str],
+                uploader_id: str, file: bytes) -> Dict[str, Any]:
+        """加入上传队列并返回任务, 可以在工作线程中调用"""
+        upload = {
+            "log_id": log_id,
+            "group_id": group_id,
+            "account": self.account,
+            "name": name,
+            "endpoint": endpoint,
+            "token": token,
+            "uploader_id": uploader_id,
+            "file": file,
+            "attempts": 0,
+            "next_attempt_at": time.time(),
+            "created_at": get_current_date_str(),
+        }
+        upload["id"] = get_log_writer().enqueue_upload(upload)
+        return upload
+
+    def has_due(self, now: Optional[float] = None) -> bool:
+        """是否有到期且没有在发送的任务, 只查询任务ID, 批量写入进行中时也不会被阻塞"""
+        if self.reader is None:
+            self.reader = open_reader(get_log_writer().db_path)
+        due = fetch_due_upload_ids(self.reader, self.account, now if now is not None else time.time(),
+                                   len(self.in_flight) + 1)
+        return any(upload_id not in self.in_flight for upload_id in due)
+
+    async def attempt(self, upload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        尝试发送一次, 成功或不可重试的失败会将任务移出队列, 否则按退避时间重新排队
+        返回{"status": UPLOAD_DONE/UPLOAD_RETRY/UPLOAD_FAILED, "success": bool, "message": str, "url": Optional[str]}
+        """
+        upload_id = upload["id"]
+        if upload_id in self.in_flight:
+            return {"status": UPLOAD_RETRY, "success": False, "message": "云端上传进行中"}
+        self.in_flight.add(upload_id)
+        writer = get_log_writer()
+        try:
+            form = {
+                'name': upload["name"],
+                'uniform_id': f"QQ:{upload['uploader_id']}",
+                'client': 'DicePP',
+                'version': str(self.version),
+            }
+            try:
+                url = await self.client.put(upload["endpoint"], form, upload["file"], upload.get("token"))
+            except UploadError as exc:
+                attempts = upload.get("attempts", 0) + 1
+                if exc.retryable and attempts < LOG_UPLOAD_MAX_ATTEMPTS:
+                    delay = get_retry_delay(attempts)
+                    writer.reschedule_upload(upload_id, attempts, time.time() + delay, str(exc))
+                    dice_log(f"[LogUpload] 日志{upload['log_id']}第{attempts}次上传失败: {exc}, {int(delay)}秒后重试")
+                    return {"status": UPLOAD_RETRY, "success": False,
+                            "message": f"云端上传失败：{exc}，将在 {int(delay)} 秒后自动重试"}
+                writer.delete_upload(upload_id)
+                dice_log(f"[LogUpload] 日志{upload['log_id']}上传失败, 不再重试: {exc}")
+                return {"status": UPLOAD_FAILED, "success": False, "message": f"云端上传失败：{exc}"}
+            writer.delete_upload(upload_id)
+            return {"status": UPLOAD_DONE, "success": True, "message": "云端上传成功", "url": url}
+        finally:
+            self.in_flight.discard(upload_id)
+
+    async def process_due(self) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """发送所有到期的任务, 返回(任务, 结果)的列表"""
+        if self.draining:
+            return []
+        self.draining = True
+        results: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+        try:
+            for upload in get_log_writer().fetch_due_uploads(self.account, time.time(), LOG_UPLOAD_BATCH):
+                if upload["id"] in self.in_flight:
+                    continue
+                results.append((upload, await self.attempt(upload)))
+        finally:
+            self.draining = False
+        return results
+
+    async def close(self) -> None:
+        """关闭HTTP客户端与只读连接, 未完成的任务留在队列中"""
+        await self.client.close()
+        if self.reader is not None:
+            reader, self.reader = self.reader, None
+            reader.close()
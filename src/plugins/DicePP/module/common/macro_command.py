@@ -19,7 +19,8 @@ CFG_DEFINE_NUM_MAX = "define_number_max"
 
 
 @custom_user_command(readable_name="宏指令", priority=DPP_COMMAND_PRIORITY_DEFAULT,
-                     flag=DPP_COMMAND_FLAG_MACRO)
+                     flag=DPP_COMMAND_FLAG_MACRO,
+                     prefixes=(".define",))
 class MacroCommand(UserCommandBase):
     """
     定义和查看宏指令, 关键字为define
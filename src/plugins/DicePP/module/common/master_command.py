@@ -33,7 +33,8 @@ class _(DataChunkBase):
         super().__init__()
 
 @custom_user_command(readable_name="Master指令", priority=DPP_COMMAND_PRIORITY_MASTER,flag=DPP_COMMAND_FLAG_MANAGE,
-                     permission_require=3 # 限定骰管理使用
+                     permission_require=3, # 限定骰管理使用
+                     prefixes=(".m",)
                      )
 class MasterCommand(UserCommandBase):
     """
@@ -117,16 +118,12 @@ class MasterCommand(UserCommandBase):
             self.bot.data_manager.set_data(DC_CTRL, ["rebooter"], meta.user_id)
             
             async def delayed_reboot():
-                from core.command import BotSendMsgCommand
-                # 发送倒计时提醒
-                await self.bot.send_msg_to_master(f"⏰ 骰娘将在 {delay_sec} 秒后重启...")
-                await asyncio.sleep(delay_sec)
                 self.bot.reboot()
                 return []
-            
-            import asyncio
-            self.bot.register_task(delayed_reboot, timeout=delay_sec + 30)
-            feedback = f"已安排延迟重启，将在 {delay_sec} 秒后执行"
+
+            # 到时间后由调度器执行重启, 不再占用一个等待中的任务
+            self.bot.schedule_at(self.bot.scheduler.now() + delay_sec, delayed_reboot, timeout=30)
+            feedback = f"⏰ 已安排延迟重启，骰娘将在 {delay_sec} 秒后重启"
         elif arg_str.startswith("send"):
             arg_list = arg_str[4:].split(":", 2)
             if len(arg_list) == 3:
@@ -158,12 +155,19 @@ class MasterCommand(UserCommandBase):
             self.bot.register_task(clear_expired_data, timeout=3600)
             feedback = "清理开始..."
         elif arg_str == "debug-tick":
+            stats = self.bot.scheduler.get_stats()
             feedback = f"异步任务状态: {self.bot.tick_task.get_name()} Done:{self.bot.tick_task.done()} Cancelled:{self.bot.tick_task.cancelled()}\n" \
-                       f"{self.bot.tick_task}"
+                       f"{self.bot.tick_task}\n" \
+                       f"等待中: {stats['pending']} (周期任务 {stats['periodic']}) 执行中: {stats['running']}\n" \
+                       f"已完成: {stats['finished']} 超时: {stats['timeouts']} 出错: {stats['errors']}"
+            if stats["next_job"]:
+                feedback += f"\n下一个任务: {stats['next_job']} ({stats['next_in']:.1f}秒后)"
         elif arg_str == "redo-tick":
             import asyncio
+            if self.bot.tick_task and not self.bot.tick_task.done():
+                self.bot.tick_task.cancel()
+            self.bot.scheduler.clear()
             self.bot.tick_task = asyncio.create_task(self.bot.tick_loop())
-            self.bot.todo_tasks = {}
             feedback = "Redo tick finish!"
         elif arg_str == "log-clean":
             # 立即删除本Bot data_path/logs 下所有文件
@@ -232,6 +236,43 @@ class MasterCommand(UserCommandBase):
                 )
             else:
                 feedback = "无法获取内存信息，可能未安装 psutil"
+        elif arg_str == "save" or arg_str == "save status":
+            # 数据保存耗时与写入量
+            metrics = self.bot.data_manager.get_save_metrics()
+            lines = [f"💾 数据保存状态 (上次总耗时 {metrics.last_total_ms:.1f} ms)"]
+            for dc_name, info in sorted(metrics.chunks.items(), key=lambda item: -item[1]["total_bytes"]):
+                lines.append(f"{dc_name}: {int(info['count'])}次 上次{info['last_ms']:.1f}ms/{int(info['last_bytes'] / 1024)}KB "
+                             f"最长{info['max_ms']:.1f}ms 累计{int(info['total_bytes'] / 1024)}KB"
+                             + (f" 失败{int(info['fail'])}次" if info["fail"] else ""))
+            if len(lines) == 1:
+                lines.append("启动后尚未保存过数据")
+            feedback = "\n".join(lines)
+        elif arg_str == "roll-cache":
+            # 掷骰表达式缓存命中率
+            from module.roll import get_roll_exp_cache_stats
+            stats = get_roll_exp_cache_stats()
+            feedback = (f"🎲 掷骰表达式缓存: {stats['size']}/{stats['max_size']}\n"
+                        f"命中 {stats['hits']} 次, 未命中 {stats['misses']} 次, 命中率 {stats['hit_rate'] * 100:.1f}%")
+        elif arg_str == "outbound":
+            # 发送队列状态
+            stats = self.bot.proxy.get_outbound_stats() if self.bot.proxy else {}
+            if stats:
+                feedback = (f"📤 发送队列: {stats['busy_targets']}/{stats['targets']}个对象待发送, "
+                            f"积压 {stats['depth']} 条 (最多 {stats['max_depth']} 条)\n"
+                            f"已发送 {stats['sent']} 条, 失败 {stats['failed']} 条\n"
+                            f"排队耗时 p50 {stats['wait_p50_ms']:.0f}ms / p95 {stats['wait_p95_ms']:.0f}ms\n"
+                            f"发送耗时 p50 {stats['send_p50_ms']:.0f}ms / p95 {stats['send_p95_ms']:.0f}ms / "
+                            f"最长 {stats['send_max_ms']:.0f}ms")
+            else:
+                feedback = "当前客户端没有发送队列"
+        elif arg_str == "assets":
+            # 多个账号共享的牌库与生成器
+            from utils.asset import ASSET_REGISTRY
+            stats = ASSET_REGISTRY.get_stats()
+            lines = [f"📦 共享资源: {stats['entries']}份, 复用 {stats['hits']} 次, 加载 {stats['misses']} 次"]
+            for slot, slot_stats in stats["slots"].items():
+                lines.append(f"{slot}: {slot_stats['entries']}份, 被{slot_stats['refs']}个账号引用")
+            feedback = "\n".join(lines)
         elif arg_str == "silent" or arg_str == "silent status":
             # 查询静默模式状态
             is_silent = self.bot.data_manager.get_data(DC_CTRL, ["silent_startup"], False)
@@ -258,6 +299,10 @@ class MasterCommand(UserCommandBase):
              ".m reboot delay <秒> 延迟重启\n" \
              ".m send 命令骰娘发送信息\n" \
              ".m memory 查看内存状态\n" \
+             ".m save 查看数据保存耗时与写入量\n" \
+             ".m roll-cache 查看掷骰表达式缓存命中率\n" \
+             ".m outbound 查看发送队列积压与延迟\n" \
+             ".m assets 查看多个账号共享的牌库与生成器\n" \
              ".m log-clean 清空日志目录\n" \
              ".m log status 查看日志状态\n" \
              ".m silent on/off 开启/关闭静默模式（启动时不发送通知）"
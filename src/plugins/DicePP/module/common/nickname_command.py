@@ -17,7 +17,8 @@ MAX_NICKNAME_LENGTH = 30  # 昵称长度上限
 @custom_user_command(readable_name="自定义昵称指令",
                      priority=0,
                      group_only=False,
-                     flag=DPP_COMMAND_FLAG_MANAGE)
+                     flag=DPP_COMMAND_FLAG_MANAGE,
+                     prefixes=(".nn",))
 class NicknameCommand(UserCommandBase):
     """
     更改用户自定义昵称的指令, 以.nn开头
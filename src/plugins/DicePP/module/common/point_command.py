@@ -33,7 +33,8 @@ class _(DataChunkBase):
 
 
 @custom_user_command(readable_name="点数指令", priority=DPP_COMMAND_PRIORITY_DEFAULT,
-                     flag=DPP_COMMAND_FLAG_INFO)
+                     flag=DPP_COMMAND_FLAG_INFO,
+                     prefixes=(".point", ".m"))
 class PointCommand(UserCommandBase):
     """
     .point 和.m point指令
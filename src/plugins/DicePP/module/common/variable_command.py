@@ -22,7 +22,8 @@ LOC_VAR_ERROR = "var_error"
 
 
 @custom_user_command(readable_name="变量指令", priority=0,  # priority要大于搜索, 否则set会被s覆盖
-                     flag=DPP_COMMAND_FLAG_MACRO, group_only=True)
+                     flag=DPP_COMMAND_FLAG_MACRO, group_only=True,
+                     prefixes=(".set", ".get", ".del"))
 class VariableCommand(UserCommandBase):
     """
     用户自定义变量 包括.set .get .del
@@ -31,7 +31,8 @@ class _(DataChunkBase):
 
 @custom_user_command(readable_name="欢迎词指令", 
                      priority=-1,
-                     flag=DPP_COMMAND_FLAG_MANAGE, group_only=True)
+                     flag=DPP_COMMAND_FLAG_MANAGE, group_only=True,
+                     prefixes=(".welcome",))
 class WelcomeCommand(UserCommandBase):
     """
     .welcome 欢迎词指令
@@ -1,4 +1,4 @@
-from typing import List, Tuple, Any, Iterable, Set, Dict
+from typing import List, Tuple, Any, Iterable, Set, Dict, Optional, Union, Hashable
 import random
 import re
 import os
@@ -12,11 +12,12 @@ from core.command import BotCommandBase, BotSendMsgCommand
 from core.communication import MessageMetaData, PrivateMessagePort, GroupMessagePort, preprocess_msg
 from core.config import DATA_PATH, LOCAL_IMG_PATH
 from core.localization import LocalizationManager, LOC_FUNC_DISABLE
-from utils.localdata import read_xlsx, update_xlsx, col_based_workbook_to_dict, create_parent_dir, get_empty_col_based_workbook
+from utils.localdata import read_xlsx_cached, CachedWorkbook, update_xlsx, col_based_workbook_to_dict, create_parent_dir, get_empty_col_based_workbook
 from utils.string import match_substring
 from utils.logger import dice_log
-from utils.cq_code import get_cq_image
-from module.roll import preprocess_roll_exp, is_roll_exp, exec_roll_exp
+from utils.cq_code import get_cq_image_cached
+from utils.asset import ASSET_REGISTRY, get_path_signature
+from module.roll import preprocess_roll_exp, is_roll_exp, exec_roll_exp, parse_roll_exp, RollExpression, RollDiceError
 
 
 LOC_DRAW_RESULT = "draw_result"
@@ -33,7 +34,9 @@ LOC_DRAW_ERR_VAGUE_DECK = "draw_error_vague_deck"
 
 CFG_DECK_ENABLE = "deck_enable"
 CFG_DECK_DATA_PATH = "deck_data_path"
+CFG_DECK_IMAGE_FILE_URI = "deck_image_file_uri"
 DRAW_DATA_PATH = "DeckData"
+DECK_ASSET_SLOT = "deck"  # 在共享资源登记表中的槽位
 
 DRAW_LIMIT = 10  # 指令抽卡的上限
 HLDL_DRAW_LIMIT = 50  # 高级抽卡语言中抽卡的上限
@@ -61,6 +64,104 @@ class ForceFinal(Exception):
         return self.info
 
 
+ROLL_PATTERN = re.compile(r"ROLL\((.{1,30}?)\)")
+DRAW_PATTERN = re.compile(r"DRAW\((.{1,30}?),\s*(.{1,30}?)\)")
+IMG_PATTERN = re.compile(r"IMG\((.{1,50}?\.[A-Za-z]{1,10}?)\)")
+TOKEN_MARK_START, TOKEN_MARK_END = "\ue000", "\ue001"  # 编译时用私用区字符标记已解析的片段
+TOKEN_MARK_PATTERN = re.compile(f"{TOKEN_MARK_START}(\\d+){TOKEN_MARK_END}")
+
+
+def resolve_deck_image(source: "Deck", key: str) -> Optional[Path]:
+    """依次在牌库所在目录, 牌库数据目录和本地图片目录中查找图片, 返回绝对路径, 找不到时返回None"""
+    for file_path in (Path(source.path) / key, Path(DATA_PATH) / DRAW_DATA_PATH / key, Path(LOCAL_IMG_PATH) / key):
+        if file_path.exists():
+            return file_path.resolve()
+    return None
+
+
+def load_deck_image(source: "Deck", key: str, file_uri: bool = False) -> str:
+    """生成图片的CQ码, 找不到图片时返回key"""
+    file_path = resolve_deck_image(source, key)
+    if file_path:
+        try:
+            return get_cq_image_cached(file_path, file_uri)
+        except OSError:
+            pass
+    dice_log(f"[DeckImage] 找不到图片 {(Path(source.path) / key).resolve()}")
+    return key
+
+
+def expand_nested_draw(target_deck: "Deck", target_deck_str: str, draw_times: int, decks: Iterable["Deck"],
+                       loc_helper: LocalizationManager, ignore: bool) -> str:
+    draw_result = target_deck.draw(draw_times, decks, loc_helper, ignore).replace("\n", " ")  # 嵌套抽取不需要换行
+    return loc_helper.format_loc_text(LOC_DRAW_RESULT_INLINE, times=draw_times, deck_name=target_deck_str, result=draw_result)
+
+
+class DeckRollToken:
+    """编译后的ROLL(...), 掷骰表达式已经解析"""
+
+    def __init__(self, roll_exp: RollExpression):
+        self.roll_exp = roll_exp
+
+    def render(self, source: "Deck", decks: Iterable["Deck"], loc_helper: LocalizationManager, ignore: bool) -> str:
+        return self.roll_exp.get_result().get_complete_result()
+
+
+class DeckDrawToken:
+    """编译后的DRAW(...), 目标牌库和固定的抽取次数已经解析"""
+
+    def __init__(self, target_deck_str: str, target_deck: Optional["Deck"], draw_times: Optional[int],
+                 roll_exp: Optional[RollExpression]):
+        """
+        Args:
+            target_deck_str: 条目中写的牌库名
+            target_deck: 目标牌库, 找不到时为None
+            draw_times: 固定的抽取次数, 由掷骰决定时为None
+            roll_exp: 决定抽取次数的掷骰表达式
+        """
+        self.target_deck_str = target_deck_str
+        self.target_deck = target_deck
+        self.draw_times = draw_times
+        self.roll_exp = roll_exp
+
+    def render(self, source: "Deck", decks: Iterable["Deck"], loc_helper: LocalizationManager, ignore: bool) -> str:
+        if self.draw_times is not None:
+            draw_times, draw_times_str = self.draw_times, str(self.draw_times)
+        else:
+            roll_res = self.roll_exp.get_result()
+            draw_times, draw_times_str = roll_res.get_val(), roll_res.get_complete_result()
+            if draw_times <= 0 or draw_times > HLDL_DRAW_LIMIT:
+                if not ignore:
+                    raise ValueError(f"DRAW({self.target_deck_str}, ...) results an invalid value! value:{draw_times}")
+                return f"{self.target_deck_str}*{draw_times_str}"
+        if not self.target_deck:
+            return f"{self.target_deck_str}*{draw_times_str}"
+        return expand_nested_draw(self.target_deck, self.target_deck_str, draw_times, decks, loc_helper, ignore)
+
+
+class DeckImgToken:
+    """编译后的IMG(...), 图片路径在加载时解析, 图片内容由get_cq_image_cached缓存"""
+
+    def __init__(self, key: str, file_path: Optional[Path], file_uri: bool):
+        """
+        Args:
+            key: 条目中写的图片路径
+            file_path: 加载时找到的图片绝对路径, 找不到时为None, 抽到时会重新查找
+            file_uri: 是否以file:///路径发送图片
+        """
+        self.key = key
+        self.file_path = file_path
+        self.file_uri = file_uri
+
+    def render(self, source: "Deck", decks: Iterable["Deck"], loc_helper: LocalizationManager, ignore: bool) -> str:
+        if self.file_path:
+            try:
+                return get_cq_image_cached(self.file_path, self.file_uri)
+            except OSError:  # 图片在加载后被删除或移动
+                pass
+        return load_deck_image(source, self.key, self.file_uri)
+
+
 class DeckItem:
     """牌库中的一个元素"""
 
@@ -78,9 +179,104 @@ class DeckItem:
         self.final_type = final_type
         if self.weight <= 0:
             self.weight = 1
+        # 编译结果, 为None时每次抽到都重新匹配高级抽卡语言
+        self.template: Optional[List[Union[str, DeckRollToken, DeckDrawToken, DeckImgToken]]] = None
+        self.errors: List[str] = []  # 编译时发现的错误
+        self.is_plain: bool = False  # 不含高级抽卡语言
+        self.image_file_uri: bool = False  # 是否以file:///路径发送图片
+
+    def compile(self, source: "Deck", deck_index: Dict[str, "Deck"], image_file_uri: bool = False) -> List[str]:
+        """
+        将高级抽卡语言编译为文本与词法单元的列表, 返回发现的错误
+        替换的顺序与逐次re.sub相同: 先ROLL, 再DRAW, 最后IMG
+        若DRAW或IMG的参数中包含ROLL或DRAW的结果, 则无法预先解析, 此时保留每次匹配的方式
+        Args:
+            source: 条目所在的牌库, 用于查找图片
+            deck_index: 牌库名到牌库的索引
+            image_file_uri: 是否以file:///路径发送图片
+        """
+        self.template, self.errors, self.image_file_uri = None, [], image_file_uri
+        text = self.content.strip()
+        self.is_plain = not ("ROLL" in text or "DRAW" in text or "IMG" in text)
+        if self.is_plain:
+            self.template = [text]
+            return self.errors
+        if TOKEN_MARK_START in text:
+            return self.errors
+        tokens: List[Union[DeckRollToken, DeckDrawToken, DeckImgToken]] = []
+        is_dynamic = False
+
+        def mark(token) -> str:
+            tokens.append(token)
+            return f"{TOKEN_MARK_START}{len(tokens) - 1}{TOKEN_MARK_END}"
+
+        def compile_roll(match):
+            roll_exp = preprocess_roll_exp(match.group(1))
+            try:
+                return mark(DeckRollToken(parse_roll_exp(preprocess_roll_exp(roll_exp))))
+            except RollDiceError:
+                self.errors.append(f"{roll_exp} in {match.group()} is an invalid roll expression!")
+                return match.group(1)
+
+        def compile_draw(match):
+            nonlocal is_dynamic
+            if TOKEN_MARK_START in match.group():
+                is_dynamic = True
+                return match.group()
+            target_deck_str = match.group(1)
+            draw_exp = preprocess_roll_exp(match.group(2)).strip()
+            draw_times: Optional[int] = None
+            roll_exp: Optional[RollExpression] = None
+            try:
+                draw_times = int(draw_exp)
+            except ValueError:
+                try:
+                    roll_exp = parse_roll_exp(preprocess_roll_exp(draw_exp))
+                except RollDiceError:
+                    self.errors.append(f"{draw_exp} in {match.group()} is an invalid roll expression!")
+                    return f"{target_deck_str}*{draw_exp}"
+            if draw_times is not None and (draw_times <= 0 or draw_times > HLDL_DRAW_LIMIT):
+                self.errors.append(f"{draw_exp} in {match.group()} results an invalid value! value:{draw_times}")
+                return f"{target_deck_str}*{draw_exp}"
+            target_deck = deck_index.get(target_deck_str)
+            if not target_deck:
+                self.errors.append(f"{target_deck_str} in {match.group()} is an invalid deck!")
+            return mark(DeckDrawToken(target_deck_str, target_deck, draw_times, roll_exp))
+
+        def compile_img(match):
+            nonlocal is_dynamic
+            if TOKEN_MARK_START in match.group():
+                is_dynamic = True
+                return match.group()
+            return mark(DeckImgToken(match.group(1), resolve_deck_image(source, match.group(1)), image_file_uri))
+
+        text = ROLL_PATTERN.sub(compile_roll, text)
+        text = DRAW_PATTERN.sub(compile_draw, text)
+        text = IMG_PATTERN.sub(compile_img, text)
+        if is_dynamic:
+            return self.errors
+        parts = TOKEN_MARK_PATTERN.split(text)
+        # split的结果中奇数位置是标记的序号
+        self.template = [tokens[int(part)] if i % 2 else part for i, part in enumerate(parts) if part]
+        return self.errors
 
     def get_result(self, source: "Deck", decks: Iterable["Deck"], loc_helper: LocalizationManager, ignore: bool = True) -> str:
         """处理高级抽卡语言"""
+        if self.template is None:
+            result = self.substitute(source, decks, loc_helper, ignore)
+        elif self.is_plain:
+            result = loc_helper.format_loc_text(LOC_DRAW_RESULT_DESIGN, result=self.template[0])
+        else:
+            if not ignore and self.errors:
+                raise ValueError(self.errors[0])
+            result = "".join([part if type(part) is str else part.render(source, decks, loc_helper, ignore)
+                              for part in self.template])
+        if self.final_type == 2:
+            raise ForceFinal(result + "\n" + loc_helper.format_loc_text(LOC_DRAW_FIN_ALL))
+        return result
+
+    def substitute(self, source: "Deck", decks: Iterable["Deck"], loc_helper: LocalizationManager, ignore: bool = True) -> str:
+        """逐次匹配并替换高级抽卡语言, 用于未编译或无法编译的条目"""
 
         def handle_roll(match):
             roll_exp = preprocess_roll_exp(match.group(1))
@@ -128,37 +324,76 @@ class DeckItem:
                     return f"{target_deck_str}*{draw_times_str}"
                 else:
                     raise ValueError(f"{target_deck_str} in {match.group()} is an invalid deck!")
-            draw_result = target_deck.draw(draw_times, decks, loc_helper, ignore).replace("\n", " ")  # 嵌套抽取不需要换行
-            #draw_result = loc_helper.format_loc_text(LOC_DRAW_RESULT_DESIGN,result=draw_result)
-            return loc_helper.format_loc_text(LOC_DRAW_RESULT_INLINE, times=draw_times, deck_name=target_deck_str,result=draw_result)
+            return expand_nested_draw(target_deck, target_deck_str, draw_times, decks, loc_helper, ignore)
 
         def handle_img(match):
-            key = match.group(1)
-            file_path_relative = Path(source.path) / key
-            file_path_absolute = Path(DATA_PATH) / DRAW_DATA_PATH / key
-            file_path_local_img = Path(LOCAL_IMG_PATH) / key
-            if file_path_relative.exists():
-                return get_cq_image(file_path_relative.read_bytes())
-            elif file_path_absolute.exists():
-                return get_cq_image(file_path_absolute.read_bytes())
-            elif file_path_local_img.exists():
-                return get_cq_image(file_path_local_img.read_bytes())
-            else:
-                dice_log(f"[DeckImage] 找不到图片 {file_path_relative.resolve()}")
-                return key
+            return load_deck_image(source, match.group(1), self.image_file_uri)
 
         result = self.content.strip()
         if "ROLL" in result or "DRAW" in result or "IMG" in result:
-            result = re.sub(r"ROLL\((.{1,30}?)\)", handle_roll, result)
-            result = re.sub(r"DRAW\((.{1,30}?),\s*(.{1,30}?)\)", handle_draw, result)
-            result = re.sub(r"IMG\((.{1,50}?\.[A-Za-z]{1,10}?)\)", handle_img, result)
+            result = ROLL_PATTERN.sub(handle_roll, result)
+            result = DRAW_PATTERN.sub(handle_draw, result)
+            result = IMG_PATTERN.sub(handle_img, result)
         else:
             result = loc_helper.format_loc_text(LOC_DRAW_RESULT_DESIGN,result=result)
-        if self.final_type == 2:
-            raise ForceFinal(result + "\n" + loc_helper.format_loc_text(LOC_DRAW_FIN_ALL))
         return result
 
 
+def build_weight_tree(weights: List[int]) -> List[int]:
+    """用O(n)的时间建立树状数组(Fenwick tree), tree[i]为下标(i - lowbit(i), i]内的权重和, tree[0]不使用"""
+    size = len(weights)
+    tree = [0] + list(weights)
+    for i in range(1, size + 1):
+        parent = i + (i & -i)
+        if parent <= size:
+            tree[parent] += tree[i]
+    return tree
+
+
+class DeckSampler:
+    """
+    一次抽卡过程中使用的加权抽样器, 抽取和移除不放回的条目都是O(log n)
+    树状数组由牌库缓存, 只有第一次移除条目时才复制一份, 所以全部放回的牌库每次抽卡不需要额外开销
+    对于同一个1到剩余权重和之间的随机数, 选中的条目与按顺序累减权重得到的条目相同
+    """
+
+    def __init__(self, deck: "Deck"):
+        self.items = deck.items
+        self.tree = deck.get_weight_tree()
+        self.shared = True  # self.tree是否仍是牌库缓存的那一份
+        self.weight_sum = deck.weight_sum
+        self.top_bit = 1 << (len(self.items).bit_length() - 1) if self.items else 0
+
+    def find(self, weight_random: int) -> int:
+        """返回前缀权重和第一次大于等于weight_random的条目下标, weight_random应在[1, weight_sum]之间"""
+        tree, size = self.tree, len(self.items)
+        pos, bit = 0, self.top_bit
+        while bit:
+            nxt = pos + bit
+            if nxt <= size and tree[nxt] < weight_random:
+                pos = nxt
+                weight_random -= tree[nxt]
+            bit >>= 1
+        return pos
+
+    def draw(self) -> Tuple[int, DeckItem]:
+        index = self.find(random.randint(1, self.weight_sum))
+        return index, self.items[index]
+
+    def remove(self, index: int) -> None:
+        """将条目移出本次抽卡"""
+        if self.shared:
+            self.tree = self.tree.copy()
+            self.shared = False
+        tree, size = self.tree, len(self.items)
+        weight = self.items[index].weight
+        self.weight_sum -= weight
+        i = index + 1
+        while i <= size:
+            tree[i] -= weight
+            i += i & -i
+
+
 class Deck:
     """牌库"""
 
@@ -168,32 +403,39 @@ class Deck:
         self.weight_sum: int = 0
         self.path = path
         self.hidden = hidden
+        self.weight_tree: Optional[List[int]] = None
 
     def add_item(self, item: DeckItem):
         self.items.append(item)
         self.weight_sum += item.weight
+        self.weight_tree = None
+
+    def compile(self, deck_index: Dict[str, "Deck"], image_file_uri: bool = False) -> List[str]:
+        """编译所有条目, 返回错误信息"""
+        errors: List[str] = []
+        for item_index, item in enumerate(self.items):
+            item_errors = item.compile(self, deck_index, image_file_uri)
+            if item_errors:
+                errors.append(f"{self.name}的第{item_index+1}个条目中存在错误: {item_errors[0]}")
+        return errors
+
+    def get_weight_tree(self) -> List[int]:
+        """返回缓存的树状数组, 不应被修改"""
+        if self.weight_tree is None:
+            self.weight_tree = build_weight_tree([item.weight for item in self.items])
+        return self.weight_tree
 
     def draw(self, times: int, decks: Iterable["Deck"], loc_helper: LocalizationManager, ignore: bool = True) -> str:
-        weight_sum_cur = self.weight_sum
-        index_mask: Set[int] = set()
+        sampler = DeckSampler(self)
         feedback: str = ""
         for t in range(times):
-            if weight_sum_cur <= 0:  # 牌库被抽光了, 全都是不放回的
+            if sampler.weight_sum <= 0:  # 牌库被抽光了, 全都是不放回的
                 feedback += loc_helper.format_loc_text(LOC_DRAW_ERR_EMPTY_DECK)
                 break
-            weight_random = random.randint(1, weight_sum_cur)
-            item_selected = None
-            for i, item in enumerate(self.items):
-                if i in index_mask:
-                    continue
-                weight_random -= item.weight
-                if weight_random <= 0:
-                    item_selected = item
-                    break
+            index, item_selected = sampler.draw()
 
             if not item_selected.redraw:  # 抽到的不放回
-                index_mask.add(self.items.index(item_selected))
-                weight_sum_cur -= item_selected.weight
+                sampler.remove(index)
 
             try:
                 content = item_selected.get_result(self, decks, loc_helper, ignore)
@@ -216,7 +458,8 @@ class Deck:
 
 
 @custom_user_command(readable_name="抽卡指令", priority=DPP_COMMAND_PRIORITY_DEFAULT,
-                     flag=DPP_COMMAND_FLAG_DRAW)
+                     flag=DPP_COMMAND_FLAG_DRAW,
+                     prefixes=(".draw", ".deck"))
 class DeckCommand(UserCommandBase):
     """
     .draw 指令, 从牌库中抽取
@@ -225,6 +468,7 @@ class DeckCommand(UserCommandBase):
     def __init__(self, bot: Bot):
         super().__init__(bot)
         self.deck_dict: Dict[str, Deck] = {}
+        self.deck_index: Dict[str, Deck] = {}  # 以牌库原名为键, 用于解析DRAW(...)
 
         bot.loc_helper.register_loc_text(LOC_DRAW_RESULT, "Draw {times} times from {deck_name}:\n{result}",
                                          f"抽卡回复, times为次数, deck_name为牌库名, result由{LOC_DRAW_SINGLE}和{LOC_DRAW_MULTI}定义")
@@ -244,6 +488,8 @@ class DeckCommand(UserCommandBase):
 
         bot.cfg_helper.register_config(CFG_DECK_ENABLE, "1", "抽卡指令开关")
         bot.cfg_helper.register_config(CFG_DECK_DATA_PATH, f"./{DRAW_DATA_PATH}", "牌库指令的数据来源, .代表Data文件夹")
+        bot.cfg_helper.register_config(CFG_DECK_IMAGE_FILE_URI, "0",
+                                       "牌库图片的发送方式, 0为发送base64编码的图片, 1为发送file:///路径 (仅当OneBot客户端与骰娘在同一台机器上时可用)")
 
     def delay_init(self) -> List[str]:
         # 从本地文件中读取资料
@@ -251,17 +497,31 @@ class DeckCommand(UserCommandBase):
         for i, path in enumerate(data_path_list):
             if path.startswith("./"):  # 用DATA_PATH作为当前路径
                 data_path_list[i] = os.path.join(DATA_PATH, path[2:])
-        init_info: List[str] = []
-        for data_path in data_path_list:
-            self.load_data_from_path(data_path, init_info)
-        for deck in self.deck_dict.values():
-            for item in deck.items:
-                try:
-                    item.get_result(deck, self.deck_dict.values(), self.bot.loc_helper, False)
-                except ForceFinal:
-                    pass
-                except ValueError as e:
-                    init_info.append(f"{deck.name}的第{deck.items.index(item)+1}个条目中存在错误: {e.args[0]}")
+        try:
+            image_file_uri = int(self.bot.cfg_helper.get_config(CFG_DECK_IMAGE_FILE_URI)[0]) != 0
+        except (ValueError, IndexError):
+            image_file_uri = False
+
+        def load_decks() -> Tuple[Dict[str, Deck], Dict[str, Deck], List[str]]:
+            error_info: List[str] = []
+            self.deck_dict = {}
+            for data_path in data_path_list:
+                self.load_data_from_path(data_path, error_info)
+            # 按牌库名建立索引并预先编译所有条目, 错误只在加载时报告一次
+            deck_index: Dict[str, Deck] = {}
+            for deck in self.deck_dict.values():
+                deck_index.setdefault(deck.name, deck)
+            for deck in self.deck_dict.values():
+                error_info += deck.compile(deck_index, image_file_uri)
+            return self.deck_dict, deck_index, error_info
+
+        def get_asset_key() -> Hashable:
+            return tuple(get_path_signature(path, (".xlsx",)) for path in data_path_list), image_file_uri
+
+        # 数据文件与设置都相同的账号共享同一份牌库, 牌库加载后只读
+        self.deck_dict, self.deck_index, load_info = ASSET_REGISTRY.acquire(self.bot.account, DECK_ASSET_SLOT,
+                                                                            get_asset_key, load_decks)
+        init_info: List[str] = list(load_info)
         init_info.append(self.get_state())
         return init_info
 
@@ -341,7 +601,7 @@ class DeckCommand(UserCommandBase):
     def load_data_from_path(self, path: str, error_info: List[str]) -> None:
         """从指定文件或目录读取信息"""
 
-        def load_data_from_xlsx(wb: openpyxl.Workbook):
+        def load_data_from_xlsx(wb: CachedWorkbook):
             data_dict = col_based_workbook_to_dict(wb, DECK_ITEM_FIELD, error_info)
             for sheet_name in data_dict.keys():
                 sheet_data = data_dict[sheet_name]
@@ -394,7 +654,7 @@ class DeckCommand(UserCommandBase):
         if path.endswith(".xlsx"):
             if os.path.exists(path):  # 存在文件则读取文件
                 try:
-                    workbook = read_xlsx(path)
+                    workbook = read_xlsx_cached(path)  # 文件没有变化时直接使用缓存, 不需要再解析xlsx
                 except PermissionError:
                     error_info.append(f"读取{path}时遇到错误: 权限不足")
                     return
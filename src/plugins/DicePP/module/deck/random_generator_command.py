@@ -2,7 +2,7 @@
 随机生成器指令, 从资料库中随机生成材料并回复给用户
 """
 import os
-from typing import List, Tuple, Any, Dict, Optional
+from typing import List, Tuple, Any, Dict, Optional, Hashable
 from pathlib import Path
 import openpyxl
 
@@ -12,8 +12,9 @@ from core.command.const import *
 from core.command import UserCommandBase, custom_user_command
 from core.command import BotCommandBase, BotSendMsgCommand
 from core.communication import MessageMetaData, PrivateMessagePort, GroupMessagePort
-from utils.localdata import read_xlsx, update_xlsx
+from utils.localdata import read_xlsx, read_xlsx_cached, update_xlsx, snapshot_worksheet, normalize_sheet_rows
 from utils.string import match_substring
+from utils.asset import ASSET_REGISTRY, get_path_signature
 
 from module.deck.random_generator_data import RandomDataSource, RandomGenerateContext
 
@@ -25,10 +26,12 @@ CFG_RAND_GEN_ENABLE = "random_gen_enable"
 CFG_RAND_GEN_DATA_PATH = "random_gen_data_path"
 RAND_GEN_DATA_PATH = "RandomGenData"
 META_FILE_NAME = "rule.xlsx"
+RAND_GEN_ASSET_SLOT = "random_gen"  # 在共享资源登记表中的槽位
 
 
 @custom_user_command(readable_name="随机生成器指令", priority=DPP_COMMAND_PRIORITY_DEFAULT,
-                     flag=DPP_COMMAND_FLAG_DRAW)
+                     flag=DPP_COMMAND_FLAG_DRAW,
+                     prefixes=(".随机",))
 class RandomGeneratorCommand(UserCommandBase):
 
     def __init__(self, bot: Bot):
@@ -52,15 +55,27 @@ class RandomGeneratorCommand(UserCommandBase):
                 data_path_list[i] = os.path.join(DATA_PATH, path[2:])
             data_path_list[i] = Path(data_path_list[i])
         data_path_list: List[Path]
-        data_dir_path_list: List[Path] = []
         for data_path in data_path_list:
-            if data_path.exists():
-                data_dir_path_list += [path for path in data_path.iterdir() if path.is_dir()]
-            else:
+            if not data_path.exists():
                 data_path.mkdir(parents=True)
-        init_info: List[str] = []
-        self.init_from_data_dir(data_dir_path_list, init_info)
-        self.finalize_init(init_info)
+
+        def load_sources() -> Tuple[List[RandomDataSource], Dict[str, RandomDataSource], List[str]]:
+            data_dir_path_list: List[Path] = []
+            for data_path in data_path_list:
+                data_dir_path_list += [path for path in data_path.iterdir() if path.is_dir()]
+            error_info: List[str] = []
+            self.source_list = []
+            self.init_from_data_dir(data_dir_path_list, error_info)
+            self.finalize_init(error_info)
+            return self.source_list, self.source_name_dict, error_info
+
+        def get_asset_key() -> Hashable:
+            return tuple(get_path_signature(str(path)) for path in data_path_list)
+
+        # 数据文件相同的账号共享同一份生成器, 每日次数限制仍记录在各自的指令中
+        self.source_list, self.source_name_dict, load_info = ASSET_REGISTRY.acquire(self.bot.account, RAND_GEN_ASSET_SLOT,
+                                                                                    get_asset_key, load_sources)
+        init_info: List[str] = list(load_info)
         # init_info.append(self.get_state())
         return init_info
 
@@ -175,12 +190,14 @@ class RandomGeneratorCommand(UserCommandBase):
         return wb
 
     def process_meta_file(self, meta_path: Path, error_info: List[str]):
+        """从缓存的快照中读取规则, 只有规范化后的内容与文件不同时才回写表格"""
         assert meta_path.suffix == ".xlsx"
         try:
-            wb = read_xlsx(str(meta_path.resolve()))
+            wb = read_xlsx_cached(str(meta_path.resolve()))
         except PermissionError:
             error_info.append(f"读取{meta_path}时遇到错误: 权限不足")
             return
+        loaded_sources: List[Tuple[str, RandomDataSource]] = []
         for name in wb.sheetnames:
             ws = wb[name]
             new_source = RandomDataSource("", meta_path.parent)
@@ -190,7 +207,15 @@ class RandomGeneratorCommand(UserCommandBase):
                 error_info.append(error)
             else:
                 self.source_list.append(new_source)
-                new_source.write_to_sheet(ws)
+                loaded_sources.append((name, new_source))
+        if all(is_source_saved(name, wb[name], source) for name, source in loaded_sources):
+            return
+        wb = read_xlsx(str(meta_path.resolve()))
+        for name, source in loaded_sources:
+            ws = wb[name]
+            source.write_to_sheet(ws)
+            if source.name:
+                ws.title = source.name
         update_xlsx(wb, str(meta_path.resolve()))
         wb.close()
 
@@ -218,3 +243,15 @@ class RandomGeneratorCommand(UserCommandBase):
         for source in self.source_list:
             if source.name:
                 self.source_name_dict[source.name] = source
+
+
+def is_source_saved(sheet_name: str, sheet, source: RandomDataSource) -> bool:
+    """名为sheet_name的工作表快照是否已经与source规范化写入后的内容一致"""
+    if source.name and sheet_name != source.name:
+        return False
+    temp_wb = openpyxl.Workbook()
+    temp_ws = temp_wb.active
+    source.write_to_sheet(temp_ws)
+    rows, comments = snapshot_worksheet(temp_ws)
+    temp_wb.close()
+    return normalize_sheet_rows(sheet.rows) == normalize_sheet_rows(rows) and sheet.comments == comments
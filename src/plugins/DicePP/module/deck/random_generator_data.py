@@ -1,4 +1,4 @@
-from typing import List, Tuple, Any, Dict, Optional, Set
+from typing import List, Tuple, Any, Dict, Optional, Set, Union
 from pathlib import Path
 from enum import Enum
 from datetime import datetime
@@ -11,8 +11,8 @@ from openpyxl.comments import Comment
 from core.config import DATA_PATH
 from module.roll import is_roll_exp, exec_roll_exp
 from utils.time import get_current_date_raw, datetime_to_str_day, datetime_to_str_week, datetime_to_str_month
-from utils.cq_code import get_cq_image
-from utils.localdata import read_xlsx
+from utils.cq_code import get_cq_image_cached
+from utils.localdata import read_xlsx_cached, CachedWorksheet
 
 RAND_SOURCE_FIELD_NAME = "生成器名称"
 RAND_SOURCE_FIELD_VISIBLE = "是否可见"
@@ -145,14 +145,13 @@ class RandomItem:
             elif resolved_path.is_file() and resolved_path.suffix == ".xlsx":
                 self.source_type = RandomSourceType.Workbook
                 self.auxiliary_data: List[str] = []
-                wb = read_xlsx(str(resolved_path.resolve()))
+                wb = read_xlsx_cached(str(resolved_path.resolve()))
                 if not sheet_name:
                     sheet_name = wb.sheetnames[0]
                 assert sheet_name in wb.sheetnames, f"工作表{sheet_name}不存在"
-                ws: Worksheet = wb[sheet_name]
+                ws = wb[sheet_name]
                 for col in ws.iter_cols(values_only=True):
                     self.auxiliary_data += [str(value).strip() for value in col if str(value) and str(value).strip()]
-                wb.close()
         elif self.source.startswith("/"):
             # [GlobalSource]
             assert self.source in global_source_dict, f"全局路径{self.source}不存在"
@@ -185,7 +184,7 @@ class RandomItem:
                 if file_type == SourceFileType.TXT:
                     result += file_path.read_text()
                 elif file_type == SourceFileType.IMG:
-                    result += get_cq_image(file_path.read_bytes())
+                    result += get_cq_image_cached(file_path)
                 else:
                     return "无效文件类型"
         elif self.source_type == RandomSourceType.Workbook:
@@ -296,8 +295,8 @@ class RandomDataSource:
                 # 写入参数
                 target.cell(row=row_index, column=column_index, value=val_text)
 
-    def read_from_sheet(self, target: Worksheet) -> str:
-        """不会抛出异常, 返回错误信息, 返回空字符串说明读取成功"""
+    def read_from_sheet(self, target: Union[Worksheet, CachedWorksheet]) -> str:
+        """不会抛出异常, 返回错误信息, 返回空字符串说明读取成功, target可以是工作表的只读快照"""
         # 读取根规则
         first_item_row = -1
         for row in target.iter_rows(min_row=1):
@@ -169,7 +169,9 @@ def get_random_delay() -> float:
 
 
 @custom_user_command(readable_name="Hub指令", priority=DPP_COMMAND_PRIORITY_DEFAULT,
-                     flag=DPP_COMMAND_FLAG_HUB)
+                     flag=DPP_COMMAND_FLAG_HUB,
+                     prefixes=(".hub", f"{HUB_MSG_LABEL}{HUB_MSG_SEP}"),
+                     tick_period=60)
 class HubCommand(UserCommandBase):
     """
     控制不同机器人之间的交互
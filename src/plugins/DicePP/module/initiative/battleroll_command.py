@@ -40,7 +40,8 @@ LOC_BR_BUFF_TIME_KEYWORD = "battleroll_buff_time_keyword"
 @custom_user_command(readable_name="战斗轮指令",
                      priority=-1,
                      group_only=True,
-                     flag=DPP_COMMAND_FLAG_BATTLE)
+                     flag=DPP_COMMAND_FLAG_BATTLE,
+                     prefixes=(".br", ".battleroll", ".战斗轮", ".轮次", ".round", ".回合", ".turn", ".跳过", ".skip", ".结束", ".ed"))
 class BattlerollCommand(UserCommandBase):
 
     def __init__(self, bot: Bot):
@@ -33,7 +33,8 @@ LOC_INIT_ERROR = "initiative_error"
 @custom_user_command(readable_name="先攻指令",
                      priority=-1,  # 要比掷骰命令前, 否则.r会覆盖.ri
                      group_only=True,
-                     flag=DPP_COMMAND_FLAG_DND | DPP_COMMAND_FLAG_BATTLE)
+                     flag=DPP_COMMAND_FLAG_DND | DPP_COMMAND_FLAG_BATTLE,
+                     prefixes=(".ri", ".init", ".先攻"))
 class InitiativeCommand(UserCommandBase):
     """
     先攻指令, 以.init开头
@@ -244,9 +245,9 @@ class InitiativeCommand(UserCommandBase):
                         assert 1 <= num <= 10
                     except (ValueError, AssertionError):
                         return [BotSendMsgCommand(self.bot.account, f"{num}不是一个有效的数字 (1~10)", [port])]
-                    for i in range(num):
-                        # 获取先攻结果
-                        name_dict[n + chr(ord("A") + i)] = roll_exp.get_result()
+                    # 获取先攻结果
+                    for i, res in enumerate(roll_exp.get_results(num)):
+                        name_dict[n + chr(ord("A") + i)] = res
                 else:
                     # 获取先攻结果
                     name_dict[n] = roll_exp.get_result()
@@ -23,7 +23,8 @@ MAX_COC_RESULT_LEN = 50
 
 @custom_user_command(readable_name="COC属性指令",
                      priority=DPP_COMMAND_PRIORITY_DEFAULT,
-                     flag=DPP_COMMAND_FLAG_FUN | DPP_COMMAND_FLAG_DND)
+                     flag=DPP_COMMAND_FLAG_FUN | DPP_COMMAND_FLAG_DND,
+                     prefixes=(".coc",))
 class UtilsCOCCommand(UserCommandBase):
     """
     .coc指令, 相当于3#2d6*5+30与6#3d6*5, 可以重复投多次, 如.coc5
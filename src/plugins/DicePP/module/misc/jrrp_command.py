@@ -16,7 +16,8 @@ LOC_JRRP_MIN = "jrrp_min"
 LOC_JRRP_MAX = "jrrp_max"
 
 @custom_user_command(readable_name="今日人品", priority=DPP_COMMAND_PRIORITY_DEFAULT,
-                     flag=DPP_COMMAND_FLAG_FUN)
+                     flag=DPP_COMMAND_FLAG_FUN,
+                     prefixes=(".jrrp",))
 class JrrpCommand(UserCommandBase):
 
     def __init__(self, bot: Bot):
@@ -17,7 +17,8 @@ from core.statistics import GroupStatInfo, UserStatInfo, UserCommandStatInfo, Ro
 # LOC_TEMP = "template_loc"
 
 
-@custom_user_command(readable_name="指令模板", priority=DPP_COMMAND_PRIORITY_DEFAULT, flag=DPP_COMMAND_FLAG_INFO)
+@custom_user_command(readable_name="指令模板", priority=DPP_COMMAND_PRIORITY_DEFAULT, flag=DPP_COMMAND_FLAG_INFO,
+                     prefixes=(".统计",))
 class StatisticsCommand(UserCommandBase):
     """
     统计指令, 返回用户或群聊的一些统计信息
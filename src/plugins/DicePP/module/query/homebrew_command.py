@@ -45,7 +45,8 @@ CFG_QUERY_DATA_PATH = "query_data_path"
                      priority=2,
                      group_only=True,
                      flag=DPP_COMMAND_FLAG_QUERY,
-                     permission_require=1 # 限定群管理/骰管理使用
+                     permission_require=1, # 限定群管理/骰管理使用
+                     prefixes=(".私设", ".房规", ".homebrew", ".hb")
                      )
 class HomebrewCommand(UserCommandBase):
     """
@@ -205,13 +206,14 @@ class HomebrewCommand(UserCommandBase):
         return result
     
     def clean_homebrews(self, db: str, name: str = "") -> str:
-        from module.query.query_database import CONNECTED_QUERY_DATABASES, DATABASE_CURSOR
+        from module.query.query_database import CONNECTED_QUERY_DATABASES, DATABASE_CURSOR, update_query_index_signature
         if name == "":
             return "你必须指定一个私设来源才能进行此操作"
         if db in CONNECTED_QUERY_DATABASES.keys():
             cursor = DATABASE_CURSOR[db]
             cursor.execute("delete from data where 来源 like '私设:" + name + "'")
             CONNECTED_QUERY_DATABASES[db].commit()
+            update_query_index_signature(CONNECTED_QUERY_DATABASES[db])
             return self.format_loc(LOC_HOMEBREW_CLEAN_FINISHED,name = name)
         else:
             return f"未加载 {db} 私设条目。"
@@ -1,5 +1,6 @@
 from typing import List, Tuple, Dict, Optional, Set, Literal, Iterable, Any
 import os
+import asyncio
 import datetime
 #import openpyxl
 import sqlite3
@@ -22,6 +23,10 @@ from utils.time import get_current_date_raw
 from utils.data import yield_deduplicate
 
 from module.query.query_database import CONNECTED_QUERY_DATABASES, DATABASE_CURSOR, create_query_database, connect_query_database, disconnect_query_database, regexp_normalize
+from module.query.query_database import FTS_QUERY_DATABASES, QUERY_FTS_TABLE, QUERY_FTS_TARGETS, QUERY_FTS_MIN_LEN, fts_phrase, \
+    update_query_index_signature
+from module.query.query_database import QUERY_EXECUTOR, borrow_query_connections, get_query_cursor
+from utils.logger import dice_log
 
 LOC_QUERY_RESULT = "query_result"
 LOC_QUERY_SINGLE_RESULT = "query_single_result"
@@ -33,6 +38,8 @@ LOC_QUERY_MULTI_RESULT_PAGE_OVERFLOW = "query_multi_result_page_overflow"
 LOC_QUERY_MULTI_RESULT_CATALOGUE = "query_multi_result_catalogue"
 LOC_QUERY_NO_RESULT = "query_no_result"
 LOC_QUERY_TOO_MUCH_RESULT = "query_too_much_result"
+LOC_QUERY_TIMEOUT = "query_timeout"
+LOC_QUERY_BUSY = "query_busy"
 LOC_QUERY_KEY_NUM_EXCEED = "query_key_num_exceed"
 LOC_QUERY_CELL_BOOK = "query_cell_book"
 LOC_QUERY_CELL_REDIRECT = "query_cell_redirect"
@@ -51,6 +58,8 @@ MAX_QUERY_ITEM_NUM = 1000  # 最多能查询多少条目
 RECORD_RESPONSE_TIME = 60  # 至多响应多久以前的查询指令, 多余的将被清理, 单位为秒
 RECORD_EDIT_RESPONSE_TIME = 600  # 至多响应多久以前的编辑指令, 多余的将被清理, 单位为秒
 RECORD_CLEAN_FREQ = 50  # 每隔多少次查询指令尝试清理一次查询记录
+QUERY_TIMEOUT = 10  # 单次查询在数据库中最多执行多久, 单位为秒
+MAX_GROUP_QUERY_NUM = 2  # 每个群(私聊为每个用户)最多同时进行多少个查询
 
 QUERY_DELETE_MAGICWORD = "DELETE"  # 删除查询条目必须回复的密文
 
@@ -290,11 +299,13 @@ class QueryRecord:
             if data.data_name != data.original_data[0] and data.original_data[0] != "":
                 cursor.execute("UPDATE redirect SET 重定向 = ? WHERE 重定向 == ?",(data.data_name,data.original_data[0]))
         database.commit()
+        update_query_index_signature(database)
     
     def delete(self, database, cursor):
         data = self.data[0]
         cursor.execute("DELETE FROM data" + data.origin_check())
         database.commit()
+        update_query_index_signature(database)
 
 class QueryError(Exception):
     """
@@ -321,6 +332,7 @@ class QueryCommand(UserCommandBase):
         #self.item_uuid_dict: Dict[int, QueryItem] = {}  # key为item uuid
         #self.src_uuid_dict: Dict[int, QuerySource] = {}  # key为source uuid
         self.record_dict: Dict[MessagePort, QueryRecord] = {}
+        self.running_query_num: Dict[str, int] = {}  # key为群号(私聊为用户id), value为正在进行的查询数量
         #CONNECTED_QUERY_DATABASES: Dict[str] = {}
         self.record_clean_flag: int = 0
 
@@ -337,6 +349,8 @@ class QueryCommand(UserCommandBase):
         reg_loc(LOC_QUERY_MULTI_RESULT_PAGE_OVERFLOW, "已经是最后一页了!", "用户尝试在最后一页往后翻页时的提醒")
         reg_loc(LOC_QUERY_NO_RESULT, "未能查询到内容...", "查询失败时的提示")
         reg_loc(LOC_QUERY_TOO_MUCH_RESULT, "查询到过多内容...", "查询到过多内容时的提示")
+        reg_loc(LOC_QUERY_TIMEOUT, "查询超时, 请尝试使用更精确的关键词", "查询耗时过长被中断时的提示")
+        reg_loc(LOC_QUERY_BUSY, "正在进行的查询过多, 请稍后再试", "同一群内同时进行的查询超过上限时的提示")
         reg_loc(LOC_QUERY_KEY_NUM_EXCEED, "关键词数量上限{key_num}个",
                 "用户查询时使用过多关键字时的提示 {key_num}为关键字数量上限")
         reg_loc(LOC_QUERY_CELL_BOOK, "\n来源：{book}",
@@ -551,11 +565,16 @@ class QueryCommand(UserCommandBase):
             if database not in CONNECTED_QUERY_DATABASES.keys():
                 feedback = "未加载的数据库。"
             else:
-                feedback = self.query_info(database, homebrew_database, arg_str, source_port, search_mode=( 0 if mode == "query" else 1), show_mode=show_mode)
-                if feedback:
-                    feedback = self.format_loc(LOC_QUERY_RESULT, result = feedback)
-                else:
-                    feedback = self.format_loc(LOC_QUERY_NO_RESULT)
+                self.record_dict.pop(source_port, None)  # 清空过往记录
+                search_mode = 0 if mode == "query" else 1
+                if self.bot.is_scheduler_running():  # 在查询线程中进行, 结果通过异步任务发送
+                    feedback = self.start_query_task(meta.group_id if meta.group_id else "private:" + meta.user_id, port, database, homebrew_database,
+                                                     arg_str, source_port, search_mode, show_mode)
+                else:  # 在Debug中, 没有运行调度器
+                    result, record = self.query_info(database, homebrew_database, arg_str, search_mode=search_mode, show_mode=show_mode)
+                    feedback = self.format_query_result(result)
+                    if record:
+                        self.record_dict[source_port] = record
         elif mode == "select":
             record = self.record_dict[source_port]
             if record.filter_mode == 0:
@@ -569,7 +588,10 @@ class QueryCommand(UserCommandBase):
                         feedback = record.choose_edit_target(index)
                     else:
                         item = record.data[index]
-                        feedback = self.format_loc(LOC_QUERY_RESULT, result = self.query_feedback(database, homebrew_database,item, source_port))
+                        result, sub_record = self.query_feedback(database, homebrew_database, item)
+                        feedback = self.format_loc(LOC_QUERY_RESULT, result = result)
+                        if sub_record:
+                            self.record_dict[source_port] = sub_record
             else:
                 index = int(arg_str)
                 if index >= len(record.catalogue_list.keys()):
@@ -779,7 +801,10 @@ class QueryCommand(UserCommandBase):
             self.record_clean_flag = 0
             self.clean_records()
         
-        #分割显示查询结果
+        return self.build_feedback_commands(feedback, port)
+
+    def build_feedback_commands(self, feedback: str, port: MessagePort) -> List[BotCommandBase]:
+        """分割显示查询结果"""
         command = []
         feedback_superlines = feedback.split("\n\n")
         for superline in feedback_superlines:
@@ -826,14 +851,63 @@ class QueryCommand(UserCommandBase):
     def get_description(self) -> str:
         return ".查询 根据关键字查找资料 .搜索 根据关键字和内容查找资料"
 
-    def query_info(self, database: str, homebrew_database: str, query_keywords: str, port: MessagePort, search_mode: int, show_mode: int = 0) -> str:
+    def start_query_task(self, group_key: str, port: MessagePort, database: str, homebrew_database: str, query_keywords: str,
+                         source_port: MessagePort, search_mode: int, show_mode: int) -> str:
+        """
+        立即在查询线程中开始查询, 查询结果由异步任务发送, 返回需要立即回复的内容(超出并发上限时的提示)
         """
-        查询信息, 返回输出给用户的字符串, 若给出选项将会记录信息以便响应用户之后的快速查询.
+        if self.running_query_num.get(group_key, 0) >= MAX_GROUP_QUERY_NUM:
+            return self.format_loc(LOC_QUERY_BUSY)
+        self.running_query_num[group_key] = self.running_query_num.get(group_key, 0) + 1
+
+        def on_query_done(_):
+            self.running_query_num[group_key] -= 1
+            if self.running_query_num[group_key] <= 0:
+                del self.running_query_num[group_key]
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(QUERY_EXECUTOR, self.query_info_pooled, database, homebrew_database, query_keywords,
+                                      search_mode, show_mode)
+        future.add_done_callback(on_query_done)
+
+        async def query_task():
+            feedback, record = await future
+            if record:  # 查询线程不修改record_dict, 回到事件循环后再记录
+                self.record_dict[source_port] = record
+            return self.build_feedback_commands(feedback, port)
+
+        def query_timeout_callback():
+            return [BotSendMsgCommand(self.bot.account, self.format_loc(LOC_QUERY_TIMEOUT), [port])]
+
+        # 超时由查询线程中的progress handler处理, 这里的超时只是兜底
+        self.bot.register_task(query_task, timeout=QUERY_TIMEOUT * 2, timeout_callback=query_timeout_callback)
+        return ""
+
+    def query_info_pooled(self, database: str, homebrew_database: str, query_keywords: str,
+                          search_mode: int, show_mode: int = 0) -> Tuple[str, Optional[QueryRecord]]:
+        """在查询线程中调用query_info, 使用只读连接池, 超过QUERY_TIMEOUT的查询会被中断, 返回值与query_info相同"""
+        try:
+            with borrow_query_connections([database, homebrew_database], QUERY_TIMEOUT):
+                feedback, record = self.query_info(database, homebrew_database, query_keywords, search_mode, show_mode)
+        except sqlite3.OperationalError as e:
+            if "interrupted" not in str(e):
+                raise
+            return self.format_loc(LOC_QUERY_TIMEOUT), None
+        return self.format_query_result(feedback), record
+
+    def format_query_result(self, feedback: str) -> str:
+        if feedback:
+            return self.format_loc(LOC_QUERY_RESULT, result = feedback)
+        else:
+            return self.format_loc(LOC_QUERY_NO_RESULT)
+
+    def query_info(self, database: str, homebrew_database: str, query_keywords: str, search_mode: int, show_mode: int = 0) \
+            -> Tuple[str, Optional[QueryRecord]]:
+        """
+        查询信息, 返回输出给用户的字符串与需要记录的查询记录, 调用方将记录写入record_dict以便响应用户之后的快速查询.
+        可能在查询线程中调用, 不会修改record_dict
         search_mode != 0则使用全文查找
         """
-        # 清空过往记录
-        if port in self.record_dict:
-            del self.record_dict[port]
         # 编辑模式
         if show_mode == 9:
             edit_flag = True
@@ -844,40 +918,41 @@ class QueryCommand(UserCommandBase):
         try:
             poss_result = self.query_item(database, homebrew_database if not edit_flag else "", query_keywords, search_mode)
         except QueryError:
-            return self.format_loc(LOC_QUERY_TOO_MUCH_RESULT)
+            return self.format_loc(LOC_QUERY_TOO_MUCH_RESULT), None
         poss_result_num: int = len(poss_result)
 
         feedback: str = ""
         poss_result_num = len(poss_result)
-        # 处理
+        # 处理, 查询可能在其他线程上进行, 记录由调用方写入record_dict
+        record: Optional[QueryRecord] = None
         if not poss_result or poss_result_num == 0:  # 找不到结果
-            return ""
+            return "", None
         elif poss_result_num == 1:  # 找到唯一结果
             if edit_flag:
-                self.record_dict[port] = QueryRecord(poss_result, database, get_current_date_raw(), poss_result_num)
-                self.record_dict[port].show_mode = show_mode
-                self.record_dict[port].edit_flag = edit_flag
-                feedback = self.record_dict[port].choose_edit_target(0)
+                record = QueryRecord(poss_result, database, get_current_date_raw(), poss_result_num)
+                record.show_mode = show_mode
+                record.edit_flag = edit_flag
+                feedback = record.choose_edit_target(0)
             else:
-                feedback = self.query_feedback(database,homebrew_database,poss_result[0],port)
+                feedback, record = self.query_feedback(database, homebrew_database, poss_result[0])
         else:  # len(poss_result) > 1  找到多个结果, 记录当前信息并提示用户选择
             # 记录当前信息以备将来查询或编辑
-            self.record_dict[port] = QueryRecord(poss_result, database, get_current_date_raw(), poss_result_num)
-            self.record_dict[port].show_mode = show_mode
-            self.record_dict[port].edit_flag = edit_flag
+            record = QueryRecord(poss_result, database, get_current_date_raw(), poss_result_num)
+            record.show_mode = show_mode
+            record.edit_flag = edit_flag
             page_item_num = MAX_QUERY_CANDIDATE_NUM if show_mode != 0 else MAX_QUERY_CANDIDATE_SIMPLE_NUM
             filter_mode: int = 1 if (poss_result_num >= page_item_num) else 0
-            self.record_dict[port].filter_mode = filter_mode
+            record.filter_mode = filter_mode
             
             #处理分类
-            if self.record_dict[port].filter_mode == 1:
-                self.record_dict[port].create_catalogue_list()
+            if record.filter_mode == 1:
+                record.create_catalogue_list()
             else:
-                self.record_dict[port].process_data()
+                record.process_data()
             #以分类模式显示结果
-            if self.record_dict[port].filter_mode == 1:
+            if record.filter_mode == 1:
                 show_result: List[QueryData] = []
-                for key,num in self.record_dict[port].catalogue_list.items():
+                for key,num in record.catalogue_list.items():
                     show_result.append(key + " (" + str(num) + ")")
                 feedback = self.format_loc(LOC_QUERY_MULTI_RESULT_CATALOGUE) + "\n" + self.format_catalogues_list_feedback(show_result)
             #直接显示结果
@@ -887,7 +962,7 @@ class QueryCommand(UserCommandBase):
                 if poss_result_num > page_item_num:
                     feedback += "\n" + self.format_loc(LOC_QUERY_MULTI_RESULT_PAGE, page_cur=1,
                                                        page_total=poss_result_num // page_item_num + 1)
-        return feedback
+        return feedback, record
     
     def command_split(self,keywords: str) -> List[str]:
         """
@@ -1055,10 +1130,9 @@ class QueryCommand(UserCommandBase):
         """
         搜索合规的对象
         """
-        sql_search_command_prefix: str = "Select * From data Where " #查询指令前缀
         sql_redirect_command_prefix: str = "Select * From redirect Where " #查询指令前缀
         sql_command_suffix: str = "" #" COLLATE NOCASE" #查询指令后缀
-        query_sqlcur = DATABASE_CURSOR[database] # 指针
+        query_sqlcur = get_query_cursor(database) # 指针
         cursor: sqlite3.Cursor
         query_result: List[QueryData] = []
         result_length: int = 0
@@ -1125,9 +1199,7 @@ class QueryCommand(UserCommandBase):
         if condition_size == 0:
             return []
         # 正常查询
-        sql_condition = self.generate_search_conditions(condition_list)
-        #print(sql_condition)
-        cursor = query_sqlcur.execute(sql_search_command_prefix + sql_condition + sql_command_suffix)
+        cursor = self.execute_data_search(database, condition_list)
         for _data in cursor:
             query_result.append(QueryData(_data,database=database))
             result_length += 1
@@ -1155,8 +1227,7 @@ class QueryCommand(UserCommandBase):
                 if len(redirect_condition_list) > 0:
                     for _redirect in redirect_result:
                         sql_condition_list[("名称",)] = [[_redirect[1]]]
-                        sql_condition = self.generate_search_conditions(sql_condition_list)
-                        cursor = query_sqlcur.execute(sql_search_command_prefix + sql_condition+ sql_command_suffix)
+                        cursor = self.execute_data_search(database, sql_condition_list)
                         for _data in cursor:
                             query_result.append(QueryData(_data,_redirect[0],database))
                             result_length += 1
@@ -1194,9 +1265,9 @@ class QueryCommand(UserCommandBase):
         # 查询结束
         return new_query_result
 
-    def query_feedback(self, database: str, homebrew_database: str, item: QueryData, port: MessagePort) -> str:
+    def query_feedback(self, database: str, homebrew_database: str, item: QueryData) -> Tuple[str, Optional[QueryRecord]]:
         """
-        生成查询到目标的返回文本，包括处理嵌套查询
+        生成查询到目标的返回文本，包括处理嵌套查询, 有嵌套查询时同时返回需要记录的查询记录
         """
         item_lines = item.data_content.splitlines()
         # 处理嵌套查询
@@ -1236,13 +1307,59 @@ class QueryCommand(UserCommandBase):
                     item_lines[index] = self.format_loc(LOC_QUERY_TOO_MUCH_RESULT)
             else:
                 item_lines[index] = item_lines[index].strip()
+        record: Optional[QueryRecord] = None
         if len(sub_query_items) > 0:
             # 记录嵌套查询内容
-            if port in self.record_dict:
-                del self.record_dict[port]
-            self.record_dict[port] = QueryRecord(sub_query_items, database, get_current_date_raw(), len(sub_query_items))
+            record = QueryRecord(sub_query_items, database, get_current_date_raw(), len(sub_query_items))
         item.data_content = "\n".join(item_lines)
-        return self.format_item_feedback(item)
+        return self.format_item_feedback(item), record
+
+    def execute_data_search(self, database: str, condition_list: Dict[tuple,List[List[str]]]) -> sqlite3.Cursor:
+        """
+        在data表中搜索满足条件的条目
+        数据库有全文索引时, 先用索引找出候选行, 正则条件只作为候选行上的精确过滤; 否则逐行正则匹配
+        """
+        query_sqlcur = get_query_cursor(database)
+        sql_condition = self.generate_search_conditions(condition_list)
+        fts_match = self.generate_search_fts(condition_list) if database in FTS_QUERY_DATABASES else ""
+        if fts_match:
+            try:
+                return query_sqlcur.execute(
+                    f"Select * From data Where rowid In (Select rowid From {QUERY_FTS_TABLE} Where {QUERY_FTS_TABLE} Match ?)"
+                    f" And {sql_condition} Order By rowid", (fts_match,))
+            except sqlite3.OperationalError as e:
+                dice_log(f"[Query] 全文索引查询失败, 改为逐行匹配: {e}")
+        return query_sqlcur.execute("Select * From data Where " + sql_condition)
+
+    def generate_search_fts(self, condition_list: Dict[tuple,List[List[str]]]) -> str:
+        """
+        生成全文索引的MATCH表达式, 只包含能用索引缩小范围的条件, 没有这样的条件时返回空字符串
+        一组候选词(用/分隔)中所有词都是至少3个字符的普通关键字或=精确关键字时才能使用索引, 排除关键字(-)无法使用索引
+        索引中的列与正则匹配一样是多列拼接后的文本, 没有对应索引列的条件只做正则匹配
+        """
+        results: List[str] = []
+        for key_list, command_lists in condition_list.items():
+            fts_column = QUERY_FTS_TARGETS.get(tuple(key_list))
+            if not fts_column:
+                continue
+            column_filter = "{" + fts_column + "} : "
+            for command_list in command_lists:
+                phrases: List[str] = []
+                for command in command_list:
+                    if command.startswith("-") and len(command) > 1:
+                        phrases.clear()
+                        break
+                    if command.startswith("=") and len(command) > 1:
+                        command = command[1:]
+                    if len(command) == 0:
+                        continue
+                    if len(command) < QUERY_FTS_MIN_LEN:
+                        phrases.clear()
+                        break
+                    phrases.append(fts_phrase(command))
+                if phrases:
+                    results.append(column_filter + "(" + " OR ".join(phrases) + ")")
+        return " AND ".join(results)
 
     def generate_search_conditions(self, condition_list: Dict[tuple,List[List[str]]]) -> str:
         results = []
@@ -1354,11 +1471,11 @@ class QueryCommand(UserCommandBase):
     def clean_records(self):
         """清理过期的查询指令"""
         invalid_ports: Set[MessagePort] = set()
-        for port, record in self.record_dict.items():
+        for port, record in list(self.record_dict.items()):
             if get_current_date_raw() - record.time > datetime.timedelta(seconds=RECORD_RESPONSE_TIME):
                 invalid_ports.add(port)
         for port in invalid_ports:
-            del self.record_dict[port]
+            self.record_dict.pop(port, None)
 
     def get_state(self) -> str:
         feedback: str
@@ -1,7 +1,12 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Set, Optional, Iterable
 import os
 import json
 import re
+import time
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import openpyxl
 import sqlite3
 from openpyxl.comments import Comment
@@ -9,6 +14,7 @@ from openpyxl.comments import Comment
 from core.data import custom_data_chunk, DataChunkBase
 from core.data import JsonObject, custom_json_object
 from utils.time import get_current_date_str
+from utils.logger import dice_log
 
 from utils.localdata import read_xlsx, update_xlsx, col_based_workbook_to_dict, create_parent_dir, get_empty_col_based_workbook
 #from module.query import QUERY_DATA_FIELD, QUERY_DATA_FIELD_LIST, QUERY_REDIRECT_FIELD, QUERY_REDIRECT_FIELD_LIST
@@ -41,6 +47,35 @@ QUERY_REDIRECT_FIELD_LIST = ["名称","重定向"]
 # 已连接的数据库DICT
 CONNECTED_QUERY_DATABASES: Dict[str, sqlite3.Connection] = {}
 DATABASE_CURSOR: Dict[str, sqlite3.Cursor] = {}
+# 建立了全文索引的数据库
+FTS_QUERY_DATABASES: Set[str] = set()
+# 已连接的数据库文件路径, 用于建立只读连接池
+QUERY_DATABASE_PATHS: Dict[str, str] = {}
+
+QUERY_WORKER_NUM = 4  # 执行查询的线程数, 也是每个数据库只读连接数的上限
+QUERY_PROGRESS_STEPS = 1000  # 每执行多少条虚拟机指令检查一次是否超时
+
+# 全文索引, 不保存原文的contentless表, 由触发器与data保持同步
+QUERY_FTS_TABLE = "data_fts"
+QUERY_FTS_MIN_LEN = 3  # trigram分词下, 少于3个字符的关键字无法使用索引
+QUERY_INDEX_META_TABLE = "query_index_meta"
+QUERY_INDEX_VERSION = "2"
+# 索引的列 -> 拼接成该列的data列, 与查询时正则匹配的拼接方式一致, 关键字跨越两列的边界时同样能被索引找到
+QUERY_FTS_COLUMNS: Dict[str, List[str]] = {
+    "名称": ["名称"],
+    "分类": ["分类"],
+    "名称英文": ["名称", "英文"],
+    "来源分类标签": ["来源", "分类", "标签"],
+    "全部": QUERY_DATA_FIELD_LIST,
+}
+# 查询条件的目标列 -> 全文索引中的列
+QUERY_FTS_TARGETS: Dict[tuple, str] = {
+    ("名称",): "名称",
+    ("分类",): "分类",
+    ("名称", "英文"): "名称英文",
+    ("来源", "分类", "标签"): "来源分类标签",
+    ("全部",): "全部",
+}
 
 def create_empty_sqlite_database(path: str):
     """创建空白查询数据库"""
@@ -53,6 +88,7 @@ def create_empty_sqlite_database(path: str):
         cur.execute("CREATE INDEX Catalogue ON data (分类);")
         cur.execute(
             "CREATE TABLE redirect (" + ",".join([(field + " TEXT DEFAULT ('')") for field in QUERY_REDIRECT_FIELD_LIST]) + ");")
+        ensure_query_index(db)
         db.close()
     except PermissionError:
         return False
@@ -85,6 +121,9 @@ def connect_query_database(path: str) -> str:
             conn.create_function("regexp", 2, regexp)
             CONNECTED_QUERY_DATABASES[db] = conn
             DATABASE_CURSOR[db] = conn.cursor()
+            QUERY_DATABASE_PATHS[db] = path
+            if ensure_query_index(conn):
+                FTS_QUERY_DATABASES.add(db)
         except PermissionError:
             error_info.append(f"读取{path}时遇到错误: 权限不足")
             return "\n".join(error_info)
@@ -107,14 +146,215 @@ def connect_query_database(path: str) -> str:
     
 def disconnect_query_database(db: str) -> None:
     """取消连接查询数据库"""
+    if db in FTS_QUERY_DATABASES:
+        update_query_index_signature(CONNECTED_QUERY_DATABASES[db])
     CONNECTED_QUERY_DATABASES[db].close()
     del CONNECTED_QUERY_DATABASES[db]
     del DATABASE_CURSOR[db]
+    FTS_QUERY_DATABASES.discard(db)
+    QUERY_DATABASE_PATHS.pop(db, None)
+    pool = QUERY_CONNECTION_POOLS.pop(db, None)
+    if pool:
+        pool.close()
+
+@lru_cache(maxsize=256)
+def compile_regexp(pattern: str) -> re.Pattern:
+    return re.compile(pattern, re.I)
 
 def regexp(pattern: str, input: str):
-    """SQL用的正则表达式公式函数"""
-    p = re.compile(str(pattern),re.I)
-    return bool(re.search(p, input or ""))
+    """SQL用的正则表达式公式函数, 同一条查询会对每一行调用一次, 因此编译结果需要缓存"""
+    return bool(compile_regexp(str(pattern)).search(input or ""))
+
+def is_fts5_trigram_available() -> bool:
+    """当前sqlite是否支持FTS5的trigram分词(3.34.0及以上)"""
+    try:
+        conn = sqlite3.connect(":memory:")
+        try:
+            conn.execute("CREATE VIRTUAL TABLE t USING fts5(a, tokenize='trigram')")
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return False
+    return True
+
+FTS5_TRIGRAM_AVAILABLE: bool = is_fts5_trigram_available()
+
+def get_data_signature(conn: sqlite3.Connection) -> str:
+    """data表的行数与rowid, 用来发现被外部工具修改(如VACUUM重排rowid)的数据库"""
+    row = conn.execute("SELECT count(*), max(rowid), total(rowid) FROM data").fetchone()
+    return f"{row[0]}:{row[1]}:{row[2]}"
+
+def ensure_query_index(conn: sqlite3.Connection) -> bool:
+    """
+    为查询数据库建立索引: redirect表按名称/重定向建立普通索引, data表建立FTS5 trigram全文索引
+    全文索引按QUERY_FTS_COLUMNS索引拼接后的列, 不额外保存文本, data表的增删改通过触发器同步
+    连接时若data表的签名与建立索引时不同(被外部工具修改过), 则重建全文索引
+    返回全文索引是否可用, 不可用时查询退回逐行正则匹配
+    """
+    fields = ", ".join(QUERY_FTS_COLUMNS.keys())
+
+    def row_fields(row: str) -> str:
+        return ", ".join("||".join(row + field for field in data_fields) for data_fields in QUERY_FTS_COLUMNS.values())
+
+    data_fields, old_fields, new_fields = row_fields(""), row_fields("old."), row_fields("new.")
+    try:
+        with conn:
+            conn.execute("CREATE INDEX IF NOT EXISTS redirect_name ON redirect (名称);")
+            conn.execute("CREATE INDEX IF NOT EXISTS redirect_target ON redirect (重定向);")
+    except sqlite3.Error as e:  # 只读数据库等情况, 不影响查询
+        dice_log(f"[Query] 无法为重定向表建立索引: {e}")
+    if not FTS5_TRIGRAM_AVAILABLE:
+        return False
+    try:
+        with conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {QUERY_INDEX_META_TABLE} (name TEXT PRIMARY KEY, value TEXT NOT NULL);")
+            meta = dict(conn.execute(f"SELECT name, value FROM {QUERY_INDEX_META_TABLE}").fetchall())
+            has_table = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
+                                     (QUERY_FTS_TABLE,)).fetchone() is not None
+            signature = get_data_signature(conn)
+            if has_table and meta.get("version") == QUERY_INDEX_VERSION and meta.get("signature") == signature:
+                return True
+            conn.execute(f"DROP TABLE IF EXISTS {QUERY_FTS_TABLE};")
+            for suffix in ("ai", "ad", "au"):  # 旧版本的触发器使用不同的列
+                conn.execute(f"DROP TRIGGER IF EXISTS {QUERY_FTS_TABLE}_{suffix};")
+            conn.execute(f"CREATE VIRTUAL TABLE {QUERY_FTS_TABLE} USING fts5({fields}, content='', "
+                         f"tokenize='trigram case_sensitive 0');")
+            conn.execute(f"CREATE TRIGGER IF NOT EXISTS {QUERY_FTS_TABLE}_ai AFTER INSERT ON data BEGIN "
+                         f"INSERT INTO {QUERY_FTS_TABLE}(rowid, {fields}) VALUES (new.rowid, {new_fields}); END;")
+            conn.execute(f"CREATE TRIGGER IF NOT EXISTS {QUERY_FTS_TABLE}_ad AFTER DELETE ON data BEGIN "
+                         f"INSERT INTO {QUERY_FTS_TABLE}({QUERY_FTS_TABLE}, rowid, {fields}) "
+                         f"VALUES ('delete', old.rowid, {old_fields}); END;")
+            conn.execute(f"CREATE TRIGGER IF NOT EXISTS {QUERY_FTS_TABLE}_au AFTER UPDATE ON data BEGIN "
+                         f"INSERT INTO {QUERY_FTS_TABLE}({QUERY_FTS_TABLE}, rowid, {fields}) "
+                         f"VALUES ('delete', old.rowid, {old_fields}); "
+                         f"INSERT INTO {QUERY_FTS_TABLE}(rowid, {fields}) VALUES (new.rowid, {new_fields}); END;")
+            conn.execute(f"INSERT INTO {QUERY_FTS_TABLE}(rowid, {fields}) SELECT rowid, {data_fields} FROM data;")
+            conn.executemany(f"INSERT OR REPLACE INTO {QUERY_INDEX_META_TABLE} (name, value) VALUES (?, ?)",
+                             [("version", QUERY_INDEX_VERSION), ("signature", signature)])
+    except sqlite3.Error as e:
+        dice_log(f"[Query] 无法建立全文索引, 将使用逐行匹配: {e}")
+        return False
+    return True
+
+def update_query_index_signature(conn: sqlite3.Connection) -> None:
+    """通过本程序修改data表后调用, 触发器已经同步了全文索引, 只需更新签名避免下次连接时重建"""
+    if not FTS5_TRIGRAM_AVAILABLE:
+        return
+    try:
+        with conn:
+            conn.execute(f"INSERT OR REPLACE INTO {QUERY_INDEX_META_TABLE} (name, value) VALUES (?, ?)",
+                         ("signature", get_data_signature(conn)))
+    except sqlite3.Error:
+        pass
+
+
+class QueryConnectionPool:
+    """
+    单个查询数据库的只读连接池, 供查询线程使用, 写入仍然通过CONNECTED_QUERY_DATABASES中的主连接
+    连接以mode=ro打开, 本进程没有写权限的文件不会被修改, 额外加上immutable以跳过文件锁
+    """
+
+    def __init__(self, path: str, max_size: int = QUERY_WORKER_NUM):
+        self.path = path
+        self.max_size = max_size
+        self.idle: List[sqlite3.Connection] = []
+        self.size: int = 0
+        self.closed: bool = False
+        self.condition = threading.Condition()
+
+    def create_connection(self) -> sqlite3.Connection:
+        uri = "file:" + os.path.abspath(self.path) + "?mode=ro"
+        if not os.access(self.path, os.W_OK):
+            uri += "&immutable=1"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.create_function("regexp", 2, regexp)
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        with self.condition:
+            while not self.closed and not self.idle and self.size >= self.max_size:
+                self.condition.wait()
+            if self.closed:
+                raise sqlite3.OperationalError(f"{self.path} 已断开连接")
+            if self.idle:
+                return self.idle.pop()
+            self.size += 1
+        try:
+            return self.create_connection()
+        except sqlite3.Error:
+            with self.condition:
+                self.size -= 1
+                self.condition.notify()
+            raise
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        conn.set_progress_handler(None, 0)
+        with self.condition:
+            if self.closed:
+                self.size -= 1
+                conn.close()
+            else:
+                self.idle.append(conn)
+            self.condition.notify()
+
+    def close(self) -> None:
+        with self.condition:
+            self.closed = True
+            for conn in self.idle:
+                conn.close()
+            self.size -= len(self.idle)
+            self.idle.clear()
+
+
+QUERY_CONNECTION_POOLS: Dict[str, QueryConnectionPool] = {}
+QUERY_EXECUTOR = ThreadPoolExecutor(max_workers=QUERY_WORKER_NUM, thread_name_prefix="dicepp_query")
+_query_local = threading.local()
+
+
+def get_query_cursor(db: str) -> sqlite3.Cursor:
+    """查询线程中返回借出的只读连接的cursor, 否则返回主连接的cursor"""
+    cursors: Optional[Dict[str, sqlite3.Cursor]] = getattr(_query_local, "cursors", None)
+    if cursors and db in cursors:
+        return cursors[db]
+    return DATABASE_CURSOR[db]
+
+
+@contextlib.contextmanager
+def borrow_query_connections(dbs: Iterable[str], timeout: float = 0):
+    """
+    在当前线程中借用若干数据库的只读连接, 期间get_query_cursor返回这些连接的cursor
+    timeout > 0时通过progress handler中断超时的查询, 被中断的查询抛出sqlite3.OperationalError
+    """
+    deadline = time.monotonic() + timeout
+
+    def check_deadline() -> int:
+        return 1 if time.monotonic() > deadline else 0
+
+    borrowed: List[tuple] = []
+    cursors: Dict[str, sqlite3.Cursor] = {}
+    try:
+        for db in dict.fromkeys(dbs):
+            if not db or db not in QUERY_DATABASE_PATHS:
+                continue
+            pool = QUERY_CONNECTION_POOLS.get(db)
+            if pool is None:
+                pool = QUERY_CONNECTION_POOLS.setdefault(db, QueryConnectionPool(QUERY_DATABASE_PATHS[db]))
+            conn = pool.acquire()
+            borrowed.append((pool, conn))
+            if timeout > 0:
+                conn.set_progress_handler(check_deadline, QUERY_PROGRESS_STEPS)
+            cursors[db] = conn.cursor()
+        _query_local.cursors = cursors
+        yield
+    finally:
+        _query_local.cursors = None
+        for pool, conn in borrowed:
+            pool.release(conn)
+
+def fts_phrase(keyword: str) -> str:
+    """将关键字转换为FTS5的短语, 双引号需要转义"""
+    return '"' + keyword.replace('"', '""') + '"'
         
 def regexp_normalize(string: str) -> str:
     """用于将正则表达式的任何公式文本改为原义"""
@@ -219,4 +459,5 @@ def load_data_from_xlsx_to_sqlite(xlsx_path: str, database_path: str, xlsx_mode:
     if wb:
         load = load_data_from_xlsx(wb,DATABASE_CURSOR[db],xlsx_name,xlsx_mode)
         CONNECTED_QUERY_DATABASES[db].commit()
+        update_query_index_signature(CONNECTED_QUERY_DATABASES[db])
     return load
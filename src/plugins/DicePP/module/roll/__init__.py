@@ -1,5 +1,6 @@
 from .result import RollResult
-from .expression import RollExpression, is_roll_exp, exec_roll_exp, preprocess_roll_exp, parse_roll_exp, sift_roll_exp_and_reason
+from .expression import RollExpression, is_roll_exp, exec_roll_exp, preprocess_roll_exp, parse_roll_exp, sift_roll_exp_and_reason, \
+    get_roll_exp_cache_stats
 from .roll_utils import RollDiceError
 
 from .roll_dice_command import RollDiceCommand
@@ -22,7 +22,8 @@ LOC_DSET_CURRENT = "roll_default_dice_current"
                      priority=-1,
                      group_only=True,
                      flag=DPP_COMMAND_FLAG_MANAGE,
-                     permission_require=1)
+                     permission_require=1,
+                     prefixes=(".dset",))
 class DiceSetCommand(UserCommandBase):
     """.dset 设置群默认掷骰表达式"""
 
@@ -0,0 +1,425 @@
+"""
+掷骰表达式的概率分布计算, 用于.r exp统计结果区间与均值
+对解析后的RollExpressionFormula逐个节点计算精确分布:
+XDY使用卷积, K/KH/KL使用次序统计, R/X/XO/M/P使用逐骰子的闭式变换, 爆炸骰在EXPLODE_LIMIT处截断
+无法精确计算(或计算量过大)的节点会退化为对该节点单独抽样
+计算在专用的单线程DIST_EXECUTOR中进行, 调用者超时取消后计算会在下一次检查时终止, 不会继续占用线程
+"""
+
+import asyncio
+import math
+import operator
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate, repeat
+from typing import Dict, List, Union, Any, Tuple, Callable
+
+from .roll_config import *
+from .roll_utils import RollDiceError
+from .formula import condition_range
+from .result import RollResult
+from .connector import RollExpConnector, ROLL_CONNECTORS_DICT
+from .modifier import REModReroll, REModCountSuccess, REModFloat, REModMinimum, REModPortent, REModMinMax
+from .expression import RollExpression, RollExpressionFormula, RollExpressionXDY, RollExpressionXDYEXP, \
+    RollExpressionInt, RollExpressionFloat, RollExpressionNull, calculate_roll_exp
+
+Number = Union[int, float]
+
+DIST_SAMPLE_TIMES = 200000  # 无法精确计算时的抽样次数
+DIST_TIME_LIMIT = 30  # 计算时间上限(秒), 与.r exp任务的超时时间一致
+DIST_WORK_MAX = 2000000  # 精确计算的运算量上限(约为python层面的循环次数), 超过则退化为抽样
+DIST_MAP_COST = 16  # 交给map完成的逐元素运算, 每DIST_MAP_COST次计为一次运算量
+DIST_EPSILON = 1e-12  # 爆炸骰计算中忽略的极小概率
+DIST_TAIL = 1e-9  # 统计最小/最大值时忽略的尾部概率
+DIST_WORKER_NUM = 1  # 计算分布的线程数, 与存档/导出等共用的默认线程池隔离
+
+DIST_EXECUTOR = ThreadPoolExecutor(max_workers=DIST_WORKER_NUM, thread_name_prefix="RollDistribution")
+
+
+class DistributionUnsupported(Exception):
+    """
+    节点无法精确计算或计算量过大, 调用者应当退化为抽样
+    """
+    pass
+
+
+class RollDistribution:
+    """
+    一个节点的结果分布, probs的键为结果的val_list之和, float_state与RollResult一致
+    """
+    __slots__ = ("probs", "float_state")
+
+    def __init__(self, probs: Dict[Number, float], float_state: bool = False):
+        self.probs = probs
+        self.float_state = float_state
+
+
+def point_distribution(val: Number, float_state: bool = False) -> RollDistribution:
+    return RollDistribution({val: 1.0}, float_state)
+
+
+def uniform_dice(dice_type: int) -> Dict[int, float]:
+    """一颗dice_type面骰的分布, 与roll_a_dice一致"""
+    return {v: 1.0 / dice_type for v in range(1, dice_type + 1)}
+
+
+def _is_dense(probs: Dict[Number, float]) -> bool:
+    return all(type(v) is int for v in probs)
+
+
+def _to_dense(probs: Dict[int, float]) -> Tuple[int, List[float]]:
+    offset = min(probs)
+    dense = [0.0] * (max(probs) - offset + 1)
+    for v, p in probs.items():
+        dense[v - offset] += p
+    return offset, dense
+
+
+def _from_dense(offset: int, dense: List[float]) -> Dict[int, float]:
+    return {offset + i: p for i, p in enumerate(dense) if p > 0}
+
+
+class DistributionCalculator:
+    """
+    对RollExpressionFormula的嵌套列表计算分布, 处理连接符的顺序与calculate_roll_exp完全一致
+    work记录已经进行的运算量, 超过DIST_WORK_MAX时当前节点退化为抽样
+    超过deadline(或被cancel)时无论精确计算还是抽样都会抛出RollDiceError终止计算
+    """
+
+    def __init__(self, sample_times: int = DIST_SAMPLE_TIMES, work_max: int = DIST_WORK_MAX,
+                 time_limit: float = DIST_TIME_LIMIT):
+        self.sample_times = sample_times
+        self.work_max = work_max
+        self.work = 0
+        self.deadline = time.monotonic() + time_limit
+
+    def cancel(self) -> None:
+        """可以在其他线程调用, 正在进行的计算会在下一次charge或抽样检查时终止"""
+        self.deadline = 0
+
+    def check_deadline(self) -> None:
+        if time.monotonic() > self.deadline:
+            raise RollDiceError("计算超时!")
+
+    def charge(self, amount: int) -> None:
+        self.check_deadline()
+        self.work += amount
+        if self.work > self.work_max:
+            raise DistributionUnsupported()
+
+    def calculate(self, expression: RollExpression) -> RollDistribution:
+        if isinstance(expression, RollExpressionFormula):
+            return self.calculate_list(expression.exp_list)
+        return self.calculate_node(expression)
+
+    def calculate_list(self, exp_list: List[Any]) -> RollDistribution:
+        work = self.work
+        try:
+            return self.combine_list(exp_list)
+        except DistributionUnsupported:
+            # 整个子表达式退化为抽样, 抽样不计入运算量
+            self.work = work
+            return self.sample(lambda: calculate_roll_exp(exp_list))
+
+    def calculate_node(self, node: RollExpression) -> RollDistribution:
+        if isinstance(node, (RollExpressionInt, RollExpressionFloat, RollExpressionNull, RollExpressionXDYEXP)):
+            res = node.get_result()  # 结果固定
+            return point_distribution(sum(res.val_list), res.float_state)
+        if isinstance(node, RollExpressionXDY):
+            work = self.work
+            try:
+                return self.xdy_distribution(node)
+            except DistributionUnsupported:
+                self.work = work
+        # XB等依赖调用次数或暂不支持的节点
+        return self.sample(node.get_result)
+
+    def sample(self, roll_func: Callable[[], RollResult]) -> RollDistribution:
+        """对节点单独抽样, 得到经验分布"""
+        counter: Counter = Counter()
+        float_state = False
+        for index in range(self.sample_times):
+            if index % 1000 == 0:
+                self.check_deadline()
+            res = roll_func()
+            counter[sum(res.val_list)] += 1
+            float_state = res.float_state
+        return RollDistribution({v: c / self.sample_times for v, c in counter.items()}, float_state)
+
+    def combine_list(self, exp_list: List[Any]) -> RollDistribution:
+        """与calculate_roll_exp相同的处理顺序, 将RollResult替换为RollDistribution"""
+        candidate: List[Any] = []
+        for roll in exp_list:
+            if type(roll) is list:
+                candidate.append(self.calculate_list(roll))
+            elif isinstance(roll, RollExpression):
+                candidate.append(self.calculate_node(roll))
+            elif roll in ROLL_CONNECTORS_DICT.values():
+                candidate.append(roll)
+            else:
+                raise RollDiceError(f"未知参数类型 {str(type(roll))}")
+        for calculation in ROLL_CONNECTORS_DICT.values():
+            length: int = len(candidate)
+            index: int = 0
+            while index < length:
+                if candidate[index] is calculation:
+                    this = candidate[index]
+                    if index + 1 >= len(candidate):
+                        right = point_distribution(0)
+                    else:
+                        right = candidate[index + 1]
+                        candidate.pop(index + 1)
+                        length -= 1
+                    if index - 1 < 0:
+                        left = point_distribution(0)
+                    else:
+                        left = candidate[index - 1]
+                        candidate.pop(index - 1)
+                        length -= 1
+                    if not (type(left) is RollDistribution and type(right) is RollDistribution):
+                        raise RollDiceError("连接符两侧参数错误")
+                    candidate[index - 1] = self.connect(this, left, right)
+                    continue
+                index += 1
+        if len(candidate) > 1:
+            raise RollDiceError("出现无法正常处理到只剩下一个结果的情况")
+        if type(candidate[0]) is not RollDistribution:
+            raise RollDiceError("剩下非结果的内容")
+        return candidate[0]
+
+    def connect(self, connector: RollExpConnector, lhs: RollDistribution, rhs: RollDistribution) -> RollDistribution:
+        """对应connector.py中各连接符的connect"""
+        float_state = lhs.float_state or rhs.float_state
+        symbol = connector.symbol
+        if symbol == "+":
+            return RollDistribution(self.add(lhs.probs, rhs.probs), float_state)
+        if symbol == "-":
+            return RollDistribution(self.add(lhs.probs, {-v: p for v, p in rhs.probs.items()}), float_state)
+        if symbol == "*":
+            if float_state:
+                func = lambda x, y: round(x * y, 2)
+            else:
+                func = operator.mul
+        elif symbol == "/":
+            if float_state:
+                func = lambda x, y: 0 if round(y, 2) == 0 else round(float(x) / float(y), 2)
+            else:
+                func = lambda x, y: 0 if y == 0 else int(x / y)
+        else:
+            raise DistributionUnsupported()
+        return RollDistribution(self.product(lhs.probs, rhs.probs, func), float_state)
+
+    def add(self, lhs: Dict[Number, float], rhs: Dict[Number, float]) -> Dict[Number, float]:
+        """两个独立分布之和"""
+        if _is_dense(lhs) and _is_dense(rhs):
+            lhs_offset, lhs_dense = _to_dense(lhs)
+            rhs_offset, rhs_dense = _to_dense(rhs)
+            return _from_dense(lhs_offset + rhs_offset, self.convolve(lhs_dense, rhs_dense))
+        return self.product(lhs, rhs, operator.add)
+
+    def product(self, lhs: Dict[Number, float], rhs: Dict[Number, float],
+                func: Callable[[Number, Number], Number]) -> Dict[Number, float]:
+        """两个独立分布经过func组合后的分布"""
+        self.charge(len(lhs) * len(rhs))
+        result: Dict[Number, float] = {}
+        for x, p in lhs.items():
+            for y, q in rhs.items():
+                val = func(x, y)
+                result[val] = result.get(val, 0.0) + p * q
+        return result
+
+    def convolve(self, lhs: List[float], rhs: List[float]) -> List[float]:
+        """稠密表示下的卷积, 内层循环交给map完成"""
+        self.charge(len(lhs) * len(rhs) // DIST_MAP_COST)
+        if len(lhs) < len(rhs):
+            lhs, rhs = rhs, lhs
+        size = len(lhs)
+        result = [0.0] * (size + len(rhs) - 1)
+        for index, q in enumerate(rhs):
+            if q:
+                result[index:index + size] = map(operator.add, result[index:index + size],
+                                                 map(operator.mul, lhs, repeat(q)))
+        return result
+
+    def convolve_uniform(self, dense: List[float], width: int) -> List[float]:
+        """与一个宽度为width的均匀分布卷积, 利用前缀和, 运算量与width无关"""
+        self.charge((len(dense) + width) // DIST_MAP_COST + 1)
+        prefix = list(accumulate(dense))
+        upper = prefix + [prefix[-1]] * (width - 1)
+        lower = [0.0] * width + prefix[:-1]
+        return [diff / width for diff in map(operator.sub, upper, lower)]
+
+    def sum_iid(self, probs: Dict[int, float], dice_num: int) -> Dict[int, float]:
+        """dice_num个独立同分布骰子之和"""
+        offset, dense = _to_dense(probs)
+        uniform = len(dense) > 1 and all(p == dense[0] for p in dense)
+        total_offset, total = offset, dense
+        for _ in range(dice_num - 1):
+            if uniform:
+                total = self.convolve_uniform(total, len(dense))
+            else:
+                total = self.convolve(total, dense)
+            total_offset += offset
+        return _from_dense(total_offset, total)
+
+    def keep_sum(self, probs: Dict[int, float], dice_num: int, keep_num: int, keep_high: bool) -> Dict[int, float]:
+        """
+        dice_num个独立同分布骰子中最大(或最小)的keep_num个之和
+        按数值从大到小(或从小到大)依次决定有多少颗骰子取该值, 多项式系数以 p^c/c! 累积, 最后乘以 dice_num!
+        已经选满keep_num颗的状态直接结算, 剩余骰子全部落在之后的数值上
+        """
+        values = sorted(probs, reverse=keep_high)
+        remain = [0.0] * len(values)  # remain[i]: 排在values[i]之后的概率之和
+        for i in range(len(values) - 2, -1, -1):
+            remain[i] = remain[i + 1] + probs[values[i + 1]]
+        factorial = [math.factorial(i) for i in range(dice_num + 1)]
+        result: Dict[int, float] = {}
+        states: Dict[Tuple[int, int], float] = {(0, 0): 1.0}  # (已决定的骰子数, 已取的和) -> 权重
+        for i, val in enumerate(values):
+            p = probs[val]
+            is_last = (i == len(values) - 1)
+            new_states: Dict[Tuple[int, int], float] = {}
+            for (count, total), weight in states.items():
+                self.charge(dice_num - count + 1)
+                for c in range(dice_num - count + 1):
+                    if is_last and count + c != dice_num:
+                        continue
+                    new_count = count + c
+                    new_total = total + val * (min(new_count, keep_num) - count)
+                    new_weight = weight * p ** c / factorial[c]
+                    if new_count >= keep_num:
+                        rest = dice_num - new_count
+                        new_weight *= remain[i] ** rest / factorial[rest]
+                        result[new_total] = result.get(new_total, 0.0) + new_weight * factorial[dice_num]
+                    else:
+                        key = (new_count, new_total)
+                        new_states[key] = new_states.get(key, 0.0) + new_weight
+            states = new_states
+        return result
+
+    def explode_chain(self, fresh: Dict[int, float], cond: Callable[[int], bool]) -> Dict[int, float]:
+        """
+        爆炸骰中由一次重骰开始的追加骰之和, 第EXPLODE_LIMIT次之后仍需重骰的情况会报错, 因此不计入(概率会小于1)
+        """
+        stop = {d: p for d, p in fresh.items() if not cond(d)}
+        trigger = {d: p for d, p in fresh.items() if cond(d)}
+        chain: Dict[int, float] = {}
+        for _ in range(EXPLODE_LIMIT):
+            new_chain = dict(stop)
+            self.charge(len(trigger) * len(chain))
+            for d, p in trigger.items():
+                for c, q in chain.items():
+                    new_chain[d + c] = new_chain.get(d + c, 0.0) + p * q
+            chain = {c: q for c, q in new_chain.items() if q > DIST_EPSILON}
+        return chain
+
+    def xdy_distribution(self, node: RollExpressionXDY) -> RollDistribution:
+        """
+        按mod_list的顺序应用修饰符, 在保持骰子独立同分布时逐骰子变换, 否则只允许不改变数值的修饰符
+        """
+        dice_num, dice_type = node.dice_num, node.dice_type
+        fresh = uniform_dice(dice_type)  # 修饰符中重骰使用的分布
+        die: Dict[int, float] = {dice_type: 1.0} if dice_type < 2 else dict(fresh)
+        total = None  # 不为None时骰子列表不再独立同分布, 只记录总和
+        float_state = False
+        for mod in node.mod_list:
+            if isinstance(mod, REModFloat):
+                float_state = True
+                continue
+            if isinstance(mod, REModCountSuccess):  # 只修改描述
+                continue
+            if total is not None:
+                raise DistributionUnsupported()
+            if isinstance(mod, REModReroll):
+                cond = lambda v, mod=mod: mod.op(v, mod.rhs)
+                if mod.mod == "R":
+                    new_die: Dict[int, float] = {}
+                    for v, p in die.items():
+                        for r, q in (fresh.items() if cond(v) else ((v, 1.0),)):
+                            new_die[r] = new_die.get(r, 0.0) + p * q
+                    die = new_die
+                    continue
+                if mod.mod == "XO":
+                    chain = fresh
+                else:  # "X"
+                    if any(cond(v) for v in die):
+                        cr = condition_range(1, max(dice_type, 1), mod.op, mod.rhs)
+                        if max(dice_type, 1) <= (cr[1] - cr[0] + 1):
+                            raise RollDiceError(f"掷骰结果出现无限大,该范围{cr[0]}~{cr[1]}不可用")
+                    chain = self.explode_chain(fresh, cond)
+                group: Dict[int, float] = {}
+                for v, p in die.items():
+                    for c, q in (chain.items() if cond(v) else ((0, 1.0),)):
+                        group[v + c] = group.get(v + c, 0.0) + p * q
+                total = self.sum_iid(group, dice_num)
+            elif isinstance(mod, REModMinimum):
+                pt = max(1, min(mod.num, dice_type))
+                new_die = {}
+                for v, p in die.items():
+                    new_die[max(v, pt)] = new_die.get(max(v, pt), 0.0) + p
+                die = new_die
+            elif isinstance(mod, REModPortent):
+                die = {max(1, min(mod.num, dice_type)): 1.0}
+            elif isinstance(mod, REModMinMax):
+                if dice_num > mod.num:
+                    total = self.keep_sum(die, dice_num, mod.num, mod.formula == "MAX")
+            else:
+                raise DistributionUnsupported()
+        if total is None:
+            total = self.sum_iid(die, dice_num)
+        return RollDistribution(total, float_state)
+
+
+def get_roll_exp_distribution(expression: RollExpression, sample_times: int = DIST_SAMPLE_TIMES) -> Dict[Number, float]:
+    """
+    计算掷骰表达式最终数值(即RollResult.get_val())的分布, 返回数值到概率的字典
+    """
+    return normalize_distribution(DistributionCalculator(sample_times).calculate(expression))
+
+
+async def get_roll_exp_distribution_async(expression: RollExpression,
+                                          sample_times: int = DIST_SAMPLE_TIMES) -> Dict[Number, float]:
+    """
+    在DIST_EXECUTOR中计算get_roll_exp_distribution, 被取消(如.r exp任务超时)时同时终止线程中的计算
+    """
+    calculator = DistributionCalculator(sample_times)
+    loop = asyncio.get_running_loop()
+    try:
+        dist = await loop.run_in_executor(DIST_EXECUTOR, calculator.calculate, expression)
+    except asyncio.CancelledError:
+        calculator.cancel()
+        raise
+    return normalize_distribution(dist)
+
+
+def normalize_distribution(dist: RollDistribution) -> Dict[Number, float]:
+    """将节点分布转换为最终数值的分布, 与RollResult.get_val()的取整方式一致"""
+    total = sum(dist.probs.values())
+    if total <= 0:
+        raise RollDiceError("无法计算该表达式的分布")
+    result: Dict[Number, float] = {}
+    for val, p in dist.probs.items():
+        val = round(val, 2) if dist.float_state else int(val)
+        result[val] = result.get(val, 0.0) + p / total
+    return result
+
+
+def get_distribution_percentiles(dist: Dict[Number, float], stat_range: List[int]) -> List[Number]:
+    """
+    返回最小值, stat_range中各百分位对应的值与最大值, 最小/最大值忽略概率不足DIST_TAIL的尾部
+    百分位r对应的值为累积概率首次超过r%的值, 与对排序后的抽样结果取第N*r/100项一致
+    """
+    items = sorted(dist.items())
+    info: List[Number] = []
+    cumulative, index = 0.0, 0
+    for q in [DIST_TAIL] + [r / 100 for r in stat_range] + [1 - DIST_TAIL]:
+        while index < len(items) - 1 and cumulative + items[index][1] <= q + 1e-12:
+            cumulative += items[index][1]
+            index += 1
+        info.append(items[index][0])
+    return info
+
+
+def get_distribution_mean(dist: Dict[Number, float]) -> float:
+    return sum(val * p for val, p in dist.items())
@@ -1,13 +1,16 @@
 import abc
 import re
-from typing import List, Tuple, Optional, Any, Union
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Tuple, Optional, Any, Union, Dict
 
 from utils.string import to_english_str
 
 from .roll_config import *
-from .modifier import RollExpModifier, ROLL_MODIFIERS_DICT
+from .modifier import RollExpModifier, ROLL_MODIFIERS_DICT, split_roll_modifiers
 from .connector import RollExpConnector, ROLL_CONNECTORS_DICT, REModSubstract, REModAdd
-from .roll_utils import RollDiceError, roll_a_dice, match_outer_parentheses, clear_border_parentheses, remove_redundant_parentheses
+from .roll_utils import RollDiceError, roll_a_dice, roll_dices, match_outer_parentheses, clear_border_parentheses, remove_redundant_parentheses
 from .result import RollResult
 
 XDY_RE = "([1-9][0-9]*)?D([1-9][0-9]*)?"
@@ -27,6 +30,12 @@ class RollExpression(metaclass=abc.ABCMeta):
         """
         raise NotImplementedError()
 
+    def get_results(self, times: int) -> List[RollResult]:
+        """
+        连续执行times次, 与重复调用get_result等价, 子类可以重写以批量生成骰子
+        """
+        return [self.get_result() for _ in range(times)]
+
 class RollExpressionFormula(RollExpression):
     """
     整个表达式的一个整合
@@ -54,6 +63,12 @@ class RollExpressionFormula(RollExpression):
         #res.exp = "(" + res.exp + ")"
         return res
 
+    def get_results(self, times: int) -> List[RollResult]:
+        """
+        批量返回times次运算的结果, 每个子表达式一次性生成全部轮次的结果
+        """
+        return calculate_roll_exp_batch(self.exp_list, times)
+
 class RollExpressionInt(RollExpression):
     """
     基础表达式之一, 代表一个整数
@@ -144,22 +159,9 @@ class RollExpressionXDY(RollExpression):
         self.mod_list: List[RollExpModifier] = []
 
         # 处理附加指令
-        cur_str: str = exp_str
-        prev_str: str = exp_str
-        has_mod = True
-        while has_mod:
-            has_mod = False
-            for mod_re in ROLL_MODIFIERS_DICT.keys():
-                mod_match = re.search(mod_re, cur_str)
-                if mod_match:
-                    m_span = mod_match.span()
-                    mod_str, cur_str = cur_str[m_span[0]:m_span[1]], cur_str[:m_span[0]] + cur_str[m_span[1]:]
-                    self.append_modifier(ROLL_MODIFIERS_DICT[mod_re](mod_str))
-                    has_mod = True
-                    break
-            if prev_str == cur_str:  # 解析一圈都没变化, 说明没有匹配的
-                break
-            prev_str = cur_str
+        cur_str, mod_list = split_roll_modifiers(exp_str)
+        for mod in mod_list:
+            self.append_modifier(mod)
         # 处理骰子部分
         d_index = cur_str.find("D")
         if d_index == -1:
@@ -187,11 +189,26 @@ class RollExpressionXDY(RollExpression):
         """
         生成投掷结果
         """
-        res: RollResult = RollResult()
         if self.dice_type < 2:
-            res.val_list = [self.dice_type for _ in range(self.dice_num)]
-        else:
-            res.val_list = [roll_a_dice(self.dice_type) for _ in range(self.dice_num)]
+            return self.build_result([self.dice_type for _ in range(self.dice_num)])
+        return self.build_result(roll_dices(self.dice_type, self.dice_num))
+
+    def get_results(self, times: int) -> List[RollResult]:
+        """
+        一次生成times轮所需的全部骰子, 再逐轮记录结果并应用修饰
+        """
+        if self.dice_type < 2:
+            return [self.get_result() for _ in range(times)]
+        num = self.dice_num
+        values = roll_dices(self.dice_type, num * times)
+        return [self.build_result(values[i * num:(i + 1) * num]) for i in range(times)]
+
+    def build_result(self, val_list: List[int]) -> RollResult:
+        """
+        用已经掷出的骰子生成结果, 记录d20/d100数量与大成功大失败等信息并应用修饰
+        """
+        res: RollResult = RollResult()
+        res.val_list = val_list
         res.info = "".join(["[" + str(v) + "]" for v in res.val_list])
         # res.info = f"({res.info})"
         res.type = self.dice_type
@@ -415,7 +432,6 @@ def calculate_roll_exp(roll_exp_list: List[Any]) -> RollResult:
     """
     用处理好的嵌套List生成掷骰结果
     """
-    final_result = 0
     candidate : List[Any] = []
     # 将非数值非连接符的内容全部变为数值与连接符
     for roll in roll_exp_list:
@@ -431,6 +447,33 @@ def calculate_roll_exp(roll_exp_list: List[Any]) -> RollResult:
             candidate.append(roll) # RollExpConnector
         else:
             raise RollDiceError(f"未知参数类型 {str(__type)}")
+    return connect_roll_candidate(candidate)
+
+def calculate_roll_exp_batch(roll_exp_list: List[Any], times: int) -> List[RollResult]:
+    """
+    与calculate_roll_exp相同, 但一次生成times轮结果, 每个子表达式通过get_results批量生成
+    """
+    columns: List[List[Any]] = []
+    for roll in roll_exp_list:
+        __type = type(roll)
+        if __type is list:
+            sub_results: List[RollResult] = calculate_roll_exp_batch(roll, times)
+            for sub_result in sub_results:
+                sub_result.info = "(" + sub_result.info + ")"
+                sub_result.exp = "(" + sub_result.exp + ")"
+            columns.append(sub_results)
+        elif issubclass(type(roll), RollExpression):
+            columns.append(roll.get_results(times))
+        elif roll in ROLL_CONNECTORS_DICT.values():
+            columns.append([roll] * times)
+        else:
+            raise RollDiceError(f"未知参数类型 {str(__type)}")
+    return [connect_roll_candidate([column[i] for column in columns]) for i in range(times)]
+
+def connect_roll_candidate(candidate: List[Any]) -> RollResult:
+    """
+    按照连接符的优先级将RollResult与连接符交替的列表合并为一个结果
+    """
     # 按照dict中的顺序处理所有连接符
     for calculation in ROLL_CONNECTORS_DICT.values():
         length: int = len(candidate)
@@ -504,9 +547,91 @@ def create_leveling_list(var_list: List[Any],depth_list: List[int]) -> List[Any]
         result.append(create_leveling_list(leveling_var_list,leveling_depth_list))
     return result
 
+class RollExpressionCache:
+    """
+    parse_roll_exp的LRU缓存, 键为预处理后的表达式字符串与默认骰子面数
+    缓存的表达式在多处共享, get_result不会修改表达式本身, 因此可以同时求值, 但调用者不能修改返回的表达式
+    含有XB等带状态节点的表达式不会被缓存, 解析失败的结果同样会被缓存以加速is_roll_exp
+    """
+
+    def __init__(self, max_size: int = ROLL_EXP_CACHE_SIZE):
+        self.max_size = max_size
+        self.__items: "OrderedDict[Tuple[str, int], Union[RollExpression, RollDiceError]]" = OrderedDict()
+        self.__lock = threading.Lock()  # .r exp会在线程池中解析与求值
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, input_str: str, default_type: int) -> Union[RollExpression, RollDiceError, None]:
+        key = (input_str, default_type)
+        with self.__lock:
+            item = self.__items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self.__items.move_to_end(key)
+            self.hits += 1
+            return item
+
+    def put(self, input_str: str, default_type: int, item: Union[RollExpression, RollDiceError]) -> None:
+        with self.__lock:
+            self.__items[(input_str, default_type)] = item
+            self.__items.move_to_end((input_str, default_type))
+            while len(self.__items) > self.max_size:
+                self.__items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__items.clear()
+            self.hits, self.misses = 0, 0
+
+    def get_stats(self) -> Dict[str, Union[int, float]]:
+        total = self.hits + self.misses
+        return {"size": len(self.__items), "max_size": self.max_size, "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0}
+
+
+ROLL_EXP_CACHE = RollExpressionCache()
+
+
+def is_exp_list_stateless(exp_list: List[Any]) -> bool:
+    """表达式中没有会随调用次数变化的节点(XB)"""
+    for item in exp_list:
+        if type(item) is list:
+            if not is_exp_list_stateless(item):
+                return False
+        elif isinstance(item, RollExpressionXB):
+            return False
+    return True
+
+
 def parse_roll_exp(input_str: str, default_type: int = DICE_TYPE_DEFAULT) -> RollExpression:
     """
-    解析掷骰表达式字符串
+    解析掷骰表达式字符串, 相同的表达式会返回缓存中的同一个对象, 不要修改返回的表达式
+    参数与返回值同compile_roll_exp
+    """
+    cached = ROLL_EXP_CACHE.get(input_str, default_type)
+    if cached is not None:
+        if isinstance(cached, RollDiceError):
+            raise RollDiceError(cached.info)
+        return cached
+    try:
+        exp = compile_roll_exp(input_str, default_type)
+    except RollDiceError as e:
+        ROLL_EXP_CACHE.put(input_str, default_type, RollDiceError(e.info))
+        raise
+    if is_exp_list_stateless(exp.exp_list):
+        ROLL_EXP_CACHE.put(input_str, default_type, exp)
+    return exp
+
+
+def get_roll_exp_cache_stats() -> Dict[str, Union[int, float]]:
+    """返回表达式缓存的大小与命中率"""
+    return ROLL_EXP_CACHE.get_stats()
+
+
+def compile_roll_exp(input_str: str, default_type: int = DICE_TYPE_DEFAULT) -> RollExpression:
+    """
+    解析掷骰表达式字符串, 每次都会生成新的表达式, 一般应当通过parse_roll_exp调用
 
     Args:
         input_str: 掷骰表达式字符串, 格式说明:
@@ -524,13 +649,10 @@ def parse_roll_exp(input_str: str, default_type: int = DICE_TYPE_DEFAULT) -> Rol
     except ValueError:
         raise RollDiceError("表达式含有不完整括号")
 
-    # 创建表达式
+    # 创建表达式, 结果与 create_leveling_list(parse_single_roll_exp(...), split_roll_str(...)) 一致
+    from .parser import parse_exp_list
     exp: RollExpressionFormula = RollExpressionFormula(input_str)
-    split_list = split_roll_str(input_str)
-    thing_list: List[Any] = []
-    for item in split_list[0]:
-        thing_list.append(parse_single_roll_exp(item,default_type))
-    exp.exp_list = create_leveling_list(thing_list, split_list[1])
+    exp.exp_list = parse_exp_list(input_str, default_type)
     return exp
     """
     # 先处理首个连接符, 若不是+或者-, 则默认为+
@@ -631,9 +753,10 @@ def parse_roll_exp(input_str: str, default_type: int = DICE_TYPE_DEFAULT) -> Rol
     """
 
 
+@lru_cache(maxsize=ROLL_EXP_CACHE_SIZE)
 def preprocess_roll_exp(input_str: str) -> str:
     """
-    预处理掷骰表达式
+    预处理掷骰表达式, 结果只与输入有关, 因此直接缓存
     """
     output_str = input_str.strip()
     # output_str = re.sub(r"\s", "", output_str)  # 去除空格和换行
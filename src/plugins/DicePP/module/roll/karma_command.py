@@ -61,6 +61,7 @@ def _match_alias(mapping: Dict[str, Tuple[str, ...]], word: str) -> Optional[str
     priority=DPP_COMMAND_PRIORITY_DEFAULT,
     group_only=True,
     flag=DPP_COMMAND_FLAG_MANAGE,
+    prefixes=(".karmadice", ".业力骰子", ".骰子模式", ".业力引擎"),
 )
 class KarmaDiceCommand(UserCommandBase):
     """业力骰子用户指令。"""
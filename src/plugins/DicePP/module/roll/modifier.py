@@ -1,6 +1,7 @@
 import abc
 import operator
-from typing import Dict, Type, Union, Iterable, Tuple, Any
+import re
+from typing import Dict, Type, Union, Iterable, Tuple, Any, List, Optional
 
 from .formula import *
 from .roll_config import *
@@ -60,6 +61,62 @@ def roll_modifier(regexp: Union[str, Iterable[str]]):
         return cls
     return inner
 
+
+XDY_CORE_RE = re.compile("[0-9]*D[0-9]*")
+_roll_modifiers_re: Optional[Tuple[int, Any]] = None  # (注册数量, 合并后的正则)
+
+
+def split_roll_modifiers(exp_str: str) -> Tuple[str, List[RollExpModifier]]:
+    """
+    从形如4D6K3R1的字符串中分离出修饰符, 返回剩余部分与修饰符列表
+    使用所有修饰符正则合并后的单个正则从左到右扫描一遍, 修饰符按注册顺序(同类按位置)排列
+    只有当字符串是XDY本体后紧跟首尾相接的修饰符时才走单遍扫描, 否则移除修饰符后两侧的字符可能拼接出新的修饰符,
+    此时退回逐个正则反复匹配的做法以保证结果一致
+    """
+    global _roll_modifiers_re
+    if _roll_modifiers_re is None or _roll_modifiers_re[0] != len(ROLL_MODIFIERS_DICT):
+        pattern = "|".join(f"(?P<m{index}>{mod_re})" for index, mod_re in enumerate(ROLL_MODIFIERS_DICT.keys()))
+        _roll_modifiers_re = (len(ROLL_MODIFIERS_DICT), re.compile(pattern))
+    core_match = XDY_CORE_RE.match(exp_str)
+    if not core_match:
+        return split_roll_modifiers_iterative(exp_str)
+    mod_classes = list(ROLL_MODIFIERS_DICT.values())
+    found: List[Tuple[int, str]] = []
+    prev_end = core_match.end()
+    for match in _roll_modifiers_re[1].finditer(exp_str, prev_end):
+        if match.start() != prev_end:
+            return split_roll_modifiers_iterative(exp_str)
+        prev_end = match.end()
+        found.append((int(match.lastgroup[1:]), match.group()))
+    if prev_end != len(exp_str):
+        return split_roll_modifiers_iterative(exp_str)
+    found.sort(key=lambda item: item[0])  # sort是稳定的, 同类修饰符保持从左到右
+    return core_match.group(), [mod_classes[index](mod_str) for index, mod_str in found]
+
+
+def split_roll_modifiers_iterative(exp_str: str) -> Tuple[str, List[RollExpModifier]]:
+    """
+    逐个正则反复匹配并移除修饰符, 每移除一个都从优先级最高的正则重新开始
+    """
+    mod_list: List[RollExpModifier] = []
+    cur_str: str = exp_str
+    prev_str: str = exp_str
+    has_mod = True
+    while has_mod:
+        has_mod = False
+        for mod_re in ROLL_MODIFIERS_DICT.keys():
+            mod_match = re.search(mod_re, cur_str)
+            if mod_match:
+                m_span = mod_match.span()
+                mod_str, cur_str = cur_str[m_span[0]:m_span[1]], cur_str[:m_span[0]] + cur_str[m_span[1]:]
+                mod_list.append(ROLL_MODIFIERS_DICT[mod_re](mod_str))
+                has_mod = True
+                break
+        if prev_str == cur_str:  # 解析一圈都没变化, 说明没有匹配的
+            break
+        prev_str = cur_str
+    return cur_str, mod_list
+
 # 注意定义的顺序也即是执行优先级, 越早定义则优先级越高
 # 同一种修饰符的匹配优先级为从左到右
 
@@ -0,0 +1,83 @@
+"""
+掷骰表达式的单遍解析
+词法分析只扫描一次字符串, 得到子表达式/连接符与所在的括号深度, 再用一个栈直接构建嵌套列表
+生成的列表与split_roll_str + create_leveling_list + parse_single_roll_exp完全一致, 运算优先级仍由calculate_roll_exp处理
+"""
+
+from typing import List, Any, Tuple
+
+from .roll_config import *
+from .roll_utils import RollDiceError
+from .connector import ROLL_CONNECTORS_DICT
+from .expression import parse_single_roll_exp
+
+
+def lex_roll_exp(input_str: str) -> List[Tuple[Any, int]]:
+    """
+    将掷骰表达式拆分为(子表达式字符串或连接符类, 括号深度)的列表, 遇到空格时停止
+    """
+    if not input_str:
+        raise RollDiceError("表达式不能为空")
+    connectors = ROLL_CONNECTORS_DICT
+    tokens: List[Tuple[Any, int]] = []
+    depth: int = 0
+    start: int = 0  # 当前子表达式的起点
+    length = len(input_str)
+    pl: int = 0
+    while pl < length:
+        if depth > PARSE_RECURSION_DEPTH_MAX:
+            raise RollDiceError("超出最大解析深度")
+        word = input_str[pl]
+        if word in connectors or word == "(" or word == ")" or word == " ":
+            if start < pl:
+                tokens.append((input_str[start:pl], depth))
+            start = pl + 1
+            if word == "(":
+                depth += 1
+            elif word == ")":
+                depth -= 1
+            elif word == " ":
+                break
+            else:
+                tokens.append((connectors[word], depth))
+        pl += 1
+    else:
+        if start < length:
+            tokens.append((input_str[start:], depth))
+    return tokens
+
+
+def build_exp_list(tokens: List[Tuple[Any, int]], default_type: int = DICE_TYPE_DEFAULT) -> List[Any]:
+    """
+    按深度将词法单元组装成嵌套列表, 子表达式字符串在此时解析为RollExpression
+    连续的更深的单元属于同一个子列表, 子列表以其中最浅的深度为基准, 因此((1))只会产生一层嵌套
+    """
+    if not tokens:
+        raise RollDiceError("表达式不能为空")
+    base = min(depth for _, depth in tokens)
+    root: List[Any] = []
+    stack: List[List[Any]] = [root]  # stack[i]对应深度base+i
+    for item, depth in tokens:
+        level = depth - base
+        del stack[level + 1:]
+        while len(stack) <= level:
+            sub_list: List[Any] = []
+            stack[-1].append(sub_list)
+            stack.append(sub_list)
+        stack[-1].append(item if type(item) is not str else parse_single_roll_exp(item, default_type))
+    return _collapse(root)
+
+
+def _collapse(exp_list: List[Any]) -> List[Any]:
+    """没有直接元素, 只包含一个子列表的中间层对应没有出现过的深度, 将其去掉"""
+    for index, item in enumerate(exp_list):
+        if type(item) is list:
+            while len(item) == 1 and type(item[0]) is list:
+                item = item[0]
+            exp_list[index] = _collapse(item)
+    return exp_list
+
+
+def parse_exp_list(input_str: str, default_type: int = DICE_TYPE_DEFAULT) -> List[Any]:
+    """解析已经去掉外层括号的表达式, 返回RollExpressionFormula.exp_list"""
+    return build_exp_list(lex_roll_exp(input_str), default_type)
@@ -19,7 +19,8 @@ ROLL_OPTIONS_LIMIT = 100  # 可选择的项目上线
 @custom_user_command(readable_name="随机选择指令",
                      priority=0,
                      group_only=False,
-                     flag=DPP_COMMAND_FLAG_ROLL)
+                     flag=DPP_COMMAND_FLAG_ROLL,
+                     prefixes=(".c",))
 class RollChooseCommand(UserCommandBase):
     """
     骰池相关的指令, 以.w开头
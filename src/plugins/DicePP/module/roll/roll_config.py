@@ -6,3 +6,5 @@ DICE_CONSTANT_MAX = 1000  # 常量大小上限
 
 PARSE_RECURSION_DEPTH_MAX = 100  # 解析表达式时最大递归深度
 EXPLODE_LIMIT = 50  # 爆炸修饰符执行次数上限
+ROLL_BATCH_NUMPY_MIN = 1000  # 批量掷骰的数量达到该值且安装了numpy时使用numpy生成
+ROLL_EXP_CACHE_SIZE = 512  # 解析后的掷骰表达式缓存数量
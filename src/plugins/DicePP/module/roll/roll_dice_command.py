@@ -1,5 +1,4 @@
 from typing import List, Tuple, Any
-import asyncio
 import math
 
 from core.bot import Bot
@@ -19,6 +18,7 @@ from module.roll.default_dice import (
     extract_default_type_hint,
 )
 from module.roll.karma_manager import get_karma_manager
+from module.roll.distribution import get_roll_exp_distribution_async, get_distribution_percentiles, get_distribution_mean
 from utils.logger import dice_log
 
 LOC_ROLL_RESULT = "roll_result"
@@ -51,7 +51,8 @@ MULTI_ROLL_LIMIT = 10  # 多轮掷骰上限次数
 @custom_user_command(readable_name="掷骰指令",
                      priority=0,
                      group_only=False,
-                     flag=DPP_COMMAND_FLAG_ROLL)
+                     flag=DPP_COMMAND_FLAG_ROLL,
+                     prefixes=(".r",))
 class RollDiceCommand(UserCommandBase):
     """
     掷骰相关的指令, 以.r开头
@@ -261,13 +262,13 @@ class RollDiceCommand(UserCommandBase):
                 try:
                     with karma_manager.activate(meta.group_id, user_token) as active:
                         karma_enabled = active
-                        res_list: List[RollResult] = [exp.get_result() for _ in range(times)]
+                        res_list: List[RollResult] = exp.get_results(times)
                 except Exception as exc:  # noqa: B902
                     dice_log(f"[KarmaDice] 激活失败，回退普通掷骰: {exc}")
                     karma_enabled = False
-                    res_list = [exp.get_result() for _ in range(times)]
+                    res_list = exp.get_results(times)
             else:
-                res_list = [exp.get_result() for _ in range(times)]
+                res_list = exp.get_results(times)
         except RollDiceError as e:
             feedback = e.info
             # 生成机器人回复端口
@@ -286,7 +287,10 @@ class RollDiceCommand(UserCommandBase):
                 return [BotSendMsgCommand(self.bot.account, res, [port])]
             else:
                 async def roll_exp_task():
-                    exp_result = await get_roll_exp_result(exp)
+                    try:
+                        exp_result = await get_roll_exp_result(exp)
+                    except RollDiceError as e:
+                        return [BotSendMsgCommand(self.bot.account, e.info, [port])]
                     exp_feedback = self.format_loc(LOC_ROLL_EXP, expression=exp.get_result().get_exp(), expectation=exp_result)
                     return [BotSendMsgCommand(self.bot.account, exp_feedback, [port])]
                 self.bot.register_task(roll_exp_task, timeout=30, timeout_callback=lambda: [BotSendMsgCommand(self.bot.account, "计算超时!", [port])])
@@ -458,26 +462,18 @@ class RollDiceCommand(UserCommandBase):
 
 
 async def get_roll_exp_result(expression: RollExpression) -> str:
-    repeat_times = 200000
-    break_times = 32
     stat_range = [1, 5, 25, 45, 55, 75, 95, 99]  # 统计区间, 大于0, 小于100
-    res_list: List[int] = []
-    for _ in range(break_times):
-        res_list += list(sorted((expression.get_result().get_val() for _ in range(repeat_times // break_times))))
-        await asyncio.sleep(0)
-    res_list = sorted(res_list)
-    mean = sum(res_list)/repeat_times
-    info = []
-    stat_range_num: List[int] = [0] + [repeat_times*r//100 for r in stat_range] + [-1]
-    for num in stat_range_num:
-        info.append(res_list[num])
+    # 精确分布通常只需几毫秒, 但不支持的节点会退化为抽样, 因此放到专用线程中计算以免阻塞事件循环
+    dist = await get_roll_exp_distribution_async(expression)
+    mean = get_distribution_mean(dist)
+    info = get_distribution_percentiles(dist, stat_range)
     feedback = ""
     left_range = 0
     for index, right_range in enumerate(stat_range):
         feedback += f"{left_range}%~{right_range}% -> [{info[index]}~{info[index + 1]}]\n"
         left_range = right_range
     feedback += f"{stat_range[-1]}%~100% -> [{info[-2]}~{info[-1]}]\n"
-    feedback += f"均值: {mean}"
+    feedback += f"均值: {round(mean, 4)}"
     return feedback
 
 
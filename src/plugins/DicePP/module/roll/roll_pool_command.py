@@ -1,6 +1,5 @@
 from typing import List, Tuple, Any
 import asyncio
-import random
 
 from core.bot import Bot
 from core.data import DC_USER_DATA, DC_GROUP_DATA, DataManagerError
@@ -9,6 +8,7 @@ from core.command import UserCommandBase, custom_user_command
 from core.command import BotCommandBase, BotSendMsgCommand
 from core.communication import MessageMetaData, PrivateMessagePort, GroupMessagePort
 from core.localization import LOC_FUNC_DISABLE
+from module.roll.roll_utils import roll_dices
 
 LOC_ROLL_POOL_RESULT = "roll_pool_result"
 LOC_ROLL_POOL_RESULT_REASON = "roll_pool_result_reason"
@@ -30,7 +30,8 @@ ROLL_WIN = 8  # 成功所需的点数
 @custom_user_command(readable_name="骰池指令",
                      priority=0,
                      group_only=False,
-                     flag=DPP_COMMAND_FLAG_ROLL)
+                     flag=DPP_COMMAND_FLAG_ROLL,
+                     prefixes=(".w",))
 class RollPoolCommand(UserCommandBase):
     """
     骰池相关的指令, 以.w开头
@@ -162,8 +163,12 @@ class RollPoolCommand(UserCommandBase):
         roll_win_str = "①②③④⑤⑥⑦⑧⑨⑩"
         roll_addon_str = "⒈⒉⒊⒋⒌⒍⒎⒏⒐⒑"
         roll_win_addon_str = "❶❷❸❹❺❻❼❽❾❿"
+        pending: List[int] = []
         while times > 0:
-            now_roll = random.randint(1, 10)
+            if not pending:  # 一次掷出当前剩余的所有骰子, 加骰会在下一批中掷出
+                pending = roll_dices(10, times)
+                pending.reverse()
+            now_roll = pending.pop()
             roll_str = str(now_roll)
             if now_roll >= win_difficult and now_roll >= pool_addon_number:
                 wins += 1 if not negative else -1
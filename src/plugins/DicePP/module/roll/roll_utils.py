@@ -4,10 +4,18 @@
 
 from typing import List, Tuple
 
-from random import randint
+from random import randint, choices
 
+from .roll_config import ROLL_BATCH_NUMPY_MIN
 from .karma_runtime import get_runtime
 
+try:
+    import numpy
+    NUMPY_AVAILABLE = True
+    _numpy_rng = numpy.random.default_rng()
+except ImportError:
+    NUMPY_AVAILABLE = False
+
 
 class RollDiceError(Exception):
     """
@@ -30,6 +38,20 @@ def roll_a_dice(dice_type: int) -> int:
     return randint(1, dice_type)
 
 
+def roll_dices(dice_type: int, dice_num: int) -> List[int]:
+    """
+    一次返回dice_num颗dice_type面骰的结果
+    存在业力运行时的情况下逐颗交给运行时处理, 与roll_a_dice的行为一致
+    数量较多且安装了numpy时使用numpy生成, 否则使用random.choices, 两者都比逐颗调用randint快得多
+    """
+    runtime = get_runtime()
+    if runtime is not None:
+        return [runtime.roll(dice_type) for _ in range(dice_num)]
+    if NUMPY_AVAILABLE and dice_num >= ROLL_BATCH_NUMPY_MIN:
+        return _numpy_rng.integers(1, dice_type + 1, size=dice_num).tolist()
+    return choices(range(1, dice_type + 1), k=dice_num)
+
+
 def match_outer_parentheses(input_str: str) -> int:
     """
     若输入字符串的第一个字符是(, 返回对应的)的索引. 若不存在对应的), 抛出一个ValueError. 若首字母不是(, 返回-1
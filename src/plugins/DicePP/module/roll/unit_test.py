@@ -1,11 +1,20 @@
 import unittest
+import asyncio
+import random
+import threading
+from collections import Counter
 from typing import Callable
 
 #import roll_config
 import module.roll.roll_config as roll_config
-from module.roll.expression import parse_roll_exp, exec_roll_exp, RollExpression, preprocess_roll_exp, split_roll_str, combine_roll_str, parse_single_roll_exp,calculate_rool_exp,create_leveling_list
-from module.roll.roll_utils import match_outer_parentheses, remove_redundant_parentheses, RollDiceError
+from module.roll.expression import ROLL_EXP_CACHE, is_roll_exp, parse_roll_exp, exec_roll_exp, RollExpression, preprocess_roll_exp, split_roll_str, combine_roll_str, parse_single_roll_exp,calculate_roll_exp,create_leveling_list
+from module.roll.roll_utils import match_outer_parentheses, remove_redundant_parentheses, clear_border_parentheses, RollDiceError
+from module.roll.modifier import split_roll_modifiers, split_roll_modifiers_iterative
+from module.roll.parser import parse_exp_list
 from module.roll.result import RollResult
+from module.roll.karma_runtime import set_runtime, reset_runtime
+from module.roll.distribution import get_roll_exp_distribution, get_distribution_percentiles, get_distribution_mean, \
+    get_roll_exp_distribution_async, DistributionCalculator, DIST_EXECUTOR
 
 
 class MyTestCase(unittest.TestCase):
@@ -84,7 +93,7 @@ class MyTestCase(unittest.TestCase):
         #print("  拆分:"+str([str(type(thing)) for thing in thing_list]))
         leveling_list = create_leveling_list(thing_list, split_list[1])
         #print(leveling_list)
-        result = calculate_rool_exp(leveling_list)
+        result = calculate_roll_exp(leveling_list)
         print(result.get_result())
             
 
@@ -225,6 +234,169 @@ class MyTestCase(unittest.TestCase):
         self.assertTrue(not repeat_until_checked("D20+D20"))
         """
 
+    def test_distribution(self):
+        # 精确分布与抽样结果对比
+        random.seed(20240101)
+        sample_times = 20000
+
+        def check_with_sampler(exp_str: str):
+            exp: RollExpression = parse_roll_exp(preprocess_roll_exp(exp_str))
+            dist = get_roll_exp_distribution(exp)
+            self.assertAlmostEqual(sum(dist.values()), 1, places=6)
+            counter = Counter(exp.get_result().get_val() for _ in range(sample_times))
+            # 累积分布函数之差的最大值(KS统计量)
+            max_diff, cdf_dist, cdf_sample = 0.0, 0.0, 0.0
+            for val in sorted(set(dist) | set(counter)):
+                cdf_dist += dist.get(val, 0)
+                cdf_sample += counter.get(val, 0) / sample_times
+                max_diff = max(max_diff, abs(cdf_dist - cdf_sample))
+            self.assertLess(max_diff, 0.02, exp_str)
+            sample_mean = sum(val * count for val, count in counter.items()) / sample_times
+            self.assertLess(abs(get_distribution_mean(dist) - sample_mean), 0.05 * max(1.0, abs(sample_mean)), exp_str)
+
+        for exp_str in ["D20", "3D6+2", "2D20K1", "2D20KL1", "4D6K3", "8D10KL5", "D20R1", "4D20R<10",
+                        "1D6X6", "4D20X<10", "4D20XO<10", "4D20R<10X>10", "10D20CS>10", "3D6M3", "3D6P2",
+                        "(1+D20)*2", "3D20/2", "2/3D20", "D20+2抗性", "2D4+D20易伤", "1D20F/3", "1.5*D6",
+                        "D20劣势+1+D优势", "1D4-1D6"]:
+            check_with_sampler(exp_str)
+
+        # 已知的精确结果
+        dist = get_roll_exp_distribution(parse_roll_exp(preprocess_roll_exp("D20优势")))
+        self.assertAlmostEqual(get_distribution_mean(dist), 13.825)
+        dist = get_roll_exp_distribution(parse_roll_exp(preprocess_roll_exp("D6X6")))
+        self.assertAlmostEqual(get_distribution_mean(dist), 4.2, places=6)
+        dist = get_roll_exp_distribution(parse_roll_exp(preprocess_roll_exp("3D6")))
+        self.assertAlmostEqual(dist[10], 27 / 216)
+        self.assertEqual(get_distribution_percentiles(dist, [1, 50, 99]), [3, 4, 11, 17, 18])
+        dist = get_roll_exp_distribution(parse_roll_exp(preprocess_roll_exp("100D1000")))
+        self.assertAlmostEqual(get_distribution_mean(dist), 50050, places=3)
+        self.assertRaises(RollDiceError, get_roll_exp_distribution, parse_roll_exp(preprocess_roll_exp("D6X>=1")))
+
+        # 取消后精确计算与抽样都会终止, 不再占用DIST_EXECUTOR
+        calculator = DistributionCalculator()
+        calculator.cancel()
+        self.assertRaises(RollDiceError, calculator.calculate, parse_roll_exp(preprocess_roll_exp("100D1000")))
+        self.assertRaises(RollDiceError, calculator.calculate, parse_roll_exp(preprocess_roll_exp("5B")))
+
+        async def cancel_sampling():
+            exp = parse_roll_exp(preprocess_roll_exp("5B"))
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(get_roll_exp_distribution_async(exp, sample_times=10 ** 9), 0.1)
+        asyncio.run(cancel_sampling())
+        DIST_EXECUTOR.submit(lambda: None).result(timeout=5)
+
+    def test_batch_roll(self):
+        # 批量掷骰与逐次掷骰的记录字段一致
+        for exp_str in ["D20", "3D20", "2D20K1", "D100", "4D6K3+2", "(D20+5)*2", "D20-D20", "10D20CS>10", "4D20X<10", "5B+D20"]:
+            exp: RollExpression = parse_roll_exp(preprocess_roll_exp(exp_str))
+            res_list = exp.get_results(50)
+            self.assertEqual(len(res_list), 50)
+            single = exp.get_result()
+            for res in res_list:
+                self.assertEqual(res.get_exp(), single.get_exp())
+                self.assertEqual((res.dice_num, res.d20_num, res.d100_num, res.float_state),
+                                 (single.dice_num, single.d20_num, single.d100_num, single.float_state))
+                self.assertEqual(len(res.average_list), len(single.average_list))
+        # 大成功与大失败
+        res_list = parse_roll_exp("D20").get_results(2000)
+        self.assertEqual(sum(res.success for res in res_list), sum(res.get_val() == 20 for res in res_list))
+        self.assertEqual(sum(res.fail for res in res_list), sum(res.get_val() == 1 for res in res_list))
+        self.assertTrue(all(res.average_list == [round((res.get_val() - 1) * 100 / 19)] for res in res_list))
+        # 批量掷骰同样经过业力运行时
+        class FixedRuntime:
+            def __init__(self):
+                self.count = 0
+
+            def roll(self, dice_type: int) -> int:
+                self.count += 1
+                return dice_type
+
+        runtime = FixedRuntime()
+        token = set_runtime(runtime)
+        try:
+            res_list = parse_roll_exp("3D6+D20").get_results(10)
+        finally:
+            reset_runtime(token)
+        self.assertEqual(runtime.count, 40)
+        self.assertTrue(all(res.get_val() == 38 and res.success == 1 for res in res_list))
+
+    def test_parse_cache(self):
+        ROLL_EXP_CACHE.clear()
+        exp_a = parse_roll_exp(preprocess_roll_exp("d20优势+5"))
+        exp_b = parse_roll_exp(preprocess_roll_exp("d20优势+5"))
+        self.assertIs(exp_a, exp_b)
+        self.assertIsNot(exp_a, parse_roll_exp(preprocess_roll_exp("d20优势+5"), 6))  # 默认骰面不同
+        stats = ROLL_EXP_CACHE.get_stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (1, 2, 2))
+        # 解析失败同样被缓存
+        self.assertFalse(is_roll_exp("(D20"))
+        self.assertRaises(RollDiceError, parse_roll_exp, preprocess_roll_exp("(D20"))
+        self.assertEqual(ROLL_EXP_CACHE.get_stats()["hits"], 2)
+        # 带状态的XB不缓存
+        self.assertIsNot(parse_roll_exp("5B"), parse_roll_exp("5B"))
+        self.assertEqual(parse_roll_exp("5B").get_results(3)[2].get_val(), 10)
+        # LRU淘汰
+        ROLL_EXP_CACHE.clear()
+        for i in range(ROLL_EXP_CACHE.max_size + 10):
+            parse_roll_exp(f"D20+{i}")
+        self.assertEqual(ROLL_EXP_CACHE.get_stats()["size"], ROLL_EXP_CACHE.max_size)
+        # 缓存的表达式可以在多个线程中同时求值
+        exp = parse_roll_exp("4D6K3+2")
+        errors = []
+
+        def worker():
+            for res in exp.get_results(500):
+                if not 5 <= res.get_val() <= 20 or res.get_exp() != "4D6K3+2":
+                    errors.append(res.get_complete_result())
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+
+    def test_parser_parity(self):
+        def describe(item):
+            if type(item) is list:
+                return [describe(i) for i in item]
+            if isinstance(item, type):
+                return item.__name__
+            mods = [(type(m).__name__, str(vars(m))) for m in getattr(item, "mod_list", [])]
+            return type(item).__name__, str({k: v for k, v in vars(item).items() if k != "mod_list"}), mods
+
+        def outcome(func, arg):
+            try:
+                return func(arg)
+            except (RollDiceError, ValueError):
+                return "error"
+
+        def legacy_list(input_str):
+            split_list = split_roll_str(input_str)
+            return describe(create_leveling_list([parse_single_roll_exp(i) for i in split_list[0]], split_list[1]))
+
+        def mods(input_str):
+            cur_str, mod_list = split_roll_modifiers(input_str)
+            return cur_str, [(type(m).__name__, str(vars(m))) for m in mod_list]
+
+        def mods_iterative(input_str):
+            cur_str, mod_list = split_roll_modifiers_iterative(input_str)
+            return cur_str, [(type(m).__name__, str(vars(m))) for m in mod_list]
+
+        rng = random.Random(8)
+        parts = ["D20", "2D6", "D", "4D6K3", "KH1", "KL2", "R1", "X6", "XO<3", "CS>5", "F", "M3", "P2",
+                 "R<=2", "5B", "1.5", "3", "+", "-", "*", "/", "(", ")", "D100"]
+        for _ in range(3000):
+            exp_str = "".join(rng.choice(parts) for _ in range(rng.randint(1, 7)))
+            self.assertEqual(outcome(mods, exp_str), outcome(mods_iterative, exp_str), exp_str)
+            try:
+                exp_str = clear_border_parentheses(exp_str)
+            except ValueError:
+                continue
+            if exp_str:
+                self.assertEqual(outcome(lambda x: describe(parse_exp_list(x)), exp_str),
+                                 outcome(legacy_list, exp_str), exp_str)
+
 
 if __name__ == '__main__':
     unittest.main()
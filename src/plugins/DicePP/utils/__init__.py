@@ -3,3 +3,4 @@ import utils.time
 import utils.string
 import utils.data
 import utils.cq_code
+import utils.asset
@@ -0,0 +1,136 @@
+"""
+进程内共享的只读资源登记表
+同一进程中的多个骰娘账号读取相同的牌库/生成器文件时只解析一次, 以文件的路径, 修改时间和大小作为键共享解析结果
+每个账号在每个槽位上最多持有一份资源, 换用新的资源或账号下线时减少引用计数, 没有账号引用的资源会被丢弃
+共享的资源必须只读, 各账号自己的状态(如每日次数限制)应当保存在指令对象中
+"""
+import os
+import threading
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Set, Tuple, TypeVar
+
+FileSignature = Tuple[str, int, int]  # (绝对路径, 修改时间(ns), 大小), 文件不存在时后两项为-1
+T = TypeVar("T")
+
+
+def get_file_signature(path: str) -> FileSignature:
+    path = os.path.abspath(path)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return path, -1, -1
+    return path, stat.st_mtime_ns, stat.st_size
+
+
+def get_path_signature(path: str, suffixes: Optional[Iterable[str]] = None) -> Tuple[FileSignature, ...]:
+    """
+    文件或文件夹(递归)的签名, 任何一个文件被修改, 添加或删除后签名都会改变
+    Args:
+        path: 文件或文件夹路径
+        suffixes: 只统计以这些后缀结尾的文件, 为None时统计所有文件
+    """
+    if not os.path.isdir(path):
+        return (get_file_signature(path),)
+    suffixes = tuple(suffixes) if suffixes is not None else None
+    signature = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for file in sorted(files):
+            if suffixes is None or file.endswith(suffixes):
+                signature.append(get_file_signature(os.path.join(root, file)))
+    return tuple(signature)
+
+
+class _AssetEntry:
+    __slots__ = ("value", "owners")
+
+    def __init__(self, value: Any):
+        self.value = value
+        self.owners: Set[str] = set()
+
+
+class AssetRegistry:
+    """
+    按(槽位, 键)保存共享资源, 记录持有每份资源的账号
+    """
+
+    def __init__(self):
+        self.__entries: Dict[Tuple[str, Hashable], _AssetEntry] = {}
+        self.__held: Dict[Tuple[str, str], Hashable] = {}  # (账号, 槽位) -> 当前持有的键
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self, owner: str, slot: str, key_func: Callable[[], Hashable], loader: Callable[[], T]) -> T:
+        """
+        获取资源, 已有相同键的资源时直接共享, 否则调用loader加载
+        加载后会重新计算一次键, 因为加载时可能创建了模板文件或者回写了表格
+        Args:
+            owner: 持有者, 一般为骰娘账号
+            slot: 资源种类, 同一持有者在同一槽位上只会持有一份资源
+            key_func: 计算资源键的函数, 一般由数据文件的签名和影响解析结果的设置组成
+            loader: 加载资源的函数, 返回值在之后会被视为只读
+        """
+        key = key_func()
+        with self.__lock:
+            entry = self.__entries.get((slot, key))
+            if entry is not None:
+                self.hits += 1
+                self.__hold(owner, slot, key, entry)
+                return entry.value
+            self.misses += 1
+        value = loader()
+        key = key_func()
+        with self.__lock:
+            entry = self.__entries.get((slot, key))
+            if entry is None:
+                entry = self.__entries[(slot, key)] = _AssetEntry(value)
+            self.__hold(owner, slot, key, entry)
+            return entry.value
+
+    def __hold(self, owner: str, slot: str, key: Hashable, entry: _AssetEntry) -> None:
+        prev_key = self.__held.get((owner, slot))
+        if prev_key is not None and prev_key != key:
+            self.__drop(owner, slot, prev_key)
+        entry.owners.add(owner)
+        self.__held[(owner, slot)] = key
+
+    def __drop(self, owner: str, slot: str, key: Hashable) -> None:
+        entry = self.__entries.get((slot, key))
+        if entry is None:
+            return
+        entry.owners.discard(owner)
+        if not entry.owners:
+            del self.__entries[(slot, key)]
+
+    def release(self, owner: str, slot: Optional[str] = None) -> None:
+        """释放owner在slot上持有的资源, slot为None时释放owner持有的所有资源"""
+        with self.__lock:
+            for owner_cur, slot_cur in [held for held in self.__held.keys() if held[0] == owner]:
+                if slot is None or slot_cur == slot:
+                    self.__drop(owner, slot_cur, self.__held.pop((owner_cur, slot_cur)))
+
+    def get_ref_count(self, slot: str, key: Hashable) -> int:
+        with self.__lock:
+            entry = self.__entries.get((slot, key))
+            return len(entry.owners) if entry else 0
+
+    def get_held_key(self, owner: str, slot: str) -> Optional[Hashable]:
+        return self.__held.get((owner, slot))
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
+            self.__held.clear()
+            self.hits, self.misses = 0, 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.__lock:
+            slots: Dict[str, Dict[str, int]] = {}
+            for (slot, key), entry in self.__entries.items():
+                slot_stat = slots.setdefault(slot, {"entries": 0, "refs": 0})
+                slot_stat["entries"] += 1
+                slot_stat["refs"] += len(entry.owners)
+            return {"entries": len(self.__entries), "slots": slots, "hits": self.hits, "misses": self.misses}
+
+
+ASSET_REGISTRY = AssetRegistry()
@@ -1,7 +1,13 @@
-from typing import Union
+from typing import Union, Tuple, Dict
 from io import BytesIO
 from pathlib import Path
 from base64 import b64encode
+from collections import OrderedDict
+import os
+import threading
+
+IMAGE_CACHE_SIZE = 128  # 缓存的图片数量
+IMAGE_CACHE_MAX_BYTES = 64 * 1024 * 1024  # 缓存的CQ码总长度上限, 超过上限的单张图片不缓存
 
 
 def get_cq_image(file: Union[str, bytes, BytesIO, Path]) -> str:
@@ -10,11 +16,78 @@ def get_cq_image(file: Union[str, bytes, BytesIO, Path]) -> str:
     if isinstance(file, bytes):
         file = f"base64://{b64encode(file).decode()}"
     elif isinstance(file, Path):
-        file = f"file:///{file.resolve()}"
+        file = file.resolve().as_uri()
     elif isinstance(file, str):
         file = f"file:///{file}"
     return f"[CQ:image,file={file}]"
 
+
+class ImagePayloadCache:
+    """
+    本地图片CQ码的LRU缓存, 键为图片的绝对路径, 同时记录文件的修改时间与大小, 文件变化后会重新读取
+    """
+
+    def __init__(self, max_size: int = IMAGE_CACHE_SIZE, max_bytes: int = IMAGE_CACHE_MAX_BYTES):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.__items: "OrderedDict[str, Tuple[int, int, str]]" = OrderedDict()
+        self.__bytes = 0
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path: Path) -> str:
+        """返回图片的base64 CQ码, 文件不存在时抛出OSError"""
+        key = str(path)
+        stat = os.stat(key)
+        with self.__lock:
+            item = self.__items.get(key)
+            if item is not None and item[0] == stat.st_mtime_ns and item[1] == stat.st_size:
+                self.__items.move_to_end(key)
+                self.hits += 1
+                return item[2]
+            self.misses += 1
+        payload = get_cq_image(path.read_bytes())
+        with self.__lock:
+            old_item = self.__items.pop(key, None)
+            if old_item is not None:
+                self.__bytes -= len(old_item[2])
+            if len(payload) <= self.max_bytes:
+                self.__items[key] = (stat.st_mtime_ns, stat.st_size, payload)
+                self.__bytes += len(payload)
+                while len(self.__items) > self.max_size or self.__bytes > self.max_bytes:
+                    self.__bytes -= len(self.__items.popitem(last=False)[1][2])
+        return payload
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__items.clear()
+            self.__bytes = 0
+            self.hits, self.misses = 0, 0
+
+    def get_stats(self) -> Dict[str, Union[int, float]]:
+        total = self.hits + self.misses
+        return {"size": len(self.__items), "max_size": self.max_size, "bytes": self.__bytes,
+                "hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+
+IMAGE_CACHE = ImagePayloadCache()
+
+
+def get_cq_image_cached(path: Path, file_uri: bool = False) -> str:
+    """
+    读取本地图片并生成CQ码, 文件不存在时抛出OSError
+    Args:
+        path: 图片路径, 传入绝对路径可以省去解析路径的开销
+        file_uri: 为True时直接发送file:///路径, 适用于OneBot客户端与骰娘在同一文件系统中的情况
+    """
+    if file_uri:
+        if not path.exists():
+            raise FileNotFoundError(str(path))
+        return get_cq_image(path)
+    return IMAGE_CACHE.get(path if path.is_absolute() else path.resolve())
+
+
 def get_cq_reply(message_id: str) -> str:
     if message_id.isdigit():
         return f"[CQ:reply,id={message_id}]\n"
@@ -1,9 +1,15 @@
-from typing import List, Dict
+from typing import List, Dict, Any, Callable, Optional, Tuple, Iterator
 import os
 import json
+import hashlib
+import pickle
 import openpyxl
 from openpyxl.comments import Comment
 
+from utils.logger import dice_log
+
+XLSX_CACHE_VERSION = 1  # 缓存格式变化时增加, 旧的缓存文件会被忽略
+
 
 def read_json(path: str) -> dict:
     """
@@ -31,6 +37,26 @@ async def update_json_async(json_dict: dict, path: str) -> None:
         json.dump(json_dict, f, ensure_ascii=False)
 
 
+def write_json_atomic(json_dict: dict, path: str, default: Optional[Callable[[Any], Any]] = None) -> int:
+    """
+    将jsonFile流式写入path.tmp, 再通过os.replace原子地替换path, 任何时刻path都是一个完整的文件
+    Args:
+        json_dict: 要保存的数据, 写入期间不能被修改
+        path: 目标路径
+        default: 传给json.dump的default, 用于序列化自定义类型
+    Returns:
+        size: 写入的字节数
+    """
+    path_tmp = path + ".tmp"
+    with open(path_tmp, "w", encoding='utf-8') as f:
+        json.dump(json_dict, f, ensure_ascii=False, default=default)
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(path_tmp, path)
+    return size
+
+
 def read_xlsx(path: str) -> openpyxl.Workbook:
     """
     读取xlsx, 记得之后手动关闭workbook
@@ -48,6 +74,216 @@ def update_xlsx(workbook: openpyxl.Workbook, path: str) -> None:
     workbook.save(path)
 
 
+class CachedCell:
+    """只读的单元格, 提供与openpyxl的Cell相同的value, row, column, comment属性, comment为注释文本"""
+    __slots__ = ("value", "row", "column", "comment")
+
+    def __init__(self, value: Any, row: int, column: int, comment: Optional[str]):
+        self.value = value
+        self.row = row
+        self.column = column
+        self.comment = comment
+
+
+class CachedWorksheet:
+    """
+    只读的工作表快照, 支持读取数据时用到的iter_rows, iter_cols与ws[行号]
+    """
+
+    def __init__(self, title: str, rows: List[tuple], comments: Dict[Tuple[int, int], str]):
+        self.title = title
+        self.rows = rows  # 与iter_rows(values_only=True)的结果相同
+        self.comments = comments  # (行号, 列号) -> 注释文本, 从1开始
+        self.max_row = max(len(rows), 1)
+        self.max_column = max((len(row) for row in rows), default=1)
+
+    def __get_cells(self, row_index: int) -> Tuple[CachedCell, ...]:
+        values = self.rows[row_index - 1] if row_index <= len(self.rows) else ()
+        values = tuple(values) + (None,) * (self.max_column - len(values))
+        return tuple(CachedCell(value, row_index, column_index + 1, self.comments.get((row_index, column_index + 1)))
+                     for column_index, value in enumerate(values))
+
+    def __getitem__(self, row_index: int) -> Tuple[CachedCell, ...]:
+        return self.__get_cells(row_index)
+
+    def iter_rows(self, min_row: int = 1, values_only: bool = False) -> Iterator[tuple]:
+        for row_index in range(min_row, len(self.rows) + 1):
+            yield tuple(self.rows[row_index - 1]) if values_only else self.__get_cells(row_index)
+
+    def iter_cols(self, values_only: bool = False) -> Iterator[tuple]:
+        for column_index in range(self.max_column):
+            column = tuple(row[column_index] if column_index < len(row) else None for row in self.rows)
+            if values_only:
+                yield column
+            else:
+                yield tuple(CachedCell(value, row_index + 1, column_index + 1,
+                                       self.comments.get((row_index + 1, column_index + 1)))
+                            for row_index, value in enumerate(column))
+
+
+class _CachedProperties:
+    def __init__(self, title: str, identifier: str):
+        self.title = title
+        self.identifier = identifier
+
+
+class CachedWorkbook:
+    """
+    xlsx的只读快照, 用于替代只读取数据的openpyxl.Workbook, 修改它不会影响文件
+    """
+
+    def __init__(self, path: str, sheets: List[Tuple[str, List[tuple], Dict[Tuple[int, int], str]]]):
+        self.__sheets: Dict[str, CachedWorksheet] = {name: CachedWorksheet(name, rows, comments)
+                                                     for name, rows, comments in sheets}
+        self.sheetnames: List[str] = [name for name, _, _ in sheets]
+        title = os.path.basename(path).rsplit(".", maxsplit=1)[0]
+        self.properties = _CachedProperties(title, path)
+
+    def __getitem__(self, sheet_name: str) -> CachedWorksheet:
+        return self.__sheets[sheet_name]
+
+    def __contains__(self, sheet_name: str) -> bool:
+        return sheet_name in self.__sheets
+
+    def close(self) -> None:
+        pass
+
+
+def snapshot_worksheet(sheet) -> Tuple[List[tuple], Dict[Tuple[int, int], str]]:
+    """得到openpyxl工作表的值与注释"""
+    rows = list(sheet.iter_rows(values_only=True))
+    comments: Dict[Tuple[int, int], str] = {}
+    for row in sheet.iter_rows():
+        for cell in row:
+            if cell.comment is not None:
+                comments[(cell.row, cell.column)] = cell.comment.text
+    return rows, comments
+
+
+class XlsxCache:
+    """
+    已解析xlsx的缓存, 以文件的绝对路径, 修改时间和大小为键
+    缓存以pickle保存在cache_dir中, 源文件没有变化时启动无需再用openpyxl解析
+    keep_in_memory的文件还会保留在内存中, 供同一进程中的多个账号复用
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.cache_dir = cache_dir
+        self.memory: Dict[str, Tuple[int, int, CachedWorkbook]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def set_cache_dir(self, cache_dir: Optional[str]) -> None:
+        self.cache_dir = cache_dir
+
+    def get_cache_path(self, path: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha1(path.encode("utf-8")).hexdigest()[:20] + ".pkl")
+
+    def read(self, path: str, keep_in_memory: bool = False) -> CachedWorkbook:
+        """读取xlsx的快照, 文件不存在时抛出FileNotFoundError, 没有权限时抛出PermissionError"""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        memory_item = self.memory.get(path)
+        if memory_item is not None and memory_item[0] == stat.st_mtime_ns and memory_item[1] == stat.st_size:
+            self.hits += 1
+            return memory_item[2]
+        sheets = self.__load_cache_file(path, stat)
+        if sheets is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            wb = read_xlsx(path)
+            sheets = [(name, *snapshot_worksheet(wb[name])) for name in wb.sheetnames]
+            wb.close()
+            self.__save_cache_file(path, stat, sheets)
+        workbook = CachedWorkbook(path, sheets)
+        if keep_in_memory:
+            self.memory[path] = (stat.st_mtime_ns, stat.st_size, workbook)
+        else:
+            self.memory.pop(path, None)
+        return workbook
+
+    def __load_cache_file(self, path: str, stat: os.stat_result) -> Optional[list]:
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self.get_cache_path(path), "rb") as f:
+                data = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            dice_log(f"[XlsxCache] 无法读取{path}的缓存: {e}")
+            return None
+        if not isinstance(data, dict) or data.get("version") != XLSX_CACHE_VERSION or data.get("path") != path \
+                or data.get("mtime_ns") != stat.st_mtime_ns or data.get("size") != stat.st_size:
+            return None
+        return data["sheets"]
+
+    def __save_cache_file(self, path: str, stat: os.stat_result, sheets: list) -> None:
+        if not self.cache_dir:
+            return
+        data = {"version": XLSX_CACHE_VERSION, "path": path, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size,
+                "sheets": sheets}
+        cache_path = self.get_cache_path(path)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(cache_path + ".tmp", "wb") as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(cache_path + ".tmp", cache_path)
+        except Exception as e:
+            dice_log(f"[XlsxCache] 无法写入{path}的缓存: {e}")
+
+    def clear(self) -> None:
+        self.memory.clear()
+        self.hits, self.misses = 0, 0
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"memory": len(self.memory), "hits": self.hits, "misses": self.misses}
+
+
+XLSX_CACHE = XlsxCache()
+
+
+def read_xlsx_cached(path: str, keep_in_memory: bool = False) -> CachedWorkbook:
+    """
+    读取xlsx的只读快照, 源文件没有变化时使用缓存, 不需要关闭
+    需要修改并保存的工作簿仍然应该使用read_xlsx
+    """
+    return XLSX_CACHE.read(path, keep_in_memory)
+
+
+def normalize_sheet_rows(rows: List[Any]) -> List[list]:
+    """去掉每行末尾与表格末尾的空单元格, 空字符串与空单元格视为相同, 用于比较工作表内容"""
+    result = []
+    for row in rows:
+        values = ["" if value is None else value for value in row]
+        while values and values[-1] == "":
+            values.pop()
+        result.append(values)
+    while result and not result[-1]:
+        result.pop()
+    return result
+
+
+def is_sheet_rows_equal(sheet: Optional[CachedWorksheet], rows: List[List[Any]],
+                        comments: Optional[Dict[int, str]] = None) -> bool:
+    """
+    工作表的前len(rows)行是否与rows一致, 用于判断是否需要回写, 空字符串与空单元格视为相同
+    Args:
+        sheet: 工作表快照, 为None时视为不一致
+        rows: 期望的每一行的值
+        comments: 行号(从1开始) -> 第一列期望的注释文本
+    """
+    if sheet is None or len(sheet.rows) < len(rows):
+        return False
+    if normalize_sheet_rows(sheet.rows[:len(rows)]) != normalize_sheet_rows(rows):
+        return False
+    for row_index, comment in (comments or {}).items():
+        if (sheet.comments.get((row_index, 1)) or "") != (comment or ""):
+            return False
+    return True
+
+
 def get_empty_col_based_workbook(keywords: List[str], keyword_comments: Dict[str, str]) -> openpyxl.Workbook:
     """获得一个模板工作簿"""
     wb = openpyxl.Workbook()
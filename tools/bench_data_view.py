@@ -0,0 +1,92 @@
+"""
+对比 DataManager.get_data（深拷贝）与 get_view（只读视图）在常见数据形状上的读取开销
+
+用法：python tools/bench_data_view.py [--repeat 2000]
+"""
+import argparse
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+
+repo_root = Path(__file__).resolve().parents[1]
+src_path = repo_root / 'src' / 'plugins' / 'DicePP'
+if str(src_path) not in sys.path:
+    sys.path.insert(0, str(src_path))
+
+from core.data import DataManager, DataChunkBase, custom_data_chunk  # noqa: E402
+
+
+@custom_data_chunk(identifier="bench_view")
+class _(DataChunkBase):
+    def __init__(self):
+        super().__init__()
+
+
+def make_log_payload(log_count: int = 8, user_count: int = 30) -> dict:
+    """模拟一个群的日志数据: 多份日志, 每份带参与者/骰面统计与配色"""
+    logs = {}
+    for i in range(log_count):
+        participants = {str(10000 + u): {"nickname": f"玩家{u}", "count": u * 7} for u in range(user_count)}
+        dice_faces = {
+            str(face): {
+                "count": 120, "sum": 61.5,
+                "users": {str(10000 + u): {"nickname": f"玩家{u}", "count": 4, "sum": 2.1} for u in range(user_count)},
+            }
+            for face in (4, 6, 8, 10, 12, 20, 100)
+        }
+        logs[f"log{i:032d}"] = {
+            "name": f"日志{i}", "created_at": "2024/01/01 20:00:00", "updated_at": "2024/01/01 23:00:00",
+            "recording": i == 0, "records": [], "session_count": 300, "upload": {},
+            "color_map": {str(10000 + u): "a1b2c3" for u in range(user_count)},
+            "stats": {"messages": 900, "participants": participants,
+                      "rolls": {"success": 10, "failure": 8, "critical_success": 1, "critical_failure": 2},
+                      "attributes": {"hp": -12}, "dice_faces": dice_faces},
+        }
+    return {"current": "log" + "0" * 32, "logs": logs,
+            "filters": {"outside": False, "command": False, "bot": False, "media": False, "forum_code": False},
+            "name_index": {f"日志{i}": f"log{i:032d}" for i in range(log_count)}}
+
+
+def make_karma_config() -> dict:
+    return {"enabled": True, "mode": "custom", "engine": "precise", "custom_percentage": 60,
+            "custom_roll_count": 20, "intro_sent": True,
+            "history": {str(10000 + u): [55, 61, 48, 77, 12, 90, 33, 41] * 4 for u in range(20)}}
+
+
+SHAPES = {
+    "activate": [True, "2024_01_01_00_00_00"],
+    "nickname": "旅行者",
+    "karma_config": make_karma_config(),
+    "log_payload": make_log_payload(),
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dm = DataManager(tmp_dir)
+        for name, value in SHAPES.items():
+            dm.set_data("bench_view", [name], value)
+
+        print(f"{'shape':<14}{'deepcopy(us)':>14}{'view(us)':>12}{'speedup':>10}")
+        for name in SHAPES:
+            # 读取一个典型字段, 与热路径上的访问方式一致
+            def read_copy():
+                node = dm.get_data("bench_view", [name])
+                if isinstance(node, dict):
+                    node.get("current")
+            def read_view():
+                node = dm.get_view("bench_view", [name])
+                if hasattr(node, "get"):
+                    node.get("current")
+            t_copy = timeit.timeit(read_copy, number=args.repeat) / args.repeat * 1e6
+            t_view = timeit.timeit(read_view, number=args.repeat) / args.repeat * 1e6
+            print(f"{name:<14}{t_copy:>14.2f}{t_view:>12.2f}{t_copy / t_view:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+对比按顺序累减权重的旧抽取方式与树状数组抽样器(DeckSampler)在大牌库上的开销, 只衡量选取条目的耗时
+以及嵌套DRAW/ROLL的姓名生成牌库在逐次re.sub替换与预编译模板下的展开耗时
+
+用法：python tools/bench_deck_draw.py [--times 10] [--number 200] [--repeat 5]
+"""
+import argparse
+import random
+import sys
+import timeit
+from pathlib import Path
+
+repo_root = Path(__file__).resolve().parents[1]
+src_path = repo_root / 'src' / 'plugins' / 'DicePP'
+if str(src_path) not in sys.path:
+    sys.path.insert(0, str(src_path))
+
+from module.deck.deck_command import Deck, DeckItem, DeckSampler, DRAW_LIMIT  # noqa: E402
+
+DECK_SIZES = [10, 100, 1000, 5000, 20000]
+FILLER_DECKS = 500  # 嵌套展开时额外加载的牌库数量, 旧的实现需要线性查找目标牌库
+
+
+class _Loc:
+    """只做字符串拼接的本地化, 避免测到本地化的开销"""
+    def format_loc_text(self, key: str, **kwargs) -> str:
+        return kwargs.get("result", kwargs.get("content", ""))
+
+
+def legacy_draw(deck: Deck, times: int) -> None:
+    weight_sum_cur, index_mask = deck.weight_sum, set()
+    for _ in range(times):
+        if weight_sum_cur <= 0:
+            break
+        weight_random = random.randint(1, weight_sum_cur)
+        item_selected = None
+        for i, item in enumerate(deck.items):
+            if i in index_mask:
+                continue
+            weight_random -= item.weight
+            if weight_random <= 0:
+                item_selected = item
+                break
+        if not item_selected.redraw:
+            index_mask.add(deck.items.index(item_selected))
+            weight_sum_cur -= item_selected.weight
+
+
+def sampler_draw(deck: Deck, times: int) -> None:
+    sampler = DeckSampler(deck)
+    for _ in range(times):
+        if sampler.weight_sum <= 0:
+            break
+        index, item = sampler.draw()
+        if not item.redraw:
+            sampler.remove(index)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--times", type=int, default=10, help="每次抽卡抽取的张数")
+    parser.add_argument("--number", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"每次抽取 {args.times} 张, 重复 {args.number} 遍, 取 {args.repeat} 次的最小值")
+    print(f"{'size':<8}{'redraw':<8}{'legacy(us)':>12}{'sampler(us)':>14}{'speedup':>10}")
+    for size in DECK_SIZES:
+        for redraw in (True, False):
+            deck = Deck(f"Bench{size}", "")
+            for i in range(size):
+                deck.add_item(DeckItem(f"C{i}", random.randint(1, 10), redraw))
+            deck.get_weight_tree()
+            t_legacy = min(timeit.repeat(lambda: legacy_draw(deck, args.times), number=args.number, repeat=args.repeat))
+            t_new = min(timeit.repeat(lambda: sampler_draw(deck, args.times), number=args.number, repeat=args.repeat))
+            t_legacy, t_new = t_legacy / args.number * 1e6, t_new / args.number * 1e6
+            print(f"{size:<8}{str(redraw):<8}{t_legacy:>12.2f}{t_new:>14.2f}{t_legacy / t_new:>9.1f}x")
+
+    decks = [Deck(f"Filler{i}", "") for i in range(FILLER_DECKS)]
+    for deck in decks:
+        deck.add_item(DeckItem("F"))
+    for name, contents in [("姓", ["赵", "钱", "孙", "李", "欧阳"]), ("名", ["一", "二", "三", "DRAW(名,1)DRAW(名,1)"]),
+                           ("年龄", ["ROLL(2D6+12)", "ROLL(1D100)"]),
+                           ("人物", ["DRAW(姓,1)DRAW(名,1), DRAW(年龄,1)岁", "DRAW(姓,1)DRAW(名,2), ROLL(1D20)岁"])]:
+        deck = Deck(name, "")
+        for content in contents:
+            deck.add_item(DeckItem(content))
+        decks.append(deck)
+    generator, loc = decks[-1], _Loc()
+    t_legacy = min(timeit.repeat(lambda: generator.draw(DRAW_LIMIT, decks, loc), number=args.number, repeat=args.repeat))
+    deck_index = {deck.name: deck for deck in decks}
+    for deck in decks:
+        deck.compile(deck_index)
+    t_new = min(timeit.repeat(lambda: generator.draw(DRAW_LIMIT, decks, loc), number=args.number, repeat=args.repeat))
+    t_legacy, t_new = t_legacy / args.number * 1e6, t_new / args.number * 1e6
+    print(f"嵌套展开 {DRAW_LIMIT} 次(另有 {FILLER_DECKS} 个牌库): 逐次替换 {t_legacy:.2f}us, "
+          f"预编译 {t_new:.2f}us, {t_legacy / t_new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
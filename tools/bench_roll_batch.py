@@ -0,0 +1,59 @@
+"""
+对比逐颗掷骰(roll_a_dice)、逐轮掷骰(get_result)与批量掷骰(get_results)的开销
+
+用法：python tools/bench_roll_batch.py [--times 1000] [--repeat 5]
+"""
+import argparse
+import sys
+import timeit
+from pathlib import Path
+
+repo_root = Path(__file__).resolve().parents[1]
+src_path = repo_root / 'src' / 'plugins' / 'DicePP'
+if str(src_path) not in sys.path:
+    sys.path.insert(0, str(src_path))
+
+from module.roll.expression import RollExpressionXDY, parse_roll_exp, preprocess_roll_exp, calculate_roll_exp  # noqa: E402
+from module.roll.roll_utils import roll_a_dice, NUMPY_AVAILABLE  # noqa: E402
+
+EXPRESSIONS = ["D20", "D20+5", "2D20K1+7", "8D6", "4D6K3", "10D10CS>6", "100D6"]
+
+
+class _PerDie(RollExpressionXDY):
+    """包装一个XDY节点, 使其逐颗掷骰"""
+    def __init__(self, node: RollExpressionXDY):
+        self.__dict__.update(node.__dict__)
+
+    def get_result(self):
+        if self.dice_type < 2:
+            return super().get_result()
+        return self.build_result([roll_a_dice(self.dice_type) for _ in range(self.dice_num)])
+
+
+def wrap_per_die(exp_list: list) -> list:
+    """将表达式中的XDY节点替换为逐颗掷骰的版本, 连接符的处理沿用calculate_roll_exp"""
+    return [wrap_per_die(item) if type(item) is list else
+            _PerDie(item) if isinstance(item, RollExpressionXDY) else item for item in exp_list]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--times", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"numpy: {'可用' if NUMPY_AVAILABLE else '不可用'}, 每次 {args.times} 轮")
+    print(f"{'expression':<14}{'per-die(ms)':>13}{'per-round(ms)':>15}{'batch(ms)':>11}{'speedup':>10}")
+    for exp_str in EXPRESSIONS:
+        exp = parse_roll_exp(preprocess_roll_exp(exp_str))
+        per_die_list = wrap_per_die(exp.exp_list)
+        t_die = timeit.timeit(lambda: [calculate_roll_exp(per_die_list) for _ in range(args.times)],
+                              number=args.repeat) / args.repeat * 1e3
+        t_round = timeit.timeit(lambda: [exp.get_result() for _ in range(args.times)],
+                                number=args.repeat) / args.repeat * 1e3
+        t_batch = timeit.timeit(lambda: exp.get_results(args.times), number=args.repeat) / args.repeat * 1e3
+        print(f"{exp_str:<14}{t_die:>13.2f}{t_round:>15.2f}{t_batch:>11.2f}{t_die / t_batch:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+对比旧的解析流程(split_roll_str + create_leveling_list + 逐个正则移除修饰符)与单遍解析(parse_exp_list)的开销
+不经过parse_roll_exp的缓存, 衡量的是未命中缓存时的解析耗时
+
+用法：python tools/bench_roll_parse.py [--number 2000] [--repeat 5]
+"""
+import argparse
+import sys
+import timeit
+from pathlib import Path
+from unittest import mock
+
+repo_root = Path(__file__).resolve().parents[1]
+src_path = repo_root / 'src' / 'plugins' / 'DicePP'
+if str(src_path) not in sys.path:
+    sys.path.insert(0, str(src_path))
+
+import module.roll.expression as expression  # noqa: E402
+from module.roll.modifier import split_roll_modifiers_iterative  # noqa: E402
+from module.roll.parser import parse_exp_list  # noqa: E402
+
+EXPRESSIONS = ["D20", "D20+5", "2D20K1+7", "4D6K3R1X6", "(2D6+3)*2+D4", "((1D20+5)/2+3D6KL2)*(D8+1)",
+               "D20+D20+D20+D20+D20+D20+D20+D20"]
+
+
+def legacy_exp_list(input_str: str) -> list:
+    split_list = expression.split_roll_str(input_str)
+    return expression.create_leveling_list([expression.parse_single_roll_exp(i) for i in split_list[0]],
+                                           split_list[1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"每次解析 {args.number} 遍, 取 {args.repeat} 次的最小值")
+    print(f"{'expression':<36}{'legacy(us)':>12}{'single-pass(us)':>17}{'speedup':>10}")
+    for exp_str in EXPRESSIONS:
+        with mock.patch.object(expression, "split_roll_modifiers", split_roll_modifiers_iterative):
+            t_legacy = min(timeit.repeat(lambda: legacy_exp_list(exp_str), number=args.number, repeat=args.repeat))
+        t_new = min(timeit.repeat(lambda: parse_exp_list(exp_str), number=args.number, repeat=args.repeat))
+        t_legacy, t_new = t_legacy / args.number * 1e6, t_new / args.number * 1e6
+        print(f"{exp_str:<36}{t_legacy:>12.2f}{t_new:>17.2f}{t_legacy / t_new:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
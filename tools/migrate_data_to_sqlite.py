@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DicePP 分片存储迁移脚本
+
+用途：将 user_data / group_data / nickname / log_session 等使用 sqlite 后端的数据
+从整文件 json 一次性迁移到按顶层 key 分行保存的 .db 文件。
+机器人首次启动时也会自动迁移，此脚本用于在停机维护时提前完成迁移。
+
+操作说明：
+1. 确保机器人已停止运行
+2. 运行此脚本: python tools/migrate_data_to_sqlite.py [数据目录]
+   不指定目录时扫描 Data/Bot 下所有账号
+3. 迁移后的 json 文件会被重命名为 *.json.migrated，确认无误后可以手动删除
+"""
+
+import os
+import sys
+
+# 项目路径设置
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_PATH = os.path.join(PROJECT_ROOT, "src", "plugins", "DicePP")
+DATA_PATH = os.path.join(SRC_PATH, "Data", "Bot")
+
+sys.path.insert(0, SRC_PATH)
+
+from core.data.storage import SqliteChunkStore, migrate_json_to_store, get_store_path  # noqa: E402
+from utils.localdata import read_json  # noqa: E402
+
+# 与 custom_data_chunk(storage=STORAGE_SQLITE) 的声明保持一致
+SHARDED_CHUNKS = ["user_data", "group_data", "nickname", "log_session"]
+
+
+def migrate_account(account_path: str) -> None:
+    for identifier in SHARDED_CHUNKS:
+        json_path = os.path.join(account_path, f"{identifier}.json")
+        json_path_tmp = json_path + ".tmp"
+        # 与 DataManager 一致：临时文件比正式文件更新, 临时文件损坏时退回正式文件
+        sources = [p for p in (json_path_tmp, json_path) if os.path.exists(p)]
+        if not sources:
+            continue
+        store = SqliteChunkStore(get_store_path(account_path, identifier))
+        count = None
+        try:
+            if store.get_attrs() is not None:
+                print(f"[SKIP] {identifier}: 数据库中已有数据")
+                continue
+            for source in sources:
+                try:
+                    count = migrate_json_to_store(read_json(source), store)
+                except ValueError as e:
+                    print(f"[ERROR] {identifier}: 无法读取 {source}: {e}")
+                    continue
+                break
+        finally:
+            store.close()
+        if count is None:
+            continue
+        for old_path in (json_path_tmp, json_path):
+            if os.path.exists(old_path):
+                os.replace(old_path, old_path + ".migrated")
+        print(f"[OK] {identifier}: 迁移 {count} 条")
+
+
+def main() -> None:
+    if len(sys.argv) > 1:
+        targets = [sys.argv[1]]
+    elif os.path.isdir(DATA_PATH):
+        targets = [os.path.join(DATA_PATH, name) for name in sorted(os.listdir(DATA_PATH))]
+    else:
+        print(f"找不到数据目录: {DATA_PATH}")
+        return
+    for account_path in targets:
+        if not os.path.isdir(account_path):
+            continue
+        print(f"== {account_path}")
+        migrate_account(account_path)
+
+
+if __name__ == "__main__":
+    main()